@@ -1,7 +1,5 @@
-import os
 import asyncio
 from logging.config import fileConfig
-from dotenv import load_dotenv
 
 from sqlalchemy import pool
 from sqlalchemy.engine import Connection
@@ -9,19 +7,22 @@ from sqlalchemy.ext.asyncio import async_engine_from_config
 
 from alembic import context
 
+from app_twitter.service.config import get_settings
 from app_twitter.service.models.models import metadata
 
-load_dotenv()
+settings = get_settings()
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
 
 section = config.config_ini_section
-config.set_section_option(section, "DB_USER", os.environ.get("DB_USER"))
-config.set_section_option(section, "DB_PASSWORD", os.environ.get("DB_PASSWORD"))
-config.set_section_option(section, "DB_HOST", os.environ.get("DB_HOST"))
-config.set_section_option(section, "DB_PORT", os.environ.get("DB_PORT"))
-config.set_section_option(section, "DB_NAME", os.environ.get("DB_NAME"))
+config.set_section_option(section, "DB_USER", settings.DB_USER)
+config.set_section_option(
+    section, "DB_PASSWORD", settings.DB_PASSWORD.get_secret_value()
+)
+config.set_section_option(section, "DB_HOST", settings.DB_HOST)
+config.set_section_option(section, "DB_PORT", str(settings.DB_PORT))
+config.set_section_option(section, "DB_NAME", settings.DB_NAME)
 
 # Interpret the config file for Python logger.
 # This line sets up loggers basically.
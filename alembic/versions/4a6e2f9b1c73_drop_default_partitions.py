@@ -0,0 +1,52 @@
+"""Drop default partitions of tweets and likes
+
+Revision ID: 4a6e2f9b1c73
+Revises: f3b71c8e02d5
+Create Date: 2026-10-21 10:05:17.402931
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4a6e2f9b1c73'
+down_revision: Union[str, None] = 'f3b71c8e02d5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# DETACH PARTITION CONCURRENTLY недоступен при секции по умолчанию: строки из нее
+# переносятся в месячные секции их месяцев, новые секции создает utils.partitions
+MOVE_DEFAULT_ROWS = """
+DO $$
+DECLARE
+    month timestamp;
+    name text;
+BEGIN
+    FOR month IN SELECT DISTINCT date_trunc('month', created_on) FROM {table}_default LOOP
+        name := '{table}_p' || to_char(month, 'YYYYMM');
+        EXECUTE format('CREATE TABLE %I (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', name);
+        EXECUTE format(
+            'WITH moved AS (DELETE FROM {table}_default WHERE created_on >= %L AND created_on < %L RETURNING *) '
+            'INSERT INTO %I SELECT * FROM moved',
+            month, month + interval '1 month', name
+        );
+        EXECUTE format(
+            'ALTER TABLE {table} ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+            name, month, month + interval '1 month'
+        );
+    END LOOP;
+END $$
+"""
+
+
+def upgrade() -> None:
+    for table in ('tweets', 'likes'):
+        op.execute(MOVE_DEFAULT_ROWS.format(table=table))
+        op.drop_table(f'{table}_default')
+
+
+def downgrade() -> None:
+    for table in ('tweets', 'likes'):
+        op.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
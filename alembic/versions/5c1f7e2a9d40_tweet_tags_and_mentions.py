@@ -0,0 +1,67 @@
+"""Tweet tags and mentions
+
+Revision ID: 5c1f7e2a9d40
+Revises: 27aab8683a13
+Create Date: 2026-10-19 10:12:31.405117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c1f7e2a9d40'
+down_revision: Union[str, None] = '27aab8683a13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('tweet_tags',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('tag', sa.String(length=100), nullable=False),
+    sa.Column('tweet_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['tweet_id'], ['tweets.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_tweet_tags_tag_tweet_id', 'tweet_tags', ['tag', 'tweet_id'], unique=True)
+    op.create_index('ix_tweet_tags_tweet_id', 'tweet_tags', ['tweet_id'], unique=False)
+    op.create_table('tweet_mentions',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('tweet_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['tweet_id'], ['tweets.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_tweet_mentions_user_id_tweet_id', 'tweet_mentions', ['user_id', 'tweet_id'], unique=True)
+    op.create_index('ix_tweet_mentions_tweet_id', 'tweet_mentions', ['tweet_id'], unique=False)
+
+    # заполнение индексов для уже существующих твитов
+    op.execute(
+        r"""
+        INSERT INTO tweet_tags (tag, tweet_id)
+        SELECT DISTINCT left(lower(m[1]), 100), t.id
+        FROM tweets t, regexp_matches(t.tweetdata, '(?:^|[^\w#])#(\w+)', 'g') AS m
+        """
+    )
+    op.execute(
+        r"""
+        INSERT INTO tweet_mentions (user_id, tweet_id)
+        SELECT DISTINCT u.id, t.id
+        FROM tweets t
+        CROSS JOIN LATERAL regexp_matches(t.tweetdata, '(?:^|[^\w@])@(\w+)', 'g') AS m
+        JOIN users u ON u.name = m[1]
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tweet_mentions_tweet_id', table_name='tweet_mentions')
+    op.drop_index('ix_tweet_mentions_user_id_tweet_id', table_name='tweet_mentions')
+    op.drop_table('tweet_mentions')
+    op.drop_index('ix_tweet_tags_tweet_id', table_name='tweet_tags')
+    op.drop_index('ix_tweet_tags_tag_tweet_id', table_name='tweet_tags')
+    op.drop_table('tweet_tags')
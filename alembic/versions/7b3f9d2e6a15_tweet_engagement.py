@@ -0,0 +1,37 @@
+"""Tweet engagement counters
+
+Revision ID: 7b3f9d2e6a15
+Revises: e5a0c3d97f14
+Create Date: 2026-10-19 23:02:51.844302
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7b3f9d2e6a15'
+down_revision: Union[str, None] = 'e5a0c3d97f14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('tweets', sa.Column('likes_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('tweets', sa.Column('like_velocity', sa.Float(), server_default='0', nullable=False))
+    op.add_column('tweets', sa.Column('like_velocity_on', sa.DateTime(), nullable=True))
+    op.create_index('ix_tweets_user_id_created_on', 'tweets', ['user_id', 'created_on'], unique=False)
+    op.execute(
+        'UPDATE tweets SET likes_count = l.count '
+        'FROM (SELECT tweet_id, count(*) AS count FROM likes GROUP BY tweet_id) AS l '
+        'WHERE l.tweet_id = tweets.id'
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tweets_user_id_created_on', table_name='tweets')
+    op.drop_column('tweets', 'like_velocity_on')
+    op.drop_column('tweets', 'like_velocity')
+    op.drop_column('tweets', 'likes_count')
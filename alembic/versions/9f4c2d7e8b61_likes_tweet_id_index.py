@@ -0,0 +1,25 @@
+"""Index likes by tweet id
+
+Revision ID: 9f4c2d7e8b61
+Revises: 4a6e2f9b1c73
+Create Date: 2026-10-22 09:41:06.518237
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9f4c2d7e8b61'
+down_revision: Union[str, None] = '4a6e2f9b1c73'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_likes_tweet_id', 'likes', ['tweet_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_likes_tweet_id', table_name='likes')
@@ -0,0 +1,33 @@
+"""User follow counters
+
+Revision ID: a91d4e7c3b28
+Revises: 7b3f9d2e6a15
+Create Date: 2026-10-19 23:48:16.239571
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a91d4e7c3b28'
+down_revision: Union[str, None] = '7b3f9d2e6a15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('followers_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('following_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute(
+        'UPDATE users SET '
+        'followers_count = (SELECT count(*) FROM followers f WHERE f.user_id = users.id), '
+        'following_count = (SELECT count(*) FROM followers f WHERE f.follower_id = users.id)'
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'following_count')
+    op.drop_column('users', 'followers_count')
@@ -0,0 +1,46 @@
+"""Trending tags
+
+Revision ID: b593616c3860
+Revises: 5c1f7e2a9d40
+Create Date: 2026-10-19 12:40:05.118342
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b593616c3860'
+down_revision: Union[str, None] = '5c1f7e2a9d40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('trend_buckets',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('tag', sa.String(length=100), nullable=False),
+    sa.Column('bucket', sa.Integer(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_trend_buckets_tag_bucket', 'trend_buckets', ['tag', 'bucket'], unique=True)
+    op.create_index('ix_trend_buckets_bucket', 'trend_buckets', ['bucket'], unique=False)
+    op.create_table('trending_tags',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('rank', sa.Integer(), nullable=False),
+    sa.Column('tag', sa.String(length=100), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.Column('updated_on', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('rank')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('trending_tags')
+    op.drop_index('ix_trend_buckets_bucket', table_name='trend_buckets')
+    op.drop_index('ix_trend_buckets_tag_bucket', table_name='trend_buckets')
+    op.drop_table('trend_buckets')
@@ -0,0 +1,40 @@
+"""Idempotency keys
+
+Revision ID: b7e3a5c91d24
+Revises: 9f4c2d7e8b61
+Create Date: 2026-10-22 11:17:43.209518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e3a5c91d24'
+down_revision: Union[str, None] = '9f4c2d7e8b61'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('idempotency_keys',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('apikey_hash', sa.String(length=64), nullable=False),
+    sa.Column('route', sa.String(length=100), nullable=False),
+    sa.Column('key', sa.String(length=200), nullable=False),
+    sa.Column('fingerprint', sa.String(length=64), nullable=False),
+    sa.Column('status_code', sa.Integer(), nullable=True),
+    sa.Column('body', sa.LargeBinary(), nullable=True),
+    sa.Column('expires_on', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_idempotency_keys_apikey_hash_route_key', 'idempotency_keys', ['apikey_hash', 'route', 'key'], unique=True)
+    op.create_index('ix_idempotency_keys_expires_on', 'idempotency_keys', ['expires_on'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_idempotency_keys_expires_on', table_name='idempotency_keys')
+    op.drop_index('ix_idempotency_keys_apikey_hash_route_key', table_name='idempotency_keys')
+    op.drop_table('idempotency_keys')
@@ -0,0 +1,28 @@
+"""Media uploader
+
+Revision ID: c47a9e15b2d8
+Revises: 8d2b6f41c9e5
+Create Date: 2026-10-19 21:03:44.120518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c47a9e15b2d8'
+down_revision: Union[str, None] = '8d2b6f41c9e5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('media', sa.Column('uploader', sa.Integer(), nullable=True))
+    op.create_foreign_key('media_uploader_fkey', 'media', 'users', ['uploader'], ['id'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('media_uploader_fkey', 'media', type_='foreignkey')
+    op.drop_column('media', 'uploader')
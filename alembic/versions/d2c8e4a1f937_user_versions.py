@@ -0,0 +1,28 @@
+"""User versions for ETag
+
+Revision ID: d2c8e4a1f937
+Revises: a91d4e7c3b28
+Create Date: 2026-10-20 00:31:05.672940
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2c8e4a1f937'
+down_revision: Union[str, None] = 'a91d4e7c3b28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('profile_version', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('content_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'content_version')
+    op.drop_column('users', 'profile_version')
@@ -0,0 +1,43 @@
+"""Follow recommendations
+
+Revision ID: e5a0c3d97f14
+Revises: c47a9e15b2d8
+Create Date: 2026-10-19 22:10:27.503114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a0c3d97f14'
+down_revision: Union[str, None] = 'c47a9e15b2d8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_followers_user_id_follower_id', 'followers', ['user_id', 'follower_id'], unique=False)
+    op.create_index('ix_followers_follower_id_user_id', 'followers', ['follower_id', 'user_id'], unique=False)
+    op.create_table('follow_recommendations',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('recommended_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Integer(), nullable=False),
+    sa.Column('created_on', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['recommended_id'], ['users.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_follow_recommendations_user_id_recommended_id', 'follow_recommendations', ['user_id', 'recommended_id'], unique=True)
+    op.create_index('ix_follow_recommendations_user_id_score', 'follow_recommendations', ['user_id', 'score'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_follow_recommendations_user_id_score', table_name='follow_recommendations')
+    op.drop_index('ix_follow_recommendations_user_id_recommended_id', table_name='follow_recommendations')
+    op.drop_table('follow_recommendations')
+    op.drop_index('ix_followers_follower_id_user_id', table_name='followers')
+    op.drop_index('ix_followers_user_id_follower_id', table_name='followers')
@@ -0,0 +1,115 @@
+"""Partition tweets and likes by created_on
+
+Revision ID: f3b71c8e02d5
+Revises: d2c8e4a1f937
+Create Date: 2026-10-20 01:12:44.308516
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3b71c8e02d5'
+down_revision: Union[str, None] = 'd2c8e4a1f937'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# месячные секции создаются от самой ранней строки до текущего месяца и на
+# три месяца вперед, дальше их создает задача обслуживания (utils.partitions)
+MONTHLY_PARTITIONS = """
+DO $$
+DECLARE
+    month timestamp;
+BEGIN
+    FOR month IN SELECT generate_series(
+        date_trunc('month', coalesce((SELECT min(created_on) FROM {table}_old), LOCALTIMESTAMP)),
+        date_trunc('month', LOCALTIMESTAMP) + interval '3 months',
+        interval '1 month'
+    ) LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF {table} FOR VALUES FROM (%L) TO (%L)',
+            '{table}_p' || to_char(month, 'YYYYMM'), month, month + interval '1 month'
+        );
+    END LOOP;
+END $$
+"""
+
+
+def tweets_columns() -> list:
+    return [
+        sa.Column('id', sa.Integer(), server_default=sa.text("nextval('tweets_id_seq'::regclass)"), nullable=False),
+        sa.Column('tweetdata', sa.Text(), nullable=True),
+        sa.Column('created_on', sa.DateTime(), server_default=sa.text('LOCALTIMESTAMP'), nullable=False),
+        sa.Column('updated_on', sa.DateTime(), nullable=True),
+        sa.Column('likes_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('like_velocity', sa.Float(), server_default='0', nullable=False),
+        sa.Column('like_velocity_on', sa.DateTime(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    ]
+
+
+def likes_columns() -> list:
+    return [
+        sa.Column('id', sa.Integer(), server_default=sa.text("nextval('likes_id_seq'::regclass)"), nullable=False),
+        sa.Column('created_on', sa.DateTime(), server_default=sa.text('LOCALTIMESTAMP'), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('tweet_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    ]
+
+
+TWEETS_COLUMNS = 'id, tweetdata, created_on, updated_on, likes_count, like_velocity, like_velocity_on, user_id'
+LIKES_COLUMNS = 'id, created_on, user_id, tweet_id'
+
+
+def partition_table(table: str, columns: list, names: str) -> None:
+    op.rename_table(table, f'{table}_old')
+    op.execute(f'ALTER TABLE {table}_old RENAME CONSTRAINT {table}_pkey TO {table}_old_pkey')
+    op.create_table(table, *columns, sa.PrimaryKeyConstraint('id', 'created_on'), postgresql_partition_by='RANGE (created_on)')
+    op.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+    op.execute(MONTHLY_PARTITIONS.format(table=table))
+    op.execute(
+        f'INSERT INTO {table} ({names}) '
+        f"SELECT {names.replace('created_on', 'coalesce(created_on, LOCALTIMESTAMP)')} FROM {table}_old"
+    )
+    op.execute(f'ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id')
+    op.drop_table(f'{table}_old')
+
+
+def unpartition_table(table: str, columns: list, names: str) -> None:
+    op.rename_table(table, f'{table}_part')
+    op.execute(f'ALTER TABLE {table}_part RENAME CONSTRAINT {table}_pkey TO {table}_part_pkey')
+    op.create_table(table, *columns, sa.PrimaryKeyConstraint('id'))
+    op.alter_column(table, 'created_on', existing_type=sa.DateTime(), server_default=None, nullable=True)
+    op.execute(f'INSERT INTO {table} ({names}) SELECT {names} FROM {table}_part')
+    op.execute(f'ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id')
+    op.drop_table(f'{table}_part')
+
+
+def upgrade() -> None:
+    op.drop_constraint('likes_tweet_id_fkey', 'likes', type_='foreignkey')
+    op.drop_constraint('tweet_tags_tweet_id_fkey', 'tweet_tags', type_='foreignkey')
+    op.drop_constraint('tweet_mentions_tweet_id_fkey', 'tweet_mentions', type_='foreignkey')
+
+    op.drop_index('ix_tweets_user_id_created_on', table_name='tweets')
+    partition_table('tweets', tweets_columns(), TWEETS_COLUMNS)
+    op.create_index('ix_tweets_user_id_created_on', 'tweets', ['user_id', 'created_on'], unique=False)
+    partition_table('likes', likes_columns(), LIKES_COLUMNS)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tweets_user_id_created_on', table_name='tweets')
+    unpartition_table('tweets', tweets_columns(), TWEETS_COLUMNS)
+    op.create_index('ix_tweets_user_id_created_on', 'tweets', ['user_id', 'created_on'], unique=False)
+    unpartition_table('likes', likes_columns(), LIKES_COLUMNS)
+
+    # строки, ссылавшиеся на заархивированные твиты, не восстанавливаются
+    for table in ('likes', 'tweet_tags', 'tweet_mentions'):
+        op.execute(f'DELETE FROM {table} WHERE tweet_id NOT IN (SELECT id FROM tweets)')
+    op.create_foreign_key('tweet_mentions_tweet_id_fkey', 'tweet_mentions', 'tweets', ['tweet_id'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key('tweet_tags_tweet_id_fkey', 'tweet_tags', 'tweets', ['tweet_id'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key('likes_tweet_id_fkey', 'likes', 'tweets', ['tweet_id'], ['id'])
@@ -0,0 +1,75 @@
+"""
+сравнение результатов двух запусков benchmarks.load.
+Код возврата 1, если задержка или пропускная способность какого-либо маршрута
+ухудшились больше допустимого порога.
+
+пример запуска:
+    python -m benchmarks.compare before.json after.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+
+METRICS = ("rps", "p50_ms", "p95_ms", "p99_ms")
+
+
+def change(before: float, after: float) -> float:
+    """
+    изменение в процентах
+    """
+    if not before:
+        return 0.0
+    return (after - before) / before * 100
+
+
+def compare(before: dict, after: dict, threshold: float) -> list:
+    """
+    :return: список строк отчета (маршрут, метрика, до, после, изменение, регрессия)
+    """
+
+    rows = []
+    for route, stats in after["routes"].items():
+        base = before["routes"].get(route)
+        if base is None:
+            continue
+        for metric in METRICS:
+            delta = change(base[metric], stats[metric])
+            # для rps ухудшение - уменьшение, для задержек - рост
+            regression = -delta if metric == "rps" else delta
+            rows.append(
+                (
+                    route,
+                    metric,
+                    base[metric],
+                    stats[metric],
+                    delta,
+                    regression > threshold,
+                )
+            )
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare load benchmark results")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10, help="percent")
+    args = parser.parse_args(argv)
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print(f"{before['revision']} -> {after['revision']}")
+    rows = compare(before, after, args.threshold)
+    for route, metric, old, new, delta, regression in rows:
+        mark = "  REGRESSION" if regression else ""
+        print(f"{route:36} {metric:7} {old:>10} {new:>10} {delta:>+8.1f}%{mark}")
+
+    return 1 if any(row[-1] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
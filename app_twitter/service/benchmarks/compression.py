@@ -0,0 +1,103 @@
+"""
+стоимость сжатия ответов ленты: время сжатия одного ответа (CPU воркера)
+и сэкономленные байты для gzip, brotli и zstd на разных уровнях.
+Тело ответа строится так же, как в GET /api/tweets: лента из micro.make_rows
+(в среднем 5 лайков на твит, картинки у каждого десятого твита), JSONResponse.
+Для каждого случая выводятся размер до и после сжатия, степень сжатия,
+время сжатия, мкс, и время на каждый сэкономленный КиБ.
+Кодировки brotli и zstd измеряются, если установлены пакеты Brotli и zstandard.
+
+пример запуска из каталога app_twitter/service:
+    python -m benchmarks.compression --output compression.json
+    python -m benchmarks.compression --tweets 20 100 --only gzip
+"""
+import argparse
+import json
+import sys
+
+from starlette.responses import JSONResponse
+
+from benchmarks.micro import make_rows, build_feed, measure
+from utils.compression import make_codecs
+
+
+# уровни сжатия: быстрые, по умолчанию сервиса и максимальные
+LEVELS = {
+    "gzip": (1, 5, 6, 9),
+    "br": (1, 4, 6, 11),
+    "zstd": (1, 3, 9, 19),
+}
+
+
+def feed_body(tweets: int) -> bytes:
+    """
+    тело ответа ленты из tweets твитов
+    """
+
+    return JSONResponse(
+        content={"result": True, "tweets": build_feed(make_rows(tweets))}
+    ).body
+
+
+def get_codec(encoding: str, level: int):
+    codecs = make_codecs(gzip_level=level, brotli_quality=level, zstd_level=level)
+    return codecs.get(encoding)
+
+
+def run(sizes: list, repeat: int, only: str = None) -> dict:
+    results = dict()
+    for tweets in sizes:
+        body = feed_body(tweets)
+        for encoding, levels in LEVELS.items():
+            if only and only != encoding:
+                continue
+            for level in levels:
+                codec = get_codec(encoding, level)
+                if codec is None:
+                    continue
+                compressed = len(codec(body))
+                stats = measure(lambda: codec(body), repeat, min_time=0.05)
+                saved_kb = (len(body) - compressed) / 1024
+                results[f"feed{tweets}.{encoding}.{level}"] = {
+                    "bytes": len(body),
+                    "compressed": compressed,
+                    "ratio": round(len(body) / compressed, 2),
+                    "us": stats["us"],
+                    "us_per_kb_saved": round(stats["us"] / saved_kb, 3),
+                }
+    return results
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Response compression benchmark")
+    parser.add_argument(
+        "--tweets", type=int, nargs="+", default=[20, 100, 1000], help="feed sizes"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", default=None, help="encoding: gzip, br or zstd")
+    parser.add_argument("--output", default=None, help="JSON results file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    results = run(args.tweets, args.repeat, args.only)
+
+    print(
+        f"{'case':22} {'bytes':>9} {'compressed':>10} {'ratio':>6} "
+        f"{'us/op':>10} {'us/KiB saved':>12}"
+    )
+    for name, stats in results.items():
+        print(
+            f"{name:22} {stats['bytes']:>9} {stats['compressed']:>10} "
+            f"{stats['ratio']:>6} {stats['us']:>10} {stats['us_per_kb_saved']:>12}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,318 @@
+"""
+нагрузочный тест API: приложение запускается под gunicorn с uvicorn-воркерами
+на локальной БД, заполненной генератором tests.generate_dataset, и нагружается
+смешанным потоком запросов в заданных пропорциях.
+Результат - пропускная способность и задержки p50/p95/p99 по маршрутам,
+сохраняется в JSON для сравнения двух коммитов (benchmarks.compare).
+
+пример запуска из каталога app_twitter/service:
+    python -m benchmarks.load --users 10000 --duration 30 --output before.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import math
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import asyncpg
+import httpx
+
+from tests.generate_dataset import get_dsn, reset_schema, load_dataset
+
+
+DEFAULT_MIX = "feed=60,post=15,like=15,follow=5,upload=5"
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_mix(mix: str) -> dict:
+    """
+    разбор пропорций нагрузки вида "feed=60,post=15"
+    """
+    result = dict()
+    for item in mix.split(","):
+        name, weight = item.split("=")
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation {name}, expected {list(OPERATIONS)}")
+        result[name] = float(weight)
+    return result
+
+
+def percentile(values: list, q: float) -> float:
+    """
+    перцентиль по методу ближайшего ранга, values отсортирован
+    """
+    if not values:
+        return 0.0
+    rank = max(math.ceil(q * len(values) / 100) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class VirtualUser:
+    """
+    клиент, выполняющий случайные операции от имени одного пользователя
+    """
+
+    def __init__(self, client: httpx.AsyncClient, rng: random.Random, users: int):
+        self.client = client
+        self.rng = rng
+        self.users = users
+        self.user_id = rng.randint(1, users)
+        self.headers = {"api-key": f"apikey_{self.user_id}"}
+        self.feed_ids = []
+
+    async def feed(self):
+        response = await self.client.get("/api/tweets", headers=self.headers)
+        if response.status_code == 200:
+            self.feed_ids = [t["id"] for t in response.json().get("tweets", [])][:100]
+        return "GET /api/tweets", response
+
+    async def post(self):
+        tag = f"tag{self.rng.randint(1, 50)}"
+        response = await self.client.post(
+            "/api/tweets",
+            headers=self.headers,
+            json={"tweet_data": f"benchmark tweet #{tag}", "tweet_media_ids": []},
+        )
+        return "POST /api/tweets", response
+
+    async def like(self):
+        if self.feed_ids:
+            tweet_id = self.rng.choice(self.feed_ids)
+        else:
+            tweet_id = self.rng.randint(1, self.users * 10)
+        response = await self.client.post(
+            f"/api/tweets/{tweet_id}/likes", headers=self.headers
+        )
+        return "POST /api/tweets/{idx}/likes", response
+
+    async def follow(self):
+        target = self.rng.randint(1, self.users)
+        response = await self.client.post(
+            f"/api/users/{target}/follow", headers=self.headers
+        )
+        return "POST /api/users/{idx}/follow", response
+
+    async def upload(self):
+        payload = self.rng.randbytes(32 * 1024)
+        response = await self.client.post(
+            "/api/medias",
+            headers=self.headers,
+            files={"file": ("bench.jpg", payload, "image/jpeg")},
+        )
+        return "POST /api/medias", response
+
+
+OPERATIONS = {
+    "feed": VirtualUser.feed,
+    "post": VirtualUser.post,
+    "like": VirtualUser.like,
+    "follow": VirtualUser.follow,
+    "upload": VirtualUser.upload,
+}
+
+
+async def run_workload(
+    base_url: str,
+    users: int,
+    mix: dict,
+    concurrency: int,
+    duration: float,
+    seed: int,
+) -> dict:
+    """
+    выполнение нагрузки заданной длительности
+    :return: задержки (с) и коды ответов по маршрутам
+    """
+
+    latencies = defaultdict(list)
+    statuses = defaultdict(lambda: defaultdict(int))
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    deadline = time.perf_counter() + duration
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=30
+    ) as client:
+
+        async def worker(n: int):
+            rng = random.Random(seed * 100_003 + n)
+            vuser = VirtualUser(client, rng, users)
+            while time.perf_counter() < deadline:
+                operation = OPERATIONS[rng.choices(names, weights)[0]]
+                started = time.perf_counter()
+                try:
+                    route, response = await operation(vuser)
+                    status = str(response.status_code)
+                except httpx.HTTPError as err:
+                    route, status = operation.__name__, type(err).__name__
+                latencies[route].append(time.perf_counter() - started)
+                statuses[route][status] += 1
+
+        await asyncio.gather(*(worker(n) for n in range(concurrency)))
+
+    return {"latencies": latencies, "statuses": statuses}
+
+
+def summarize(raw: dict, duration: float) -> dict:
+    routes = dict()
+    total = 0
+    for route, values in sorted(raw["latencies"].items()):
+        values.sort()
+        total += len(values)
+        routes[route] = {
+            "requests": len(values),
+            "rps": round(len(values) / duration, 2),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+            "max_ms": round(values[-1] * 1000, 2),
+            "statuses": dict(raw["statuses"][route]),
+        }
+    return {
+        "total_requests": total,
+        "rps": round(total / duration, 2),
+        "routes": routes,
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SERVICE_DIR, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def start_server(port: int, workers: int, options: tuple = ()) -> subprocess.Popen:
+    command = [
+        sys.executable,
+        "-m",
+        "gunicorn",
+        "main:app",
+        "--workers",
+        str(workers),
+        "--worker-class",
+        "uvicorn.workers.UvicornWorker",
+        f"--bind=127.0.0.1:{port}",
+        "--log-level=warning",
+        *options,
+    ]
+    # загруженные файлы не попадают в static/media
+    media_dir = tempfile.mkdtemp(prefix="bench_media_")
+    env = dict(os.environ, ADD_TEST_DATA="no", MEDIA_DIR=media_dir)
+    return subprocess.Popen(command, cwd=SERVICE_DIR, env=env)
+
+
+async def wait_ready(base_url: str, timeout: float = 30):
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.perf_counter() < deadline:
+            try:
+                response = await client.get("/")
+                if response.status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise TimeoutError("server did not start")
+
+
+async def seed_database(args: argparse.Namespace):
+    dsn = get_dsn()
+    await reset_schema(dsn)
+    connection = await asyncpg.connect(dsn)
+    try:
+        stats = await load_dataset(
+            connection,
+            users=args.users,
+            tweets=args.users * 10,
+            seed=args.seed,
+        )
+    finally:
+        await connection.close()
+    print(f"seeded: {stats}")
+
+
+async def main(args: argparse.Namespace) -> dict:
+    mix = parse_mix(args.mix)
+    if not args.skip_seed:
+        await seed_database(args)
+
+    base_url = args.url or f"http://127.0.0.1:{args.port}"
+    server = None if args.url else start_server(args.port, args.workers)
+    try:
+        await wait_ready(base_url)
+        if args.warmup:
+            await run_workload(
+                base_url, args.users, mix, args.concurrency, args.warmup, args.seed + 1
+            )
+        raw = await run_workload(
+            base_url, args.users, mix, args.concurrency, args.duration, args.seed
+        )
+    finally:
+        if server is not None:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=30)
+
+    result = {
+        "revision": git_revision(),
+        "created_on": datetime.datetime.now().isoformat(timespec="seconds"),
+        "params": {
+            "users": args.users,
+            "workers": args.workers,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "mix": mix,
+            "seed": args.seed,
+        },
+        **summarize(raw, args.duration),
+    }
+    return result
+
+
+def print_report(result: dict):
+    print(
+        f"\nrevision {result['revision']}: {result['total_requests']} requests, "
+        f"{result['rps']} req/s"
+    )
+    print(f"{'route':36} {'req':>7} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for route, stats in result["routes"].items():
+        print(
+            f"{route:36} {stats['requests']:>7} {stats['rps']:>8} "
+            f"{stats['p50_ms']:>8} {stats['p95_ms']:>8} {stats['p99_ms']:>8}"
+        )
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="HTTP load benchmark")
+    parser.add_argument("--users", type=int, default=10_000, help="dataset scale")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-seed", action="store_true", help="reuse loaded data")
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=5100)
+    parser.add_argument("--url", default=None, help="benchmark a running server")
+    parser.add_argument("--output", default=None, help="JSON results file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    benchmark = asyncio.run(main(arguments))
+    print_report(benchmark)
+    if arguments.output:
+        with open(arguments.output, "w") as f:
+            json.dump(benchmark, f, indent=2)
@@ -0,0 +1,357 @@
+"""
+микро-бенчмарки горячих участков без обращения к БД:
+формирование ленты из строк результата (группировка лайков и медиа, словари твитов),
+кодирование ленты в JSON целиком и пачками по 100 твитов (потоковая лента),
+to_json моделей и построение/компиляция SQL-выражений из utils.
+Случаи sql.compile.* компилируют выражение, построенное заново, как при каждом
+запросе; sql.cached.* - выражения уровня модуля из utils через кэш компиляции,
+как при выполнении engine. С --db дополнительно измеряется выполнение запросов
+в БД без кэша подготовленных выражений asyncpg и с кэшем (время разбора запроса).
+Для каждого случая измеряется время одной операции и пик выделенной памяти (tracemalloc).
+С --baseline запуск завершается с кодом 1, если какой-либо случай замедлился
+больше чем на --threshold процентов.
+
+пример запуска из каталога app_twitter/service:
+    python -m benchmarks.micro --output micro.json
+    python -m benchmarks.micro --baseline micro.json --threshold 20
+    python -m benchmarks.micro --only sql --db
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import sys
+import time
+import timeit
+import tracemalloc
+from collections import namedtuple
+
+import asyncpg
+from sqlalchemy import select, insert, update, lambda_stmt
+from sqlalchemy.dialects import postgresql
+
+from models.models import Users, Tweets, Likes, Followers, Media
+from utils import tweets as tweet_queries
+from utils import users as user_queries
+from utils.tweets import group_likes, group_media, format_tweet
+from utils.streaming import encode_json, encode_items
+
+
+LikeRow = namedtuple("LikeRow", "user_id tweet_id name")
+MediaRow = namedtuple("MediaRow", "id filepath tweet_id")
+TweetRow = namedtuple("TweetRow", "id tweetdata id_1 name")
+
+DIALECT = postgresql.asyncpg.dialect()
+
+
+def make_rows(tweets: int, seed: int = 0) -> dict:
+    """
+    строки результатов запросов ленты: tweets твитов, в среднем 5 лайков
+    на твит и картинки у каждого десятого твита
+    """
+
+    rng = random.Random(seed)
+    tweet_rows = [
+        TweetRow(idx, f"tweet number {idx}", idx % 100 + 1, f"user_{idx % 100 + 1}")
+        for idx in range(1, tweets + 1)
+    ]
+    like_rows = [
+        LikeRow(user_id, rng.randint(1, tweets), f"user_{user_id}")
+        for user_id in (rng.randint(1, 1000) for _ in range(tweets * 5))
+    ]
+    media_rows = [
+        MediaRow(idx, f"{idx:012d}.jpg", idx * 10) for idx in range(1, tweets // 10 + 1)
+    ]
+    return {"tweets": tweet_rows, "likes": like_rows, "media": media_rows}
+
+
+def build_feed(rows: dict) -> list:
+    likes = group_likes(rows["likes"])
+    media_dict = group_media(rows["media"])
+    return [format_tweet(tweet, media_dict, likes) for tweet in rows["tweets"]]
+
+
+def make_chunks(rows: dict, size: int) -> list:
+    """
+    строки ленты пачками по size твитов, как их читает stream_tweets_list
+    """
+
+    chunks = []
+    for start in range(0, len(rows["tweets"]), size):
+        tweets = rows["tweets"][start : start + size]
+        ids = {tweet.id for tweet in tweets}
+        chunks.append(
+            {
+                "tweets": tweets,
+                "likes": [like for like in rows["likes"] if like.tweet_id in ids],
+                "media": [media for media in rows["media"] if media.tweet_id in ids],
+            }
+        )
+    return chunks
+
+
+def render_chunked(chunks: list) -> int:
+    """
+    кодирование ленты пачками, закодированная пачка сразу отбрасывается
+    (отправлена клиенту)
+    """
+
+    size = 0
+    for chunk in chunks:
+        size += len(encode_items(build_feed(chunk)))
+    return size
+
+
+def make_models(count: int) -> dict:
+    now = datetime.datetime.now()
+    users = [
+        Users(id=n, name=f"user_{n}", email=f"{n}@example.com", apikey=f"k{n}")
+        for n in range(count)
+    ]
+    for user in users:
+        user.last_activity = now
+    tweets = [
+        Tweets(id=n, tweetdata="text", created_on=now, updated_on=now, user_id=1)
+        for n in range(count)
+    ]
+    return {"users": users, "tweets": tweets}
+
+
+# выражения, которые строятся при каждом запросе к API
+STATEMENTS = {
+    "feed_tweets": lambda: (
+        select(Tweets.id, Tweets.tweetdata, Users.id, Users.name)
+        .join(Users)
+        .join(Followers)
+        .where(Followers.follower_id == 1)
+    ),
+    "feed_likes": lambda: (
+        select(Likes.user_id, Likes.tweet_id, Users.name)
+        .join(Users)
+        .where(
+            Likes.tweet_id.in_(
+                select(Tweets.id)
+                .join(Users)
+                .join(Followers)
+                .where(Followers.follower_id == 1)
+            )
+        )
+    ),
+    "feed_media": lambda: select(Media.id, Media.filepath, Media.tweet_id).where(
+        Media.tweet_id.in_([1, 2, 3])
+    ),
+    "user_by_apikey": lambda: select(Users).filter(Users.apikey == "test"),
+    "last_activity": lambda: (
+        update(Users)
+        .where(Users.id == 1)
+        .values(last_activity=datetime.datetime.now())
+        .returning(Users.id)
+    ),
+    "follows_tweet": lambda: select(Tweets.id).where(
+        Tweets.user_id.in_(select(Followers.follower_id).where(Followers.user_id == 1)),
+        Tweets.id == 1,
+    ),
+    "insert_like": lambda: insert(Likes).values(user_id=1, tweet_id=1),
+}
+
+
+def insert_like(user_idx: int, tweet_idx: int):
+    return lambda_stmt(
+        lambda: insert(Likes).values(user_id=user_idx, tweet_id=tweet_idx)
+    )
+
+
+# выражения из utils: (функция, возвращающая выражение; параметры выполнения)
+CACHED_STATEMENTS = {
+    "feed_tweets": (
+        lambda: tweet_queries.FEED_TWEETS,
+        {"user_idx": 1, "since": datetime.datetime.min},
+    ),
+    "feed_likes": (
+        lambda: tweet_queries.FEED_LIKES,
+        {"user_idx": 1, "since": datetime.datetime.min},
+    ),
+    "feed_media": (lambda: tweet_queries.MEDIA_BY_TWEET_IDS, {"tweet_ids": [1, 2, 3]}),
+    "user_by_apikey": (lambda: user_queries.USER_PROFILE_BY_APIKEY, {"apikey": "key1"}),
+    "last_activity": (
+        lambda: user_queries.UPDATE_LAST_ACTIVITY,
+        {"user_id": 1, "now": datetime.datetime.now()},
+    ),
+    "follows_tweet": (
+        lambda: tweet_queries.FOLLOWS_TWEET_EXISTS,
+        {"user_idx": 1, "tweet_idx": 1, "since": datetime.datetime.min},
+    ),
+    "insert_like": (lambda: insert_like(1, 1), {}),
+}
+
+COMPILED_CACHE = dict()
+
+
+def compile_statement(build):
+    return build().compile(dialect=DIALECT)
+
+
+def compile_cached(build, params: dict):
+    """
+    компиляция через кэш, так же как Connection.execute
+    """
+    return build()._compile_w_cache(
+        dialect=DIALECT,
+        compiled_cache=COMPILED_CACHE,
+        column_keys=sorted(params),
+        for_executemany=False,
+        schema_translate_map=None,
+    )
+
+
+def get_cases(tweets: int) -> dict:
+    """
+    случаи измерения: имя -> функция без аргументов
+    """
+
+    rows = make_rows(tweets)
+    chunks = make_chunks(rows, 100)
+    models = make_models(tweets)
+
+    cases = {
+        "feed.group_likes": lambda: group_likes(rows["likes"]),
+        "feed.group_media": lambda: group_media(rows["media"]),
+        "feed.build": lambda: build_feed(rows),
+        "feed.render": lambda: encode_json(
+            {"result": True, "tweets": build_feed(rows)}
+        ),
+        "feed.render_chunked": lambda: render_chunked(chunks),
+        "to_json.users": lambda: [u.to_json() for u in models["users"]],
+        "to_json.tweets": lambda: [t.to_json() for t in models["tweets"]],
+    }
+    for name, build in STATEMENTS.items():
+        cases[f"sql.build.{name}"] = build
+        cases[f"sql.compile.{name}"] = lambda build=build: compile_statement(build)
+    for name, (build, params) in CACHED_STATEMENTS.items():
+        cases[f"sql.cached.{name}"] = lambda build=build, params=params: (
+            compile_cached(build, params)
+        )
+    return cases
+
+
+def measure(func, repeat: int, min_time: float = 0.2) -> dict:
+    """
+    время одной операции (минимум по repeat серий) и пик памяти за один вызов
+    """
+
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(number, int(number * min_time / 0.2))
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"us": round(best * 1e6, 3), "peak_kb": round(peak / 1024, 1)}
+
+
+def run(tweets: int, repeat: int, only: str = None) -> dict:
+    results = dict()
+    for name, func in get_cases(tweets).items():
+        if only and only not in name:
+            continue
+        results[name] = measure(func, repeat)
+    return results
+
+
+async def measure_db(dsn: str, number: int = 500) -> dict:
+    """
+    выполнение запросов чтения из CACHED_STATEMENTS соединением без кэша
+    подготовленных выражений и с кэшем
+    """
+
+    results = dict()
+    for mode, cache_size in (("unprepared", 0), ("prepared", 100)):
+        connection = await asyncpg.connect(dsn, statement_cache_size=cache_size)
+        try:
+            for name, (build, params) in CACHED_STATEMENTS.items():
+                statement = build()
+                if not statement.is_select:
+                    continue
+                compiled = statement.compile(dialect=DIALECT)
+                if "POSTCOMPILE" in compiled.string:
+                    # списки значений (expanding) раскрываются при выполнении
+                    continue
+                values = compiled.construct_params(params)
+                args = [values[key] for key in compiled.positiontup]
+                sql = compiled.string % tuple(f"${n}" for n in range(1, len(args) + 1))
+
+                await connection.fetch(sql, *args)
+                started = time.perf_counter()
+                for _ in range(number):
+                    await connection.fetch(sql, *args)
+                elapsed = (time.perf_counter() - started) / number
+                results[f"db.{mode}.{name}"] = {
+                    "us": round(elapsed * 1e6, 3),
+                    "peak_kb": 0.0,
+                }
+        finally:
+            await connection.close()
+    return results
+
+
+def regressions(baseline: dict, results: dict, threshold: float) -> list:
+    """
+    :return: случаи, время которых выросло больше чем на threshold процентов
+    """
+
+    found = []
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if not base or not base["us"]:
+            continue
+        change = (stats["us"] - base["us"]) / base["us"] * 100
+        if change > threshold:
+            found.append((name, base["us"], stats["us"], change))
+    return found
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Micro benchmarks")
+    parser.add_argument("--tweets", type=int, default=1000, help="feed size")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", default=None, help="substring of case names")
+    parser.add_argument("--output", default=None, help="JSON results file")
+    parser.add_argument("--baseline", default=None, help="JSON results to compare")
+    parser.add_argument("--threshold", type=float, default=20, help="percent")
+    parser.add_argument("--db", action="store_true", help="measure queries in DB")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    results = run(args.tweets, args.repeat, args.only)
+    if args.db:
+        from tests.generate_dataset import get_dsn
+
+        results.update(asyncio.run(measure_db(get_dsn())))
+
+    print(f"{'case':40} {'us/op':>12} {'peak KiB':>10}")
+    for name, stats in results.items():
+        print(f"{name:40} {stats['us']:>12} {stats['peak_kb']:>10}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        found = regressions(baseline, results, args.threshold)
+        for name, old, new, change in found:
+            print(f"REGRESSION {name}: {old} -> {new} us/op ({change:+.1f}%)")
+        if found:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+время запуска сервиса: стоимость импорта main (python -X importtime)
+и время от запуска gunicorn до первого успешного ответа.
+Результат сохраняется в JSON для сравнения двух коммитов.
+
+пример запуска из каталога app_twitter/service:
+    python -m benchmarks.startup --output before.json
+    python -m benchmarks.startup --preload --output after.json
+"""
+import argparse
+import asyncio
+import json
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.load import SERVICE_DIR, git_revision, start_server
+
+
+def parse_importtime(stderr: str, module: str) -> dict:
+    """
+    разбор вывода -X importtime
+    :return: общее время импорта module и время модулей, импортированных из него
+    """
+
+    total = 0
+    children = dict()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip())) // 2
+        name = name.strip()
+        if depth == 0 and name == module:
+            total = int(cumulative)
+        elif depth == 1:
+            children[name] = int(cumulative)
+    return {"total_us": total, "children": children}
+
+
+def import_time(module: str = "main", runs: int = 5) -> dict:
+    """
+    медиана времени импорта module в отдельном процессе по runs запускам
+    """
+
+    samples = []
+    for _ in range(runs):
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=SERVICE_DIR,
+            capture_output=True,
+            text=True,
+        )
+        samples.append(parse_importtime(process.stderr, module))
+
+    samples.sort(key=lambda sample: sample["total_us"])
+    median = samples[len(samples) // 2]
+    top = sorted(median["children"].items(), key=lambda item: item[1], reverse=True)
+    return {
+        "total_ms": round(median["total_us"] / 1000, 1),
+        "top_ms": {name: round(us / 1000, 1) for name, us in top[:10]},
+    }
+
+
+async def wait_first_response(url: str, timeout: float) -> float:
+    started = time.perf_counter()
+    async with httpx.AsyncClient() as client:
+        while time.perf_counter() - started < timeout:
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return time.perf_counter() - started
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.01)
+    raise TimeoutError("server did not start")
+
+
+def first_request_time(
+    port: int, workers: int, preload: bool, runs: int = 3, timeout: float = 60
+) -> float:
+    """
+    медиана времени от запуска gunicorn до первого ответа на GET /
+    """
+
+    samples = []
+    for _ in range(runs):
+        server = start_server(port, workers, ("--preload",) if preload else ())
+        try:
+            samples.append(
+                asyncio.run(wait_first_response(f"http://127.0.0.1:{port}/", timeout))
+            )
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=30)
+    return round(statistics.median(samples), 3)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Startup benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=5100)
+    parser.add_argument("--preload", action="store_true", help="gunicorn --preload")
+    parser.add_argument("--output", default=None, help="JSON results file")
+    return parser.parse_args(argv)
+
+
+def main(args: argparse.Namespace) -> dict:
+    return {
+        "revision": git_revision(),
+        "preload": args.preload,
+        "import": import_time("main", args.runs),
+        "first_request_s": first_request_time(
+            args.port, args.workers, args.preload, runs=args.runs
+        ),
+    }
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    result = main(arguments)
+    print(json.dumps(result, indent=2))
+    if arguments.output:
+        with open(arguments.output, "w") as f:
+            json.dump(result, f, indent=2)
@@ -0,0 +1,220 @@
+import re
+from functools import lru_cache
+from typing import List, Literal
+
+from dotenv import load_dotenv
+from pydantic import BaseSettings, SecretStr, conint, confloat, root_validator
+
+
+class Settings(BaseSettings):
+    """
+    настройки сервиса из переменных окружения (и файла .env).
+    Значения проверяются при создании объекта, ошибка останавливает запуск.
+    Значения по умолчанию рассчитаны на prod: 4 воркера gunicorn на один postgres
+    с max_connections=100
+    """
+
+    DB_USER: str = "default_value"
+    DB_PASSWORD: SecretStr = SecretStr("default_value")
+    DB_HOST: str = "default_value"
+    DB_PORT: conint(ge=1, le=65535) = 5432
+    DB_NAME: str = "default_value"
+
+    # пул соединений сохраняет между запросами подготовленные выражения asyncpg,
+    # DB_POOL_SIZE=0 - соединение на каждый запрос (NullPool).
+    # 4 воркера * (10 + 10) = 80 соединений, остаток - миграции и LISTEN
+    DB_POOL_SIZE: conint(ge=0) = 10
+    DB_MAX_OVERFLOW: conint(ge=0) = 10
+    # ожидание свободного соединения, секунды: при перегрузке запрос быстрее
+    # получает ошибку, чем ждет 30 с по умолчанию SQLAlchemy
+    DB_POOL_TIMEOUT: confloat(gt=0) = 5
+    # пересоздание соединений старше N секунд, -1 - без ограничения
+    DB_POOL_RECYCLE: conint(ge=-1) = 1800
+    # ограничение времени выполнения запроса на сервере, мс, 0 - без ограничения
+    DB_STATEMENT_TIMEOUT: conint(ge=0) = 10000
+    # размер кэша скомпилированных SQL-выражений SQLAlchemy
+    DB_QUERY_CACHE_SIZE: conint(ge=0) = 1200
+    # размер кэша подготовленных выражений asyncpg на соединение
+    DB_PREPARED_STATEMENT_CACHE_SIZE: conint(ge=0) = 500
+
+    MEDIA_DIR: str = "static/media"
+    # размер блока записи загружаемого файла на диск, байт
+    UPLOAD_CHUNK_SIZE: conint(gt=0) = 1024 * 1024
+
+    # размер страницы списков с курсором: по умолчанию и максимальный
+    PAGE_SIZE: conint(ge=1) = 20
+    PAGE_SIZE_MAX: conint(ge=1) = 100
+    BATCH_MAX_ITEMS: conint(ge=1) = 500
+    # лента формируется одним SQL-запросом в JSON на стороне postgres
+    FEED_FAST_PATH: bool = False
+    # твитов в пачке потоковой ленты (GET /api/tweets?stream=true)
+    FEED_STREAM_CHUNK_SIZE: conint(ge=1) = 500
+    # глубина ленты в днях: запросы ленты и твитов по id читают только секции
+    # tweets и likes этого окна, 0 - вся история. Твиты старше окна остаются в БД,
+    # но не показываются в ленте, окно сдвигается раз в сутки
+    FEED_WINDOW_DAYS: conint(ge=0) = 0
+    # строк в пачке выгрузки и загрузки данных пользователя (utils.export)
+    EXPORT_CHUNK_SIZE: conint(ge=1) = 5000
+
+    # gunicorn.conf.py: количество воркеров и импорт приложения до fork
+    GUNICORN_WORKERS: conint(ge=1) = 4
+    GUNICORN_BIND: str = "0.0.0.0:5000"
+    GUNICORN_PRELOAD: bool = False
+
+    # очередь задач: фоновые задачи воркера, пачка, период опроса, секунды
+    JOBS_WORKERS: conint(ge=0) = 2
+    JOBS_BATCH_SIZE: conint(ge=1) = 50
+    JOBS_POLL_INTERVAL: confloat(gt=0) = 1
+    JOBS_MAX_ATTEMPTS: conint(ge=1) = 5
+    JOBS_BACKOFF_BASE: confloat(gt=0) = 1
+    JOBS_BACKOFF_MAX: confloat(gt=0) = 300
+    # выполнение задач сразу после отправки ответа на запрос, который их создал
+    JOBS_DRAIN_AFTER_RESPONSE: bool = True
+
+    # запросов в секунду и размер пачки для одного api-key, 0 - без ограничения
+    RATE_LIMIT_PER_KEY: confloat(ge=0) = 50
+    RATE_LIMIT_PER_KEY_BURST: confloat(ge=1) = 100
+    # общее ограничение воркера
+    RATE_LIMIT_GLOBAL: confloat(ge=0) = 2000
+    RATE_LIMIT_GLOBAL_BURST: confloat(ge=1) = 4000
+    # memory - счетчики в памяти воркера, postgres - общие для всех воркеров
+    RATE_LIMIT_BACKEND: Literal["memory", "postgres"] = "memory"
+    RATE_LIMIT_MAX_KEYS: conint(ge=1) = 100000
+    # postgres: отдельный пул соединений ограничителя и ожидание соединения
+    # из него, секунды (дольше - запрос не ограничивается), период удаления
+    # счетчиков неактивных ключей, секунды (0 - не удаляются)
+    RATE_LIMIT_POOL_SIZE: conint(ge=1) = 2
+    RATE_LIMIT_POOL_TIMEOUT: confloat(gt=0) = 0.5
+    RATE_LIMIT_CLEANUP_INTERVAL: conint(ge=0) = 3600
+
+    # пороги сброса нагрузки, секунды
+    SHED_LOOP_LAG: confloat(gt=0) = 0.5
+    SHED_POOL_WAIT: confloat(gt=0) = 1.0
+    SHED_CHECK_INTERVAL: confloat(gt=0) = 0.1
+    # измерение ожидания пула действительно, пока не устарело
+    SHED_SAMPLE_TTL: confloat(gt=0) = 2.0
+
+    # ответы на запросы с Idempotency-Key хранятся в БД IDEMPOTENCY_TTL секунд,
+    # просроченные удаляются раз в IDEMPOTENCY_CLEANUP_INTERVAL (0 - не удаляются)
+    IDEMPOTENCY_TTL: confloat(gt=0) = 3600
+    IDEMPOTENCY_CLEANUP_INTERVAL: conint(ge=0) = 3600
+    # отдельный пул соединений ключей: соединение с ключом открыто до ответа,
+    # ожидание соединения из него, секунды (дольше - ответ 503)
+    IDEMPOTENCY_POOL_SIZE: conint(ge=1) = 5
+    IDEMPOTENCY_POOL_TIMEOUT: confloat(gt=0) = 2.0
+
+    # популярные хэштеги: корзина счетчиков, секунды, число корзин в окне,
+    # период полураспада веса, размер списка и период снимка, секунды
+    TRENDS_BUCKET_SECONDS: conint(ge=1) = 300
+    TRENDS_WINDOW_BUCKETS: conint(ge=1) = 12
+    TRENDS_HALF_LIFE: confloat(gt=0) = 1800
+    TRENDS_TOP_K: conint(ge=1) = 20
+    TRENDS_SNAPSHOT_INTERVAL: conint(ge=1) = 30
+
+    # поток событий ленты
+    EVENTS_CHANNEL: str = "tw_events"
+    EVENTS_QUEUE_SIZE: conint(ge=1) = 100
+    EVENTS_MAX_CONNECTIONS: conint(ge=1) = 10000
+    EVENTS_KEEPALIVE: confloat(gt=0) = 15
+    EVENTS_RECONNECT_DELAY: confloat(gt=0) = 5
+
+    # индекс подписок в памяти воркера: период полной перезагрузки, секунды
+    # (0 - только при подключении к каналу событий), строк в пачке загрузки
+    FOLLOW_GRAPH_ENABLED: bool = True
+    FOLLOW_GRAPH_RELOAD_INTERVAL: conint(ge=0) = 3600
+    FOLLOW_GRAPH_LOAD_BATCH: conint(ge=1) = 50000
+
+    # рекомендации "на кого подписаться": количество на пользователя, период полного
+    # пересчета, секунды (0 - только после изменения подписок), пользователей в пачке
+    # пересчета и задержка пересчета после изменения подписок, секунды
+    RECOMMENDATIONS_LIMIT: conint(ge=1) = 50
+    RECOMMENDATIONS_REFRESH_INTERVAL: conint(ge=0) = 86400
+    RECOMMENDATIONS_BATCH_USERS: conint(ge=1) = 1000
+    RECOMMENDATIONS_REFRESH_DELAY: confloat(ge=0) = 60
+
+    # ранжированная лента: кандидатов в кэше пользователя, окно кандидатов, секунды,
+    # периоды полураспада скорости лайков и свежести твита, секунды,
+    # вес близости к автору, время жизни кэша, секунды, и число пользователей в кэше
+    RANK_TOP_K: conint(ge=1) = 200
+    RANK_WINDOW: conint(ge=1) = 7 * 24 * 3600
+    RANK_VELOCITY_HALF_LIFE: confloat(gt=0) = 3600
+    RANK_RECENCY_HALF_LIFE: confloat(gt=0) = 6 * 3600
+    RANK_AFFINITY_WEIGHT: confloat(ge=0) = 1
+    RANK_CACHE_TTL: confloat(gt=0) = 60
+    RANK_CACHE_MAX_USERS: conint(ge=1) = 10000
+
+    # сжатие ответов /api/ (gzip, brotli и zstd - если установлены пакеты):
+    # минимальный размер тела, байт, уровни сжатия, размер тела, с которого
+    # сжатие выполняется в пуле потоков, байт, и число сжатых вариантов в кэше
+    COMPRESSION_ENABLED: bool = True
+    COMPRESSION_MIN_SIZE: conint(ge=0) = 1024
+    COMPRESSION_GZIP_LEVEL: conint(ge=1, le=9) = 5
+    COMPRESSION_BROTLI_QUALITY: conint(ge=0, le=11) = 4
+    COMPRESSION_ZSTD_LEVEL: conint(ge=1, le=22) = 3
+    COMPRESSION_THREAD_MIN_SIZE: conint(ge=0) = 64 * 1024
+    COMPRESSION_CACHE_SIZE: conint(ge=0) = 1000
+
+    # месячные секции tweets и likes: сколько месяцев вперед создавать заранее,
+    # старше скольких месяцев выгружать в архив (0 - без архивации), каталог
+    # архива и период обслуживания секций, секунды (0 - не обслуживать)
+    PARTITION_MONTHS_AHEAD: conint(ge=1) = 3
+    PARTITION_ARCHIVE_AFTER_MONTHS: conint(ge=0) = 0
+    PARTITION_ARCHIVE_DIR: str = "archive"
+    PARTITION_MAINTENANCE_INTERVAL: conint(ge=0) = 86400
+
+    # шардирование по id пользователя: строки подключения к шардам JSON-списком
+    # (пустой - все данные в DB_*), виртуальных узлов шарда в кольце согласованного
+    # хэширования, шаг последовательностей id на шардах - максимальное число шардов
+    SHARD_DSNS: List[str] = []
+    SHARD_VNODES: conint(ge=1) = 256
+    SHARD_ID_STRIDE: conint(ge=1) = 64
+
+    # ключ служебных маршрутов /api/service/*, передается в заголовке api-key,
+    # пустой - маршруты закрыты
+    SERVICE_API_KEY: SecretStr = SecretStr("")
+
+    # заполнение БД тестовыми данными при запуске
+    ADD_TEST_DATA: bool = False
+    # разрешение запуска тестов на БД из DB_NAME
+    TESTING: bool = False
+
+    @root_validator(skip_on_failure=True)
+    def check_limits(cls, values: dict) -> dict:
+        if values["PAGE_SIZE"] > values["PAGE_SIZE_MAX"]:
+            raise ValueError("PAGE_SIZE must not exceed PAGE_SIZE_MAX")
+        if values["JOBS_BACKOFF_BASE"] > values["JOBS_BACKOFF_MAX"]:
+            raise ValueError("JOBS_BACKOFF_BASE must not exceed JOBS_BACKOFF_MAX")
+        if len(values["SHARD_DSNS"]) > values["SHARD_ID_STRIDE"]:
+            raise ValueError("SHARD_DSNS must not have more than SHARD_ID_STRIDE items")
+        return values
+
+    @property
+    def database_dsn(self) -> str:
+        """
+        строка подключения для asyncpg
+        """
+        return (
+            f"postgresql://{self.DB_USER}:{self.DB_PASSWORD.get_secret_value()}"
+            f"@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
+        )
+
+    def public(self) -> dict:
+        """
+        настройки для диагностики, пароль и ключ скрыты
+        """
+        values = self.dict()
+        values["DB_PASSWORD"] = str(self.DB_PASSWORD)
+        values["SERVICE_API_KEY"] = str(self.SERVICE_API_KEY)
+        values["SHARD_DSNS"] = [
+            re.sub(r":[^:@/]*@", ":**********@", dsn) for dsn in self.SHARD_DSNS
+        ]
+        return values
+
+
+@lru_cache()
+def get_settings() -> Settings:
+    """
+    настройки читаются и проверяются один раз на процесс
+    """
+    load_dotenv()
+    return Settings()
@@ -0,0 +1,16 @@
+"""
+настройки gunicorn, файл читается из каталога запуска.
+При GUNICORN_PRELOAD=yes приложение импортируется один раз в мастер-процессе
+до fork воркеров. Импорт main не открывает соединений с БД и не создает
+цикл событий: соединения пула, фоновые задачи и цикл событий создаются
+в каждом воркере после fork (обработчик startup)
+"""
+from config import get_settings
+
+
+settings = get_settings()
+
+bind = settings.GUNICORN_BIND
+workers = settings.GUNICORN_WORKERS
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = settings.GUNICORN_PRELOAD
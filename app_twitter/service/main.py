@@ -1,14 +1,27 @@
-import gunicorn
+import asyncio
+
 from fastapi import FastAPI
+from starlette.background import BackgroundTask
 from starlette.requests import Request
-import uvicorn
 
 from fastapi.staticfiles import StaticFiles
 
-from models.database import engine
-from routes import tweet_routes, user_routes
+from config import get_settings
+from models.database import engine, async_session_maker, ASYNCPG_DSN, TimedQueuePool
+from models import sharding
+from routes import tweet_routes, user_routes, tag_routes, service_routes
 from logger.logger import logger
-from tests.add_testdata_db import add_test_data_in_db
+from utils.trends import trends_snapshot_loop
+from utils.events import event_broker
+from utils.follow_graph import follow_graph
+from utils.ranking import ranked_feed
+from utils.recommendations import start_recommendations_refresh
+from utils.partitions import start_partition_maintenance
+from utils.ratelimit import RequestLimiter, create_key_limiter, load_shedder
+from utils.ratelimit import start_rate_limit_cleanup
+from utils.jobs import job_runner, track_enqueued, JOBS_DRAIN_AFTER_RESPONSE
+from utils.idempotency import idempotency_store, start_idempotency_cleanup
+from utils.compression import compress_response
 
 # todo  доделать README
 
@@ -16,9 +29,16 @@ from tests.add_testdata_db import add_test_data_in_db
 app = FastAPI()
 app.include_router(tweet_routes.router)
 app.include_router(user_routes.router)
+app.include_router(tag_routes.router)
+app.include_router(service_routes.router)
 
 app.mount("/", StaticFiles(directory="static", html=True))
 
+request_limiter = RequestLimiter(create_key_limiter(ASYNCPG_DSN))
+TimedQueuePool.wait_callbacks.append(load_shedder.record_pool_wait)
+job_runner.bind(async_session_maker)
+idempotency_store.connect(ASYNCPG_DSN)
+
 
 @app.middleware("http")
 async def add_csp_header(request: Request, call_next):
@@ -28,14 +48,67 @@ async def add_csp_header(request: Request, call_next):
     return response
 
 
+@app.middleware("http")
+async def compress_responses(request: Request, call_next):
+    # ответы API сжимаются кодировкой из Accept-Encoding
+    response = await call_next(request)
+    if request.url.path.startswith('/api/'):
+        return await compress_response(request, response)
+    return response
+
+
+@app.middleware("http")
+async def run_jobs_after_response(request: Request, call_next):
+    # задачи, созданные запросом, выполняются после отправки ответа
+    jobs = track_enqueued()
+    response = await call_next(request)
+    if JOBS_DRAIN_AFTER_RESPONSE and jobs.count:
+        response.background = BackgroundTask(job_runner.drain)
+    return response
+
+
+@app.middleware("http")
+async def limit_requests(request: Request, call_next):
+    if request.url.path.startswith('/api/'):
+        response = await request_limiter.check(request)
+        if response is not None:
+            return response
+    return await call_next(request)
+
+
 @app.on_event("startup")
 async def startup():
-    await add_test_data_in_db()
+    if get_settings().ADD_TEST_DATA:
+        # код заполнения тестовыми данными загружается только когда он нужен
+        from tests.add_testdata_db import add_test_data_in_db
+
+        await add_test_data_in_db()
+    app.state.trends_task = asyncio.create_task(
+        trends_snapshot_loop(async_session_maker)
+    )
+    follow_graph.start(async_session_maker, event_broker)
+    ranked_feed.start(event_broker)
+    event_broker.start(ASYNCPG_DSN)
+    load_shedder.start()
+    job_runner.start()
+    await start_recommendations_refresh(async_session_maker)
+    await start_partition_maintenance(async_session_maker)
+    await start_idempotency_cleanup(async_session_maker)
+    await start_rate_limit_cleanup(async_session_maker)
     logger.info(f'{__name__}:Engine begin')
 
 
 @app.on_event("shutdown")
 async def shutdown():
+    app.state.trends_task.cancel()
+    await event_broker.stop()
+    await follow_graph.stop()
+    await load_shedder.stop()
+    await job_runner.stop()
+    await request_limiter.close()
+    await idempotency_store.close()
+    if sharding.shard_sessions is not None:
+        await sharding.shard_sessions.dispose()
     await engine.dispose()
     logger.info(f'{__name__}:Engine dispose')
 
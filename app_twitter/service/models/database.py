@@ -1,28 +1,65 @@
-import os
+import time
 from typing import AsyncGenerator
-from dotenv import load_dotenv
 
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import NullPool, AsyncAdaptedQueuePool
 
+from config import get_settings
 from logger.logger import logger
 
-load_dotenv()
+settings = get_settings()
 
-DB_USER = os.environ.get("DB_USER", "default_value")
-DB_PASSWORD = os.environ.get("DB_PASSWORD", "default_value")
-DB_HOST = os.environ.get("DB_HOST", "default_value")
-DB_PORT = os.environ.get("DB_PORT", "5432")
-DB_NAME = os.environ.get("DB_NAME", "default_value")
+DB_NAME = settings.DB_NAME
 
 
 logger.info(f"DB NAME = {DB_NAME}")
 
-engine = create_async_engine(
-    f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}",
-    poolclass=NullPool,
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    пул соединений, сообщающий время ожидания соединения функциям wait_callbacks
+    """
+
+    wait_callbacks = []
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            for callback in self.wait_callbacks:
+                callback(waited)
+
+
+if settings.DB_POOL_SIZE > 0:
+    pool_options = dict(
+        poolclass=TimedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+    )
+else:
+    pool_options = dict(poolclass=NullPool)
+
+# строка подключения для прямых соединений asyncpg (LISTEN/NOTIFY)
+ASYNCPG_DSN = settings.database_dsn
+
+# параметры движков основной БД и шардов (models.sharding)
+engine_options = dict(
     echo=False,
+    query_cache_size=settings.DB_QUERY_CACHE_SIZE,
+    connect_args={
+        "prepared_statement_cache_size": settings.DB_PREPARED_STATEMENT_CACHE_SIZE,
+        "server_settings": {"statement_timeout": str(settings.DB_STATEMENT_TIMEOUT)},
+    },
+    **pool_options,
+)
+
+engine = create_async_engine(
+    ASYNCPG_DSN.replace("postgresql://", "postgresql+asyncpg://", 1), **engine_options
 )
 
 async_session_maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
@@ -1,7 +1,9 @@
 from datetime import datetime
 
-from sqlalchemy import Column, ForeignKey, MetaData
-from sqlalchemy import Text, Integer, DateTime, String
+from sqlalchemy import Column, ForeignKey, MetaData, Index, PrimaryKeyConstraint
+from sqlalchemy import Text, Integer, DateTime, String, Float, Boolean, JSON
+from sqlalchemy import LargeBinary
+from sqlalchemy import DDL, event, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -18,6 +20,13 @@ class Users(Base):
     email = Column(String(50), nullable=False, unique=True)
     apikey = Column(String(100), nullable=True, unique=True)
     last_activity = Column(DateTime, default=datetime.now)
+    # количество строк followers с user_id и с follower_id пользователя,
+    # обновляются вместе с подписками
+    followers_count = Column(Integer, nullable=False, default=0, server_default="0")
+    following_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # версии для ETag: профиля (подписки) и твитов пользователя (твиты и лайки к ним)
+    profile_version = Column(Integer, nullable=False, default=0, server_default="0")
+    content_version = Column(Integer, nullable=False, default=0, server_default="0")
 
     tweets = relationship("Tweets", back_populates="user", lazy="selectin")
     likes = relationship("Likes", back_populates="user", lazy="selectin")
@@ -36,20 +45,43 @@ class Users(Base):
         return json
 
 
+# секционирована по месяцам created_on (utils.partitions), поэтому первичный ключ
+# (id, created_on), а ссылки на твиты из других таблиц - без внешних ключей
 class Tweets(Base):
     __tablename__ = "tweets"
     metadata = metadata
-    id = Column(Integer, primary_key=True, autoincrement=True)
+    id = Column(Integer, autoincrement=True)
     tweetdata = Column(Text)
-    created_on = Column(DateTime, default=datetime.now)
+    created_on = Column(
+        DateTime,
+        nullable=False,
+        default=datetime.now,
+        server_default=text("LOCALTIMESTAMP"),
+    )
     updated_on = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    # счетчики для ранжированной ленты, обновляются вместе с лайками
+    likes_count = Column(Integer, nullable=False, default=0, server_default="0")
+    like_velocity = Column(Float, nullable=False, default=0, server_default="0")
+    like_velocity_on = Column(DateTime, nullable=True)
 
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     user = relationship(
         "Users", back_populates="tweets", cascade="all", lazy="selectin"
     )
 
-    likes = relationship("Likes", back_populates="tweet", lazy="selectin")
+    __table_args__ = (
+        PrimaryKeyConstraint("id", "created_on"),
+        Index("ix_tweets_user_id_created_on", "user_id", "created_on"),
+        {"postgresql_partition_by": "RANGE (created_on)"},
+    )
+    __mapper_args__ = {"primary_key": [id]}
+
+    likes = relationship(
+        "Likes",
+        primaryjoin="Tweets.id == foreign(Likes.tweet_id)",
+        back_populates="tweet",
+        lazy="selectin",
+    )
 
     def __repr__(self):
         return f"Tweet {self.id}: {self.tweetdata}"
@@ -65,6 +97,7 @@ class Media(Base):
     filepath = Column(String(200), nullable=False)
 
     tweet_id = Column(Integer, nullable=True)
+    uploader = Column(Integer, ForeignKey("users.id"), nullable=True)
 
     def __repr__(self):
         return f"Media {self.id}: {self.tweet_id} {self.filepath}"
@@ -73,19 +106,36 @@ class Media(Base):
         return {c.name: getattr(self, c.name) for c in self.__table__.columns}
 
 
+# секционирована по месяцам created_on, как и tweets
 class Likes(Base):
     __tablename__ = "likes"
     metadata = metadata
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    created_on = Column(DateTime, default=datetime.now)
+    id = Column(Integer, autoincrement=True)
+    created_on = Column(
+        DateTime,
+        nullable=False,
+        default=datetime.now,
+        server_default=text("LOCALTIMESTAMP"),
+    )
 
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     user = relationship("Users", back_populates="likes", cascade="all", lazy="selectin")
 
-    tweet_id = Column(Integer, ForeignKey("tweets.id"), nullable=False)
+    tweet_id = Column(Integer, nullable=False)
     tweet = relationship(
-        "Tweets", back_populates="likes", cascade="all", lazy="selectin"
+        "Tweets",
+        primaryjoin="foreign(Likes.tweet_id) == Tweets.id",
+        back_populates="likes",
+        cascade="all",
+        lazy="selectin",
+    )
+
+    __table_args__ = (
+        PrimaryKeyConstraint("id", "created_on"),
+        Index("ix_likes_tweet_id", "tweet_id"),
+        {"postgresql_partition_by": "RANGE (created_on)"},
     )
+    __mapper_args__ = {"primary_key": [id]}
 
     def __repr__(self):
         return f"Like {self.id}: user:{self.user_id} tweet:{self.tweet_id}"
@@ -94,6 +144,34 @@ class Likes(Base):
         return {c.name: getattr(self, c.name) for c in self.__table__.columns}
 
 
+# секции текущего месяца и трех следующих, дальше секции создает и архивирует
+# utils.partitions. Секции по умолчанию нет: с ней недоступен
+# DETACH PARTITION CONCURRENTLY
+MONTHLY_PARTITIONS = DDL(
+    """
+    DO $$
+    DECLARE
+        month timestamp;
+    BEGIN
+        FOR month IN SELECT generate_series(
+            date_trunc('month', LOCALTIMESTAMP),
+            date_trunc('month', LOCALTIMESTAMP) + interval '3 months',
+            interval '1 month'
+        ) LOOP
+            EXECUTE format(
+                'CREATE TABLE %%I PARTITION OF %(table)s FOR VALUES FROM (%%L) TO (%%L)',
+                '%(table)s_p' || to_char(month, 'YYYYMM'),
+                month,
+                month + interval '1 month'
+            );
+        END LOOP;
+    END $$
+    """
+)
+for _table in (Tweets.__table__, Likes.__table__):
+    event.listen(_table, "after_create", MONTHLY_PARTITIONS)
+
+
 class Followers(Base):
     __tablename__ = "followers"
     metadata = metadata
@@ -105,8 +183,225 @@ class Followers(Base):
         "Users", back_populates="follower", cascade="all", lazy="selectin"
     )
 
+    __table_args__ = (
+        Index("ix_followers_user_id_follower_id", "user_id", "follower_id"),
+        Index("ix_followers_follower_id_user_id", "follower_id", "user_id"),
+    )
+
     def __repr__(self):
         return f"Follower:{self.follower_id}, user:{self.user_id}"
 
     def to_json(self):
         return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+
+# инвертированный индекс хэштегов: тег -> id твитов
+class TweetTags(Base):
+    __tablename__ = "tweet_tags"
+    metadata = metadata
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    tag = Column(String(100), nullable=False)
+
+    tweet_id = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("ix_tweet_tags_tag_tweet_id", "tag", "tweet_id", unique=True),
+        Index("ix_tweet_tags_tweet_id", "tweet_id"),
+    )
+
+    def __repr__(self):
+        return f"Tag #{self.tag}: tweet:{self.tweet_id}"
+
+    def to_json(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+
+# инвертированный индекс упоминаний: пользователь -> id твитов
+class TweetMentions(Base):
+    __tablename__ = "tweet_mentions"
+    metadata = metadata
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    tweet_id = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("ix_tweet_mentions_user_id_tweet_id", "user_id", "tweet_id", unique=True),
+        Index("ix_tweet_mentions_tweet_id", "tweet_id"),
+    )
+
+    def __repr__(self):
+        return f"Mention user:{self.user_id} tweet:{self.tweet_id}"
+
+    def to_json(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+
+# счетчики хэштегов по временным интервалам, накапливаются всеми воркерами
+class TrendBuckets(Base):
+    __tablename__ = "trend_buckets"
+    metadata = metadata
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    tag = Column(String(100), nullable=False)
+    bucket = Column(Integer, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_trend_buckets_tag_bucket", "tag", "bucket", unique=True),
+        Index("ix_trend_buckets_bucket", "bucket"),
+    )
+
+    def __repr__(self):
+        return f"TrendBucket #{self.tag}: {self.bucket} {self.count}"
+
+    def to_json(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+
+# снимок списка популярных хэштегов
+class TrendingTags(Base):
+    __tablename__ = "trending_tags"
+    metadata = metadata
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    rank = Column(Integer, nullable=False, unique=True)
+    tag = Column(String(100), nullable=False)
+    score = Column(Float, nullable=False)
+    updated_on = Column(DateTime, default=datetime.now)
+
+    def __repr__(self):
+        return f"Trending {self.rank}: #{self.tag} {self.score}"
+
+    def to_json(self):
+        return {
+            "tag": self.tag,
+            "score": self.score,
+            "updated_on": str(self.updated_on),
+        }
+
+
+# общие для всех воркеров счетчики токенов ограничения частоты запросов
+class RateLimitBuckets(Base):
+    __tablename__ = "rate_limit_buckets"
+    metadata = metadata
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    key = Column(String(200), nullable=False, unique=True)
+    tokens = Column(Float, nullable=False)
+    allowed = Column(Boolean, nullable=False, default=True)
+    updated_on = Column(DateTime, default=datetime.now)
+
+    def __repr__(self):
+        return f"RateLimitBucket {self.key}: {self.tokens}"
+
+    def to_json(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+
+# ответы на запросы с ключом идемпотентности, общие для всех воркеров:
+# строка без ответа - запрос выполняется в открытой транзакции
+class IdempotencyKeys(Base):
+    __tablename__ = "idempotency_keys"
+    metadata = metadata
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    apikey_hash = Column(String(64), nullable=False)
+    route = Column(String(100), nullable=False)
+    key = Column(String(200), nullable=False)
+    fingerprint = Column(String(64), nullable=False)
+    status_code = Column(Integer, nullable=True)
+    body = Column(LargeBinary, nullable=True)
+    expires_on = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index(
+            "ix_idempotency_keys_apikey_hash_route_key",
+            "apikey_hash",
+            "route",
+            "key",
+            unique=True,
+        ),
+        Index("ix_idempotency_keys_expires_on", "expires_on"),
+    )
+
+    def __repr__(self):
+        return f"IdempotencyKey {self.route} {self.key}: {self.status_code}"
+
+    def to_json(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+
+# очередь отложенных задач, выбирается воркерами через FOR UPDATE SKIP LOCKED
+class Jobs(Base):
+    __tablename__ = "jobs"
+    metadata = metadata
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String(50), nullable=False)
+    payload = Column(JSON, nullable=False)
+    dedup_key = Column(String(200), nullable=True, unique=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    run_at = Column(DateTime, nullable=False, default=datetime.now)
+    created_on = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (Index("ix_jobs_run_at", "run_at"),)
+
+    def __repr__(self):
+        return f"Job {self.id}: {self.kind} attempts:{self.attempts}"
+
+    def to_json(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+
+# задачи, не выполненные после всех попыток
+class DeadJobs(Base):
+    __tablename__ = "dead_jobs"
+    metadata = metadata
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(Integer, nullable=False)
+    kind = Column(String(50), nullable=False)
+    payload = Column(JSON, nullable=False)
+    attempts = Column(Integer, nullable=False)
+    last_error = Column(Text, nullable=True)
+    created_on = Column(DateTime)
+    failed_on = Column(DateTime, default=datetime.now)
+
+    def __repr__(self):
+        return f"Dead job {self.job_id}: {self.kind} {self.last_error}"
+
+    def to_json(self):
+        return {
+            c.name: str(getattr(self, c.name))
+            if isinstance(getattr(self, c.name), datetime)
+            else getattr(self, c.name)
+            for c in self.__table__.columns
+        }
+
+
+# рекомендации "на кого подписаться": пользователи на расстоянии двух подписок,
+# score - количество подписок пользователя, через которые они найдены
+class FollowRecommendations(Base):
+    __tablename__ = "follow_recommendations"
+    metadata = metadata
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+    )
+    recommended_id = Column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+    )
+    score = Column(Integer, nullable=False)
+    created_on = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        Index(
+            "ix_follow_recommendations_user_id_recommended_id",
+            "user_id",
+            "recommended_id",
+            unique=True,
+        ),
+        Index("ix_follow_recommendations_user_id_score", "user_id", "score"),
+    )
+
+    def __repr__(self):
+        return f"Recommendation for {self.user_id}: {self.recommended_id} {self.score}"
+
+    def to_json(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
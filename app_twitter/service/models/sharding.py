@@ -0,0 +1,164 @@
+import asyncio
+import bisect
+import hashlib
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Union
+
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from config import get_settings
+from .database import engine_options, pool_options
+
+
+settings = get_settings()
+
+SHARD_VNODES = settings.SHARD_VNODES
+SHARD_ID_STRIDE = settings.SHARD_ID_STRIDE
+
+
+def ring_hash(key: str) -> int:
+    """
+    положение ключа на кольце: первые 8 байт md5, одинаковое во всех процессах
+    (встроенный hash() строк зависит от PYTHONHASHSEED)
+    """
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    кольцо согласованного хэширования: каждый узел занимает vnodes точек кольца,
+    ключ принадлежит узлу первой точки по часовой стрелке. При добавлении или
+    удалении узла меняют узел только ключи его точек, примерно 1/N ключей
+    """
+
+    def __init__(self, nodes: Iterable[str], vnodes: int = SHARD_VNODES):
+        self.nodes = list(nodes)
+        self.vnodes = vnodes
+        points = sorted(
+            (ring_hash(f"{node}#{idx}"), node)
+            for node in self.nodes
+            for idx in range(vnodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key: Union[int, str]) -> str:
+        """
+        узел, которому принадлежит ключ
+        """
+        if not self._hashes:
+            raise LookupError("Hash ring is empty")
+        idx = bisect.bisect(self._hashes, ring_hash(str(key)))
+        return self._nodes[idx % len(self._nodes)]
+
+
+def shard_name(idx: int) -> str:
+    """
+    имя шарда по номеру в SHARD_DSNS, номер задает и остаток id на шарде
+    """
+    return f"shard{idx}"
+
+
+class ShardSessionMaker:
+    """
+    фабрика сессий шардов: пользователь, его твиты с их лайками, хэштегами и
+    упоминаниями и его медиа-файлы хранятся на шарде, выбранном кольцом
+    согласованного хэширования по id пользователя. Основная БД (DB_*) остается
+    справочником пользователей и подписок, в ней же очередь задач и события
+    """
+
+    def __init__(self, dsns: list, vnodes: int = SHARD_VNODES, **options):
+        """
+        :param dsns: строки подключения к шардам, порядок определяет имена шардов
+        :param vnodes: виртуальных узлов шарда в кольце
+        :param options: параметры движков, по умолчанию - как у основной БД,
+        с другим poolclass параметры пула основной БД не передаются
+        """
+        defaults = dict(engine_options)
+        if "poolclass" in options:
+            for key in pool_options:
+                defaults.pop(key)
+        options = {**defaults, **options}
+        self.dsns = {shard_name(idx): dsn for idx, dsn in enumerate(dsns)}
+        self.engines = {
+            name: create_async_engine(
+                dsn.replace("postgresql://", "postgresql+asyncpg://", 1), **options
+            )
+            for name, dsn in self.dsns.items()
+        }
+        self.session_makers = {
+            name: sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+            for name, engine in self.engines.items()
+        }
+        self.ring = HashRing(self.dsns, vnodes)
+
+    @property
+    def names(self) -> list:
+        return list(self.dsns)
+
+    def shard_for(self, user_id: int) -> str:
+        """
+        имя шарда пользователя
+        """
+        return self.ring.node_for(user_id)
+
+    def __call__(self, name: str) -> AsyncSession:
+        """
+        новая сессия шарда по имени
+        """
+        return self.session_makers[name]()
+
+    def for_user(self, user_id: int) -> AsyncSession:
+        """
+        новая сессия шарда пользователя
+        """
+        return self(self.shard_for(user_id))
+
+    async def scatter(
+        self, func: Callable[[AsyncSession, str], Awaitable], names: list = None
+    ) -> dict:
+        """
+        параллельное выполнение func(session, имя шарда) на шардах,
+        у каждого шарда своя сессия
+        :param func: async функция запроса к одному шарду
+        :param names: имена шардов, по умолчанию - все
+        :return: dict имя шарда -> результат func
+        """
+
+        async def run(name: str):
+            async with self(name) as session:
+                return await func(session, name)
+
+        names = self.names if names is None else list(names)
+        results = await asyncio.gather(*(run(name) for name in names))
+        return dict(zip(names, results))
+
+    async def dispose(self):
+        for engine in self.engines.values():
+            await engine.dispose()
+
+
+# None - шардирование выключено, все данные в основной БД
+shard_sessions = ShardSessionMaker(settings.SHARD_DSNS) if settings.SHARD_DSNS else None
+
+
+@asynccontextmanager
+async def shard_session(
+    session: AsyncSession, user_id: int
+) -> AsyncIterator[AsyncSession]:
+    """
+    сессия данных пользователя: без шардов - переданная сессия основной БД,
+    изменения сохраняет commit вызывающей функции; с шардами - сессия шарда
+    пользователя, commit при выходе из блока без исключения
+    :param session: сессия основной БД
+    :param user_id: id пользователя
+    """
+
+    if shard_sessions is None:
+        yield session
+        return
+
+    async with shard_sessions.for_user(user_id) as content:
+        yield content
+        await content.commit()
@@ -0,0 +1,134 @@
+import secrets
+from typing import Union
+
+from fastapi import APIRouter, Header
+from starlette import status
+from starlette.responses import JSONResponse
+
+from config import get_settings
+from utils.jobs import job_runner
+from utils.follow_graph import follow_graph
+from utils.compression import compressed_cache, CODECS
+from utils.ratelimit import load_shedder
+from logger.logger import logger
+
+
+router = APIRouter()
+
+SERVICE_API_KEY = get_settings().SERVICE_API_KEY.get_secret_value()
+
+
+def check_service_key(api_key: Union[str, None]) -> Union[JSONResponse, None]:
+    """
+    проверка ключа служебных маршрутов, без SERVICE_API_KEY маршруты закрыты
+    :param api_key: значение заголовка api-key
+    :return: ответ с ошибкой или None, если ключ верный
+    """
+
+    if SERVICE_API_KEY and secrets.compare_digest(
+        (api_key or "").encode(), SERVICE_API_KEY.encode()
+    ):
+        return None
+    return JSONResponse(
+        content={
+            "result": False,
+            "error_type": "Authorisation Error.",
+            "error_message": "Invalid service key.",
+        },
+        status_code=status.HTTP_403_FORBIDDEN,
+    )
+
+
+@router.get("/api/service/jobs")
+async def get_jobs_metrics(api_key: Union[str, None] = Header(default=None)):
+    """
+    метрики очереди задач: задачи в очереди и в dead_jobs по типам,
+    счетчики выполненных, повторенных и отброшенных задач воркера
+    :param api_key: ключ служебных маршрутов
+    :return: json-объект с метриками
+    """
+
+    denied = check_service_key(api_key)
+    if denied is not None:
+        return denied
+
+    try:
+        metrics = await job_runner.metrics()
+    except Exception as err:
+        logger.error(err)
+        return JSONResponse(
+            content={
+                "result": False,
+                "error_type": "DB error",
+                "error_message": "Error when accessing the database.",
+            },
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        )
+
+    metrics["load"] = {
+        "loop_lag": round(load_shedder.loop_lag, 4),
+        "pool_wait": round(load_shedder.current_pool_wait(), 4),
+        "shed": load_shedder.shed_count,
+    }
+    return JSONResponse(
+        content={"result": True, "metrics": metrics}, status_code=status.HTTP_200_OK
+    )
+
+
+@router.get("/api/service/settings")
+async def get_service_settings(api_key: Union[str, None] = Header(default=None)):
+    """
+    действующие настройки воркера (только чтение), пароль БД скрыт
+    :param api_key: ключ служебных маршрутов
+    :return: json-объект с настройками
+    """
+
+    denied = check_service_key(api_key)
+    if denied is not None:
+        return denied
+
+    return JSONResponse(
+        content={"result": True, "settings": get_settings().public()},
+        status_code=status.HTTP_200_OK,
+    )
+
+
+@router.get("/api/service/follow_graph")
+async def get_follow_graph_stats(api_key: Union[str, None] = Header(default=None)):
+    """
+    состояние индекса подписок воркера: загружен ли индекс, количество
+    пользователей и подписок, занимаемая память в байтах, время загрузки
+    :param api_key: ключ служебных маршрутов
+    :return: json-объект со статистикой
+    """
+
+    denied = check_service_key(api_key)
+    if denied is not None:
+        return denied
+
+    return JSONResponse(
+        content={"result": True, "follow_graph": follow_graph.stats()},
+        status_code=status.HTTP_200_OK,
+    )
+
+
+@router.get("/api/service/compression")
+async def get_compression_stats(api_key: Union[str, None] = Header(default=None)):
+    """
+    сжатие ответов воркера: доступные кодировки и кэш сжатых вариантов
+    :param api_key: ключ служебных маршрутов
+    :return: json-объект со статистикой
+    """
+
+    denied = check_service_key(api_key)
+    if denied is not None:
+        return denied
+
+    return JSONResponse(
+        content={
+            "result": True,
+            "encodings": list(CODECS),
+            "cache": compressed_cache.stats(),
+        },
+        status_code=status.HTTP_200_OK,
+    )
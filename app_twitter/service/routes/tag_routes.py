@@ -0,0 +1,93 @@
+from typing import Union
+
+from fastapi import APIRouter, Header, Query
+from fastapi import Depends
+from starlette import status
+from starlette.responses import JSONResponse
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from utils.users import check_user_exists
+from utils.tweets import tweets_by_ids
+from utils.tags import tag_tweet_ids
+from utils.trends import get_trending_tags
+from config import get_settings
+from models.database import get_async_session
+
+
+router = APIRouter()
+settings = get_settings()
+
+
+@router.get("/api/tags/trending")
+async def get_trending(
+    limit: int = Query(default=10, ge=1, le=100),
+    api_key: Union[str, None] = Header(default=None),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    популярные хэштеги из последнего снимка
+    :param limit: размер списка
+    :param api_key: ключ авторизации пользователя
+    :param session: экземпляр сессии работы с БД
+    :return: список хэштегов по убыванию популярности
+    """
+
+    user = await check_user_exists(session, apikey=api_key)
+    if not user:
+        return JSONResponse(
+            content={
+                "result": False,
+                "error_type": "Authorisation Error.",
+                "error_message": "Invalid authorization key.",
+            },
+            status_code=status.HTTP_403_FORBIDDEN,
+        )
+
+    tags = await get_trending_tags(session, limit)
+
+    return JSONResponse(
+        content={"result": True, "tags": tags}, status_code=status.HTTP_200_OK
+    )
+
+
+@router.get("/api/tags/{tag}/tweets")
+async def get_tag_timeline(
+    tag: str,
+    before_id: Union[int, None] = Query(default=None, ge=1),
+    limit: int = Query(default=settings.PAGE_SIZE, ge=1, le=settings.PAGE_SIZE_MAX),
+    api_key: Union[str, None] = Header(default=None),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    лента твитов с хэштегом, постранично от новых к старым
+    :param tag: хэштег (без символа #)
+    :param before_id: курсор - id последнего твита предыдущей страницы
+    :param limit: размер страницы
+    :param api_key: ключ авторизации пользователя
+    :param session: экземпляр сессии работы с БД
+    :return: список твитов и курсор следующей страницы
+    """
+
+    user = await check_user_exists(session, apikey=api_key)
+    if not user:
+        return JSONResponse(
+            content={
+                "result": False,
+                "error_type": "Authorisation Error.",
+                "error_message": "Invalid authorization key.",
+            },
+            status_code=status.HTTP_403_FORBIDDEN,
+        )
+
+    ids = await tag_tweet_ids(session, tag, before_id, limit)
+    tweets = await tweets_by_ids(session, ids)
+
+    return JSONResponse(
+        content={
+            "result": True,
+            "tweets": tweets,
+            "next_cursor": ids[-1] if len(ids) == limit else None,
+        },
+        status_code=status.HTTP_200_OK,
+    )
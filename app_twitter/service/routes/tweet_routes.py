@@ -1,48 +1,75 @@
-from typing import Union
+from typing import Literal, Union
 
-from fastapi import APIRouter, Header, UploadFile
+from fastapi import APIRouter, Header, Query, UploadFile
 from fastapi import Depends
 from starlette import status
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, StreamingResponse, Response
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from utils.users import get_user_by_apikey, check_user_exists
+from utils.users import check_user_exists
+from utils import tweets as tweets_utils
 from utils.tweets import (
     add_tweet,
     tweets_list,
+    tweets_list_json,
+    ranked_tweets_list,
+    stream_tweets_list,
     check_tweet_exists,
     add_like_to_tweet,
     delete_like_to_tweet,
     delete_tweet,
     check_users_tweet_exists,
     check_follows_tweet_exists,
+    batch_like_tweets,
 )
-from utils.media import save_file
-
+from utils.media import save_file, MediaLinkError
+from utils.idempotency import idempotency_store, request_fingerprint
+from utils.idempotency import upload_fingerprint
+from utils.events import event_broker, event_stream, get_feed_author_ids
+from utils.etags import feed_etag, etag_matches, not_modified
+from utils.streaming import json_object_stream
+
+from config import get_settings
 from logger.logger import logger
+from models import sharding
 from models.database import get_async_session
-from schemas.schemas import BaseTweet
+from schemas.schemas import BaseTweet, BatchLikes
 
 
 router = APIRouter()
+settings = get_settings()
 
 
 @router.post("/api/tweets")
 async def add_tweet_route(
     tweet_data: BaseTweet,
     api_key: Union[str, None] = Header(default=None),
+    idempotency_key: Union[str, None] = Header(default=None),
     session: AsyncSession = Depends(get_async_session),
 ):
     """
     1.создание твита
     :param tweet_data: содержание твита
     :param api_key: ключ авторизации пользователя
+    :param idempotency_key: ключ повтора запроса, повтор возвращает сохраненный ответ
     :param session: экземпляр сессии для работы с БД
     :return: json-объект с результатом операции, id - созданного твита
     """
 
-    user = await get_user_by_apikey(session, api_key)
+    if idempotency_key:
+        return await idempotency_store.run(
+            (api_key, "/api/tweets", idempotency_key),
+            lambda: create_tweet(tweet_data, api_key, session),
+            fingerprint=request_fingerprint(tweet_data.json()),
+        )
+    return await create_tweet(tweet_data, api_key, session)
+
+
+async def create_tweet(
+    tweet_data: BaseTweet, api_key: Union[str, None], session: AsyncSession
+) -> JSONResponse:
+    user = await check_user_exists(session, apikey=api_key)
 
     if not user:
         logger.error(f"User not found.")
@@ -56,12 +83,24 @@ async def add_tweet_route(
         )
 
     if user:
-        tweet_id = await add_tweet(
-            session,
-            user["user"]["id"],
-            tweet_data.tweet_data,
-            tweet_data.tweet_media_ids,
-        )
+        try:
+            tweet_id = await add_tweet(
+                session,
+                user["id"],
+                tweet_data.tweet_data,
+                tweet_data.tweet_media_ids,
+            )
+        except MediaLinkError as err:
+            return JSONResponse(
+                content={
+                    "result": False,
+                    "error_type": "Media Error.",
+                    "error_message": "Media not found, already attached "
+                    "or uploaded by another user.",
+                    "media_ids": err.media_ids,
+                },
+                status_code=status.HTTP_400_BAD_REQUEST,
+            )
         if tweet_id:
             return JSONResponse(
                 content={"result": True, "tweet_id": tweet_id},
@@ -84,21 +123,62 @@ async def add_tweet_route(
 
 @router.get("/api/tweets")
 async def get_tweets_list(
+    mode: Literal["chronological", "ranked"] = Query(default="chronological"),
+    limit: int = Query(default=settings.PAGE_SIZE, ge=1, le=settings.PAGE_SIZE_MAX),
+    stream: bool = Query(default=False),
     api_key: Union[str, None] = Header(default=None),
+    if_none_match: Union[str, None] = Header(default=None),
     session: AsyncSession = Depends(get_async_session),
 ):
     """
     8. получить ленту с твитами
+    :param mode: chronological - все твиты от новых к старым,
+    ranked - limit твитов по убыванию score (скорость лайков, свежесть, близость к автору)
+    :param limit: размер ранжированной ленты
+    :param stream: chronological лента кодируется и отправляется пачками твитов
+    по мере чтения из БД, память не зависит от размера ленты
     :param api_key: ключ авторизации пользователя
+    :param if_none_match: ETag ранее полученной ленты, если лента не изменилась,
+    возвращается 304 без выборки твитов и обновления активности (только для chronological)
     :param session: экземпляр сессии работы с БД
     :return:
     """
 
     user = await check_user_exists(session, apikey=api_key)
+    if user and mode == "ranked":
+        result = await ranked_tweets_list(session, user["id"], limit)
+        return JSONResponse(
+            content={"result": True, "tweets": result}, status_code=status.HTTP_200_OK
+        )
+    if user:
+        etag = await feed_etag(session, user, tweets_utils.feed_since())
+        # 304 не меняет last_activity: время входит в ETag профиля,
+        # и каждый опрос ленты сбрасывал бы кэш профиля пользователя
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+    if user and stream:
+        return StreamingResponse(
+            json_object_stream(
+                {"result": True}, "tweets", stream_tweets_list(session, user["id"])
+            ),
+            media_type="application/json",
+            headers={"ETag": etag},
+        )
+    if user and tweets_utils.FEED_FAST_PATH:
+        body = await tweets_list_json(session, user["id"])
+        if body is not None:
+            return Response(
+                content=body,
+                media_type="application/json",
+                status_code=status.HTTP_200_OK,
+                headers={"ETag": etag},
+            )
     if user:
         result = await tweets_list(session, user["id"])
         return JSONResponse(
-            content={"result": True, "tweets": result}, status_code=status.HTTP_200_OK
+            content={"result": True, "tweets": result},
+            status_code=status.HTTP_200_OK,
+            headers={"ETag": etag},
         )
 
     return JSONResponse(
@@ -111,6 +191,53 @@ async def get_tweets_list(
     )
 
 
+@router.get("/api/tweets/stream")
+async def get_tweets_stream(
+    api_key: Union[str, None] = Header(default=None),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    поток событий ленты (Server-Sent Events): новые и удаленные твиты,
+    изменения количества лайков
+    :param api_key: ключ авторизации пользователя
+    :param session: экземпляр сессии работы с БД
+    :return: поток text/event-stream
+    """
+
+    user = await check_user_exists(session, apikey=api_key)
+    if not user:
+        return JSONResponse(
+            content={
+                "result": False,
+                "error_type": "Authorisation Error.",
+                "error_message": "Invalid authorization key.",
+            },
+            status_code=status.HTTP_403_FORBIDDEN,
+        )
+
+    authors = await get_feed_author_ids(session, user["id"])
+    # соединение с БД не удерживается на время жизни потока
+    await session.close()
+
+    sub = event_broker.subscribe(user["id"], authors)
+    if sub is None:
+        logger.error("Events connections limit reached.")
+        return JSONResponse(
+            content={
+                "result": False,
+                "error_type": "Service Unavailable",
+                "error_message": "Too many stream connections.",
+            },
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+
+    return StreamingResponse(
+        event_stream(sub),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.post("/api/tweets/{idx}/likes")
 async def add_like(
     idx: int,
@@ -154,6 +281,55 @@ async def add_like(
     )
 
 
+@router.post("/api/tweets/likes/batch")
+async def batch_likes(
+    batch: BatchLikes,
+    api_key: Union[str, None] = Header(default=None),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    поставить или убрать лайки для списка твитов одним запросом
+    :param batch: список id твитов и действие like/unlike
+    :param api_key: ключ авторизации пользователя
+    :param session: экземпляр сессии работы с БД
+    :return: результат операции для каждого твита
+    """
+
+    user = await check_user_exists(session, apikey=api_key)
+
+    if not user:
+        return JSONResponse(
+            content={
+                "result": False,
+                "error_type": "Authorisation Error.",
+                "error_message": "Invalid authorization key.",
+            },
+            status_code=status.HTTP_403_FORBIDDEN,
+        )
+
+    if sharding.shard_sessions is not None:
+        # твиты пачки могут быть на разных шардах, одна транзакция на
+        # несколько БД не поддерживается
+        return JSONResponse(
+            content={
+                "result": False,
+                "error_type": "Not Implemented.",
+                "error_message": "Batch likes are not supported with sharding.",
+            },
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+        )
+
+    result = await batch_like_tweets(
+        session, user["id"], batch.tweet_ids, like=batch.action == "like"
+    )
+
+    if result["result"]:
+        return JSONResponse(content=result, status_code=status.HTTP_200_OK)
+    return JSONResponse(
+        content=result, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
+    )
+
+
 @router.delete("/api/tweets/{idx}/likes")
 async def del_like(
     idx: int,
@@ -247,16 +423,46 @@ async def del_tweet(
 
 @router.post("/api/medias")
 async def upload_media(
-    file: UploadFile, session: AsyncSession = Depends(get_async_session)
+    file: UploadFile,
+    api_key: Union[str, None] = Header(default=None),
+    idempotency_key: Union[str, None] = Header(default=None),
+    session: AsyncSession = Depends(get_async_session),
 ):
     """
     2. загрузка файлов из твита
     :param file:    объект файла
+    :param api_key: ключ авторизации пользователя
+    :param idempotency_key: ключ повтора запроса, повтор возвращает сохраненный ответ
     :param session: сессия для работы с БД
     :return:        возвращает id медиа файла
     """
 
-    result = await save_file(session, file)
+    if idempotency_key:
+        return await idempotency_store.run(
+            (api_key, "/api/medias", idempotency_key),
+            lambda: create_media(file, api_key, session),
+            fingerprint=await upload_fingerprint(file),
+        )
+    return await create_media(file, api_key, session)
+
+
+async def create_media(
+    file: UploadFile, api_key: Union[str, None], session: AsyncSession
+) -> JSONResponse:
+    user = await check_user_exists(session, apikey=api_key)
+
+    if not user:
+        logger.info(f"Wrong api-key: {api_key}.")
+        return JSONResponse(
+            content={
+                "result": False,
+                "error_type": "Authorisation Error.",
+                "error_message": "Invalid authorization key.",
+            },
+            status_code=status.HTTP_403_FORBIDDEN,
+        )
+
+    result = await save_file(session, file, user["id"])
 
     if result:
         return JSONResponse(
@@ -1,9 +1,9 @@
-from typing import Union
+from typing import Literal, Union
 
-from fastapi import APIRouter, Header
+from fastapi import APIRouter, Header, Query
 from fastapi import Depends
 from starlette import status
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, StreamingResponse
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -12,45 +12,304 @@ from utils.users import (
     get_user_by_id,
     follow_to_user,
     delete_follower_to_user,
+    check_user_exists,
+    get_users_by_ids,
+    batch_follow_users,
+    get_follow_page,
 )
+from utils.tweets import tweets_by_ids
+from utils.tags import mention_tweet_ids
+from utils.recommendations import get_recommendations
+from utils.etags import profile_etag, etag_matches, not_modified
+from utils.export import export_account
+from config import get_settings
 from models.database import get_async_session
+from schemas.schemas import BatchFollows, BatchUsers
 
 
 router = APIRouter()
+settings = get_settings()
 
 
 @router.get("/api/users/me")
 async def get_my_profile(
+    fields: Literal["full", "counts"] = Query(default="full"),
     api_key: Union[str, None] = Header(default=None),
+    if_none_match: Union[str, None] = Header(default=None),
     session: AsyncSession = Depends(get_async_session),
 ):
     """
     9.возвращает профиль пользователя
+    :param fields: full - со списками подписчиков и подписок, counts - только
+    их количество (followers_count, following_count)
+    :param if_none_match: ETag ранее полученного профиля, если профиль
+    не изменился, возвращается 304
     :return:
     """
 
-    result = await get_user_by_apikey(session, api_key)
+    etag = await profile_etag(session, fields, apikey=api_key)
+    if etag and etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    result = await get_user_by_apikey(session, api_key, fields)
     if result["result"]:
-        return JSONResponse(content=result, status_code=status.HTTP_200_OK)
+        return JSONResponse(
+            content=result, status_code=status.HTTP_200_OK, headers={"ETag": etag}
+        )
     return JSONResponse(content=result, status_code=status.HTTP_404_NOT_FOUND)
 
 
+@router.get("/api/users/me/recommendations")
+async def get_my_recommendations(
+    limit: int = Query(
+        default=settings.PAGE_SIZE, ge=1, le=settings.RECOMMENDATIONS_LIMIT
+    ),
+    api_key: Union[str, None] = Header(default=None),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    рекомендации "на кого подписаться": пользователи, на которых подписаны
+    подписки пользователя, по убыванию количества общих подписок.
+    Рекомендации пересчитываются фоновыми задачами
+    :param limit: количество рекомендаций
+    :param api_key: ключ авторизации пользователя
+    :param session: экземпляр сессии работы с БД
+    :return: список пользователей
+    """
+
+    user = await check_user_exists(session, apikey=api_key)
+    if not user:
+        return JSONResponse(
+            content={
+                "result": False,
+                "error_type": "Authorisation Error.",
+                "error_message": "Invalid authorization key.",
+            },
+            status_code=status.HTTP_403_FORBIDDEN,
+        )
+
+    result = await get_recommendations(session, user["id"], limit)
+    if result["result"]:
+        return JSONResponse(content=result, status_code=status.HTTP_200_OK)
+    return JSONResponse(
+        content=result, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
+    )
+
+
+@router.get("/api/users/me/export")
+async def export_my_data(
+    api_key: Union[str, None] = Header(default=None),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    выгрузка данных пользователя в формате NDJSON (по записи JSON на строку):
+    профиль, твиты, картинки, лайки и подписки. Выгрузка читается курсорами
+    и отправляется по частям, загрузка - python -m utils.export import
+    :param api_key: ключ авторизации пользователя
+    :param session: экземпляр сессии работы с БД
+    :return: поток NDJSON
+    """
+
+    user = await check_user_exists(session, apikey=api_key)
+    if not user:
+        return JSONResponse(
+            content={
+                "result": False,
+                "error_type": "Authorisation Error.",
+                "error_message": "Invalid authorization key.",
+            },
+            status_code=status.HTTP_403_FORBIDDEN,
+        )
+
+    return StreamingResponse(
+        export_account(session, user["id"]),
+        media_type="application/x-ndjson",
+        headers={
+            "Content-Disposition": f'attachment; filename="user_{user["id"]}.ndjson"'
+        },
+    )
+
+
+@router.get("/api/users/me/followers")
+async def get_my_followers(
+    after_id: int = Query(default=0, ge=0),
+    limit: int = Query(default=settings.PAGE_SIZE, ge=1, le=settings.PAGE_SIZE_MAX),
+    api_key: Union[str, None] = Header(default=None),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    подписчики пользователя постранично
+    :param after_id: курсор - id последнего пользователя предыдущей страницы
+    :param limit: размер страницы
+    :param api_key: ключ авторизации пользователя
+    :param session: экземпляр сессии работы с БД
+    :return: список пользователей, количество и курсор следующей страницы
+    """
+
+    return await my_follow_list_response(session, api_key, True, after_id, limit)
+
+
+@router.get("/api/users/me/following")
+async def get_my_following(
+    after_id: int = Query(default=0, ge=0),
+    limit: int = Query(default=settings.PAGE_SIZE, ge=1, le=settings.PAGE_SIZE_MAX),
+    api_key: Union[str, None] = Header(default=None),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    подписки пользователя постранично
+    :param after_id: курсор - id последнего пользователя предыдущей страницы
+    :param limit: размер страницы
+    :param api_key: ключ авторизации пользователя
+    :param session: экземпляр сессии работы с БД
+    :return: список пользователей, количество и курсор следующей страницы
+    """
+
+    return await my_follow_list_response(session, api_key, False, after_id, limit)
+
+
 @router.get("/api/users/{idx}")
-async def get_my_profile(idx: int, session: AsyncSession = Depends(get_async_session)):
+async def get_my_profile(
+    idx: int,
+    fields: Literal["full", "counts"] = Query(default="full"),
+    if_none_match: Union[str, None] = Header(default=None),
+    session: AsyncSession = Depends(get_async_session),
+):
     """
     10.возвращает профиль пользователя по user_id
     :param idx: user_id
+    :param fields: full - со списками подписчиков и подписок, counts - только количество
+    :param if_none_match: ETag ранее полученного профиля
     :param session:
     :return: словарь с результатом операции и объектом пользователя
     """
 
-    user = await get_user_by_id(session, idx)
+    etag = await profile_etag(session, fields, user_id=idx)
+    if etag and etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    user = await get_user_by_id(session, idx, fields)
 
     if user["result"]:
-        return JSONResponse(content=user, status_code=status.HTTP_200_OK)
+        return JSONResponse(
+            content=user, status_code=status.HTTP_200_OK, headers={"ETag": etag}
+        )
     return JSONResponse(content=user, status_code=status.HTTP_404_NOT_FOUND)
 
 
+@router.get("/api/users/{idx}/followers")
+async def get_followers(
+    idx: int,
+    after_id: int = Query(default=0, ge=0),
+    limit: int = Query(default=settings.PAGE_SIZE, ge=1, le=settings.PAGE_SIZE_MAX),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    подписчики пользователя по user_id постранично
+    :param idx: user_id
+    :param after_id: курсор - id последнего пользователя предыдущей страницы
+    :param limit: размер страницы
+    :param session: экземпляр сессии работы с БД
+    :return: список пользователей, количество и курсор следующей страницы
+    """
+
+    return await follow_list_response(session, idx, True, after_id, limit)
+
+
+@router.get("/api/users/{idx}/following")
+async def get_following(
+    idx: int,
+    after_id: int = Query(default=0, ge=0),
+    limit: int = Query(default=settings.PAGE_SIZE, ge=1, le=settings.PAGE_SIZE_MAX),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    подписки пользователя по user_id постранично
+    :param idx: user_id
+    :param after_id: курсор - id последнего пользователя предыдущей страницы
+    :param limit: размер страницы
+    :param session: экземпляр сессии работы с БД
+    :return: список пользователей, количество и курсор следующей страницы
+    """
+
+    return await follow_list_response(session, idx, False, after_id, limit)
+
+
+async def my_follow_list_response(
+    session: AsyncSession,
+    api_key: Union[str, None],
+    followers: bool,
+    after_id: int,
+    limit: int,
+) -> JSONResponse:
+    user = await check_user_exists(session, apikey=api_key)
+    if not user:
+        return JSONResponse(
+            content={
+                "result": False,
+                "error_type": "Authorisation Error.",
+                "error_message": "Invalid authorization key.",
+            },
+            status_code=status.HTTP_403_FORBIDDEN,
+        )
+    return await follow_list_response(session, user["id"], followers, after_id, limit)
+
+
+async def follow_list_response(
+    session: AsyncSession, user_idx: int, followers: bool, after_id: int, limit: int
+) -> JSONResponse:
+    result = await get_follow_page(session, user_idx, followers, after_id, limit)
+    if result["result"]:
+        return JSONResponse(content=result, status_code=status.HTTP_200_OK)
+    if result["error_type"] == "User not found":
+        return JSONResponse(content=result, status_code=status.HTTP_404_NOT_FOUND)
+    return JSONResponse(
+        content=result, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
+    )
+
+
+@router.get("/api/users/{idx}/mentions")
+async def get_user_mentions(
+    idx: int,
+    before_id: Union[int, None] = Query(default=None, ge=1),
+    limit: int = Query(default=settings.PAGE_SIZE, ge=1, le=settings.PAGE_SIZE_MAX),
+    api_key: Union[str, None] = Header(default=None),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    твиты, в которых упомянут пользователь, постранично от новых к старым
+    :param idx: user_id
+    :param before_id: курсор - id последнего твита предыдущей страницы
+    :param limit: размер страницы
+    :param api_key: ключ авторизации пользователя
+    :param session: экземпляр сессии работы с БД
+    :return: список твитов и курсор следующей страницы
+    """
+
+    user = await check_user_exists(session, apikey=api_key)
+    if not user:
+        return JSONResponse(
+            content={
+                "result": False,
+                "error_type": "Authorisation Error.",
+                "error_message": "Invalid authorization key.",
+            },
+            status_code=status.HTTP_403_FORBIDDEN,
+        )
+
+    ids = await mention_tweet_ids(session, idx, before_id, limit)
+    tweets = await tweets_by_ids(session, ids)
+
+    return JSONResponse(
+        content={
+            "result": True,
+            "tweets": tweets,
+            "next_cursor": ids[-1] if len(ids) == limit else None,
+        },
+        status_code=status.HTTP_200_OK,
+    )
+
+
 @router.post("/api/users/{idx}/follow")
 async def add_follower_to_user(
     idx: int,
@@ -91,3 +350,73 @@ async def del_follower_to_user(
     if delete_follower["result"]:
         return JSONResponse(content=delete_follower, status_code=status.HTTP_200_OK)
     return JSONResponse(content=delete_follower, status_code=status.HTTP_404_NOT_FOUND)
+
+
+@router.post("/api/users/batch")
+async def get_users_batch(
+    batch: BatchUsers,
+    api_key: Union[str, None] = Header(default=None),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    профили списка пользователей одним запросом, без api-key и email
+    :param batch: список id пользователей
+    :param api_key:
+    :param session:
+    :return: результат для каждого id
+    """
+
+    user = await check_user_exists(session, apikey=api_key)
+    if not user:
+        return JSONResponse(
+            content={
+                "result": False,
+                "error_type": "Authorisation Error.",
+                "error_message": "Invalid authorization key.",
+            },
+            status_code=status.HTTP_403_FORBIDDEN,
+        )
+
+    result = await get_users_by_ids(session, batch.user_ids)
+
+    if result["result"]:
+        return JSONResponse(content=result, status_code=status.HTTP_200_OK)
+    return JSONResponse(
+        content=result, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
+    )
+
+
+@router.post("/api/users/follow/batch")
+async def follow_users_batch(
+    batch: BatchFollows,
+    api_key: Union[str, None] = Header(default=None),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    подписка или отписка от списка пользователей одним запросом
+    :param batch: список id пользователей и действие follow/unfollow
+    :param api_key:
+    :param session:
+    :return: результат операции для каждого пользователя
+    """
+
+    user = await check_user_exists(session, apikey=api_key)
+    if not user:
+        return JSONResponse(
+            content={
+                "result": False,
+                "error_type": "Authorisation Error.",
+                "error_message": "Invalid authorization key.",
+            },
+            status_code=status.HTTP_403_FORBIDDEN,
+        )
+
+    result = await batch_follow_users(
+        session, user["id"], batch.user_ids, follow=batch.action == "follow"
+    )
+
+    if result["result"]:
+        return JSONResponse(content=result, status_code=status.HTTP_200_OK)
+    return JSONResponse(
+        content=result, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
+    )
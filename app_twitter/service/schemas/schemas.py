@@ -1,7 +1,28 @@
-from pydantic import BaseModel, Field
+from typing import Literal
+
+from pydantic import BaseModel, Field, conlist
 from pydantic.class_validators import Optional
 
+from config import get_settings
+
+
+BATCH_MAX_ITEMS = get_settings().BATCH_MAX_ITEMS
+
 
 class BaseTweet(BaseModel):
     tweet_data: str
     tweet_media_ids: tuple
+
+
+class BatchLikes(BaseModel):
+    tweet_ids: conlist(int, min_items=1, max_items=BATCH_MAX_ITEMS)
+    action: Literal["like", "unlike"] = "like"
+
+
+class BatchFollows(BaseModel):
+    user_ids: conlist(int, min_items=1, max_items=BATCH_MAX_ITEMS)
+    action: Literal["follow", "unfollow"] = "follow"
+
+
+class BatchUsers(BaseModel):
+    user_ids: conlist(int, min_items=1, max_items=BATCH_MAX_ITEMS)
@@ -1,8 +1,6 @@
 import datetime
-import os
 
 import pytest_asyncio
-from dotenv import load_dotenv
 import asyncio
 from httpx import AsyncClient
 
@@ -12,37 +10,33 @@ from sqlalchemy.pool import NullPool
 from typing import AsyncGenerator
 
 from models.models import Base, metadata, Users, Followers, Tweets, Media, Likes
+from config import get_settings
 from logger.logger import logger
 from main import app
+from routes import service_routes
+from utils.users import recount_follow_counters
 
 
 TEST_USERS = 3
 APIKEYS = ["zero_user", "key1", "key2", "key3"]
+SERVICE_KEY = "service_key"
 
 TWEETS = {1: [], 2: [], 3: []}
 
-load_dotenv()
+settings = get_settings()
 
-DB_USER = os.environ.get("DB_USER", "default_value")
-DB_PASSWORD = os.environ.get("DB_PASSWORD", "default_value")
-DB_HOST = os.environ.get("DB_HOST", "default_value")
-DB_PORT = os.environ.get("DB_PORT", "5432")
-DB_NAME = os.environ.get("DB_NAME", "default_value")
-TESTING = os.environ.get("TESTING", "no")
 
-
-if TESTING != "yes":
+if not settings.TESTING:
     logger.error(
-        f"Testing interrupted, incorrect environment. DB_NAME={DB_NAME}, TESTING={TESTING}"
+        f"Testing interrupted, incorrect environment. DB_NAME={settings.DB_NAME}, "
+        f"TESTING={settings.TESTING}"
     )
     raise Exception("Testing interrupted, incorrect environment.")
 
 
 logger.info("Conf test Start.")
 
-TEST_DB_URL = (
-    f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:" f"{DB_PORT}/{DB_NAME}"
-)
+TEST_DB_URL = settings.database_dsn.replace("postgresql://", "postgresql+asyncpg://", 1)
 
 engine_test = create_async_engine(
     TEST_DB_URL,
@@ -55,6 +49,7 @@ async_session_maker = sessionmaker(
     engine_test, class_=AsyncSession, expire_on_commit=False
 )
 metadata.bind = engine_test
+service_routes.SERVICE_API_KEY = SERVICE_KEY
 
 
 @pytest_asyncio.fixture(autouse=True, scope="session")
@@ -114,6 +109,9 @@ async def init_test_data():
             async with session.begin():
                 session.add(new_follower)
 
+    async with session.begin():
+        await recount_follow_counters(session)
+
     for n in range(1, TEST_USERS + 1):
         for tw in range(1, 6):
             new_tweet = Tweets(
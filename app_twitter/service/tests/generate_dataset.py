@@ -0,0 +1,428 @@
+"""
+генератор синтетических данных для нагрузочного тестирования.
+Данные загружаются в БД через COPY (asyncpg) порциями, в памяти остаются
+только массивы подписчиков и авторов твитов (для лайков и картинок).
+Один и тот же seed дает один и тот же набор.
+
+пример запуска из каталога app_twitter/service:
+    python -m tests.generate_dataset --users 1000000 --seed 42 --reset
+"""
+import argparse
+import asyncio
+import datetime
+import random
+import time
+from array import array
+from typing import Iterable, Iterator
+
+import asyncpg
+
+from config import get_settings
+from logger.logger import logger
+
+
+CHUNK_SIZE = 50_000
+
+VOCABULARY = (
+    "just had coffee with the team today was great new release shipped "
+    "looking forward weekend python async postgres deploy friday bug fix "
+    "reading about databases performance latency benchmark tweet feed"
+).split()
+
+TABLE_COLUMNS = {
+    "users": ("id", "name", "email", "apikey", "last_activity"),
+    "followers": ("follower_id", "user_id"),
+    "tweets": ("id", "tweetdata", "created_on", "updated_on", "user_id"),
+    "tweet_tags": ("tag", "tweet_id"),
+    "tweet_mentions": ("user_id", "tweet_id"),
+    "likes": ("created_on", "user_id", "tweet_id"),
+    "media": ("filepath", "tweet_id", "uploader"),
+}
+
+# таблицы с явно заданными id, для них после загрузки сдвигаются sequence
+EXPLICIT_ID_TABLES = ("users", "tweets")
+
+
+def get_dsn() -> str:
+    return get_settings().database_dsn
+
+
+def skewed_id(rng: random.Random, n: int, alpha: float) -> int:
+    """
+    id от 1 до n со степенным распределением: малые id выпадают чаще.
+    Чем больше alpha, тем сильнее перекос
+    """
+    return 1 + int(n * rng.random() ** alpha)
+
+
+def chunked(rows: Iterable, size: int = CHUNK_SIZE) -> Iterator[list]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def gen_users(users: int, end: datetime.datetime) -> Iterator[tuple]:
+    for idx in range(1, users + 1):
+        yield (
+            idx,
+            f"user_{idx}",
+            f"user_{idx}@example.com",
+            f"apikey_{idx}",
+            end,
+        )
+
+
+def gen_followers(
+    rng: random.Random,
+    users: int,
+    follows_per_user: float,
+    alpha: float,
+    followers_of: dict = None,
+) -> Iterator[tuple]:
+    """
+    подписки с распределением числа подписчиков по степенному закону:
+    популярные аккаунты - пользователи с малыми id.
+    Строка (follower_id, user_id): пользователь follower_id видит в ленте твиты user_id
+    :param followers_of: заполняется user_id -> массив follower_id для gen_likes
+    """
+
+    for follower in range(1, users + 1):
+        count = min(int(rng.expovariate(1 / follows_per_user)), (users - 1) // 2)
+        targets = set()
+        while len(targets) < count:
+            target = skewed_id(rng, users, alpha)
+            if target != follower:
+                targets.add(target)
+        for target in sorted(targets):
+            if followers_of is not None:
+                followers_of.setdefault(target, array("i")).append(follower)
+            yield follower, target
+
+
+def gen_tweets(
+    rng: random.Random,
+    users: int,
+    tweets: int,
+    alpha: float,
+    days: int,
+    end: datetime.datetime,
+) -> Iterator[dict]:
+    """
+    твиты со строками индексов хэштегов и упоминаний, порциями по CHUNK_SIZE.
+    Активные авторы - пользователи с малыми id, время создания растет с id твита
+    """
+
+    start = end - datetime.timedelta(days=days)
+    step = (end - start) / max(tweets, 1)
+
+    chunk = {"tweets": [], "tweet_tags": [], "tweet_mentions": []}
+    for idx in range(1, tweets + 1):
+        author = skewed_id(rng, users, alpha)
+        words = rng.choices(VOCABULARY, k=rng.randint(3, 12))
+
+        tags = set()
+        if rng.random() < 0.3:
+            tags.add(f"tag{skewed_id(rng, 1000, 2.0)}")
+        mentioned = None
+        if rng.random() < 0.05:
+            mentioned = skewed_id(rng, users, alpha)
+            words.append(f"@user_{mentioned}")
+
+        words.extend(f"#{tag}" for tag in sorted(tags))
+        created_on = start + step * idx
+
+        chunk["tweets"].append((idx, " ".join(words), created_on, created_on, author))
+        chunk["tweet_tags"].extend((tag, idx) for tag in sorted(tags))
+        if mentioned:
+            chunk["tweet_mentions"].append((mentioned, idx))
+
+        if len(chunk["tweets"]) >= CHUNK_SIZE:
+            yield chunk
+            chunk = {"tweets": [], "tweet_tags": [], "tweet_mentions": []}
+
+    if chunk["tweets"]:
+        yield chunk
+
+
+def gen_likes(
+    rng: random.Random,
+    authors: array,
+    followers_of: dict,
+    likes: int,
+    alpha: float,
+    days: int,
+    end: datetime.datetime,
+) -> Iterator[tuple]:
+    """
+    лайки с «горячими» твитами: небольшая доля твитов собирает большую часть лайков.
+    Популярные номера перемешиваются мультипликативным хэшем,
+    чтобы горячие твиты были распределены по всему времени.
+    Твит лайкают только подписчики автора, каждый не больше одного раза,
+    поэтому лайков может быть меньше likes
+    :param authors: id автора твита с id = индекс + 1
+    :param followers_of: user_id -> массив follower_id
+    """
+
+    tweets = len(authors)
+    start = end - datetime.timedelta(days=days)
+    step = (end - start) / max(tweets, 1)
+    for rank in range(tweets):
+        # доля лайков твита ранга rank при распределении skewed_id
+        share = ((rank + 1) / tweets) ** (1 / alpha) - (rank / tweets) ** (1 / alpha)
+        tweet_id = (rank * 2654435761) % tweets + 1
+        followers = followers_of.get(authors[tweet_id - 1], ())
+        count = min(int(likes * share + rng.random()), len(followers))
+        for user_id in rng.sample(followers, count):
+            created_on = min(
+                start + step * tweet_id + datetime.timedelta(hours=rng.random()), end
+            )
+            yield created_on, user_id, tweet_id
+
+
+def gen_media(
+    rng: random.Random, authors: array, media_ratio: float
+) -> Iterator[tuple]:
+    for tweet_id, author in enumerate(authors, start=1):
+        if rng.random() < media_ratio:
+            for n in range(rng.randint(1, 4)):
+                yield f"{tweet_id:012d}{n}.tmp", tweet_id, author
+
+
+async def copy_rows(
+    connection: asyncpg.Connection, table: str, rows: Iterable[tuple]
+) -> int:
+    """
+    загрузка строк в таблицу через COPY порциями по CHUNK_SIZE
+    :return: количество загруженных строк
+    """
+
+    total = 0
+    for chunk in chunked(rows):
+        await connection.copy_records_to_table(
+            table, records=chunk, columns=TABLE_COLUMNS[table]
+        )
+        total += len(chunk)
+    return total
+
+
+async def reset_sequences(connection: asyncpg.Connection):
+    for table in EXPLICIT_ID_TABLES:
+        await connection.execute(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"coalesce((SELECT max(id) FROM {table}), 0) + 1, false)"
+        )
+
+
+# счетчики, которые приложение обновляет вместе с подписками и лайками
+RECOUNT_SQL = (
+    "UPDATE users SET "
+    "followers_count = (SELECT count(*) FROM followers f WHERE f.user_id = users.id), "
+    "following_count = (SELECT count(*) FROM followers f WHERE f.follower_id = users.id)",
+    "UPDATE tweets SET likes_count = l.count "
+    "FROM (SELECT tweet_id, count(*) AS count FROM likes GROUP BY tweet_id) AS l "
+    "WHERE l.tweet_id = tweets.id",
+)
+
+
+async def recount_counters(connection: asyncpg.Connection):
+    for query in RECOUNT_SQL:
+        await connection.execute(query)
+
+
+async def create_partitions(
+    connection: asyncpg.Connection, start: datetime.datetime, end: datetime.datetime
+):
+    """
+    месячные секции tweets и likes на период набора: секции по умолчанию нет,
+    строки вне секций не загружаются
+    """
+
+    from utils.partitions import PARTITIONED_TABLES
+    from utils.partitions import month_start, add_months, partition_name
+
+    month = month_start(start)
+    while month <= month_start(end):
+        for table in PARTITIONED_TABLES:
+            await connection.execute(
+                f'CREATE TABLE IF NOT EXISTS "{partition_name(table, month)}" '
+                f"PARTITION OF {table} "
+                f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')"
+            )
+        month = add_months(month, 1)
+
+
+async def reset_schema(dsn: str):
+    """
+    пересоздание таблиц по моделям приложения
+    """
+
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import NullPool
+
+    from models.models import metadata
+
+    engine = create_async_engine(
+        dsn.replace("postgresql://", "postgresql+asyncpg://", 1), poolclass=NullPool
+    )
+    async with engine.begin() as conn:
+        await conn.run_sync(metadata.drop_all)
+        await conn.run_sync(metadata.create_all)
+    await engine.dispose()
+
+
+async def load_dataset(
+    connection: asyncpg.Connection,
+    users: int,
+    tweets: int,
+    follows_per_user: float = 20,
+    likes_per_tweet: float = 5,
+    media_ratio: float = 0.1,
+    alpha: float = 3.0,
+    days: int = 30,
+    seed: int = 0,
+    end: datetime.datetime = None,
+) -> dict:
+    """
+    генерация и загрузка синтетического набора данных
+    :param connection: соединение asyncpg
+    :param users: количество пользователей
+    :param tweets: количество твитов
+    :param follows_per_user: среднее количество подписок пользователя
+    :param likes_per_tweet: среднее количество лайков на твит
+    :param media_ratio: доля твитов с картинками
+    :param alpha: степень перекоса распределений
+    :param days: за сколько дней до end распределены твиты
+    :param seed: зерно генератора случайных чисел
+    :param end: время создания последнего твита
+    :return: количество загруженных строк по таблицам
+    """
+
+    rng = random.Random(seed)
+    end = end or datetime.datetime.combine(datetime.date.today(), datetime.time())
+    stats = dict.fromkeys(TABLE_COLUMNS, 0)
+    # подписчики и авторы твитов для лайков и картинок, по 4 байта на строку
+    followers_of = dict()
+    authors = array("i")
+
+    async with connection.transaction():
+        await create_partitions(connection, end - datetime.timedelta(days=days), end)
+        stats["users"] = await copy_rows(connection, "users", gen_users(users, end))
+        stats["followers"] = await copy_rows(
+            connection,
+            "followers",
+            gen_followers(rng, users, follows_per_user, alpha, followers_of),
+        )
+
+        for chunk in gen_tweets(rng, users, tweets, alpha, days, end):
+            authors.extend(row[4] for row in chunk["tweets"])
+            for table, rows in chunk.items():
+                stats[table] += await copy_rows(connection, table, rows)
+
+        stats["likes"] = await copy_rows(
+            connection,
+            "likes",
+            gen_likes(
+                rng,
+                authors,
+                followers_of,
+                int(tweets * likes_per_tweet),
+                alpha,
+                days,
+                end,
+            ),
+        )
+        stats["media"] = await copy_rows(
+            connection, "media", gen_media(rng, authors, media_ratio)
+        )
+
+        await reset_sequences(connection)
+        await recount_counters(connection)
+
+    await connection.execute("ANALYZE")
+    return stats
+
+
+async def load_fixture_dataset(connection: asyncpg.Connection):
+    """
+    небольшой набор данных для разработки: 3 пользователя с подписками
+    1user -> 2,3, 2user -> 3, по 5 твитов от каждого, и пользователь test
+    """
+
+    now = datetime.datetime.now()
+    users = [
+        (n, f"User_name_{n}", f"user{n}email@email.com", f"key{n}", now)
+        for n in range(1, 4)
+    ]
+    users.append((4, "test_User", "user_test_email@email.com", "test", now))
+
+    followers = [(f, n) for n in range(1, 4) for f in range(n + 1, 4)]
+
+    tweets = []
+    for n in range(1, 4):
+        for tw in range(1, 6):
+            idx = len(tweets) + 1
+            text = f"test tweet number {tw} from user {n}"
+            tweets.append((idx, text, now, now, n))
+
+    async with connection.transaction():
+        await copy_rows(connection, "users", users)
+        await copy_rows(connection, "followers", followers)
+        await copy_rows(connection, "tweets", tweets)
+        await reset_sequences(connection)
+        await recount_counters(connection)
+
+
+async def main(args: argparse.Namespace):
+    dsn = get_dsn()
+    if args.reset:
+        await reset_schema(dsn)
+        logger.info("...schema recreated")
+
+    connection = await asyncpg.connect(dsn)
+    started = time.perf_counter()
+    try:
+        stats = await load_dataset(
+            connection,
+            users=args.users,
+            tweets=args.tweets or args.users * 10,
+            follows_per_user=args.follows_per_user,
+            likes_per_tweet=args.likes_per_tweet,
+            media_ratio=args.media_ratio,
+            alpha=args.alpha,
+            days=args.days,
+            seed=args.seed,
+            end=args.end_date,
+        )
+    finally:
+        await connection.close()
+
+    logger.info(f"Dataset loaded in {time.perf_counter() - started:.1f}s: {stats}")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Synthetic dataset generator")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--tweets", type=int, default=None, help="default users*10")
+    parser.add_argument("--follows-per-user", type=float, default=20)
+    parser.add_argument("--likes-per-tweet", type=float, default=5)
+    parser.add_argument("--media-ratio", type=float, default=0.1)
+    parser.add_argument("--alpha", type=float, default=3.0)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--end-date",
+        type=datetime.datetime.fromisoformat,
+        default=None,
+        help="time of the last tweet, default today 00:00",
+    )
+    parser.add_argument("--reset", action="store_true", help="drop and create tables")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
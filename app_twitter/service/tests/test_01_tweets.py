@@ -1,8 +1,10 @@
 import pytest
 from httpx import AsyncClient
+from sqlalchemy import event
 
 from main import app
-from .conftest import APIKEYS, TWEETS
+from utils.users import check_user_exists
+from .conftest import APIKEYS, TWEETS, async_session_maker, engine_test
 
 
 async def test_api_add_tweet():
@@ -29,6 +31,13 @@ async def test_api_add_tweet():
         assert response.json()["result"] is True
         TWEETS[1].append(response.json()["tweet_id"])
 
+        # твит от несуществующего пользователя
+        response = await ac.post(
+            "/api/tweets", headers={"api-key": APIKEYS[0]}, json=tweet_data
+        )
+        assert response.status_code == 403
+        assert response.json()["result"] is False
+
         response = await ac.post(
             "/api/tweets",
             headers={"api-key": APIKEYS[2]},
@@ -159,6 +168,13 @@ async def test_tweet_with_media():
 
         media_id = response.json()["media_id"]
 
+        response = await ac.post(
+            "/api/medias",
+            headers={"api-key": APIKEYS[0]},
+            files={"file": (test_file, open(test_file, "rb"))},
+        )
+        assert response.status_code == 403
+
         tweet_data = {
             "tweet_data": "Test tweet from User_1.",
             "tweet_media_ids": (media_id,),
@@ -177,3 +193,22 @@ async def test_tweet_with_media():
         )
 
         assert response.status_code == 200
+
+
+async def test_check_user_exists_without_relationships():
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    # проверка ключа - один запрос, твиты, лайки и подписки не загружаются
+    event.listen(engine_test.sync_engine, "before_cursor_execute", record)
+    try:
+        async with async_session_maker() as session:
+            by_apikey = await check_user_exists(session, apikey=APIKEYS[1])
+            by_id = await check_user_exists(session, user_id=1)
+    finally:
+        event.remove(engine_test.sync_engine, "before_cursor_execute", record)
+
+    assert by_apikey == by_id and by_id["id"] == 1
+    assert len([s for s in statements if s.lstrip().upper().startswith("SELECT")]) == 2
@@ -0,0 +1,135 @@
+import time
+
+from httpx import AsyncClient
+
+from main import app
+from utils.tags import parse_tweet_text
+from utils.trends import TrendingCounter, flush_trends, snapshot_trends
+from .conftest import APIKEYS, async_session_maker
+
+
+TAG_TWEETS = []
+
+
+def test_parse_tweet_text():
+    tags, mentions = parse_tweet_text(
+        "#Python and #python, mail@example.com, a#b, @User_name_2 @User_name_2"
+    )
+    assert tags == ["python"]
+    assert mentions == ["User_name_2"]
+
+
+async def test_api_tag_timeline():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        for n in range(3):
+            response = await ac.post(
+                "/api/tweets",
+                headers={"api-key": APIKEYS[1]},
+                json={
+                    "tweet_data": f"Tweet {n} about #FastAPI for @User_name_2",
+                    "tweet_media_ids": (),
+                },
+            )
+            assert response.status_code == 201
+            TAG_TWEETS.append(response.json()["tweet_id"])
+
+        response = await ac.get(
+            "/api/tags/fastapi/tweets", headers={"api-key": APIKEYS[2]}
+        )
+        assert response.status_code == 200
+        assert [t["id"] for t in response.json()["tweets"]] == TAG_TWEETS[::-1]
+        assert response.json()["tweets"][0]["author"]["id"] == 1
+
+        # постраничная выдача
+        response = await ac.get(
+            "/api/tags/FastAPI/tweets?limit=2", headers={"api-key": APIKEYS[2]}
+        )
+        assert [t["id"] for t in response.json()["tweets"]] == TAG_TWEETS[:0:-1]
+        cursor = response.json()["next_cursor"]
+        assert cursor == TAG_TWEETS[1]
+
+        response = await ac.get(
+            f"/api/tags/fastapi/tweets?limit=2&before_id={cursor}",
+            headers={"api-key": APIKEYS[2]},
+        )
+        assert [t["id"] for t in response.json()["tweets"]] == TAG_TWEETS[:1]
+        assert response.json()["next_cursor"] is None
+
+        # запрос без авторизации
+        response = await ac.get(
+            "/api/tags/fastapi/tweets", headers={"api-key": APIKEYS[0]}
+        )
+        assert response.status_code == 403
+
+
+async def test_api_user_mentions():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get(
+            "/api/users/2/mentions", headers={"api-key": APIKEYS[3]}
+        )
+        assert response.status_code == 200
+        assert [t["id"] for t in response.json()["tweets"]] == TAG_TWEETS[::-1]
+
+        response = await ac.get(
+            "/api/users/3/mentions", headers={"api-key": APIKEYS[3]}
+        )
+        assert response.status_code == 200
+        assert response.json()["tweets"] == []
+
+        # удаленный твит пропадает из индекса
+        response = await ac.delete(
+            f"/api/tweets/{TAG_TWEETS[0]}", headers={"api-key": APIKEYS[1]}
+        )
+        assert response.status_code == 200
+
+        response = await ac.get(
+            "/api/users/2/mentions", headers={"api-key": APIKEYS[3]}
+        )
+        assert [t["id"] for t in response.json()["tweets"]] == TAG_TWEETS[:0:-1]
+
+
+def test_trending_counter():
+    counter = TrendingCounter(bucket_seconds=60, window_buckets=3, half_life=60)
+    now = time.time()
+
+    counter.add(["old"], ts=now - 90)
+    counter.add(["old", "new"], ts=now - 90)
+    counter.add(["new"], ts=now)
+    counter.add(["new"], ts=now)
+    counter.add(["gone"], ts=now)
+    counter.remove(["gone"], ts=now)
+
+    rows = counter.drain()
+    assert ("gone", counter.bucket_of(now), 0) not in rows
+    assert counter.drain() == []
+
+    top = counter.top(rows, k=5, now=now)
+    # свежие упоминания весят больше старых, удаленные не учитываются
+    assert [tag for tag, _ in top] == ["new", "old"]
+    assert counter.top(rows, k=1, now=now)[0][0] == "new"
+
+    # интервалы за пределами окна отбрасываются
+    assert counter.top(rows, k=5, now=now + 240) == []
+
+
+async def test_api_trending_tags():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        for text in ("#hot #warm", "#hot #warm", "#hot #warm #cold", "#hot"):
+            response = await ac.post(
+                "/api/tweets",
+                headers={"api-key": APIKEYS[3]},
+                json={"tweet_data": text, "tweet_media_ids": ()},
+            )
+            assert response.status_code == 201
+
+        async with async_session_maker() as session:
+            await flush_trends(session)
+            assert await snapshot_trends(session) is True
+
+        response = await ac.get(
+            "/api/tags/trending?limit=3", headers={"api-key": APIKEYS[1]}
+        )
+        assert response.status_code == 200
+        tags = [t["tag"] for t in response.json()["tags"]]
+        assert tags[:2] == ["hot", "warm"]
+        assert len(tags) == 3
@@ -0,0 +1,120 @@
+import asyncio
+
+from httpx import AsyncClient
+
+from main import app
+from models.database import ASYNCPG_DSN
+from utils.events import EventBroker, event_broker, event_stream, get_feed_author_ids
+from .conftest import APIKEYS, async_session_maker
+
+
+IDLE_CONNECTIONS = 3000
+
+
+async def test_event_broker_idle_connections():
+    broker = EventBroker()
+    subs = [broker.subscribe(n, {n % 50, 1000}) for n in range(IDLE_CONNECTIONS)]
+    assert broker.connections == IDLE_CONNECTIONS
+
+    streams = [event_stream(sub, broker, keepalive=60) for sub in subs]
+    for stream in streams:
+        assert await stream.__anext__() == "retry: 3000\n\n"
+
+    # все подключения ждут событий
+    waiting = [asyncio.ensure_future(stream.__anext__()) for stream in streams]
+    await asyncio.sleep(0)
+
+    assert broker.dispatch({"type": "tweet", "tweet_id": 1, "author_id": 7}) == (
+        IDLE_CONNECTIONS // 50
+    )
+    assert broker.dispatch({"type": "tweet", "tweet_id": 2, "author_id": 1000}) == (
+        IDLE_CONNECTIONS
+    )
+
+    messages = await asyncio.gather(*waiting)
+    assert sum('"author_id": 7' in msg for msg in messages) == IDLE_CONNECTIONS // 50
+
+    for stream in streams:
+        await stream.aclose()
+    assert broker.connections == 0
+    assert broker.by_author == {}
+
+
+async def test_subscription_bounded_queue():
+    broker = EventBroker()
+    sub = broker.subscribe(1, {2})
+    maxsize = sub.queue.maxsize
+
+    for n in range(maxsize + 10):
+        broker.dispatch({"type": "like", "tweet_id": n, "author_id": 2, "delta": 1})
+
+    # при переполнении отбрасываются самые старые события
+    assert sub.queue.qsize() == maxsize
+    assert sub.overflow is True
+
+    stream = event_stream(sub, broker)
+    await stream.__anext__()
+    assert "resync" in await stream.__anext__()
+    assert '"tweet_id": 10' in await stream.__anext__()
+    await stream.aclose()
+
+
+def test_event_broker_follow_updates_authors():
+    broker = EventBroker()
+    sub = broker.subscribe(1, {2})
+    other = broker.subscribe(4, {2})
+
+    broker.update_authors({"type": "follow", "user_id": 3, "follower_ids": [1, 5]})
+    assert sub.authors == {2, 3}
+    assert broker.dispatch({"type": "tweet", "tweet_id": 1, "author_id": 3}) == 1
+
+    broker.update_authors({"type": "unfollow", "user_id": 2, "follower_ids": [1]})
+    assert sub.authors == {3}
+    assert broker.by_author[2] == {other}
+
+    broker.unsubscribe(sub)
+    broker.unsubscribe(other)
+    assert broker.by_author == {} and broker.by_user == {}
+
+
+async def test_events_notify():
+    event_broker.start(ASYNCPG_DSN)
+    async with async_session_maker() as session:
+        authors = await get_feed_author_ids(session, 3)
+    sub = event_broker.subscribe(3, authors)
+
+    try:
+        # ожидание подключения слушателя
+        await asyncio.sleep(0.5)
+
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.post(
+                "/api/tweets",
+                headers={"api-key": APIKEYS[1]},
+                json={"tweet_data": "Streamed tweet", "tweet_media_ids": ()},
+            )
+            tweet_id = response.json()["tweet_id"]
+
+            event = await asyncio.wait_for(sub.queue.get(), 5)
+            assert event == {"type": "tweet", "tweet_id": tweet_id, "author_id": 1}
+
+            response = await ac.post(
+                f"/api/tweets/{tweet_id}/likes", headers={"api-key": APIKEYS[3]}
+            )
+            assert response.status_code == 201
+
+            event = await asyncio.wait_for(sub.queue.get(), 5)
+            assert event == {
+                "type": "like",
+                "tweet_id": tweet_id,
+                "author_id": 1,
+                "delta": 1,
+            }
+
+            response = await ac.get(
+                "/api/tweets/stream", headers={"api-key": APIKEYS[0]}
+            )
+            assert response.status_code == 403
+    finally:
+        event_broker.unsubscribe(sub)
+        await event_broker.stop()
@@ -0,0 +1,139 @@
+from httpx import AsyncClient
+
+from main import app
+from .conftest import APIKEYS
+
+
+TEST_KEY = "test"
+TEST_USER_ID = 4
+
+
+async def test_api_batch_follow():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.post(
+            "/api/users/follow/batch",
+            headers={"api-key": TEST_KEY},
+            json={"user_ids": [1, 2, TEST_USER_ID, 99, 1]},
+        )
+        assert response.status_code == 200
+        assert [(i["user_id"], i["status"]) for i in response.json()["items"]] == [
+            (1, "followed"),
+            (2, "followed"),
+            (TEST_USER_ID, "self"),
+            (99, "not_found"),
+        ]
+
+        response = await ac.post(
+            "/api/users/follow/batch",
+            headers={"api-key": TEST_KEY},
+            json={"user_ids": [2]},
+        )
+        assert response.json()["items"][0]["status"] == "already_following"
+
+        response = await ac.post(
+            "/api/users/follow/batch",
+            headers={"api-key": APIKEYS[0]},
+            json={"user_ids": [2]},
+        )
+        assert response.status_code == 403
+
+        response = await ac.post(
+            "/api/users/follow/batch",
+            headers={"api-key": TEST_KEY},
+            json={"user_ids": []},
+        )
+        assert response.status_code == 422
+
+
+async def test_api_batch_users():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.post(
+            "/api/users/batch", json={"user_ids": [1, TEST_USER_ID, 99]}
+        )
+        assert response.status_code == 403
+
+        response = await ac.post(
+            "/api/users/batch",
+            headers={"api-key": TEST_KEY},
+            json={"user_ids": [1, TEST_USER_ID, 99]},
+        )
+        assert response.status_code == 200
+        items = response.json()["items"]
+        assert [i["result"] for i in items] == [True, True, False]
+
+        # профили совпадают с результатом запроса по одному пользователю,
+        # кроме api-key и email
+        for item in items[:2]:
+            single = (await ac.get(f"/api/users/{item['id']}")).json()["user"]
+            assert single.pop("apikey") and single.pop("email")
+            assert item["user"] == single
+
+        assert [f["name"] for f in items[1]["user"]["followers"]] == [
+            "User_name_1",
+            "User_name_2",
+        ]
+
+
+async def test_api_batch_likes():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        tweets = []
+        for key in (APIKEYS[1], APIKEYS[3]):
+            response = await ac.post(
+                "/api/tweets",
+                headers={"api-key": key},
+                json={"tweet_data": "Tweet for batch likes", "tweet_media_ids": ()},
+            )
+            tweets.append(response.json()["tweet_id"])
+        visible, hidden = tweets
+
+        response = await ac.post(
+            "/api/tweets/likes/batch",
+            headers={"api-key": TEST_KEY},
+            json={"tweet_ids": [visible, hidden, visible]},
+        )
+        assert response.status_code == 200
+        assert [(i["tweet_id"], i["status"]) for i in response.json()["items"]] == [
+            (visible, "liked"),
+            (hidden, "not_found"),
+        ]
+
+        response = await ac.post(
+            "/api/tweets/likes/batch",
+            headers={"api-key": TEST_KEY},
+            json={"tweet_ids": [visible]},
+        )
+        assert response.json()["items"][0]["status"] == "already_liked"
+
+        response = await ac.post(
+            "/api/tweets/likes/batch",
+            headers={"api-key": TEST_KEY},
+            json={"tweet_ids": [visible, hidden], "action": "unlike"},
+        )
+        assert [i["status"] for i in response.json()["items"]] == [
+            "unliked",
+            "not_found",
+        ]
+
+        response = await ac.post(
+            "/api/tweets/likes/batch",
+            headers={"api-key": TEST_KEY},
+            json={"tweet_ids": [visible], "action": "unlike"},
+        )
+        assert response.json()["items"][0]["status"] == "not_liked"
+
+
+async def test_api_batch_unfollow():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.post(
+            "/api/users/follow/batch",
+            headers={"api-key": TEST_KEY},
+            json={"user_ids": [1, 2, 3], "action": "unfollow"},
+        )
+        assert [i["status"] for i in response.json()["items"]] == [
+            "unfollowed",
+            "unfollowed",
+            "not_following",
+        ]
+
+        response = await ac.get(f"/api/users/{TEST_USER_ID}")
+        assert response.json()["user"]["followers"] == []
@@ -0,0 +1,29 @@
+from benchmarks.micro import make_rows, build_feed, regressions, run
+from utils.tweets import group_likes, group_media
+
+
+def test_feed_grouping():
+    rows = make_rows(100)
+    likes = group_likes(rows["likes"])
+    assert sum(len(v) for v in likes.values()) == len(rows["likes"])
+
+    media = group_media(rows["media"])
+    assert media[10] == ["media/000000000001.jpg"]
+
+    feed = build_feed(rows)
+    assert len(feed) == 100
+    assert feed[9]["attachments"] == media[10]
+    assert feed[0]["likes"] == likes.get(1, [])
+    assert feed[0]["author"] == {"id": 2, "name": "user_2"}
+
+
+def test_micro_regressions():
+    results = run(tweets=20, repeat=1, only="sql.build.insert_like")
+    assert list(results) == ["sql.build.insert_like"]
+    assert results["sql.build.insert_like"]["us"] > 0
+
+    slower = {
+        "sql.build.insert_like": {"us": results["sql.build.insert_like"]["us"] * 2}
+    }
+    assert regressions(results, slower, threshold=50)
+    assert not regressions(slower, results, threshold=50)
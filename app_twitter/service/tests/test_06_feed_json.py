@@ -0,0 +1,70 @@
+import json
+
+from httpx import AsyncClient
+
+from main import app
+from utils import tweets as tweets_utils
+from utils.tweets import tweets_list, tweets_list_json
+from .conftest import APIKEYS, async_session_maker
+
+
+async def test_feed_json_matches_orm():
+    test_file = "tests/test_upload_file.jpg"
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        media_ids = []
+        for _ in range(2):
+            response = await ac.post(
+                "/api/medias",
+                headers={"api-key": APIKEYS[1]},
+                files={"file": (test_file, open(test_file, "rb"))},
+            )
+            media_ids.append(response.json()["media_id"])
+
+        response = await ac.post(
+            "/api/tweets",
+            headers={"api-key": APIKEYS[1]},
+            json={"tweet_data": "Fast path tweet", "tweet_media_ids": media_ids},
+        )
+        tweet_id = response.json()["tweet_id"]
+
+        liked = []
+        for user_idx in (2, 3):
+            response = await ac.post(
+                f"/api/tweets/{tweet_id}/likes",
+                headers={"api-key": APIKEYS[user_idx]},
+            )
+            if response.status_code == 201:
+                liked.append(user_idx)
+
+    feeds = dict()
+    for user_idx in (1, 2, 3, 4):
+        async with async_session_maker() as session:
+            feeds[user_idx] = await tweets_list(session, user_idx)
+        async with async_session_maker() as session:
+            body = await tweets_list_json(session, user_idx)
+        assert json.loads(body) == {"result": True, "tweets": feeds[user_idx]}
+
+    # твиты User_1 видят User_2 и User_3
+    orm = feeds[3]
+    tweet = next(t for t in orm if t["id"] == tweet_id)
+    assert len(tweet["attachments"]) == 2
+    assert liked
+    assert [like["user_id"] for like in tweet["likes"]] == liked
+    assert [t["id"] for t in orm] == sorted((t["id"] for t in orm), reverse=True)
+
+
+async def test_api_feed_fast_path(monkeypatch):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get("/api/tweets", headers={"api-key": APIKEYS[3]})
+        expected = response.json()
+
+        monkeypatch.setattr(tweets_utils, "FEED_FAST_PATH", True)
+        response = await ac.get("/api/tweets", headers={"api-key": APIKEYS[3]})
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/json"
+        assert response.json() == expected
+        assert expected["tweets"]
+
+        response = await ac.get("/api/tweets", headers={"api-key": APIKEYS[0]})
+        assert response.status_code == 403
@@ -0,0 +1,164 @@
+import asyncio
+
+from httpx import AsyncClient
+from sqlalchemy import select, func
+from starlette.responses import JSONResponse
+
+from main import app
+from models.database import ASYNCPG_DSN
+from models.models import Tweets, Media, IdempotencyKeys
+from utils.idempotency import IdempotencyStore, hash_apikey, delete_expired_keys
+from .conftest import APIKEYS, async_session_maker
+
+
+async def count_tweets(text: str) -> int:
+    async with async_session_maker() as session:
+        return await session.scalar(
+            select(func.count(Tweets.id)).where(Tweets.tweetdata == text)
+        )
+
+
+async def test_api_tweet_idempotency_key():
+    text = "Idempotent tweet"
+    tweet_data = {"tweet_data": text, "tweet_media_ids": ()}
+    headers = {"api-key": APIKEYS[1], "idempotency-key": "tweet-key-1"}
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        first = await ac.post("/api/tweets", headers=headers, json=tweet_data)
+        assert first.status_code == 201
+        assert "idempotent-replayed" not in first.headers
+
+        retry = await ac.post("/api/tweets", headers=headers, json=tweet_data)
+        assert retry.status_code == 201
+        assert retry.headers["idempotent-replayed"] == "true"
+        assert retry.json() == first.json()
+        assert await count_tweets(text) == 1
+
+        # тот же ключ с другим телом запроса
+        response = await ac.post(
+            "/api/tweets",
+            headers=headers,
+            json={"tweet_data": "Another tweet", "tweet_media_ids": ()},
+        )
+        assert response.status_code == 422
+
+        # ключи разных пользователей не пересекаются
+        response = await ac.post(
+            "/api/tweets",
+            headers={"api-key": APIKEYS[2], "idempotency-key": "tweet-key-1"},
+            json=tweet_data,
+        )
+        assert response.status_code == 201
+        assert response.json()["tweet_id"] != first.json()["tweet_id"]
+
+
+async def test_api_tweet_idempotency_concurrent():
+    text = "Concurrent idempotent tweet"
+    tweet_data = {"tweet_data": text, "tweet_media_ids": ()}
+    headers = {"api-key": APIKEYS[1], "idempotency-key": "tweet-key-2"}
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        responses = await asyncio.gather(
+            *(
+                ac.post("/api/tweets", headers=headers, json=tweet_data)
+                for _ in range(5)
+            )
+        )
+
+    assert {r.status_code for r in responses} == {201}
+    assert len({r.json()["tweet_id"] for r in responses}) == 1
+    assert await count_tweets(text) == 1
+
+
+async def test_api_media_idempotency_key():
+    test_file = "tests/test_upload_file.jpg"
+    headers = {"api-key": APIKEYS[1], "idempotency-key": "media-key-1"}
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        media_ids = []
+        for _ in range(2):
+            response = await ac.post(
+                "/api/medias",
+                headers=headers,
+                files={"file": (test_file, open(test_file, "rb"))},
+            )
+            assert response.status_code == 201
+            media_ids.append(response.json()["media_id"])
+
+    assert media_ids[0] == media_ids[1]
+    async with async_session_maker() as session:
+        assert (
+            await session.scalar(
+                select(func.count(Media.id)).where(Media.id > media_ids[0])
+            )
+            == 0
+        )
+
+
+async def test_idempotency_store_expiry():
+    store = IdempotencyStore(async_session_maker, ttl=60)
+    calls = []
+
+    async def handler(status_code=201):
+        calls.append(status_code)
+        return JSONResponse(content={"n": len(calls)}, status_code=status_code)
+
+    await store.run(("key", "/test", "a"), handler)
+    response = await store.run(("key", "/test", "a"), handler)
+    assert response.headers["idempotent-replayed"] == "true"
+    assert calls == [201]
+
+    # api-key хранится только в виде хэша
+    async with async_session_maker() as session:
+        stored = (
+            await session.scalars(
+                select(IdempotencyKeys).where(IdempotencyKeys.key == "a")
+            )
+        ).one()
+    assert stored.apikey_hash == hash_apikey("key") != "key"
+
+    # ответы с ошибкой не сохраняются
+    await store.run(("key", "/test", "d"), lambda: handler(500))
+    await store.run(("key", "/test", "d"), lambda: handler(500))
+    assert calls == [201, 500, 500]
+
+    response = await store.run(("key", "/test", "x" * 201), handler)
+    assert response.status_code == 400
+
+    expired = IdempotencyStore(async_session_maker, ttl=0.001)
+    await expired.run(("key", "/test", "e"), handler)
+    await asyncio.sleep(0.01)
+    await expired.run(("key", "/test", "e"), handler)
+    assert len(calls) == 5
+
+    # просроченные ключи удаляет периодическая задача
+    await asyncio.sleep(0.01)
+    async with async_session_maker() as session:
+        await delete_expired_keys(session, {})
+        await session.commit()
+        keys = set(await session.scalars(select(IdempotencyKeys.key)))
+    assert "e" not in keys and "a" in keys
+
+
+async def test_idempotency_store_pool():
+    store = IdempotencyStore()
+    store.connect(ASYNCPG_DSN, pool_size=1, pool_timeout=0.2)
+    release = asyncio.Event()
+
+    async def slow_handler():
+        await release.wait()
+        return JSONResponse(content={}, status_code=201)
+
+    try:
+        # соединение с ключом занято до ответа, остальные запросы ждут его
+        # не дольше pool_timeout и не занимают соединения основного пула
+        first = asyncio.create_task(store.run(("key", "/pool", "a"), slow_handler))
+        await asyncio.sleep(0.1)
+        response = await store.run(("key", "/pool", "b"), slow_handler)
+        assert response.status_code == 503
+        release.set()
+        assert (await first).status_code == 201
+        response = await store.run(("key", "/pool", "b"), slow_handler)
+        assert response.status_code == 201
+    finally:
+        await store.close()
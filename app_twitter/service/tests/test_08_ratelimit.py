@@ -0,0 +1,115 @@
+import datetime
+
+from httpx import AsyncClient
+from sqlalchemy import select, update
+
+import main
+from main import app
+from utils.ratelimit import (
+    TokenBucket,
+    MemoryRateLimiter,
+    PostgresRateLimiter,
+    LoadShedder,
+    create_limiter_engine,
+    hash_key,
+    delete_idle_buckets,
+)
+from models.models import RateLimitBuckets
+from .conftest import APIKEYS, async_session_maker, settings
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=2, burst=3, now=0)
+    assert [bucket.take(0) for _ in range(3)] == [0, 0, 0]
+    assert bucket.take(0) == 0.5
+    # за 0.5 с появляется один токен
+    assert bucket.take(0.5) == 0
+    assert bucket.take(0.5) > 0
+    # пополнение не превышает burst
+    assert [bucket.take(100) for _ in range(4)][-1] > 0
+
+
+async def test_memory_rate_limiter_max_keys():
+    limiter = MemoryRateLimiter(rate=1, burst=1, max_keys=2)
+    assert await limiter.acquire("a") == 0
+    assert await limiter.acquire("a") > 0
+    await limiter.acquire("b")
+    await limiter.acquire("c")
+    assert list(limiter.buckets) == ["b", "c"]
+    assert await limiter.acquire("a") == 0
+
+
+async def test_postgres_rate_limiter():
+    limiter = PostgresRateLimiter(
+        create_limiter_engine(settings.database_dsn), rate=0.5, burst=2
+    )
+    try:
+        assert await limiter.acquire("pg-key") == 0
+        assert await limiter.acquire("pg-key") == 0
+        retry_after = await limiter.acquire("pg-key")
+        assert 0 < retry_after <= 2
+        assert await limiter.acquire("other-key") == 0
+    finally:
+        await limiter.close()
+
+    # api-key хранится только в виде хэша
+    async with async_session_maker() as session:
+        keys = set(await session.scalars(select(RateLimitBuckets.key)))
+    assert hash_key("pg-key") in keys and "pg-key" not in keys
+
+    # счетчики неактивных ключей удаляет периодическая задача
+    async with async_session_maker() as session:
+        await session.execute(
+            update(RateLimitBuckets)
+            .where(RateLimitBuckets.key == hash_key("other-key"))
+            .values(updated_on=datetime.datetime.now() - datetime.timedelta(days=1))
+        )
+        await delete_idle_buckets(session, {})
+        await session.commit()
+        keys = set(await session.scalars(select(RateLimitBuckets.key)))
+    assert hash_key("other-key") not in keys and hash_key("pg-key") in keys
+
+
+async def test_api_rate_limit(monkeypatch):
+    limiter = MemoryRateLimiter(rate=0.01, burst=2)
+    monkeypatch.setattr(main.request_limiter, "key_limiter", limiter)
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        for _ in range(2):
+            response = await ac.get("/api/tweets", headers={"api-key": APIKEYS[1]})
+            assert response.status_code == 200
+
+        response = await ac.get("/api/tweets", headers={"api-key": APIKEYS[1]})
+        assert response.status_code == 429
+        assert int(response.headers["retry-after"]) >= 1
+        assert response.json()["result"] is False
+
+        response = await ac.get("/api/tweets", headers={"api-key": APIKEYS[2]})
+        assert response.status_code == 200
+
+
+async def test_api_load_shedding(monkeypatch):
+    shedder = LoadShedder(loop_lag_limit=0.5, pool_wait_limit=1.0)
+    monkeypatch.setattr(main.request_limiter, "shedder", shedder)
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        shedder.loop_lag = 2.0
+        response = await ac.get("/api/tweets", headers={"api-key": APIKEYS[1]})
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "1"
+
+        # статические файлы не ограничиваются
+        response = await ac.get("/")
+        assert response.status_code == 200
+
+        shedder.loop_lag = 0.0
+        for _ in range(20):
+            shedder.record_pool_wait(5.0)
+        response = await ac.get("/api/tweets", headers={"api-key": APIKEYS[1]})
+        assert response.status_code == 503
+        assert shedder.shed_count == 2
+
+        # устаревшее измерение ожидания пула не учитывается
+        shedder.pool_wait_updated -= 60
+        response = await ac.get("/api/tweets", headers={"api-key": APIKEYS[1]})
+        assert response.status_code == 200
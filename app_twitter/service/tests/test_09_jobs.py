@@ -0,0 +1,223 @@
+import asyncio
+import datetime
+
+from httpx import AsyncClient
+from sqlalchemy import select, delete, update, text
+
+from main import app
+from models.models import Jobs, DeadJobs, Users
+from utils.jobs import JobRunner, enqueue_job, job_handler, job_runner
+from utils.jobs import track_enqueued
+from utils.users import update_user_last_activity
+from .conftest import APIKEYS, async_session_maker, SERVICE_KEY
+
+
+CALLS = []
+
+
+@job_handler("test_ok")
+async def ok_job(session, payload):
+    CALLS.append(payload["n"])
+
+
+@job_handler("test_fail")
+async def fail_job(session, payload):
+    raise ValueError("boom")
+
+
+@job_handler("test_lock_user")
+async def lock_user_job(session, payload):
+    await session.execute(
+        update(Users).where(Users.id == payload["user_id"]).values(last_activity=None)
+    )
+
+
+@job_handler("test_probe_user")
+async def probe_user_job(session, payload):
+    # другое соединение: блокировка строки предыдущей задачи уже снята
+    async with async_session_maker() as other:
+        await other.execute(text("SET LOCAL lock_timeout = '1s'"))
+        await other.execute(
+            update(Users)
+            .where(Users.id == payload["user_id"])
+            .values(last_activity=datetime.datetime.now())
+        )
+        await other.commit()
+    CALLS.append(payload["user_id"])
+
+
+async def clear_jobs():
+    async with async_session_maker() as session:
+        await session.execute(delete(Jobs))
+        await session.execute(delete(DeadJobs))
+        await session.commit()
+    CALLS.clear()
+
+
+async def make_due():
+    async with async_session_maker() as session:
+        await session.execute(update(Jobs).values(run_at=datetime.datetime.now()))
+        await session.commit()
+
+
+async def test_enqueue_and_dedup():
+    await clear_jobs()
+    runner = JobRunner()
+    runner.bind(async_session_maker)
+
+    async with async_session_maker() as session:
+        await enqueue_job(session, "test_ok", {"n": 1})
+        await enqueue_job(session, "test_ok", {"n": 2}, dedup_key="test:2")
+        await enqueue_job(session, "test_ok", {"n": 3}, dedup_key="test:2")
+        await session.commit()
+
+    assert await runner.run_once() == 2
+    assert CALLS == [1, 2]
+    assert runner.counters["processed"] == 2
+    assert await runner.run_once() == 0
+
+
+async def test_enqueue_tracked_per_request():
+    async def request(enqueue: bool) -> int:
+        jobs = track_enqueued()
+        await asyncio.sleep(0)
+        if enqueue:
+            async with async_session_maker() as session:
+                await enqueue_job(session, "test_ok", {"n": 1})
+                await session.rollback()
+        await asyncio.sleep(0.05)
+        return jobs.count
+
+    # задача одного запроса не видна параллельному запросу
+    assert await asyncio.gather(request(True), request(False)) == [1, 0]
+
+
+async def test_last_activity_keeps_latest():
+    await clear_jobs()
+    runner = JobRunner()
+    runner.bind(async_session_maker)
+    started = datetime.datetime.now() - datetime.timedelta(minutes=5)
+    async with async_session_maker() as session:
+        await session.execute(
+            update(Users).where(Users.id == 2).values(last_activity=started)
+        )
+        await session.commit()
+
+    times = []
+    for _ in range(2):
+        async with async_session_maker() as session:
+            await update_user_last_activity(session, user_id=2)
+            await session.commit()
+            job = (await session.scalars(select(Jobs))).one()
+        times.append(job.payload["time"])
+
+    # ожидающая задача получила время последней активности
+    assert times[1] > times[0]
+    assert await runner.run_once() == 1
+    async with async_session_maker() as session:
+        user = await session.get(Users, 2)
+    assert user.last_activity.isoformat() == times[1]
+
+    # задача со старым временем не переносит время назад
+    async with async_session_maker() as session:
+        await enqueue_job(
+            session,
+            "last_activity",
+            {"user_id": 2, "time": started.isoformat()},
+            dedup_key="last_activity:2",
+        )
+        await session.commit()
+    assert await runner.run_once() == 1
+    async with async_session_maker() as session:
+        assert (await session.get(Users, 2)).last_activity == user.last_activity
+
+
+async def test_retry_and_dead_letter():
+    await clear_jobs()
+    runner = JobRunner(max_attempts=3)
+    runner.bind(async_session_maker)
+
+    async with async_session_maker() as session:
+        await enqueue_job(session, "test_fail", {"n": 1})
+        await enqueue_job(session, "test_unknown", {"n": 2})
+        await session.commit()
+
+    assert await runner.run_once() == 2
+    async with async_session_maker() as session:
+        job = (await session.scalars(select(Jobs))).one()
+    assert job.kind == "test_fail"
+    assert job.attempts == 1
+    assert job.run_at > datetime.datetime.now()
+    assert job.last_error == "ValueError: boom"
+
+    # задача не выбирается до окончания паузы
+    assert await runner.run_once() == 0
+    for _ in range(2):
+        await make_due()
+        assert await runner.run_once() == 1
+
+    async with async_session_maker() as session:
+        assert (await session.scalars(select(Jobs))).all() == []
+        dead = {d.kind: d for d in (await session.scalars(select(DeadJobs))).all()}
+    assert dead["test_fail"].attempts == 3
+    assert dead["test_unknown"].attempts == 1
+    assert runner.counters == {"processed": 0, "retried": 2, "dead": 2}
+
+    metrics = await runner.metrics()
+    assert metrics["dead"] == {"test_fail": 1, "test_unknown": 1}
+    assert metrics["pending"] == {}
+
+
+async def test_jobs_commit_separately():
+    await clear_jobs()
+    runner = JobRunner()
+    runner.bind(async_session_maker)
+
+    async with async_session_maker() as session:
+        await enqueue_job(session, "test_lock_user", {"user_id": 1})
+        await enqueue_job(session, "test_probe_user", {"user_id": 1})
+        await session.commit()
+
+    assert await runner.run_once() == 2
+    assert CALLS == [1]
+    assert runner.counters == {"processed": 2, "retried": 0, "dead": 0}
+
+
+async def test_concurrent_workers_skip_locked():
+    await clear_jobs()
+    async with async_session_maker() as session:
+        for n in range(40):
+            await enqueue_job(session, "test_ok", {"n": n})
+        await session.commit()
+
+    runners = [JobRunner() for _ in range(4)]
+    for runner in runners:
+        runner.bind(async_session_maker)
+    await asyncio.gather(*(runner.drain(limit=5) for runner in runners))
+
+    assert sorted(CALLS) == list(range(40))
+    assert sum(runner.counters["processed"] for runner in runners) == 40
+
+
+async def test_last_activity_job():
+    await clear_jobs()
+    async with async_session_maker() as session:
+        await session.execute(
+            update(Users).where(Users.id == 2).values(last_activity=None)
+        )
+        await session.commit()
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get("/api/tweets", headers={"api-key": APIKEYS[2]})
+        assert response.status_code == 200
+        # задача выполнена в фоне после отправки ответа
+        response = await ac.get("/api/service/jobs", headers={"api-key": SERVICE_KEY})
+        assert response.status_code == 200
+        metrics = response.json()["metrics"]
+        assert metrics["pending"] == {}
+        assert "load" in metrics
+
+    async with async_session_maker() as session:
+        user = await session.get(Users, 2)
+    assert user.last_activity is not None
+    assert job_runner.counters["processed"] >= 1
@@ -0,0 +1,92 @@
+from httpx import AsyncClient
+from sqlalchemy import event, select, func
+
+from main import app
+from models.models import Media, Tweets
+from utils.tweets import add_tweet
+from .conftest import APIKEYS, async_session_maker
+
+
+TEST_FILE = "tests/test_upload_file.jpg"
+
+
+async def upload(ac: AsyncClient, user_idx: int) -> int:
+    response = await ac.post(
+        "/api/medias",
+        headers={"api-key": APIKEYS[user_idx]},
+        files={"file": (TEST_FILE, open(TEST_FILE, "rb"))},
+    )
+    assert response.status_code == 201
+    return response.json()["media_id"]
+
+
+async def count_tweets() -> int:
+    async with async_session_maker() as session:
+        return await session.scalar(select(func.count(Tweets.id)))
+
+
+async def test_upload_requires_api_key():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.post(
+            "/api/medias",
+            headers={"api-key": "wrong_key"},
+            files={"file": (TEST_FILE, open(TEST_FILE, "rb"))},
+        )
+    assert response.status_code == 403
+
+
+async def test_tweet_media_mismatch():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        own = await upload(ac, 1)
+        foreign = await upload(ac, 2)
+        tweets_before = await count_tweets()
+
+        for media_ids, mismatch in (
+            ([own, foreign], [foreign]),
+            ([own, 10**9], [10**9]),
+        ):
+            response = await ac.post(
+                "/api/tweets",
+                headers={"api-key": APIKEYS[1]},
+                json={"tweet_data": "Media mismatch", "tweet_media_ids": media_ids},
+            )
+            assert response.status_code == 400
+            assert response.json()["media_ids"] == mismatch
+
+        # твит не создан, собственный файл остался свободным
+        assert await count_tweets() == tweets_before
+        async with async_session_maker() as session:
+            media = await session.get(Media, own)
+        assert media.tweet_id is None
+        assert media.uploader == 1
+
+        response = await ac.post(
+            "/api/tweets",
+            headers={"api-key": APIKEYS[1]},
+            json={"tweet_data": "Media ok", "tweet_media_ids": [own]},
+        )
+        assert response.status_code == 201
+
+        # уже привязанный файл нельзя использовать повторно
+        response = await ac.post(
+            "/api/tweets",
+            headers={"api-key": APIKEYS[1]},
+            json={"tweet_data": "Media reused", "tweet_media_ids": [own]},
+        )
+        assert response.status_code == 400
+        assert response.json()["media_ids"] == [own]
+
+
+async def test_add_tweet_single_commit():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        media_id = await upload(ac, 1)
+
+    commits = []
+    async with async_session_maker() as session:
+        event.listen(session.sync_session, "after_commit", commits.append)
+        tweet_id = await add_tweet(session, 1, "One commit #atomic", (media_id,))
+
+    assert tweet_id
+    assert len(commits) == 1
+    async with async_session_maker() as session:
+        assert (await session.get(Media, media_id)).tweet_id == tweet_id
@@ -0,0 +1,82 @@
+import subprocess
+import sys
+
+import pytest
+from httpx import AsyncClient
+from pydantic import ValidationError
+from sqlalchemy import text
+
+from config import Settings, get_settings
+from main import app
+from models.database import async_session_maker
+from .conftest import APIKEYS, SERVICE_KEY
+
+
+def test_settings_parsing(monkeypatch):
+    monkeypatch.setenv("ADD_TEST_DATA", "yes")
+    monkeypatch.setenv("DB_POOL_SIZE", "0")
+    settings = Settings()
+    assert settings.ADD_TEST_DATA is True
+    assert settings.DB_POOL_SIZE == 0
+
+    monkeypatch.setenv("ADD_TEST_DATA", "no")
+    assert Settings().ADD_TEST_DATA is False
+
+
+def test_settings_cached():
+    assert get_settings() is get_settings()
+
+
+def test_main_import_is_lazy():
+    # сервер, код тестовых данных и соединения с БД при импорте не загружаются
+    code = (
+        "import sys, main; "
+        "print(sorted(m for m in ('uvicorn', 'gunicorn', 'tests.add_testdata_db') "
+        "if m in sys.modules)); "
+        "print(main.engine.pool.checkedin())"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.split("\n")[:2] == ["[]", "0"]
+
+
+def test_settings_validation(monkeypatch):
+    for name, value in (
+        ("RATE_LIMIT_BACKEND", "redis"),
+        ("DB_POOL_SIZE", "-1"),
+        ("FEED_FAST_PATH", "maybe"),
+        ("PAGE_SIZE", "500"),
+    ):
+        with monkeypatch.context() as m:
+            m.setenv(name, value)
+            with pytest.raises(ValidationError):
+                Settings()
+
+
+async def test_settings_endpoint():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        # служебные маршруты закрыты для пользователей и без ключа
+        for headers in ({}, {"api-key": APIKEYS[1]}):
+            response = await ac.get("/api/service/settings", headers=headers)
+            assert response.status_code == 403
+
+        response = await ac.get(
+            "/api/service/settings", headers={"api-key": SERVICE_KEY}
+        )
+
+    assert response.status_code == 200
+    settings = response.json()["settings"]
+    assert settings["DB_PASSWORD"] == "**********"
+    public = Settings(SERVICE_API_KEY="secret").public()
+    assert public["SERVICE_API_KEY"] == "**********"
+    assert settings["PAGE_SIZE"] == get_settings().PAGE_SIZE
+    assert settings["RATE_LIMIT_BACKEND"] in ("memory", "postgres")
+
+
+async def test_statement_timeout():
+    async with async_session_maker() as session:
+        value = await session.scalar(
+            text("SELECT setting FROM pg_settings WHERE name = 'statement_timeout'")
+        )
+    assert int(value) == get_settings().DB_STATEMENT_TIMEOUT
@@ -0,0 +1,167 @@
+import asyncio
+
+from httpx import AsyncClient
+from sqlalchemy import select
+
+from main import app
+from models.database import ASYNCPG_DSN
+from models.models import Followers
+from utils.events import EventBroker, get_feed_author_ids
+from utils.follow_graph import FollowGraph, follow_graph
+from utils.tweets import check_follows_tweet_exists
+from .conftest import APIKEYS, async_session_maker, SERVICE_KEY
+
+
+async def get_followers_rows() -> set:
+    async with async_session_maker() as session:
+        res = await session.execute(select(Followers.user_id, Followers.follower_id))
+        return set(res.all())
+
+
+async def wait_for(condition, timeout: float = 5):
+    for _ in range(int(timeout / 0.05)):
+        if condition():
+            return True
+        await asyncio.sleep(0.05)
+    return condition()
+
+
+def test_follow_graph_apply():
+    graph = FollowGraph()
+    graph.apply({"type": "follow", "user_id": 1, "follower_ids": [5, 3, 4]})
+    graph.apply({"type": "follow", "user_id": 2, "follower_ids": [3]})
+    # повторное событие не меняет индекс
+    graph.apply({"type": "follow", "user_id": 1, "follower_ids": [3]})
+    graph.apply({"type": "tweet", "tweet_id": 1, "author_id": 1})
+
+    assert graph.follower_ids(1).tolist() == [3, 4, 5]
+    assert graph.user_ids(3).tolist() == [1, 2]
+    assert graph.has_edge(1, 4) and not graph.has_edge(4, 1)
+    assert graph.edges == 4
+
+    graph.apply({"type": "unfollow", "user_id": 1, "follower_ids": [4, 7]})
+    graph.apply({"type": "unfollow", "user_id": 2, "follower_ids": [3]})
+    assert graph.follower_ids(1).tolist() == [3, 5]
+    assert graph.user_ids(3).tolist() == [1]
+    assert 2 not in graph.forward
+    assert graph.edges == 2
+    assert graph.stats()["memory_bytes"] > 0
+
+
+async def test_follow_graph_load():
+    rows = await get_followers_rows()
+    graph = FollowGraph()
+    graph.session_maker = async_session_maker
+
+    load = asyncio.create_task(graph.load())
+    await asyncio.sleep(0)
+    # событие во время загрузки применяется к загруженному индексу
+    graph.apply({"type": "follow", "user_id": 1000, "follower_ids": [1001]})
+    assert await load is True
+
+    assert graph.ready is True
+    assert graph.has_edge(1000, 1001)
+    graph.apply({"type": "unfollow", "user_id": 1000, "follower_ids": [1001]})
+
+    loaded = {
+        (user_id, follower_id)
+        for user_id, values in graph.forward.items()
+        for follower_id in values
+    }
+    assert loaded == rows
+    assert graph.edges == len(rows)
+
+    # результат индекса совпадает с запросом к БД, который используется,
+    # пока глобальный индекс не загружен
+    assert follow_graph.ready is False
+    async with async_session_maker() as session:
+        for user_id in range(1, 4):
+            authors = await get_feed_author_ids(session, user_id)
+            assert sorted(authors) == graph.user_ids(user_id).tolist()
+
+
+async def test_follow_graph_reload_single_task():
+    graph = FollowGraph()
+    graph.session_maker = async_session_maker
+    loads = []
+    load = graph.load
+
+    async def counted_load():
+        loads.append(len(loads))
+        return await load()
+
+    graph.load = counted_load
+
+    # повторные запросы во время загрузки не запускают параллельную загрузку
+    task = graph.reload()
+    await asyncio.sleep(0)
+    assert graph.reload() is task
+    graph.on_connect(True)
+    assert await task is True
+    assert loads == [0, 1]
+
+    # потеря подключения во время загрузки: индекс не используется до следующей
+    task = graph.reload()
+    await asyncio.sleep(0)
+    graph.on_connect(False)
+    assert await task is True
+    assert graph.ready is False
+    assert (await graph.reload()) is True and graph.ready is True
+    await graph.stop()
+
+
+async def test_follow_graph_api_updates():
+    rows = await get_followers_rows()
+    user_id, follower_id = next(
+        (a, b)
+        for a in range(1, 4)
+        for b in range(1, 4)
+        if a != b and (a, b) not in rows
+    )
+
+    # второй воркер получает изменения через канал событий
+    broker = EventBroker()
+    worker_graph = FollowGraph()
+    worker_graph.start(async_session_maker, broker)
+    broker.start(ASYNCPG_DSN)
+
+    follow_graph.session_maker = async_session_maker
+    await follow_graph.load()
+    try:
+        assert await wait_for(lambda: worker_graph.ready)
+
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.post(
+                f"/api/users/{follower_id}/follow",
+                headers={"api-key": APIKEYS[user_id]},
+            )
+            assert response.json() == {"result": True}
+            assert follow_graph.has_edge(user_id, follower_id)
+            assert await wait_for(lambda: worker_graph.has_edge(user_id, follower_id))
+
+            response = await ac.get(
+                "/api/service/follow_graph", headers={"api-key": SERVICE_KEY}
+            )
+            stats = response.json()["follow_graph"]
+            assert stats["ready"] is True
+            assert stats["edges"] == len(rows) + 1
+            assert stats["memory_bytes"] > 0
+
+            response = await ac.delete(
+                f"/api/users/{follower_id}/follow",
+                headers={"api-key": APIKEYS[user_id]},
+            )
+            assert response.json() == {"result": True}
+            assert not follow_graph.has_edge(user_id, follower_id)
+            assert await wait_for(
+                lambda: not worker_graph.has_edge(user_id, follower_id)
+            )
+
+        async with async_session_maker() as session:
+            assert not await check_follows_tweet_exists(session, 1, 1000)
+    finally:
+        await broker.stop()
+        await worker_graph.stop()
+        await follow_graph.stop()
+
+    assert await get_followers_rows() == rows
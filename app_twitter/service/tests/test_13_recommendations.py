@@ -0,0 +1,191 @@
+import datetime
+
+from httpx import AsyncClient
+from sqlalchemy import select, insert, delete, or_
+
+from main import app
+from models.models import Users, Followers, FollowRecommendations, Jobs
+from utils import recommendations
+from utils.recommendations import (
+    REFRESH_ALL_KEY,
+    refresh_recommendations,
+    refresh_user_recommendations,
+    refresh_all_recommendations,
+    start_recommendations_refresh,
+)
+from .conftest import async_session_maker
+
+
+APIKEY = "recommendations_key"
+# подписки тестового графа: user_id подписан на follower_id
+EDGES = [(0, 1), (0, 2), (1, 3), (2, 3), (2, 4), (1, 0), (3, 0)]
+
+
+async def create_graph() -> list:
+    async with async_session_maker() as session:
+        ids = (
+            await session.scalars(
+                insert(Users)
+                .values(
+                    [
+                        {"name": f"rec_user_{n}", "email": f"rec_{n}@test"}
+                        for n in range(5)
+                    ]
+                )
+                .returning(Users.id)
+            )
+        ).all()
+        await session.execute(
+            Users.__table__.update().where(Users.id == ids[0]).values(apikey=APIKEY)
+        )
+        await session.execute(
+            insert(Followers),
+            [{"user_id": ids[a], "follower_id": ids[b]} for a, b in EDGES],
+        )
+        await session.commit()
+    return ids
+
+
+async def drop_graph(ids: list):
+    async with async_session_maker() as session:
+        await session.execute(
+            delete(Followers).where(
+                or_(Followers.user_id.in_(ids), Followers.follower_id.in_(ids))
+            )
+        )
+        await session.execute(delete(Users).where(Users.id.in_(ids)))
+        await session.execute(
+            delete(Jobs).where(
+                Jobs.kind.in_(("recommendations", "recommendations_all"))
+            )
+        )
+        await session.commit()
+
+
+async def get_stored(user_id: int) -> list:
+    async with async_session_maker() as session:
+        res = await session.execute(
+            select(FollowRecommendations.recommended_id, FollowRecommendations.score)
+            .where(FollowRecommendations.user_id == user_id)
+            .order_by(FollowRecommendations.score.desc())
+        )
+        return [tuple(row) for row in res]
+
+
+async def test_recommendations_refresh_and_read():
+    ids = await create_graph()
+    try:
+        async with async_session_maker() as session:
+            await refresh_recommendations(session, [ids[0]], limit=1)
+            await session.commit()
+        assert await get_stored(ids[0]) == [(ids[3], 2)]
+
+        async with async_session_maker() as session:
+            await refresh_recommendations(session, [ids[0]])
+            await session.commit()
+        # подписки и сам пользователь не рекомендуются
+        assert await get_stored(ids[0]) == [(ids[3], 2), (ids[4], 1)]
+
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.get("/api/users/me/recommendations")
+            assert response.status_code == 403
+
+            response = await ac.get(
+                "/api/users/me/recommendations", headers={"api-key": APIKEY}
+            )
+            assert response.json() == {
+                "result": True,
+                "users": [
+                    {"id": ids[3], "name": "rec_user_3", "score": 2},
+                    {"id": ids[4], "name": "rec_user_4", "score": 1},
+                ],
+            }
+
+            response = await ac.post(
+                f"/api/users/{ids[3]}/follow", headers={"api-key": APIKEY}
+            )
+            assert response.json() == {"result": True}
+
+            # подписка исключается из ответа до пересчета
+            response = await ac.get(
+                "/api/users/me/recommendations?limit=5", headers={"api-key": APIKEY}
+            )
+            assert [user["id"] for user in response.json()["users"]] == [ids[4]]
+
+        async with async_session_maker() as session:
+            job = await session.scalar(
+                select(Jobs).where(Jobs.dedup_key == f"recommendations:{ids[0]}")
+            )
+            assert job.payload == {"user_id": ids[0]}
+            assert job.run_at > datetime.datetime.now()
+
+            # пересчет пользователя и подписанных на него
+            await refresh_user_recommendations(session, job.payload)
+            await session.commit()
+
+        assert await get_stored(ids[0]) == [(ids[4], 1)]
+        assert await get_stored(ids[1]) == [(ids[2], 1)]
+    finally:
+        await drop_graph(ids)
+
+
+async def test_recommendations_user_refresh_batches(monkeypatch):
+    ids = await create_graph()
+    monkeypatch.setattr(recommendations, "RECOMMENDATIONS_BATCH_USERS", 1)
+    try:
+        # на ids[0] подписаны ids[1] и ids[3]: по одному в задаче
+        payload = {"user_id": ids[0]}
+        refreshed = []
+        while payload is not None:
+            async with async_session_maker() as session:
+                await refresh_user_recommendations(session, payload)
+                job = await session.scalar(
+                    select(Jobs).where(Jobs.kind == "recommendations")
+                )
+                payload = job and job.payload
+                if job is not None:
+                    refreshed.append(payload["after_id"])
+                    await session.delete(job)
+                await session.commit()
+
+        assert refreshed == [ids[1], ids[3]]
+        assert await get_stored(ids[0]) == [(ids[3], 2), (ids[4], 1)]
+        assert await get_stored(ids[1]) == [(ids[2], 1)]
+        assert sorted(await get_stored(ids[3])) == [(ids[1], 1), (ids[2], 1)]
+    finally:
+        await drop_graph(ids)
+
+
+async def test_recommendations_full_refresh_schedule():
+    ids = await create_graph()
+    try:
+        await start_recommendations_refresh(async_session_maker)
+        await start_recommendations_refresh(async_session_maker)
+
+        async with async_session_maker() as session:
+            jobs = (
+                await session.scalars(
+                    select(Jobs).where(Jobs.kind == "recommendations_all")
+                )
+            ).all()
+            assert len(jobs) == 1
+            assert jobs[0].dedup_key == REFRESH_ALL_KEY
+
+            await refresh_all_recommendations(session, jobs[0].payload)
+            await session.delete(jobs[0])
+            await session.commit()
+
+            # следующий пересчет занимает ключ и запланирован через интервал
+            jobs = (
+                await session.scalars(
+                    select(Jobs).where(Jobs.kind == "recommendations_all")
+                )
+            ).all()
+            assert len(jobs) == 1
+            assert jobs[0].dedup_key == REFRESH_ALL_KEY
+            assert jobs[0].run_at > datetime.datetime.now()
+
+        assert await get_stored(ids[0]) == [(ids[3], 2), (ids[4], 1)]
+        assert await get_stored(ids[4]) == []
+    finally:
+        await drop_graph(ids)
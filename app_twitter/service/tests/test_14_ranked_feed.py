@@ -0,0 +1,106 @@
+from httpx import AsyncClient
+from sqlalchemy import select
+
+from main import app
+from models.models import Followers, Tweets
+from utils.ranking import RankedFeed, update_engagement
+from utils.tweets import add_like_to_tweet, delete_like_to_tweet
+from .conftest import APIKEYS, async_session_maker
+
+
+async def create_tweets(count: int) -> list:
+    ids = []
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        for n in range(count):
+            response = await ac.post(
+                "/api/tweets",
+                headers={"api-key": APIKEYS[1]},
+                json={"tweet_data": f"Ranked tweet {n}", "tweet_media_ids": ()},
+            )
+            ids.append(response.json()["tweet_id"])
+    return ids
+
+
+async def get_reader() -> int:
+    async with async_session_maker() as session:
+        return await session.scalar(
+            select(Followers.follower_id).where(Followers.user_id == 1).limit(1)
+        )
+
+
+async def test_engagement_counters():
+    [tweet_id] = await create_tweets(1)
+
+    async with async_session_maker() as session:
+        assert (await add_like_to_tweet(session, 2, tweet_id))["result"]
+    async with async_session_maker() as session:
+        tweet = await session.get(Tweets, tweet_id)
+        assert tweet.likes_count == 1
+        assert 0.99 < tweet.like_velocity <= 1
+        assert tweet.like_velocity_on is not None
+
+    async with async_session_maker() as session:
+        assert (await delete_like_to_tweet(session, 2, tweet_id))["result"]
+    async with async_session_maker() as session:
+        tweet = await session.get(Tweets, tweet_id)
+        assert tweet.likes_count == 0
+        assert tweet.like_velocity < 0.01
+
+
+async def test_ranked_feed_cache():
+    old_id, new_id = await create_tweets(2)
+    reader = await get_reader()
+
+    async with async_session_maker() as session:
+        for _ in range(3):
+            await update_engagement(session, [old_id], 1)
+        await session.commit()
+
+    feed = RankedFeed()
+    async with async_session_maker() as session:
+        ids = await feed.top_ids(session, reader, 100)
+    # более старый твит с лайками выше нового твита без лайков
+    assert ids.index(old_id) < ids.index(new_id)
+    assert feed.misses == 1
+
+    # лайки из канала событий меняют порядок без запроса к БД
+    feed.apply({"type": "like", "tweet_id": new_id, "author_id": 1, "delta": 10})
+    ids = await feed.top_ids(None, reader, 2)
+    assert ids[0] == new_id
+    assert feed.hits == 1
+
+    feed.apply({"type": "delete", "tweet_id": new_id, "author_id": 1})
+    assert new_id not in await feed.top_ids(None, reader, 100)
+
+    feed.apply({"type": "follow", "user_id": 1, "follower_ids": [reader]})
+    assert len(feed) == 0
+    assert feed.stats()["tweets"] == 0
+
+
+async def test_api_ranked_feed():
+    await create_tweets(3)
+    reader = await get_reader()
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get("/api/tweets", headers={"api-key": APIKEYS[reader]})
+        chronological = response.json()["tweets"]
+        assert [t["id"] for t in chronological] == sorted(
+            (t["id"] for t in chronological), reverse=True
+        )
+
+        response = await ac.get(
+            "/api/tweets?mode=ranked&limit=2", headers={"api-key": APIKEYS[reader]}
+        )
+        assert response.status_code == 200
+        ranked = response.json()["tweets"]
+        assert len(ranked) == 2
+        by_id = {t["id"]: t for t in chronological}
+        assert all(by_id[t["id"]] == t for t in ranked)
+
+        response = await ac.get(
+            "/api/tweets?mode=popular", headers={"api-key": APIKEYS[reader]}
+        )
+        assert response.status_code == 422
+
+        response = await ac.get("/api/tweets?mode=ranked")
+        assert response.status_code == 403
@@ -0,0 +1,131 @@
+from httpx import AsyncClient
+from sqlalchemy import insert, delete, or_
+
+from main import app
+from models.models import Users, Followers
+from utils.users import batch_follow_users
+from .conftest import APIKEYS, async_session_maker
+
+
+FOLLOWERS = 7
+
+
+async def test_profile_counts_match_lists():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        for idx in range(1, 4):
+            full = (await ac.get(f"/api/users/{idx}")).json()["user"]
+            assert full["followers_count"] == len(full["followers"])
+            assert full["following_count"] == len(full["following"])
+
+            response = await ac.get(f"/api/users/{idx}?fields=counts")
+            assert response.status_code == 200
+            counts = response.json()["user"]
+            assert "followers" not in counts and "following" not in counts
+            assert counts["followers_count"] == full["followers_count"]
+            assert counts["following_count"] == full["following_count"]
+
+        response = await ac.get(
+            "/api/users/me?fields=counts", headers={"api-key": APIKEYS[1]}
+        )
+        assert response.json()["user"]["id"] == 1
+        assert "followers" not in response.json()["user"]
+
+        response = await ac.get("/api/users/1?fields=all")
+        assert response.status_code == 422
+
+
+async def test_follow_lists_pagination():
+    async with async_session_maker() as session:
+        ids = (
+            await session.scalars(
+                insert(Users)
+                .values(
+                    [
+                        {"name": f"page_user_{n}", "email": f"page_{n}@test"}
+                        for n in range(FOLLOWERS + 1)
+                    ]
+                )
+                .returning(Users.id)
+            )
+        ).all()
+        await session.commit()
+    owner, others = ids[0], ids[1:]
+
+    try:
+        async with async_session_maker() as session:
+            result = await batch_follow_users(session, owner, others)
+            assert all(item["result"] for item in result["items"])
+
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            pages, cursor = [], 0
+            while cursor is not None:
+                response = await ac.get(
+                    f"/api/users/{owner}/followers?limit=3&after_id={cursor}"
+                )
+                assert response.status_code == 200
+                page = response.json()
+                assert page["count"] == FOLLOWERS
+                pages.append(page["users"])
+                cursor = page["next_cursor"]
+
+            assert [len(users) for users in pages] == [3, 3, 1]
+            listed = [user["user_id"] for users in pages for user in users]
+            assert listed == sorted(others)
+            assert pages[0][0]["name"] == "page_user_1"
+
+            response = await ac.get(f"/api/users/{others[0]}/following")
+            page = response.json()
+            assert page["count"] == 1
+            assert [user["user_id"] for user in page["users"]] == [owner]
+            assert page["next_cursor"] is None
+
+            response = await ac.get("/api/users/1000000/followers")
+            assert response.status_code == 404
+
+        async with async_session_maker() as session:
+            await batch_follow_users(session, owner, others[:2], follow=False)
+
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            user = (await ac.get(f"/api/users/{owner}?fields=counts")).json()["user"]
+            assert user["followers_count"] == FOLLOWERS - 2
+            user = (await ac.get(f"/api/users/{others[0]}?fields=counts")).json()
+            assert user["user"]["following_count"] == 0
+    finally:
+        async with async_session_maker() as session:
+            await session.execute(
+                delete(Followers).where(
+                    or_(Followers.user_id.in_(ids), Followers.follower_id.in_(ids))
+                )
+            )
+            await session.execute(delete(Users).where(Users.id.in_(ids)))
+            await session.commit()
+
+
+async def test_my_follow_lists():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get("/api/users/me/following")
+        assert response.status_code == 403
+
+        for path in ("followers", "following"):
+            response = await ac.get(
+                f"/api/users/me/{path}", headers={"api-key": APIKEYS[2]}
+            )
+            assert response.status_code == 200
+            expected = (await ac.get(f"/api/users/2/{path}")).json()
+            assert response.json() == expected
+            profile = (await ac.get("/api/users/2")).json()["user"]
+            assert expected["count"] == len(profile[path])
+            assert sorted(user["id"] for user in expected["users"]) == sorted(
+                user["id"] for user in profile[path]
+            )
+
+
+def test_follow_lists_openapi():
+    # у каждого списка своя операция в документации API
+    paths = app.openapi()["paths"]
+    operations = [
+        paths[f"/api/users/{prefix}/{kind}"]["get"]["operationId"]
+        for prefix in ("me", "{idx}")
+        for kind in ("followers", "following")
+    ]
+    assert len(set(operations)) == 4
@@ -0,0 +1,139 @@
+from httpx import AsyncClient
+from sqlalchemy import select, delete
+
+from main import app
+from models.models import Followers, Jobs
+from utils.etags import etag_matches, make_etag
+from utils.tweets import add_like_to_tweet, delete_like_to_tweet
+from .conftest import APIKEYS, async_session_maker
+
+
+async def get_reader() -> int:
+    async with async_session_maker() as session:
+        return await session.scalar(
+            select(Followers.follower_id).where(Followers.user_id == 1).limit(1)
+        )
+
+
+def test_etag_matches():
+    etag = make_etag("feed", 1, 2)
+    assert etag.startswith('"') and etag != make_etag("feed", 1, 3)
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches('"other"', etag)
+
+
+async def test_feed_etag():
+    reader = await get_reader()
+    headers = {"api-key": APIKEYS[reader]}
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get("/api/tweets", headers=headers)
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+
+        async with async_session_maker() as session:
+            await session.execute(
+                delete(Jobs).where(Jobs.dedup_key == f"last_activity:{reader}")
+            )
+            await session.commit()
+        profile = (await ac.get(f"/api/users/{reader}")).headers["etag"]
+
+        response = await ac.get(
+            "/api/tweets", headers={**headers, "if-none-match": etag}
+        )
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == etag
+
+        # опрос ленты с ответом 304 не меняет активность и ETag профиля
+        async with async_session_maker() as session:
+            assert not await session.scalar(
+                select(Jobs.id).where(Jobs.dedup_key == f"last_activity:{reader}")
+            )
+        response = await ac.get(
+            f"/api/users/{reader}", headers={"if-none-match": profile}
+        )
+        assert response.status_code == 304
+
+        # новый твит автора из ленты
+        response = await ac.post(
+            "/api/tweets",
+            headers={"api-key": APIKEYS[1]},
+            json={"tweet_data": "ETag tweet", "tweet_media_ids": ()},
+        )
+        tweet_id = response.json()["tweet_id"]
+        response = await ac.get(
+            "/api/tweets", headers={**headers, "if-none-match": etag}
+        )
+        assert response.status_code == 200
+        assert tweet_id in [t["id"] for t in response.json()["tweets"]]
+        etag = response.headers["etag"]
+
+        # лайк твита из ленты
+        async with async_session_maker() as session:
+            assert (await add_like_to_tweet(session, 2, tweet_id))["result"]
+        response = await ac.get(
+            "/api/tweets", headers={**headers, "if-none-match": etag}
+        )
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+
+        # ранжированная лента зависит от времени и не кэшируется клиентом
+        response = await ac.get(
+            "/api/tweets?mode=ranked", headers={**headers, "if-none-match": etag}
+        )
+        assert response.status_code == 200
+        assert "etag" not in response.headers
+
+        async with async_session_maker() as session:
+            assert (await delete_like_to_tweet(session, 2, tweet_id))["result"]
+        response = await ac.get(
+            "/api/tweets", headers={**headers, "if-none-match": etag}
+        )
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+
+        await ac.delete(f"/api/tweets/{tweet_id}", headers={"api-key": APIKEYS[1]})
+        response = await ac.get(
+            "/api/tweets", headers={**headers, "if-none-match": etag}
+        )
+        assert response.status_code == 200
+        assert tweet_id not in [t["id"] for t in response.json()["tweets"]]
+
+
+async def test_profile_etag():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get("/api/users/3")
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+
+        response = await ac.get("/api/users/3", headers={"if-none-match": etag})
+        assert response.status_code == 304
+
+        response = await ac.get(
+            "/api/users/3?fields=counts", headers={"if-none-match": etag}
+        )
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+
+        response = await ac.get(
+            "/api/users/me", headers={"api-key": APIKEYS[3], "if-none-match": etag}
+        )
+        assert response.status_code == 304
+
+        # подписка меняет версию профиля обоих пользователей
+        response = await ac.post("/api/users/4/follow", headers={"api-key": APIKEYS[3]})
+        assert response.status_code == 201
+        response = await ac.get("/api/users/3", headers={"if-none-match": etag})
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+
+        await ac.delete("/api/users/4/follow", headers={"api-key": APIKEYS[3]})
+        response = await ac.get("/api/users/3", headers={"if-none-match": etag})
+        assert response.status_code == 200
+
+        response = await ac.get("/api/users/1000000", headers={"if-none-match": "*"})
+        assert response.status_code == 404
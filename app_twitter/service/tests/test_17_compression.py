@@ -0,0 +1,100 @@
+import gzip
+import json
+
+from httpx import AsyncClient
+from sqlalchemy import select
+
+from main import app
+from models.models import Followers
+from utils import compression
+from utils.compression import CODECS, choose_encoding, compressed_cache
+from .conftest import APIKEYS, async_session_maker, SERVICE_KEY
+
+
+async def get_reader() -> int:
+    async with async_session_maker() as session:
+        return await session.scalar(
+            select(Followers.follower_id).where(Followers.user_id == 1).limit(1)
+        )
+
+
+def test_choose_encoding():
+    codecs = {"zstd": None, "br": None, "gzip": None}
+    assert choose_encoding("gzip, deflate", codecs) == "gzip"
+    assert choose_encoding("gzip, br, zstd", codecs) == "zstd"
+    assert choose_encoding("gzip;q=1.0, br;q=0.5", codecs) == "gzip"
+    assert choose_encoding("br;q=0, gzip;q=0", codecs) is None
+    assert choose_encoding("*", codecs) == "zstd"
+    assert choose_encoding("*, zstd;q=0", codecs) == "br"
+    assert choose_encoding("identity", codecs) is None
+    assert choose_encoding(None, codecs) is None
+    assert choose_encoding("br", {"gzip": None}) is None
+
+
+async def test_feed_compression(monkeypatch):
+    monkeypatch.setattr(compression, "COMPRESSION_MIN_SIZE", 100)
+    reader = await get_reader()
+    headers = {"api-key": APIKEYS[reader]}
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        plain = await ac.get("/api/tweets", headers={**headers, "accept-encoding": ""})
+        assert "content-encoding" not in plain.headers
+        assert plain.headers["vary"] == "Accept-Encoding"
+        assert len(plain.content) >= 100
+
+        response = await ac.get(
+            "/api/tweets", headers={**headers, "accept-encoding": "gzip"}
+        )
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.json() == plain.json()
+        assert int(response.headers["content-length"]) < len(plain.content)
+        assert response.headers["etag"] == f"W/{plain.headers['etag']}"
+
+        # слабый ETag сжатого ответа подходит для If-None-Match
+        response = await ac.get(
+            "/api/tweets",
+            headers={**headers, "if-none-match": response.headers["etag"]},
+        )
+        assert response.status_code == 304
+
+        # повторное сжатие той же версии ленты берется из кэша
+        hits = compressed_cache.hits
+        await ac.get("/api/tweets", headers={**headers, "accept-encoding": "gzip"})
+        assert compressed_cache.hits == hits + 1
+
+        for encoding in CODECS:
+            response = await ac.get(
+                "/api/tweets", headers={**headers, "accept-encoding": encoding}
+            )
+            assert response.headers["content-encoding"] == encoding
+            if encoding == "zstd":
+                # httpx не распаковывает zstd
+                body = compression.zstandard.ZstdDecompressor().decompress(
+                    response.content
+                )
+                assert json.loads(body) == plain.json()
+            else:
+                assert response.json() == plain.json()
+
+        response = await ac.get(
+            "/api/service/compression", headers={"api-key": SERVICE_KEY}
+        )
+        assert "gzip" in response.json()["encodings"]
+
+
+async def test_compression_thresholds(monkeypatch):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get("/api/users/1?fields=counts")
+        assert len(response.content) < compression.COMPRESSION_MIN_SIZE
+        assert "content-encoding" not in response.headers
+
+        response = await ac.get("/api/tweets")
+        assert response.status_code == 403
+        assert "content-encoding" not in response.headers
+
+    # большие тела сжимаются в пуле потоков
+    monkeypatch.setattr(compression, "COMPRESSION_THREAD_MIN_SIZE", 0)
+    body = b'{"tweets": []}' * 1000
+    compressed = await compression.compress_body(body, "gzip")
+    assert gzip.decompress(compressed) == body
@@ -0,0 +1,79 @@
+import json
+
+from httpx import AsyncClient
+from sqlalchemy import select
+
+from main import app
+from models.models import Followers
+from utils.streaming import json_object_stream
+from utils.tweets import stream_tweets_list, tweets_list
+from .conftest import APIKEYS, async_session_maker
+
+
+async def get_reader() -> int:
+    async with async_session_maker() as session:
+        return await session.scalar(
+            select(Followers.follower_id).where(Followers.user_id == 1).limit(1)
+        )
+
+
+async def chunks_of(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+async def collect(stream) -> bytes:
+    return b"".join([part async for part in stream])
+
+
+async def test_json_object_stream():
+    body = await collect(json_object_stream({"result": True}, "items", chunks_of()))
+    assert json.loads(body) == {"result": True, "items": []}
+
+    body = await collect(
+        json_object_stream(
+            {"result": True}, "items", chunks_of([1, {"a": "б"}], [], [None])
+        )
+    )
+    assert body == '{"result":true,"items":[1,{"a":"б"},null]}'.encode()
+
+    body = await collect(json_object_stream({}, "items", chunks_of([1])))
+    assert json.loads(body) == {"items": [1]}
+
+
+async def test_stream_tweets_list_chunks():
+    reader = await get_reader()
+    async with async_session_maker() as session:
+        expected = await tweets_list(session, reader)
+    assert len(expected) > 2
+
+    async with async_session_maker() as session:
+        chunks = [
+            chunk async for chunk in stream_tweets_list(session, reader, chunk_size=2)
+        ]
+    assert all(len(chunk) <= 2 for chunk in chunks)
+    assert [tweet for chunk in chunks for tweet in chunk] == expected
+
+
+async def test_api_streamed_feed():
+    reader = await get_reader()
+    headers = {"api-key": APIKEYS[reader]}
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get("/api/tweets", headers=headers)
+        expected = response.json()
+
+        response = await ac.get("/api/tweets?stream=true", headers=headers)
+        assert response.status_code == 200
+        assert "content-length" not in response.headers
+        assert response.headers["content-type"] == "application/json"
+        assert response.json() == expected
+
+        response = await ac.get(
+            "/api/tweets?stream=true",
+            headers={**headers, "if-none-match": response.headers["etag"]},
+        )
+        assert response.status_code == 304
+
+        response = await ac.get("/api/tweets?stream=true")
+        assert response.status_code == 403
@@ -0,0 +1,180 @@
+import json
+
+from httpx import AsyncClient
+from sqlalchemy import select, delete, func, or_
+
+from main import app
+from models.models import Users, Tweets, Likes, Followers, Media, Jobs
+from models.models import TweetTags, TweetMentions
+from utils.export import import_account
+from utils.tweets import add_like_to_tweet
+from utils.users import recount_follow_counters
+from .conftest import APIKEYS, async_session_maker
+
+
+async def lines_of(records):
+    for record in records:
+        yield record
+
+
+async def export_records(user_idx: int) -> list:
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get(
+            "/api/users/me/export", headers={"api-key": APIKEYS[user_idx]}
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        return [json.loads(line) for line in response.text.splitlines()]
+
+
+async def test_export_import_account():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.post(
+            "/api/tweets",
+            headers={"api-key": APIKEYS[1]},
+            json={
+                "tweet_data": "Export #backup for @User_name_2",
+                "tweet_media_ids": (),
+            },
+        )
+        own_tweet = response.json()["tweet_id"]
+        response = await ac.get("/api/users/me/export")
+        assert response.status_code == 403
+
+    async with async_session_maker() as session:
+        assert (await add_like_to_tweet(session, 1, own_tweet))["result"]
+        other_tweet = await session.scalar(
+            select(Tweets.id).where(Tweets.user_id != 1).limit(1)
+        )
+        assert (await add_like_to_tweet(session, 1, other_tweet))["result"]
+
+    records = await export_records(1)
+    assert records[0]["type"] == "user" and records[0]["id"] == 1
+    assert "apikey" not in records[0]
+    by_type = dict()
+    for record in records:
+        by_type.setdefault(record["type"], []).append(record)
+
+    async with async_session_maker() as session:
+        tweets = await session.scalar(
+            select(func.count(Tweets.id)).where(Tweets.user_id == 1)
+        )
+        likes = await session.scalar(
+            select(func.count(Likes.id)).where(Likes.user_id == 1)
+        )
+        follows = await session.scalar(
+            select(func.count(Followers.id)).where(
+                or_(Followers.user_id == 1, Followers.follower_id == 1)
+            )
+        )
+        source = await session.get(Users, 1)
+    assert len(by_type["tweet"]) == tweets
+    assert len(by_type["like"]) == likes
+    assert len(by_type["follow"]) == follows
+
+    lines = [json.dumps(record) for record in records]
+    async with async_session_maker() as session:
+        result = await import_account(
+            session,
+            lines_of(lines),
+            name="export_copy",
+            email="export_copy@test",
+            chunk_size=2,
+        )
+    assert result["result"], result
+    user_id = result["user_id"]
+
+    try:
+        assert result["tweets"] == tweets
+        assert result["likes"] == likes
+        assert result["follows"] == follows
+
+        async with async_session_maker() as session:
+            user = await session.get(Users, user_id)
+            assert user.name == "export_copy" and user.apikey is None
+            assert user.followers_count == source.followers_count
+            assert user.following_count == source.following_count
+
+            contents = (
+                await session.scalars(
+                    select(Tweets.tweetdata)
+                    .where(Tweets.user_id == user_id)
+                    .order_by(Tweets.id)
+                )
+            ).all()
+            assert contents == [record["content"] for record in by_type["tweet"]]
+
+            # лайк своего твита связан с новым твитом, чужого - с тем же твитом
+            liked = (
+                await session.execute(
+                    select(Tweets.user_id, Tweets.tweetdata, Tweets.likes_count)
+                    .join(Likes, Likes.tweet_id == Tweets.id)
+                    .where(Likes.user_id == user_id)
+                )
+            ).all()
+            assert (user_id, "Export #backup for @User_name_2", 1) in liked
+            assert (
+                other_tweet
+                in (
+                    await session.scalars(
+                        select(Likes.tweet_id).where(Likes.user_id == user_id)
+                    )
+                ).all()
+            )
+
+            # хэштеги и упоминания новых твитов проиндексированы
+            tagged = (
+                await session.scalars(
+                    select(TweetTags.tweet_id)
+                    .join(Tweets, Tweets.id == TweetTags.tweet_id)
+                    .where(TweetTags.tag == "backup", Tweets.user_id == user_id)
+                )
+            ).all()
+            assert len(tagged) == 1
+            mentioned = await session.scalar(
+                select(func.count(TweetMentions.id)).where(
+                    TweetMentions.tweet_id == tagged[0]
+                )
+            )
+            assert mentioned == 1
+
+        # повторная загрузка: пользователь уже существует
+        async with async_session_maker() as session:
+            again = await import_account(
+                session, lines_of(lines), name="export_copy", email="other@test"
+            )
+        assert not again["result"] and again["error_type"] == "Import error"
+
+        async with async_session_maker() as session:
+            bad = await import_account(session, lines_of(lines[1:]))
+        assert not bad["result"]
+        async with async_session_maker() as session:
+            assert (
+                await session.scalar(
+                    select(func.count(Tweets.id)).where(Tweets.user_id == user_id)
+                )
+                == tweets
+            )
+    finally:
+        async with async_session_maker() as session:
+            tweet_ids = select(Tweets.id).where(Tweets.user_id == user_id)
+            await session.execute(
+                delete(Likes)
+                .where(or_(Likes.user_id == user_id, Likes.tweet_id.in_(tweet_ids)))
+                .execution_options(synchronize_session=False)
+            )
+            await session.execute(delete(Media).where(Media.uploader == user_id))
+            await session.execute(delete(Tweets).where(Tweets.user_id == user_id))
+            await session.execute(
+                delete(Followers).where(
+                    or_(Followers.user_id == user_id, Followers.follower_id == user_id)
+                )
+            )
+            await session.execute(delete(Users).where(Users.id == user_id))
+            await session.execute(
+                delete(Jobs).where(
+                    Jobs.kind.in_(("recommendations", "recommendations_all"))
+                )
+            )
+            await recount_follow_counters(session)
+            await session.commit()
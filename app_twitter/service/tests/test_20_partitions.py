@@ -0,0 +1,210 @@
+import datetime
+import gzip
+
+from sqlalchemy import select, insert, delete, func, text
+from sqlalchemy.engine.default import DefaultDialect
+
+from models.models import Tweets, Likes, TweetTags, Media, Followers
+from utils import partitions, tweets
+from utils.partitions import (
+    ensure_partitions,
+    archive_partitions,
+    list_partitions,
+    month_start,
+    add_months,
+    partition_name,
+)
+from utils.tweets import add_tweet, add_like_to_tweet, delete_tweet
+from utils.tweets import tweets_list, check_tweet_exists, feed_since, FEED_TWEETS
+from utils.users import check_user_exists
+from utils.etags import feed_etag
+from .conftest import async_session_maker, engine_test
+
+
+def test_add_months():
+    month = datetime.date(2024, 11, 1)
+    assert add_months(month, 1) == datetime.date(2024, 12, 1)
+    assert add_months(month, 2) == datetime.date(2025, 1, 1)
+    assert add_months(month, -11) == datetime.date(2023, 12, 1)
+    assert month_start(datetime.datetime(2024, 2, 29, 12)) == datetime.date(2024, 2, 1)
+    assert partition_name("tweets", month) == "tweets_p202411"
+
+
+async def test_ensure_partitions():
+    current = month_start(datetime.date.today())
+    since = add_months(current, -2)
+
+    async with async_session_maker() as session:
+        result = await ensure_partitions(session, months_ahead=4, since=since)
+        await session.commit()
+    assert result["result"]
+    # секции текущего месяца и трех следующих создаются вместе с таблицами
+    assert partition_name("tweets", current) not in result["created"]
+    assert partition_name("tweets", since) in result["created"]
+    assert partition_name("likes", add_months(current, 4)) in result["created"]
+
+    async with async_session_maker() as session:
+        assert (await ensure_partitions(session, months_ahead=4))["created"] == []
+        partitions = await list_partitions(session, "tweets")
+        assert partition_name("tweets", since) in partitions
+        assert "tweets_default" not in partitions
+
+        # запрос за месяц читает только секцию этого месяца
+        plan = "\n".join(
+            (
+                await session.scalars(
+                    text(
+                        "EXPLAIN SELECT id FROM tweets "
+                        "WHERE created_on >= :start AND created_on < :end"
+                    ),
+                    {"start": current, "end": add_months(current, 1)},
+                )
+            ).all()
+        )
+    assert partition_name("tweets", current) in plan
+    assert partition_name("tweets", since) not in plan
+
+
+async def test_feed_window(monkeypatch):
+    old = datetime.datetime.now() - datetime.timedelta(days=200)
+    async with async_session_maker() as session:
+        await ensure_partitions(session, since=old)
+        await session.commit()
+        follower_id = await session.scalar(
+            select(Followers.follower_id).where(Followers.user_id == 1).limit(1)
+        )
+
+    async with async_session_maker() as session:
+        tweet_id = await add_tweet(session, 1, "Tweet out of feed window", ())
+        await session.execute(
+            Tweets.__table__.update()
+            .where(Tweets.id == tweet_id)
+            .values(created_on=old)
+        )
+        await session.commit()
+
+    # по умолчанию лента читает всю историю
+    async with async_session_maker() as session:
+        assert tweet_id in [
+            tweet["id"] for tweet in await tweets_list(session, follower_id)
+        ]
+        user = await check_user_exists(session, user_id=follower_id)
+        etag = await feed_etag(session, user, feed_since())
+
+    # лента читает только секции окна, твит по id находится во всех секциях
+    monkeypatch.setattr(tweets, "FEED_WINDOW_DAYS", 90)
+    async with async_session_maker() as session:
+        feed = await tweets_list(session, follower_id)
+        assert feed and tweet_id not in [tweet["id"] for tweet in feed]
+        assert await check_tweet_exists(session, tweet_id)
+        # сдвиг окна меняет ETag ленты без изменения версий авторов
+        assert await feed_etag(session, user, feed_since()) != etag
+        assert await feed_etag(session, user, feed_since(91)) != (
+            await feed_etag(session, user, feed_since())
+        )
+
+        named = DefaultDialect(paramstyle="named")
+        plan = "\n".join(
+            (
+                await session.scalars(
+                    text(f"EXPLAIN {FEED_TWEETS.compile(dialect=named)}"),
+                    {"user_idx": follower_id, "since": feed_since()},
+                )
+            ).all()
+        )
+    assert partition_name("tweets", month_start(datetime.date.today())) in plan
+    assert partition_name("tweets", month_start(old)) not in plan
+
+    async with async_session_maker() as session:
+        assert (await delete_tweet(session, 1, tweet_id))["result"]
+
+
+async def test_archive_partitions(tmp_path, monkeypatch):
+    old = datetime.datetime.now() - datetime.timedelta(days=800)
+    old_month = month_start(old)
+    name = partition_name("tweets", old_month)
+    monkeypatch.setattr(partitions, "FILES_DIR", tmp_path.joinpath("media"))
+    tmp_path.joinpath("media").mkdir()
+    tmp_path.joinpath("media", "archived.jpg").write_bytes(b"jpg")
+
+    async with async_session_maker() as session:
+        assert name in (await ensure_partitions(session, since=old))["created"]
+        await session.commit()
+
+    async with async_session_maker() as session:
+        tweet_id = await add_tweet(session, 1, "Archived #oldtag tweet", ())
+        live_id = await add_tweet(session, 1, "Live tweet", ())
+        await session.execute(
+            Tweets.__table__.update()
+            .where(Tweets.id == tweet_id)
+            .values(created_on=old)
+        )
+        session.add(Media(filepath="archived.jpg", tweet_id=tweet_id, uploader=1))
+        await session.commit()
+    # лайк архивируемого твита - в секции текущего месяца,
+    # старый лайк живого твита - в старой секции лайков
+    async with async_session_maker() as session:
+        assert (await add_like_to_tweet(session, 2, tweet_id))["result"]
+        await session.execute(
+            insert(Likes).values(user_id=3, tweet_id=live_id, created_on=old)
+        )
+        await session.commit()
+
+    result = await archive_partitions(
+        engine_test, after_months=12, archive_dir=tmp_path
+    )
+    path = tmp_path.joinpath(f"{name}.csv.gz")
+    assert str(path) in result["archived"]
+    assert 1 in result["authors"]
+
+    with gzip.open(path, "rt") as archive:
+        lines = archive.read().splitlines()
+    assert lines[0].startswith("id,tweetdata,created_on")
+    assert any("Archived #oldtag tweet" in line for line in lines[1:])
+    with gzip.open(tmp_path.joinpath(f"{name}_likes.csv.gz"), "rt") as archive:
+        lines = archive.read().splitlines()
+    assert len(lines) == 2 and lines[1].endswith(f",2,{tweet_id}")
+    assert tmp_path.joinpath(f"{name}_media", "archived.jpg").read_bytes() == b"jpg"
+    assert not tmp_path.joinpath("media", "archived.jpg").exists()
+
+    async with async_session_maker() as session:
+        assert await session.get(Tweets, tweet_id) is None
+        assert name not in await list_partitions(session, "tweets")
+        for model in (Likes, TweetTags, Media):
+            assert not await session.scalar(
+                select(func.count(model.id)).where(model.tweet_id == tweet_id)
+            )
+        # лайки живых твитов не архивируются, их старая секция остается
+        assert await session.scalar(
+            select(func.count(Likes.id)).where(Likes.tweet_id == live_id)
+        )
+        likes_name = partition_name("likes", old_month)
+        assert likes_name in await list_partitions(session, "likes")
+        # секции текущего месяца не архивируются
+        current = partition_name("tweets", month_start(datetime.date.today()))
+        assert current in await list_partitions(session, "tweets")
+
+        await session.execute(delete(Likes).where(Likes.tweet_id == live_id))
+        await session.commit()
+
+    # пустая старая секция лайков удаляется
+    await archive_partitions(engine_test, after_months=12, archive_dir=tmp_path)
+    async with async_session_maker() as session:
+        assert likes_name not in await list_partitions(session, "likes")
+
+
+async def test_delete_liked_tweet():
+    async with async_session_maker() as session:
+        tweet_id = await add_tweet(session, 1, "Liked #partitioned tweet", ())
+    async with async_session_maker() as session:
+        assert (await add_like_to_tweet(session, 1, tweet_id))["result"]
+
+    async with async_session_maker() as session:
+        assert (await delete_tweet(session, 1, tweet_id))["result"]
+    async with async_session_maker() as session:
+        assert not await session.scalar(
+            select(func.count(Likes.id)).where(Likes.tweet_id == tweet_id)
+        )
+        assert not await session.scalar(
+            select(func.count(TweetTags.id)).where(TweetTags.tweet_id == tweet_id)
+        )
@@ -0,0 +1,261 @@
+import asyncio
+import datetime
+import json
+
+import asyncpg
+import pytest_asyncio
+
+from httpx import AsyncClient
+from sqlalchemy import select, func, text
+from sqlalchemy.pool import NullPool
+
+from config import get_settings
+from models import sharding
+from models.database import ASYNCPG_DSN
+from models.models import Tweets, Likes, Followers
+from models.sharding import HashRing, ShardSessionMaker
+from utils.sharding import init_shards, rebalance, sequence_start, locate_tweet
+from utils.tweets import add_tweet, tweets_list, add_like_to_tweet
+from utils.tweets import delete_like_to_tweet, delete_tweet, check_tweet_exists
+from utils.tweets import ranked_tweets_list, tweets_by_ids
+from utils.tags import tag_tweet_ids, mention_tweet_ids
+from utils.ranking import ranked_feed
+from utils.events import EventBroker
+from utils.export import export_account
+from utils.partitions import maintain_partitions, list_partitions, ensure_partitions
+from utils.partitions import partition_name, month_start, add_months
+from main import app
+from .conftest import async_session_maker, APIKEYS
+
+
+SHARD_DBS = ["tw_shard0", "tw_shard1", "tw_shard2"]
+STRIDE = 64
+
+settings = get_settings()
+
+
+def test_ring_add_node_moves_only_to_new_node():
+    keys = range(1, 10001)
+    before = HashRing(["shard0", "shard1", "shard2"])
+    after = HashRing(["shard0", "shard1", "shard2", "shard3"])
+
+    moved = [key for key in keys if before.node_for(key) != after.node_for(key)]
+    assert all(after.node_for(key) == "shard3" for key in moved)
+    # примерно 1/4 ключей, при перехэшировании по модулю - около 3/4
+    assert 0.15 < len(moved) / len(keys) < 0.35
+
+
+def test_ring_remove_node_moves_only_its_keys():
+    keys = range(1, 10001)
+    before = HashRing(["shard0", "shard1", "shard2"])
+    after = HashRing(["shard0", "shard2"])
+
+    for key in keys:
+        if before.node_for(key) != "shard1":
+            assert after.node_for(key) == before.node_for(key)
+
+
+def test_ring_balance():
+    ring = HashRing([f"shard{idx}" for idx in range(4)])
+    counts = dict()
+    for key in range(1, 20001):
+        node = ring.node_for(key)
+        counts[node] = counts.get(node, 0) + 1
+    assert min(counts.values()) > 20000 / 4 * 0.8
+    assert max(counts.values()) < 20000 / 4 * 1.2
+
+
+def test_sequence_start():
+    assert sequence_start(0, 1, 64) == 1
+    assert sequence_start(1, 1, 64) == 65
+    assert sequence_start(100, 2, 64) == 130
+    assert sequence_start(129, 2, 64) == 130
+    assert sequence_start(130, 0, 64) == 192
+
+
+def shard_dsn(name: str) -> str:
+    return settings.database_dsn.rsplit("/", 1)[0] + f"/{name}"
+
+
+@pytest_asyncio.fixture
+async def shards(monkeypatch):
+    conn = await asyncpg.connect(settings.database_dsn)
+    try:
+        for name in SHARD_DBS:
+            await conn.execute(f'DROP DATABASE IF EXISTS "{name}"')
+            await conn.execute(f'CREATE DATABASE "{name}"')
+    finally:
+        await conn.close()
+
+    shard_sessions = ShardSessionMaker(
+        [shard_dsn(name) for name in SHARD_DBS[:2]], poolclass=NullPool
+    )
+    monkeypatch.setattr(sharding, "shard_sessions", shard_sessions)
+    yield shard_sessions
+    await shard_sessions.dispose()
+
+
+async def shard_tweets(shards: ShardSessionMaker) -> dict:
+    async def rows(session, name):
+        return (await session.execute(select(Tweets.id, Tweets.user_id))).all()
+
+    return {
+        name: {tweet_id: user_id for tweet_id, user_id in rows}
+        for name, rows in (await shards.scatter(rows)).items()
+    }
+
+
+async def test_sharded_tweets(shards):
+    result = await init_shards(shards, async_session_maker, stride=STRIDE)
+    assert result["result"]
+
+    tweet_ids = dict()
+    for user_id in (1, 2, 3):
+        async with async_session_maker() as session:
+            primary_total = await session.scalar(select(func.count(Tweets.id)))
+            tweet_ids[user_id] = await add_tweet(
+                session, user_id, f"Sharded #tweet of @User_name_1 by {user_id}", ()
+            )
+            assert await session.scalar(select(func.count(Tweets.id))) == primary_total
+
+    # твит на шарде автора, остаток id задан номером шарда
+    placed = await shard_tweets(shards)
+    for user_id, tweet_id in tweet_ids.items():
+        name = shards.shard_for(user_id)
+        assert placed[name][tweet_id] == user_id
+        assert tweet_id % STRIDE == shards.names.index(name) + 1
+        assert await locate_tweet(tweet_id) == (name, user_id)
+
+    # лента собирается со всех шардов, новые твиты первыми
+    async with async_session_maker() as session:
+        followed = set(
+            await session.scalars(
+                select(Followers.user_id).where(Followers.follower_id == 3)
+            )
+        )
+        feed = await tweets_list(session, 3)
+    assert 1 in followed
+    expected = [tweet_ids[user_id] for user_id in (3, 2, 1) if user_id in followed]
+    assert [tweet["id"] for tweet in feed] == expected
+
+    # хэштеги и упоминания - на шардах авторов, страницы собираются со всех шардов
+    async with async_session_maker() as session:
+        ids = await tag_tweet_ids(session, "tweet", None, 10)
+        assert ids == sorted(tweet_ids.values(), reverse=True)
+        assert await tag_tweet_ids(session, "tweet", ids[0], 10) == ids[1:]
+        assert await mention_tweet_ids(session, 1, None, 10) == ids
+        assert [tweet["id"] for tweet in await tweets_by_ids(session, ids)] == ids
+
+        ranked_feed.invalidate(3)
+        ranked = await ranked_tweets_list(session, 3, 10)
+    assert sorted(tweet["id"] for tweet in ranked) == sorted(expected)
+
+    # событие лайка доставляется подписчикам автора: автор твита - с шарда
+    broker = EventBroker()
+    connected = asyncio.Event()
+    broker.connect_callbacks.append(lambda ok: ok and connected.set())
+    sub = broker.subscribe(3, {1})
+    broker.start(ASYNCPG_DSN)
+    try:
+        await asyncio.wait_for(connected.wait(), 5)
+        async with async_session_maker() as session:
+            assert (await add_like_to_tweet(session, 3, tweet_ids[1]))["result"]
+        event = await asyncio.wait_for(sub.queue.get(), 5)
+    finally:
+        await broker.stop()
+    assert event == {
+        "type": "like",
+        "tweet_id": tweet_ids[1],
+        "author_id": 1,
+        "delta": 1,
+    }
+    async with shards.for_user(1) as content:
+        assert await content.scalar(
+            select(func.count(Likes.id)).where(Likes.tweet_id == tweet_ids[1])
+        )
+        assert (await content.get(Tweets, tweet_ids[1])).likes_count == 1
+    async with async_session_maker() as session:
+        feed = await tweets_list(session, 3)
+    assert feed[-1]["likes"] == [{"user_id": 3, "name": "User_name_3"}]
+
+    # выгрузка: твиты - с шарда пользователя, лайки - с шардов твитов
+    async with async_session_maker() as session:
+        records = [
+            json.loads(line)
+            async for part in export_account(session, 3)
+            for line in part.splitlines()
+        ]
+    assert tweet_ids[3] in [r["id"] for r in records if r["type"] == "tweet"]
+    assert tweet_ids[1] in [r["tweet_id"] for r in records if r["type"] == "like"]
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.post(
+            "/api/tweets/likes/batch",
+            headers={"api-key": APIKEYS[3]},
+            json={"tweet_ids": [tweet_ids[1]]},
+        )
+    assert response.status_code == 501
+
+    # секции шардов обслуживает задача основной БД
+    future = partition_name("tweets", add_months(month_start(datetime.date.today()), 3))
+    async with shards(shards.names[0]) as content:
+        await content.execute(text(f'DROP TABLE "{future}"'))
+        await content.commit()
+    async with async_session_maker() as session:
+        await maintain_partitions(session, {})
+        await session.commit()
+    async with shards(shards.names[0]) as content:
+        assert future in await list_partitions(content, "tweets")
+
+    async with async_session_maker() as session:
+        assert (await delete_like_to_tweet(session, 3, tweet_ids[1]))["result"]
+        assert (await delete_tweet(session, 2, tweet_ids[2]))["result"]
+        assert not await check_tweet_exists(session, tweet_ids[2])
+        assert await check_tweet_exists(session, tweet_ids[1])
+    async with async_session_maker() as session:
+        feed = await tweets_list(session, 3)
+    assert [tweet["id"] for tweet in feed] == [
+        tweet_id for tweet_id in expected if tweet_id != tweet_ids[2]
+    ]
+    assert feed[-1]["likes"] == []
+
+    # перенос старых твитов: на новом шарде нет секций их месяцев
+    old = datetime.datetime.now() - datetime.timedelta(days=400)
+    for user_id in (1, 3):
+        async with shards.for_user(user_id) as content:
+            await ensure_partitions(content, since=old)
+            await content.execute(
+                Tweets.__table__.update()
+                .where(Tweets.id == tweet_ids[user_id])
+                .values(created_on=old)
+            )
+            await content.commit()
+
+    # третий шард: переносятся только пользователи, которых кольцо отдает ему
+    grown = ShardSessionMaker(
+        [shard_dsn(name) for name in SHARD_DBS], poolclass=NullPool
+    )
+    try:
+        await init_shards(grown, async_session_maker, stride=STRIDE)
+        plan = await rebalance(grown, dry_run=True)
+        result = await rebalance(grown)
+        assert result["users"] == plan["users"]
+        assert all(direction.endswith("->shard2") for direction in result["users"])
+
+        placed = await shard_tweets(grown)
+        for name, tweets in placed.items():
+            assert all(grown.shard_for(user_id) == name for user_id in tweets.values())
+        assert sorted(sum((list(tweets) for tweets in placed.values()), [])) == sorted(
+            [tweet_ids[1], tweet_ids[3]]
+        )
+
+        # удаление третьего шарда возвращает данные на прежние шарды
+        drained = {"drain": grown.session_makers["shard2"]}
+        await rebalance(shards, drained)
+        placed = await shard_tweets(shards)
+        for user_id in (1, 3):
+            assert tweet_ids[user_id] in placed[shards.shard_for(user_id)]
+        async with grown("shard2") as content:
+            assert not await content.scalar(select(func.count(Tweets.id)))
+    finally:
+        await grown.dispose()
@@ -0,0 +1,210 @@
+import gzip
+from collections import OrderedDict
+from typing import Union
+
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import Response
+
+from config import get_settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+settings = get_settings()
+
+COMPRESSION_ENABLED = settings.COMPRESSION_ENABLED
+COMPRESSION_MIN_SIZE = settings.COMPRESSION_MIN_SIZE
+COMPRESSION_THREAD_MIN_SIZE = settings.COMPRESSION_THREAD_MIN_SIZE
+COMPRESSION_CACHE_SIZE = settings.COMPRESSION_CACHE_SIZE
+
+
+def make_codecs(
+    gzip_level: int = settings.COMPRESSION_GZIP_LEVEL,
+    brotli_quality: int = settings.COMPRESSION_BROTLI_QUALITY,
+    zstd_level: int = settings.COMPRESSION_ZSTD_LEVEL,
+) -> dict:
+    """
+    функции сжатия доступных кодировок в порядке предпочтения сервера,
+    brotli и zstd используются, если установлены соответствующие пакеты
+    :return: {кодировка: функция bytes -> bytes}
+    """
+
+    codecs = dict()
+    if zstandard is not None:
+        # ZstdCompressor не потокобезопасен, объект создается на каждый вызов
+        codecs["zstd"] = lambda body: zstandard.ZstdCompressor(
+            level=zstd_level
+        ).compress(body)
+    if brotli is not None:
+        codecs["br"] = lambda body: brotli.compress(
+            body, mode=brotli.MODE_TEXT, quality=brotli_quality
+        )
+    codecs["gzip"] = lambda body: gzip.compress(body, compresslevel=gzip_level, mtime=0)
+    return codecs
+
+
+CODECS = make_codecs()
+
+
+def choose_encoding(accept_encoding: Union[str, None], codecs: dict = None) -> str:
+    """
+    выбор кодировки по заголовку Accept-Encoding: наибольший q среди доступных,
+    при равных q - по порядку предпочтения сервера
+    :param accept_encoding: значение заголовка
+    :param codecs: доступные кодировки
+    :return: кодировка или None - без сжатия
+    """
+
+    codecs = CODECS if codecs is None else codecs
+    if not accept_encoding:
+        return None
+
+    weights = dict()
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0
+        weights[name.strip().lower()] = q
+
+    best, best_q = None, 0
+    for name in codecs:
+        q = weights.get(name, weights.get("*", 0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+class CompressedCache:
+    """
+    сжатые варианты ответов с ETag: повторный запрос той же версии ленты
+    или профиля без If-None-Match не сжимается заново
+    """
+
+    def __init__(self, max_size: int = COMPRESSION_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> Union[bytes, None]:
+        body = self.entries.get(key)
+        if body is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return body
+
+    def put(self, key: tuple, body: bytes) -> None:
+        if self.max_size <= 0:
+            return
+        self.entries[key] = body
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "size_bytes": sum(len(body) for body in self.entries.values()),
+        }
+
+
+compressed_cache = CompressedCache()
+
+
+async def compress_body(body: bytes, encoding: str) -> bytes:
+    """
+    сжатие тела ответа, большие тела сжимаются в пуле потоков, чтобы не
+    блокировать цикл событий (zlib, brotli и zstd освобождают GIL)
+    """
+
+    codec = CODECS[encoding]
+    if len(body) >= COMPRESSION_THREAD_MIN_SIZE:
+        return await run_in_threadpool(codec, body)
+    return codec(body)
+
+
+def is_compressible(response: Response) -> bool:
+    """
+    сжимаются только ответы 200 с известной длиной не меньше порога:
+    потоки (Server-Sent Events, файлы) и уже сжатые ответы не изменяются
+    """
+
+    headers = response.headers
+    length = headers.get("content-length")
+    return (
+        response.status_code == 200
+        and "content-encoding" not in headers
+        and length is not None
+        and int(length) >= COMPRESSION_MIN_SIZE
+        and not headers.get("content-type", "").startswith("text/event-stream")
+    )
+
+
+async def compress_response(request: Request, response: Response) -> Response:
+    """
+    сжатие ответа кодировкой, согласованной по Accept-Encoding.
+    ETag сжатого ответа становится слабым: тело отличается байтами, но не содержанием
+    :param request: запрос
+    :param response: ответ приложения
+    :return: исходный или сжатый ответ
+    """
+
+    if not COMPRESSION_ENABLED:
+        return response
+    if response.status_code == 304 and "etag" in response.headers:
+        # ETag 304 совпадает с ETag ответа 200, который получил бы клиент
+        etag = response.headers["etag"]
+        if choose_encoding(request.headers.get("accept-encoding")):
+            if not etag.startswith("W/"):
+                response.headers["etag"] = f"W/{etag}"
+        return response
+    if not is_compressible(response):
+        return response
+    encoding = choose_encoding(request.headers.get("accept-encoding"))
+    if encoding is None:
+        response.headers.append("Vary", "Accept-Encoding")
+        return response
+
+    # тело читается всегда, чтобы ответ приложения был завершен
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    etag = response.headers.get("etag")
+    key = (etag, encoding)
+    compressed = compressed_cache.get(key) if etag else None
+    if compressed is None:
+        compressed = await compress_body(body, encoding)
+        if etag:
+            compressed_cache.put(key, compressed)
+
+    headers = {
+        name: value
+        for name, value in response.headers.items()
+        if name not in ("content-length", "etag")
+    }
+    headers["Content-Encoding"] = encoding
+    headers["Vary"] = "Accept-Encoding"
+    if etag:
+        headers["ETag"] = etag if etag.startswith("W/") else f"W/{etag}"
+    return Response(
+        content=compressed,
+        status_code=response.status_code,
+        headers=headers,
+        background=response.background,
+    )
@@ -0,0 +1,136 @@
+import datetime
+import hashlib
+from typing import Union
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, func, bindparam
+from starlette import status
+from starlette.responses import Response
+
+from models.models import Users, Followers, Tweets
+from .users import PROFILE_VERSION_BY_ID, PROFILE_VERSION_BY_APIKEY
+
+
+# версия ленты: количество авторов и сумма версий их твитов. Версии только
+# растут, поэтому сумма меняется при любом изменении твитов или лайков авторов,
+# изменение набора авторов меняет profile_version читателя
+FEED_VERSION = select(
+    func.count(Users.id), func.coalesce(func.sum(Users.content_version), 0)
+).where(
+    Users.id.in_(
+        select(Followers.user_id).where(Followers.follower_id == bindparam("user_idx"))
+    )
+)
+BUMP_USER_CONTENT_VERSION = (
+    update(Users)
+    .where(Users.id == bindparam("user_id"))
+    .values(content_version=Users.content_version + 1)
+    .execution_options(synchronize_session=False)
+)
+BUMP_AUTHORS_CONTENT_VERSION = (
+    update(Users)
+    .where(
+        Users.id.in_(
+            select(Tweets.user_id).where(
+                Tweets.id.in_(bindparam("tweet_ids", expanding=True))
+            )
+        )
+    )
+    .values(content_version=Users.content_version + 1)
+    .execution_options(synchronize_session=False)
+)
+
+
+def make_etag(*parts) -> str:
+    """
+    строгий ETag из значений, от которых зависит ответ
+    :param parts: значения
+    :return: строка в кавычках
+    """
+
+    digest = hashlib.sha256(":".join(map(str, parts)).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(if_none_match: Union[str, None], etag: str) -> bool:
+    """
+    проверка заголовка If-None-Match, слабые ETag (W/) сравниваются как строгие
+    :param if_none_match: значение заголовка
+    :param etag: текущий ETag ответа
+    :return: True, если клиент уже получил эту версию
+    """
+
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def not_modified(etag: str) -> Response:
+    """
+    ответ 304 без тела
+    """
+
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+
+async def bump_content_version(
+    session: AsyncSession, user_id: int = None, tweet_ids: list = None
+) -> None:
+    """
+    увеличивает версию твитов автора или авторов твитов,
+    выполняется в транзакции вызывающей функции
+    :param session: объект сессии
+    :param user_id: id автора
+    :param tweet_ids: id твитов, версии авторов которых увеличиваются
+    """
+
+    if user_id is not None:
+        await session.execute(BUMP_USER_CONTENT_VERSION, {"user_id": user_id})
+    if tweet_ids:
+        await session.execute(
+            BUMP_AUTHORS_CONTENT_VERSION, {"tweet_ids": list(tweet_ids)}
+        )
+
+
+async def feed_etag(
+    session: AsyncSession, user: dict, since: datetime.datetime = datetime.datetime.min
+) -> str:
+    """
+    ETag хронологической ленты пользователя, считается без выборки твитов
+    :param session: объект сессии
+    :param user: пользователь (id, profile_version)
+    :param since: начало окна ленты (utils.tweets.feed_since): твиты, вышедшие
+    из окна, не меняют версии авторов, но меняют ETag
+    :return: ETag
+    """
+
+    row = (await session.execute(FEED_VERSION, {"user_idx": user["id"]})).one()
+    return make_etag(
+        "feed", user["id"], user["profile_version"], *row, since.isoformat()
+    )
+
+
+async def profile_etag(
+    session: AsyncSession, fields: str, user_id: int = None, apikey: str = None
+) -> Union[str, None]:
+    """
+    ETag профиля пользователя по id или api-key
+    :param session: объект сессии
+    :param fields: full или counts
+    :param user_id: id пользователя
+    :param apikey: ключ авторизации пользователя
+    :return: ETag или None, если пользователь не найден
+    """
+
+    if apikey is not None:
+        res = await session.execute(PROFILE_VERSION_BY_APIKEY, {"apikey": apikey})
+    else:
+        res = await session.execute(PROFILE_VERSION_BY_ID, {"user_id": user_id})
+    row = res.one_or_none()
+    if row is None:
+        return None
+    return make_etag("profile", fields, *row)
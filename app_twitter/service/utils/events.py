@@ -0,0 +1,320 @@
+import asyncio
+import json
+from typing import Union
+
+import asyncpg
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, cast, Text
+
+from config import get_settings
+from logger.logger import logger
+from models.models import Tweets, Followers
+from utils.follow_graph import follow_graph
+
+
+settings = get_settings()
+
+EVENTS_CHANNEL = settings.EVENTS_CHANNEL
+EVENTS_QUEUE_SIZE = settings.EVENTS_QUEUE_SIZE
+EVENTS_MAX_CONNECTIONS = settings.EVENTS_MAX_CONNECTIONS
+EVENTS_KEEPALIVE = settings.EVENTS_KEEPALIVE
+EVENTS_RECONNECT_DELAY = settings.EVENTS_RECONNECT_DELAY
+
+
+class Subscription:
+    """
+    подключение пользователя к потоку событий с ограниченной очередью.
+    При переполнении очереди старые события отбрасываются, а клиент
+    получает событие resync и должен заново запросить ленту
+    """
+
+    __slots__ = ("user_id", "authors", "queue", "overflow")
+
+    def __init__(self, user_id: int, authors: set, maxsize: int = EVENTS_QUEUE_SIZE):
+        self.user_id = user_id
+        self.authors = authors
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.overflow = False
+
+    def put(self, event: dict):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.overflow = True
+        self.queue.put_nowait(event)
+
+
+class EventBroker:
+    """
+    рассылка событий ленты подключенным к воркеру пользователям.
+    События между воркерами передаются через LISTEN/NOTIFY postgres
+    """
+
+    def __init__(self, channel: str = EVENTS_CHANNEL):
+        self.channel = channel
+        # id автора -> подписки пользователей, в ленте которых есть его твиты
+        self.by_author = dict()
+        # id пользователя -> его подписки, для изменения авторов по follow/unfollow
+        self.by_user = dict()
+        self.connections = 0
+        # обработчики всех событий канала (индексы воркера) и состояния подключения
+        self.listeners = []
+        self.connect_callbacks = []
+        self._task = None
+
+    def subscribe(self, user_id: int, authors) -> Union[Subscription, None]:
+        """
+        подключение пользователя
+        :param user_id: id пользователя
+        :param authors: id авторов, твиты которых есть в ленте пользователя
+        :return: подписка, None если превышен лимит подключений воркера
+        """
+
+        if self.connections >= EVENTS_MAX_CONNECTIONS:
+            return None
+
+        sub = Subscription(user_id, set(authors))
+        for author_id in sub.authors:
+            self.by_author.setdefault(author_id, set()).add(sub)
+        self.by_user.setdefault(user_id, set()).add(sub)
+        self.connections += 1
+        return sub
+
+    def _discard(self, index: dict, key: int, sub: Subscription):
+        subs = index.get(key)
+        if subs is None:
+            return
+        subs.discard(sub)
+        if not subs:
+            del index[key]
+
+    def unsubscribe(self, sub: Subscription):
+        for author_id in sub.authors:
+            self._discard(self.by_author, author_id, sub)
+        self._discard(self.by_user, sub.user_id, sub)
+        self.connections -= 1
+
+    def update_authors(self, event: dict):
+        """
+        изменение авторов подписок подписчиков по событию follow/unfollow,
+        остальные события пропускаются
+        :param event: событие с полями user_id (автор) и follower_ids
+        """
+
+        if event.get("type") not in ("follow", "unfollow"):
+            return
+
+        author_id = event["user_id"]
+        for follower_id in event["follower_ids"]:
+            for sub in self.by_user.get(follower_id, ()):
+                if event["type"] == "follow":
+                    sub.authors.add(author_id)
+                    self.by_author.setdefault(author_id, set()).add(sub)
+                else:
+                    sub.authors.discard(author_id)
+                    self._discard(self.by_author, author_id, sub)
+
+    def dispatch(self, event: dict) -> int:
+        """
+        передача события подпискам
+        :param event: событие с полем author_id
+        :return: количество получателей
+        """
+
+        subs = self.by_author.get(event.get("author_id"), ())
+        for sub in subs:
+            sub.put(event)
+        return len(subs)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            event = json.loads(payload)
+            for listener in self.listeners:
+                listener(event)
+            self.update_authors(event)
+            self.dispatch(event)
+        except Exception as err:
+            logger.error(f"Bad event payload {payload}: {err}")
+
+    def _set_connected(self, connected: bool):
+        for callback in self.connect_callbacks:
+            callback(connected)
+
+    async def _listen(self, dsn: str):
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(dsn)
+                await connection.add_listener(self.channel, self._on_notify)
+                logger.info(f"Listening for events on channel {self.channel}")
+                self._set_connected(True)
+                while not connection.is_closed():
+                    await asyncio.sleep(EVENTS_RECONNECT_DELAY)
+            except asyncio.CancelledError:
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+                raise
+            except Exception as err:
+                logger.error(f"Events listener error: {err}")
+            self._set_connected(False)
+            await asyncio.sleep(EVENTS_RECONNECT_DELAY)
+
+    def start(self, dsn: str):
+        """
+        запуск фоновой задачи, принимающей события от всех воркеров
+        :param dsn: строка подключения asyncpg
+        """
+        self._task = asyncio.create_task(self._listen(dsn))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+event_broker = EventBroker()
+
+
+async def publish_event(
+    session: AsyncSession,
+    event_type: str,
+    tweet_id: int,
+    author_id: int = None,
+    delta: int = None,
+):
+    """
+    отправка события ленты в канал postgres, событие доставляется
+    после commit транзакции вызывающей функции
+    :param session: объект сессии
+    :param event_type: тип события: tweet, delete, like
+    :param tweet_id: id твита
+    :param author_id: id автора твита, если не задан - определяется по tweet_id
+    :param delta: изменение количества лайков
+    """
+
+    if author_id is None:
+        author_id = (
+            select(Tweets.user_id).where(Tweets.id == tweet_id).scalar_subquery()
+        )
+
+    fields = ["type", event_type, "tweet_id", tweet_id, "author_id", author_id]
+    if delta is not None:
+        fields += ["delta", delta]
+
+    await session.execute(
+        select(
+            func.pg_notify(EVENTS_CHANNEL, cast(func.json_build_object(*fields), Text))
+        )
+    )
+
+
+async def publish_events(
+    session: AsyncSession, event_type: str, tweet_ids: list, delta: int = None
+):
+    """
+    отправка событий для набора твитов одним запросом
+    :param session: объект сессии
+    :param event_type: тип события
+    :param tweet_ids: список id твитов
+    :param delta: изменение количества лайков
+    """
+
+    if not tweet_ids:
+        return
+
+    fields = ["type", event_type, "tweet_id", Tweets.id, "author_id", Tweets.user_id]
+    if delta is not None:
+        fields += ["delta", delta]
+
+    await session.execute(
+        select(
+            func.pg_notify(EVENTS_CHANNEL, cast(func.json_build_object(*fields), Text))
+        ).where(Tweets.id.in_(tweet_ids))
+    )
+
+
+async def publish_follow_event(
+    session: AsyncSession, event_type: str, user_id: int, follower_ids: list
+):
+    """
+    отправка изменения подписок в канал postgres для индекса подписок воркеров,
+    событие доставляется после commit транзакции вызывающей функции
+    :param session: объект сессии
+    :param event_type: follow или unfollow
+    :param user_id: значение user_id строк followers
+    :param follower_ids: значения follower_id добавленных или удаленных строк
+    """
+
+    if not follower_ids:
+        return
+
+    fields = [
+        "type",
+        event_type,
+        "user_id",
+        user_id,
+        "follower_ids",
+        func.json_build_array(*follower_ids),
+    ]
+    await session.execute(
+        select(
+            func.pg_notify(EVENTS_CHANNEL, cast(func.json_build_object(*fields), Text))
+        )
+    )
+
+
+async def get_feed_author_ids(session: AsyncSession, user_idx: int) -> list:
+    """
+    id авторов, твиты которых попадают в ленту пользователя,
+    из индекса подписок, пока он не загружен - из БД
+    :param session: объект сессии
+    :param user_idx: id пользователя
+    :return: список id
+    """
+
+    if follow_graph.ready:
+        return follow_graph.user_ids(user_idx).tolist()
+
+    res = await session.scalars(
+        select(Followers.user_id).where(Followers.follower_id == user_idx)
+    )
+    return res.all()
+
+
+def format_event(event: dict) -> str:
+    """
+    сообщение в формате Server-Sent Events
+    """
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+async def event_stream(
+    sub: Subscription, broker: EventBroker = None, keepalive: float = None
+):
+    """
+    генератор потока событий для StreamingResponse
+    :param sub: подписка пользователя
+    :param broker: брокер, от которого подписка отключается по завершении
+    :param keepalive: период отправки комментариев для поддержания соединения
+    """
+
+    broker = broker or event_broker
+    keepalive = keepalive or EVENTS_KEEPALIVE
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(sub.queue.get(), keepalive)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+
+            if sub.overflow:
+                sub.overflow = False
+                yield format_event({"type": "resync"})
+            yield format_event(event)
+    finally:
+        broker.unsubscribe(sub)
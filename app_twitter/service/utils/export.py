@@ -0,0 +1,588 @@
+"""
+выгрузка и загрузка данных пользователя в формате NDJSON: одна JSON-запись
+на строку, записи читаются курсором на стороне сервера и загружаются через COPY
+пачками, поэтому память не зависит от количества строк.
+
+Записи выгрузки (поле type), в этом порядке:
+    user   - id, name, email, last_activity (без api-key)
+    tweet  - id, content, created_on, updated_on
+    media  - id, tweet_id, filepath: картинки пользователя (файлы не выгружаются)
+    like   - tweet_id, author (имя автора твита), created_on: лайки пользователя
+    follow - user, follower: имена пользователей строки followers с пользователем
+
+При загрузке создается новый пользователь, твиты получают новые id, лайки
+и подписки связываются с существующими пользователями по имени.
+При шардировании (SHARD_DSNS) твиты и картинки выгружаются с шарда
+пользователя, лайки - со всех шардов, загрузка не поддерживается.
+
+пример запуска из каталога app_twitter/service:
+    python -m utils.export export --user-id 1 --output user_1.ndjson
+    python -m utils.export import user_1.ndjson --name user_1_copy --email copy@test
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import sys
+from typing import AsyncIterable, AsyncIterator, Union
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, or_, bindparam, text
+from sqlalchemy.orm import aliased
+
+from config import get_settings
+from logger.logger import logger
+from models import sharding
+from models.models import Users, Tweets, Likes, Followers, Media
+from .streaming import encode_json
+from .tags import parse_tweet_text
+from .events import publish_follow_event
+from .recommendations import schedule_recommendations_refresh
+from .partitions import ensure_partitions
+
+
+EXPORT_CHUNK_SIZE = get_settings().EXPORT_CHUNK_SIZE
+
+# пользователи из одного события follow в канале событий
+FOLLOW_EVENT_MAX_IDS = 500
+
+Author = aliased(Users)
+Follower = aliased(Users)
+
+EXPORT_USER = select(Users.id, Users.name, Users.email, Users.last_activity).where(
+    Users.id == bindparam("user_idx")
+)
+EXPORT_TWEETS = (
+    select(Tweets.id, Tweets.tweetdata, Tweets.created_on, Tweets.updated_on)
+    .where(Tweets.user_id == bindparam("user_idx"))
+    .order_by(Tweets.id)
+)
+EXPORT_MEDIA = (
+    select(Media.id, Media.tweet_id, Media.filepath)
+    .where(
+        or_(
+            Media.uploader == bindparam("user_idx"),
+            Media.tweet_id.in_(
+                select(Tweets.id).where(Tweets.user_id == bindparam("user_idx"))
+            ),
+        )
+    )
+    .order_by(Media.id)
+)
+EXPORT_LIKES = (
+    select(Likes.tweet_id, Author.name, Likes.created_on)
+    .join(Tweets, Tweets.id == Likes.tweet_id)
+    .join(Author, Author.id == Tweets.user_id)
+    .where(Likes.user_id == bindparam("user_idx"))
+    .order_by(Likes.id)
+)
+EXPORT_FOLLOWS = (
+    select(Author.name, Follower.name)
+    .select_from(Followers)
+    .join(Author, Author.id == Followers.user_id)
+    .join(Follower, Follower.id == Followers.follower_id)
+    .where(
+        or_(
+            Followers.user_id == bindparam("user_idx"),
+            Followers.follower_id == bindparam("user_idx"),
+        )
+    )
+    .order_by(Followers.id)
+)
+
+
+def export_time(value: Union[datetime.datetime, None]) -> Union[str, None]:
+    return value.isoformat() if value else None
+
+
+def import_time(value: Union[str, None]) -> Union[datetime.datetime, None]:
+    return datetime.datetime.fromisoformat(value) if value else None
+
+
+# запись выгрузки из строки каждого запроса и где выполняется запрос при
+# шардировании: user - шард пользователя, shards - все шарды, primary - основная БД
+EXPORT_PARTS = (
+    (
+        EXPORT_TWEETS,
+        lambda row: {
+            "type": "tweet",
+            "id": row.id,
+            "content": row.tweetdata,
+            "created_on": export_time(row.created_on),
+            "updated_on": export_time(row.updated_on),
+        },
+        "user",
+    ),
+    (
+        EXPORT_MEDIA,
+        lambda row: {
+            "type": "media",
+            "id": row.id,
+            "tweet_id": row.tweet_id,
+            "filepath": row.filepath,
+        },
+        "user",
+    ),
+    (
+        EXPORT_LIKES,
+        lambda row: {
+            "type": "like",
+            "tweet_id": row[0],
+            "author": row[1],
+            "created_on": export_time(row[2]),
+        },
+        "shards",
+    ),
+    (
+        EXPORT_FOLLOWS,
+        lambda row: {"type": "follow", "user": row[0], "follower": row[1]},
+        "primary",
+    ),
+)
+
+
+async def export_account(
+    session: AsyncSession, user_idx: int, chunk_size: int = EXPORT_CHUNK_SIZE
+) -> AsyncIterator[bytes]:
+    """
+    выгрузка данных пользователя: все части читаются курсорами в одной
+    транзакции REPEATABLE READ, поэтому выгрузка согласована, а в памяти
+    находится одна пачка строк. При шардировании части с шардов читаются
+    в транзакциях REPEATABLE READ шардов, согласованность - в пределах одной БД
+    :param session: объект сессии, открыт до конца чтения
+    :param user_idx: id пользователя
+    :param chunk_size: строк в пачке
+    :return: асинхронный итератор частей NDJSON
+    """
+
+    async def stream_records(
+        content: AsyncSession, query, make_record
+    ) -> AsyncIterator[bytes]:
+        result = await content.stream(
+            query,
+            {"user_idx": user_idx},
+            execution_options={"yield_per": chunk_size},
+        )
+        async for rows in result.partitions():
+            yield b"".join(encode_json(make_record(row)) + b"\n" for row in rows)
+
+    # снимок читается в новой транзакции
+    await session.commit()
+    await session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+    try:
+        user = (await session.execute(EXPORT_USER, {"user_idx": user_idx})).one()
+        yield encode_json(
+            {
+                "type": "user",
+                "id": user.id,
+                "name": user.name,
+                "email": user.email,
+                "last_activity": export_time(user.last_activity),
+            }
+        ) + b"\n"
+
+        shards = sharding.shard_sessions
+        for query, make_record, place in EXPORT_PARTS:
+            if shards is None or place == "primary":
+                async for part in stream_records(session, query, make_record):
+                    yield part
+                continue
+
+            names = [shards.shard_for(user_idx)] if place == "user" else shards.names
+            for name in names:
+                async with shards(name) as content:
+                    await content.connection(
+                        execution_options={"isolation_level": "REPEATABLE READ"}
+                    )
+                    async for part in stream_records(content, query, make_record):
+                        yield part
+
+        await session.commit()
+
+    except Exception as err:
+        logger.error(err)
+        await session.rollback()
+        raise
+
+
+class AccountImportError(Exception):
+    """
+    выгрузку нельзя загрузить: нет записи пользователя, пользователь с таким
+    именем или email уже существует, неизвестная запись, включено шардирование
+    """
+
+
+# временные таблицы загрузки, удаляются при commit.
+# Пустые user_name, follower_name, author и name - загружаемый пользователь
+IMPORT_TABLES_SQL = (
+    "CREATE TEMP TABLE import_tweet_ids (old_id integer PRIMARY KEY, new_id integer)"
+    " ON COMMIT DROP",
+    "CREATE TEMP TABLE import_media (tweet_id integer, filepath text) ON COMMIT DROP",
+    "CREATE TEMP TABLE import_likes (tweet_id integer, author text, "
+    "created_on timestamp) ON COMMIT DROP",
+    "CREATE TEMP TABLE import_follows (user_name text, follower_name text)"
+    " ON COMMIT DROP",
+    "CREATE TEMP TABLE import_mentions (name text, tweet_id integer) ON COMMIT DROP",
+    "CREATE TEMP TABLE import_new_follows (user_id integer, follower_id integer)"
+    " ON COMMIT DROP",
+)
+IMPORT_COLUMNS = {
+    "tweets": ("id", "tweetdata", "created_on", "updated_on", "user_id"),
+    "import_tweet_ids": ("old_id", "new_id"),
+    "tweet_tags": ("tag", "tweet_id"),
+    "import_mentions": ("name", "tweet_id"),
+    "import_media": ("tweet_id", "filepath"),
+    "import_likes": ("tweet_id", "author", "created_on"),
+    "import_follows": ("user_name", "follower_name"),
+}
+NEXT_TWEET_IDS_SQL = (
+    "SELECT nextval(pg_get_serial_sequence('tweets', 'id')) "
+    "FROM generate_series(1, $1)"
+)
+IMPORT_MEDIA_SQL = """
+INSERT INTO media (filepath, tweet_id, uploader)
+SELECT i.filepath, m.new_id, $1
+FROM import_media i
+LEFT JOIN import_tweet_ids m ON m.old_id = i.tweet_id
+"""
+IMPORT_MENTIONS_SQL = """
+INSERT INTO tweet_mentions (user_id, tweet_id)
+SELECT DISTINCT coalesce(u.id, $1), i.tweet_id
+FROM import_mentions i
+LEFT JOIN users u ON u.name = i.name
+WHERE i.name IS NULL OR u.id IS NOT NULL
+"""
+# лайки своих твитов связываются с новыми id, чужих - с твитами
+# того же автора с тем же id
+IMPORT_LIKES_SQL = """
+INSERT INTO likes (created_on, user_id, tweet_id)
+SELECT min(s.created_on), $1, s.tweet_id
+FROM (
+    SELECT i.created_on, coalesce(m.new_id, t.id) AS tweet_id
+    FROM import_likes i
+    LEFT JOIN import_tweet_ids m ON i.author IS NULL AND m.old_id = i.tweet_id
+    LEFT JOIN users a ON a.name = i.author
+    LEFT JOIN tweets t ON t.id = i.tweet_id AND t.user_id = a.id
+) s
+WHERE s.tweet_id IS NOT NULL
+AND NOT EXISTS (SELECT 1 FROM likes l WHERE l.user_id = $1 AND l.tweet_id = s.tweet_id)
+GROUP BY s.tweet_id
+"""
+IMPORT_FOLLOWS_SQL = """
+WITH inserted AS (
+    INSERT INTO followers (user_id, follower_id)
+    SELECT DISTINCT coalesce(u.id, $1), coalesce(f.id, $1)
+    FROM import_follows i
+    LEFT JOIN users u ON u.name = i.user_name
+    LEFT JOIN users f ON f.name = i.follower_name
+    WHERE (i.user_name IS NULL OR u.id IS NOT NULL)
+    AND (i.follower_name IS NULL OR f.id IS NOT NULL)
+    AND NOT EXISTS (
+        SELECT 1 FROM followers x
+        WHERE x.user_id = coalesce(u.id, $1) AND x.follower_id = coalesce(f.id, $1)
+    )
+    RETURNING user_id, follower_id
+)
+INSERT INTO import_new_follows SELECT user_id, follower_id FROM inserted
+"""
+# счетчики и версии ETag затронутых пользователей и твитов
+IMPORT_RECOUNT_SQL = (
+    """
+    UPDATE users SET
+    followers_count = (SELECT count(*) FROM followers f WHERE f.user_id = users.id),
+    following_count = (SELECT count(*) FROM followers f WHERE f.follower_id = users.id),
+    profile_version = profile_version + 1
+    WHERE id = $1 OR id IN (
+        SELECT user_id FROM import_new_follows
+        UNION SELECT follower_id FROM import_new_follows
+    )
+    """,
+    """
+    UPDATE tweets SET likes_count = c.count
+    FROM (
+        SELECT tweet_id, count(*) AS count FROM likes
+        WHERE tweet_id IN (SELECT tweet_id FROM likes WHERE user_id = $1)
+        GROUP BY tweet_id
+    ) c
+    WHERE tweets.id = c.tweet_id
+    """,
+    """
+    UPDATE users SET content_version = content_version + 1
+    WHERE id = $1 OR id IN (
+        SELECT t.user_id FROM likes l JOIN tweets t ON t.id = l.tweet_id
+        WHERE l.user_id = $1
+    )
+    """,
+)
+# изменения подписок для индекса подписок воркеров, по FOLLOW_EVENT_MAX_IDS
+IMPORT_FOLLOW_EVENTS_SQL = f"""
+SELECT user_id, array_agg(follower_id) AS follower_ids
+FROM (
+    SELECT user_id, follower_id,
+    (row_number() OVER (PARTITION BY user_id ORDER BY follower_id) - 1)
+    / {FOLLOW_EVENT_MAX_IDS} AS part
+    FROM import_new_follows
+) s
+GROUP BY user_id, part
+"""
+
+
+class AccountImporter:
+    """
+    загрузка выгрузки export_account в одной транзакции: твиты, теги и
+    связи старых и новых id твитов записываются через COPY пачками по
+    chunk_size, остальные записи копируются во временные таблицы и
+    переносятся в таблицы приложения запросами INSERT ... SELECT
+    """
+
+    def __init__(
+        self,
+        session: AsyncSession,
+        name: str = None,
+        email: str = None,
+        chunk_size: int = EXPORT_CHUNK_SIZE,
+    ):
+        self.session = session
+        self.name = name
+        self.email = email
+        self.chunk_size = chunk_size
+        self.connection = None
+        self.user_id = None
+        self.source_name = None
+        self.batches = {table: [] for table in IMPORT_COLUMNS}
+        self.counts = {"tweets": 0, "media": 0, "likes": 0, "follows": 0}
+
+    async def copy(self, table: str, force: bool = False):
+        rows = self.batches[table]
+        if rows and (force or len(rows) >= self.chunk_size):
+            await self.connection.copy_records_to_table(
+                table, records=rows, columns=IMPORT_COLUMNS[table]
+            )
+            self.batches[table] = []
+
+    def local_name(self, name: Union[str, None]) -> Union[str, None]:
+        """
+        имя пользователя из выгрузки, None - загружаемый пользователь
+        """
+        return None if name == self.source_name else name
+
+    async def add_user(self, record: dict):
+        if self.user_id is not None:
+            raise AccountImportError("Duplicate user record")
+        self.source_name = record["name"]
+        name = self.name or record["name"]
+        email = self.email or record["email"]
+        exists = await self.connection.fetchval(
+            "SELECT id FROM users WHERE name = $1 OR email = $2", name, email
+        )
+        if exists:
+            raise AccountImportError(f"User {name} <{email}> already exists")
+        self.user_id = await self.connection.fetchval(
+            "INSERT INTO users (name, email, last_activity) VALUES ($1, $2, $3) "
+            "RETURNING id",
+            name,
+            email,
+            import_time(record.get("last_activity")),
+        )
+
+    async def flush_tweets(self):
+        tweets = self.batches["tweets"]
+        if not tweets:
+            return
+        ids = await self.connection.fetch(NEXT_TWEET_IDS_SQL, len(tweets))
+        records = []
+        for (old_id, content, created_on, updated_on), (new_id,) in zip(tweets, ids):
+            records.append((new_id, content, created_on, updated_on, self.user_id))
+            self.batches["import_tweet_ids"].append((old_id, new_id))
+            tags, mentions = parse_tweet_text(content)
+            self.batches["tweet_tags"].extend((tag, new_id) for tag in tags)
+            self.batches["import_mentions"].extend(
+                (self.local_name(name), new_id) for name in mentions
+            )
+        self.batches["tweets"] = records
+        # секции месяцев старых твитов создаются до COPY
+        await self.ensure_partitions(row[2] for row in records)
+        for table in ("tweets", "import_tweet_ids", "tweet_tags", "import_mentions"):
+            await self.copy(table, force=True)
+
+    async def ensure_partitions(self, times):
+        times = [time for time in times if time is not None]
+        if times:
+            await ensure_partitions(self.session, since=min(times))
+
+    async def add(self, record: dict):
+        kind = record.get("type")
+        if kind == "user":
+            return await self.add_user(record)
+        if self.user_id is None:
+            raise AccountImportError("The first record must be the user record")
+
+        if kind == "tweet":
+            self.batches["tweets"].append(
+                (
+                    record["id"],
+                    record["content"],
+                    import_time(record.get("created_on")),
+                    import_time(record.get("updated_on")),
+                )
+            )
+            self.counts["tweets"] += 1
+            if len(self.batches["tweets"]) >= self.chunk_size:
+                await self.flush_tweets()
+        elif kind == "media":
+            self.batches["import_media"].append(
+                (record.get("tweet_id"), record["filepath"])
+            )
+            await self.copy("import_media")
+        elif kind == "like":
+            self.batches["import_likes"].append(
+                (
+                    record["tweet_id"],
+                    self.local_name(record["author"]),
+                    import_time(record.get("created_on")),
+                )
+            )
+            await self.copy("import_likes")
+        elif kind == "follow":
+            self.batches["import_follows"].append(
+                (self.local_name(record["user"]), self.local_name(record["follower"]))
+            )
+            await self.copy("import_follows")
+        else:
+            raise AccountImportError(f"Unknown record type: {kind}")
+
+    async def finish(self):
+        await self.flush_tweets()
+        for table in ("import_media", "import_likes", "import_follows"):
+            await self.copy(table, force=True)
+
+        connection = self.connection
+        await connection.execute(IMPORT_MENTIONS_SQL, self.user_id)
+        status = await connection.execute(IMPORT_MEDIA_SQL, self.user_id)
+        self.counts["media"] = int(status.split()[-1])
+        await self.ensure_partitions(
+            [await connection.fetchval("SELECT min(created_on) FROM import_likes")]
+        )
+        status = await connection.execute(IMPORT_LIKES_SQL, self.user_id)
+        self.counts["likes"] = int(status.split()[-1])
+        status = await connection.execute(IMPORT_FOLLOWS_SQL, self.user_id)
+        self.counts["follows"] = int(status.split()[-1])
+        for query in IMPORT_RECOUNT_SQL:
+            await connection.execute(query, self.user_id)
+
+        async for user_id, follower_ids in connection.cursor(IMPORT_FOLLOW_EVENTS_SQL):
+            await publish_follow_event(self.session, "follow", user_id, follower_ids)
+            await schedule_recommendations_refresh(self.session, user_id)
+
+    async def run(self, lines: AsyncIterable[Union[str, bytes]]) -> dict:
+        """
+        загрузка строк выгрузки, при ошибке транзакция откатывается
+        :param lines: асинхронный итератор строк NDJSON
+        :return: dict результат операции, id пользователя и количество записей
+        """
+
+        try:
+            if sharding.shard_sessions is not None:
+                # COPY загружает твиты и лайки в основную БД, на шардах их не видно
+                raise AccountImportError("Import is not supported with SHARD_DSNS")
+            # запросы COPY и INSERT ... SELECT дольше ограничения времени запроса
+            await self.session.execute(text("SET LOCAL statement_timeout = 0"))
+            raw_connection = await (
+                await self.session.connection()
+            ).get_raw_connection()
+            self.connection = raw_connection.driver_connection
+            for query in IMPORT_TABLES_SQL:
+                await self.connection.execute(query)
+
+            async for line in lines:
+                if line.strip():
+                    await self.add(json.loads(line))
+            if self.user_id is None:
+                raise AccountImportError("The first record must be the user record")
+            await self.finish()
+            await self.session.commit()
+
+        except (AccountImportError, ValueError, KeyError) as err:
+            await self.session.rollback()
+            logger.info(f"Account import failed: {err}")
+            return {
+                "result": False,
+                "error_type": "Import error",
+                "error_message": str(err),
+            }
+
+        except Exception as err:
+            await self.session.rollback()
+            logger.error(err)
+            return {
+                "result": False,
+                "error_type": "DB error",
+                "error_message": "Error when accessing the database.",
+            }
+
+        return {"result": True, "user_id": self.user_id, **self.counts}
+
+
+async def import_account(
+    session: AsyncSession,
+    lines: AsyncIterable[Union[str, bytes]],
+    name: str = None,
+    email: str = None,
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+) -> dict:
+    """
+    загрузка выгрузки export_account новым пользователем
+    :param session: объект сессии
+    :param lines: асинхронный итератор строк NDJSON
+    :param name: имя нового пользователя, по умолчанию из выгрузки
+    :param email: email нового пользователя, по умолчанию из выгрузки
+    :param chunk_size: строк в пачке COPY
+    :return: dict результат операции
+    """
+
+    importer = AccountImporter(session, name, email, chunk_size)
+    return await importer.run(lines)
+
+
+async def read_lines(path: str) -> AsyncIterator[str]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            yield line
+
+
+async def main(args: argparse.Namespace) -> int:
+    from models.database import async_session_maker, engine
+
+    try:
+        async with async_session_maker() as session:
+            if args.command == "export":
+                with open(args.output, "wb") as f:
+                    async for part in export_account(session, args.user_id):
+                        f.write(part)
+                logger.info(f"User id={args.user_id} exported to {args.output}")
+                return 0
+
+            result = await import_account(
+                session, read_lines(args.input), args.name, args.email
+            )
+            logger.info(f"Import {args.input}: {result}")
+            return 0 if result["result"] else 1
+    finally:
+        await engine.dispose()
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="User data export and import")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="export user data to NDJSON")
+    export_parser.add_argument("--user-id", type=int, required=True)
+    export_parser.add_argument("--output", required=True, help="NDJSON file")
+    import_parser = commands.add_parser("import", help="import NDJSON as a new user")
+    import_parser.add_argument("input", help="NDJSON file")
+    import_parser.add_argument("--name", default=None, help="new user name")
+    import_parser.add_argument("--email", default=None, help="new user email")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,254 @@
+import asyncio
+import sys
+import time
+from array import array
+from bisect import bisect_left
+
+from sqlalchemy import select
+
+from config import get_settings
+from logger.logger import logger
+from models.models import Followers
+
+
+settings = get_settings()
+
+FOLLOW_GRAPH_ENABLED = settings.FOLLOW_GRAPH_ENABLED
+FOLLOW_GRAPH_RELOAD_INTERVAL = settings.FOLLOW_GRAPH_RELOAD_INTERVAL
+FOLLOW_GRAPH_LOAD_BATCH = settings.FOLLOW_GRAPH_LOAD_BATCH
+
+EMPTY = array("i")
+
+
+def _add(index: dict, key: int, value: int) -> bool:
+    values = index.get(key)
+    if values is None:
+        index[key] = array("i", (value,))
+        return True
+    pos = bisect_left(values, value)
+    if pos < len(values) and values[pos] == value:
+        return False
+    values.insert(pos, value)
+    return True
+
+
+def _remove(index: dict, key: int, value: int) -> bool:
+    values = index.get(key)
+    if values is None:
+        return False
+    pos = bisect_left(values, value)
+    if pos == len(values) or values[pos] != value:
+        return False
+    del values[pos]
+    if not values:
+        del index[key]
+    return True
+
+
+class FollowGraph:
+    """
+    индекс таблицы followers в памяти воркера: для каждого user_id отсортированный
+    массив follower_id (forward) и обратный индекс follower_id -> user_id (reverse).
+    Проверка пары - бинарный поиск в массиве, количество - длина массива.
+    Индекс загружается из БД после подключения к каналу событий и обновляется
+    событиями follow/unfollow всех воркеров. Пока индекс не загружен (ready=False),
+    вызывающий код выполняет запрос к БД
+    """
+
+    def __init__(self):
+        self.forward = dict()
+        self.reverse = dict()
+        self.edges = 0
+        self.ready = False
+        self.loaded_at = None
+        self.load_seconds = None
+        self.session_maker = None
+        # события, полученные во время загрузки, применяются к загруженному индексу
+        self._pending = None
+        # подключение к каналу терялось после начала загрузки: индекс мог
+        # пропустить события, нужна еще одна загрузка
+        self._stale = False
+        self._load_requested = False
+        self._load_task = None
+        self._reload_task = None
+
+    def has_edge(self, user_id: int, follower_id: int) -> bool:
+        values = self.forward.get(user_id, EMPTY)
+        pos = bisect_left(values, follower_id)
+        return pos < len(values) and values[pos] == follower_id
+
+    def follower_ids(self, user_id: int) -> array:
+        """
+        follower_id строк с заданным user_id
+        """
+        return self.forward.get(user_id, EMPTY)
+
+    def user_ids(self, follower_id: int) -> array:
+        """
+        user_id строк с заданным follower_id
+        """
+        return self.reverse.get(follower_id, EMPTY)
+
+    def _apply(self, forward: dict, reverse: dict, event: dict) -> int:
+        user_id = event["user_id"]
+        change = _add if event["type"] == "follow" else _remove
+        changed = 0
+        for follower_id in event["follower_ids"]:
+            if change(forward, user_id, follower_id):
+                changed += 1
+            change(reverse, follower_id, user_id)
+        return changed if event["type"] == "follow" else -changed
+
+    def apply(self, event: dict):
+        """
+        изменение индекса по событию follow/unfollow, остальные события пропускаются.
+        Повторное применение события не меняет индекс
+        """
+
+        if event.get("type") not in ("follow", "unfollow"):
+            return
+        if self._pending is not None:
+            self._pending.append(event)
+        self.edges += self._apply(self.forward, self.reverse, event)
+
+    async def _load_index(self, key, value) -> dict:
+        index = dict()
+        current_key, values = None, None
+        async with self.session_maker() as session:
+            result = await session.stream(
+                select(key, value)
+                .order_by(key, value)
+                .execution_options(yield_per=FOLLOW_GRAPH_LOAD_BATCH)
+            )
+            async for rows in result.partitions():
+                for row_key, row_value in rows:
+                    if row_key != current_key:
+                        current_key = row_key
+                        values = index[row_key] = array("i")
+                    elif values[-1] == row_value:
+                        continue
+                    values.append(row_value)
+        return index
+
+    async def load(self) -> bool:
+        """
+        загрузка индекса из БД, до окончания загрузки используется прежний индекс
+        :return: результат загрузки
+        """
+
+        started = time.perf_counter()
+        self._stale = False
+        self._pending = []
+        try:
+            forward = await self._load_index(Followers.user_id, Followers.follower_id)
+            reverse = await self._load_index(Followers.follower_id, Followers.user_id)
+            for event in self._pending:
+                self._apply(forward, reverse, event)
+        except Exception as err:
+            logger.error(f"Follow graph load error: {err}")
+            return False
+        finally:
+            self._pending = None
+
+        self.forward, self.reverse = forward, reverse
+        self.edges = sum(len(values) for values in forward.values())
+        self.ready = not self._stale
+        self.loaded_at = time.time()
+        self.load_seconds = round(time.perf_counter() - started, 3)
+        logger.info(
+            f"Follow graph loaded: {len(forward)} users, {self.edges} edges "
+            f"in {self.load_seconds}s"
+        )
+        return True
+
+    def on_connect(self, connected: bool):
+        """
+        состояние подключения к каналу событий: пока подключения нет, события
+        могут быть пропущены, поэтому индекс не используется до перезагрузки
+        """
+
+        if not connected:
+            self._stale = True
+            self.ready = False
+        else:
+            self.reload()
+
+    async def _load_loop(self) -> bool:
+        while True:
+            self._load_requested = False
+            result = await self.load()
+            if not self._load_requested:
+                return result
+
+    def reload(self) -> asyncio.Task:
+        """
+        загрузка индекса в единственной задаче: запрос во время загрузки
+        не запускает параллельную, а повторяет загрузку после текущей
+        :return: задача загрузки
+        """
+
+        if self._load_task is None or self._load_task.done():
+            self._load_task = asyncio.create_task(self._load_loop())
+        else:
+            self._load_requested = True
+        return self._load_task
+
+    async def _reload(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.shield(self.reload())
+
+    def start(self, session_maker, broker):
+        """
+        подключение к брокеру событий: загрузка начинается после подключения
+        брокера к каналу, чтобы не пропустить изменения во время загрузки
+        :param session_maker: фабрика сессий
+        :param broker: брокер событий (utils.events.EventBroker)
+        """
+
+        if not FOLLOW_GRAPH_ENABLED:
+            return
+        self.session_maker = session_maker
+        broker.listeners.append(self.apply)
+        broker.connect_callbacks.append(self.on_connect)
+        if FOLLOW_GRAPH_RELOAD_INTERVAL > 0:
+            self._reload_task = asyncio.create_task(
+                self._reload(FOLLOW_GRAPH_RELOAD_INTERVAL)
+            )
+
+    async def stop(self):
+        for task in (self._load_task, self._reload_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._load_task = self._reload_task = None
+        self.ready = False
+
+    def memory_usage(self) -> int:
+        """
+        память индекса в байтах: словари, ключи и массивы
+        """
+
+        total = 0
+        for index in (self.forward, self.reverse):
+            total += sys.getsizeof(index)
+            for key, values in index.items():
+                total += sys.getsizeof(key) + sys.getsizeof(values)
+        return total
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "users": len(self.forward),
+            "followed": len(self.reverse),
+            "edges": self.edges,
+            "memory_bytes": self.memory_usage(),
+            "loaded_at": self.loaded_at,
+            "load_seconds": self.load_seconds,
+        }
+
+
+follow_graph = FollowGraph()
@@ -0,0 +1,244 @@
+import datetime
+import hashlib
+from typing import Awaitable, Callable, Union
+
+from fastapi import UploadFile
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from starlette import status
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response
+
+from config import get_settings
+from logger.logger import logger
+from models.models import IdempotencyKeys
+from .jobs import job_handler, enqueue_next_run, start_periodic_job
+
+
+IDEMPOTENCY_TTL = get_settings().IDEMPOTENCY_TTL
+IDEMPOTENCY_CLEANUP_INTERVAL = get_settings().IDEMPOTENCY_CLEANUP_INTERVAL
+IDEMPOTENCY_POOL_SIZE = get_settings().IDEMPOTENCY_POOL_SIZE
+IDEMPOTENCY_POOL_TIMEOUT = get_settings().IDEMPOTENCY_POOL_TIMEOUT
+UPLOAD_CHUNK_SIZE = get_settings().UPLOAD_CHUNK_SIZE
+
+CLEANUP_KEY = "idempotency_cleanup"
+KEY_MAX_LENGTH = IdempotencyKeys.key.type.length
+
+KEYS = IdempotencyKeys.__table__
+STORED_RESPONSE = select(KEYS.c.fingerprint, KEYS.c.status_code, KEYS.c.body)
+
+
+def hash_apikey(api_key: Union[str, None]) -> str:
+    """
+    api-key хранится в БД только в виде хэша
+    """
+    return hashlib.sha256((api_key or "").encode()).hexdigest()
+
+
+def idempotency_error(message: str, status_code: int) -> JSONResponse:
+    return JSONResponse(
+        content={
+            "result": False,
+            "error_type": "Idempotency Error.",
+            "error_message": message,
+        },
+        status_code=status_code,
+    )
+
+
+class IdempotencyStore:
+    """
+    ответы на запросы с ключом идемпотентности в таблице idempotency_keys,
+    общие для всех воркеров. Строка ключа вставляется в транзакции, открытой
+    до ответа handler: повторы с тем же ключом ждут на уникальном индексе ее
+    commit (ответ сохранен) или rollback (запрос выполняется заново).
+    Сохраняются только успешные ответы (2xx), после ошибки запрос можно повторить.
+    Соединение с ключом берется из отдельного пула (connect): handler получает
+    соединение основного пула, и ожидающие ключи запросы его не занимают
+    """
+
+    def __init__(self, session_maker=None, ttl: float = IDEMPOTENCY_TTL):
+        self.session_maker = session_maker
+        self.ttl = ttl
+        self.engine = None
+
+    def bind(self, session_maker):
+        """
+        :param session_maker: фабрика сессий для таблицы ключей
+        """
+        self.session_maker = session_maker
+
+    def connect(
+        self,
+        dsn: str,
+        pool_size: int = IDEMPOTENCY_POOL_SIZE,
+        pool_timeout: float = IDEMPOTENCY_POOL_TIMEOUT,
+    ):
+        """
+        отдельный небольшой пул соединений для таблицы ключей
+        :param dsn: строка подключения postgresql://
+        :param pool_size: размер пула
+        :param pool_timeout: ожидание соединения, секунды
+        """
+
+        self.engine = create_async_engine(
+            dsn.replace("postgresql://", "postgresql+asyncpg://", 1),
+            pool_size=pool_size,
+            max_overflow=0,
+            pool_timeout=pool_timeout,
+        )
+        self.bind(
+            sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+        )
+
+    async def close(self):
+        if self.engine is not None:
+            await self.engine.dispose()
+
+    async def run(
+        self,
+        key: tuple,
+        handler: Callable[[], Awaitable[Response]],
+        fingerprint: str = "",
+    ) -> Response:
+        """
+        выполнение запроса не более одного раза для ключа
+        :param key: (api-key, маршрут, ключ идемпотентности)
+        :param handler: функция, выполняющая запрос и возвращающая ответ
+        :param fingerprint: хэш тела запроса, повтор ключа с другим телом отклоняется
+        :return: ответ первого выполнения или ответ handler
+        """
+
+        api_key, route, idempotency_key = key
+        if len(idempotency_key) > KEY_MAX_LENGTH:
+            return idempotency_error(
+                f"Idempotency-Key is longer than {KEY_MAX_LENGTH} characters.",
+                status.HTTP_400_BAD_REQUEST,
+            )
+
+        apikey_hash = hash_apikey(api_key)
+        where = (
+            KEYS.c.apikey_hash == apikey_hash,
+            KEYS.c.route == route,
+            KEYS.c.key == idempotency_key,
+        )
+        now = func.localtimestamp()
+        query = pg_insert(KEYS).values(
+            apikey_hash=apikey_hash,
+            route=route,
+            key=idempotency_key,
+            fingerprint=fingerprint,
+            expires_on=now + datetime.timedelta(seconds=self.ttl),
+        )
+        # просроченный ключ занимается заново
+        query = query.on_conflict_do_update(
+            index_elements=[KEYS.c.apikey_hash, KEYS.c.route, KEYS.c.key],
+            set_=dict(
+                fingerprint=query.excluded.fingerprint,
+                status_code=None,
+                body=None,
+                expires_on=query.excluded.expires_on,
+            ),
+            where=KEYS.c.expires_on <= now,
+        ).returning(KEYS.c.id)
+
+        async with self.session_maker() as session:
+            try:
+                row_id = await session.scalar(query)
+            except PoolTimeoutError:
+                logger.error("Idempotency keys pool exhausted.")
+                return idempotency_error(
+                    "Too many concurrent requests with Idempotency-Key.",
+                    status.HTTP_503_SERVICE_UNAVAILABLE,
+                )
+
+            if row_id is None:
+                stored = (await session.execute(STORED_RESPONSE.where(*where))).one()
+                if stored.fingerprint != fingerprint:
+                    return idempotency_error(
+                        "Idempotency-Key was used with another request.",
+                        status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    )
+                logger.info(f"Replay response for Idempotency-Key {idempotency_key}")
+                return Response(
+                    content=stored.body,
+                    status_code=stored.status_code,
+                    media_type="application/json",
+                    headers={"Idempotent-Replayed": "true"},
+                )
+
+            # при ошибке handler транзакция откатывается и ключ освобождается
+            response = await handler()
+            if 200 <= response.status_code < 300:
+                await session.execute(
+                    update(KEYS)
+                    .where(KEYS.c.id == row_id)
+                    .values(status_code=response.status_code, body=response.body)
+                )
+                await session.commit()
+            return response
+
+
+idempotency_store = IdempotencyStore()
+
+
+@job_handler(CLEANUP_KEY)
+async def delete_expired_keys(session: AsyncSession, payload: dict):
+    """
+    удаление просроченных ключей, следующее - через IDEMPOTENCY_CLEANUP_INTERVAL
+    """
+
+    result = await session.execute(
+        delete(IdempotencyKeys)
+        .where(IdempotencyKeys.expires_on <= func.localtimestamp())
+        .execution_options(synchronize_session=False)
+    )
+    logger.info(f"Expired idempotency keys deleted: {result.rowcount}")
+    await enqueue_next_run(
+        session, CLEANUP_KEY, CLEANUP_KEY, IDEMPOTENCY_CLEANUP_INTERVAL
+    )
+
+
+async def start_idempotency_cleanup(session_maker):
+    """
+    постановка в очередь удаления просроченных ключей, если его еще нет,
+    вызывается при запуске каждого воркера
+    :param session_maker: фабрика сессий
+    """
+
+    if IDEMPOTENCY_CLEANUP_INTERVAL <= 0:
+        return
+    await start_periodic_job(session_maker, CLEANUP_KEY, CLEANUP_KEY)
+
+
+def request_fingerprint(*parts: Union[str, bytes]) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode() if isinstance(part, str) else part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+async def upload_fingerprint(file: UploadFile) -> str:
+    """
+    хэш имени и содержимого загружаемого файла, как request_fingerprint:
+    файл читается блоками UPLOAD_CHUNK_SIZE в потоке, без загрузки в память
+    целиком, затем позиция чтения возвращается в начало
+    :param file: загружаемый файл
+    :return: хэш в hex
+    """
+
+    def digest_file() -> str:
+        digest = hashlib.sha256()
+        digest.update((file.filename or "").encode())
+        digest.update(b"\0")
+        for block in iter(lambda: file.file.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(block)
+        digest.update(b"\0")
+        file.file.seek(0)
+        return digest.hexdigest()
+
+    return await run_in_threadpool(digest_file)
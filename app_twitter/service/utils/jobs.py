@@ -0,0 +1,339 @@
+import asyncio
+import datetime
+import random
+from contextvars import ContextVar
+from typing import Awaitable, Callable
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete, update, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from config import get_settings
+from logger.logger import logger
+from models.models import Jobs, DeadJobs
+
+
+settings = get_settings()
+
+JOBS_WORKERS = settings.JOBS_WORKERS
+JOBS_BATCH_SIZE = settings.JOBS_BATCH_SIZE
+JOBS_POLL_INTERVAL = settings.JOBS_POLL_INTERVAL
+JOBS_MAX_ATTEMPTS = settings.JOBS_MAX_ATTEMPTS
+JOBS_BACKOFF_BASE = settings.JOBS_BACKOFF_BASE
+JOBS_BACKOFF_MAX = settings.JOBS_BACKOFF_MAX
+JOBS_DRAIN_AFTER_RESPONSE = settings.JOBS_DRAIN_AFTER_RESPONSE
+
+# тип задачи -> async функция (session, payload)
+JOB_HANDLERS = dict()
+
+
+class EnqueueTracker:
+    """
+    счетчик задач, созданных при обработке одного запроса
+    """
+
+    def __init__(self):
+        self.count = 0
+
+
+# счетчик текущего запроса, у каждого запроса свой контекст
+current_tracker: ContextVar = ContextVar("jobs_enqueue_tracker", default=None)
+
+
+def track_enqueued() -> EnqueueTracker:
+    """
+    начало учета задач, созданных в текущем контексте (запросе) и в задачах,
+    запущенных из него. Задачи параллельных запросов не учитываются
+    :return: счетчик задач
+    """
+
+    tracker = EnqueueTracker()
+    current_tracker.set(tracker)
+    return tracker
+
+
+def job_handler(kind: str):
+    """
+    регистрация обработчика задач типа kind
+    """
+
+    def decorator(func: Callable[[AsyncSession, dict], Awaitable]):
+        JOB_HANDLERS[kind] = func
+        return func
+
+    return decorator
+
+
+def backoff_delay(attempts: int) -> float:
+    """
+    пауза перед повтором: экспоненциальный рост со случайной добавкой
+    """
+    delay = JOBS_BACKOFF_BASE * 2 ** (attempts - 1)
+    return min(delay, JOBS_BACKOFF_MAX) + random.uniform(0, JOBS_BACKOFF_BASE)
+
+
+class JobRunner:
+    """
+    выполнение задач из таблицы jobs. Задачи выбираются через
+    FOR UPDATE SKIP LOCKED, поэтому воркеры всех процессов не мешают друг другу.
+    Выполненные задачи удаляются, неудачные повторяются с паузой,
+    после JOBS_MAX_ATTEMPTS попыток переносятся в dead_jobs
+    """
+
+    def __init__(self, max_attempts: int = JOBS_MAX_ATTEMPTS):
+        self.max_attempts = max_attempts
+        self.session_maker = None
+        # счетчик созданных воркером задач
+        self.enqueued = 0
+        self.counters = {"processed": 0, "retried": 0, "dead": 0}
+        self._tasks = []
+        self._wakeup = None
+
+    def bind(self, session_maker):
+        """
+        :param session_maker: фабрика сессий для выполнения задач
+        """
+        self.session_maker = session_maker
+
+    def wakeup(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run_job(self) -> bool:
+        """
+        выполнение одной готовой задачи в отдельной транзакции: блокировки строк,
+        взятые обработчиком, освобождаются сразу после задачи и не ждут
+        медленных задач
+        :return: True - задача была выбрана
+        """
+
+        async with self.session_maker() as session:
+            job = await session.scalar(
+                select(Jobs)
+                .where(Jobs.run_at <= func.localtimestamp())
+                .order_by(Jobs.id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )
+            if job is None:
+                return False
+
+            handler = JOB_HANDLERS.get(job.kind)
+            try:
+                if handler is None:
+                    raise LookupError(f"Unknown job kind {job.kind}")
+                async with session.begin_nested():
+                    await handler(session, job.payload)
+            except Exception as err:
+                await self._fail(session, job, err, retry=handler is not None)
+            else:
+                await session.execute(delete(Jobs).where(Jobs.id == job.id))
+                self.counters["processed"] += 1
+            await session.commit()
+
+        return True
+
+    async def run_once(self, limit: int = JOBS_BATCH_SIZE) -> int:
+        """
+        выполнение пачки готовых задач, каждой - в своей транзакции
+        :param limit: максимальное количество задач
+        :return: количество выбранных задач
+        """
+
+        count = 0
+        while count < limit and await self.run_job():
+            count += 1
+        return count
+
+    async def _fail(
+        self, session: AsyncSession, job: Jobs, err: Exception, retry: bool
+    ):
+        job.attempts += 1
+        job.last_error = f"{type(err).__name__}: {err}"
+
+        if retry and job.attempts < self.max_attempts:
+            delay = backoff_delay(job.attempts)
+            job.run_at = datetime.datetime.now() + datetime.timedelta(seconds=delay)
+            self.counters["retried"] += 1
+            logger.warning(
+                f"Job {job.id} {job.kind} failed ({job.last_error}), retry in {delay:.1f}s"
+            )
+            return
+
+        session.add(
+            DeadJobs(
+                job_id=job.id,
+                kind=job.kind,
+                payload=job.payload,
+                attempts=job.attempts,
+                last_error=job.last_error,
+                created_on=job.created_on,
+            )
+        )
+        await session.delete(job)
+        self.counters["dead"] += 1
+        logger.error(f"Job {job.id} {job.kind} moved to dead letters: {job.last_error}")
+
+    async def drain(self, limit: int = JOBS_BATCH_SIZE):
+        """
+        выполнение готовых задач, пока они есть
+        """
+
+        try:
+            while await self.run_once(limit) == limit:
+                pass
+        except Exception as err:
+            logger.error(f"Jobs drain error: {err}")
+
+    async def _work(self, interval: float):
+        while True:
+            try:
+                if await self.run_once() == JOBS_BATCH_SIZE:
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                logger.error(f"Jobs worker error: {err}")
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self, workers: int = JOBS_WORKERS, interval: float = JOBS_POLL_INTERVAL):
+        """
+        запуск фоновых задач, выполняющих очередь
+        :param workers: количество задач
+        :param interval: период опроса очереди
+        """
+
+        self._wakeup = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._work(interval)) for _ in range(workers)
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    async def metrics(self) -> dict:
+        """
+        размер очереди и количество задач в dead_jobs по типам, счетчики воркера
+        """
+
+        async with self.session_maker() as session:
+            pending = await session.execute(
+                select(
+                    Jobs.kind,
+                    func.count(Jobs.id),
+                    func.max(Jobs.attempts),
+                    func.min(Jobs.created_on),
+                ).group_by(Jobs.kind)
+            )
+            dead = await session.execute(
+                select(DeadJobs.kind, func.count(DeadJobs.id)).group_by(DeadJobs.kind)
+            )
+
+            now = datetime.datetime.now()
+            return {
+                "pending": {
+                    kind: {
+                        "count": count,
+                        "max_attempts": attempts,
+                        "oldest_seconds": round((now - oldest).total_seconds(), 1),
+                    }
+                    for kind, count, attempts, oldest in pending
+                },
+                "dead": {kind: count for kind, count in dead},
+                "worker": dict(self.counters, enqueued=self.enqueued),
+            }
+
+
+job_runner = JobRunner()
+
+
+async def enqueue_job(
+    session: AsyncSession,
+    kind: str,
+    payload: dict,
+    dedup_key: str = None,
+    delay: float = 0,
+    replace_payload: bool = False,
+):
+    """
+    добавление задачи в очередь, задача сохраняется при commit транзакции
+    вызывающей функции
+    :param session: объект сессии
+    :param kind: тип задачи
+    :param payload: параметры задачи
+    :param dedup_key: если в очереди уже есть задача с таким ключом - новая не создается
+    :param delay: через сколько секунд задачу можно выполнять
+    :param replace_payload: параметры задачи с тем же dedup_key, уже ожидающей
+    в очереди, заменяются новыми
+    """
+
+    run_at = datetime.datetime.now() + datetime.timedelta(seconds=delay)
+    query = pg_insert(Jobs).values(
+        kind=kind, payload=payload, dedup_key=dedup_key, attempts=0, run_at=run_at
+    )
+    if dedup_key is not None and replace_payload:
+        query = query.on_conflict_do_update(
+            index_elements=[Jobs.dedup_key], set_={"payload": query.excluded.payload}
+        )
+    elif dedup_key is not None:
+        query = query.on_conflict_do_nothing(index_elements=[Jobs.dedup_key])
+
+    await session.execute(query)
+    job_runner.enqueued += 1
+    tracker = current_tracker.get()
+    if tracker is not None:
+        tracker.count += 1
+
+
+async def enqueue_next_run(
+    session: AsyncSession, kind: str, dedup_key: str, delay: float, payload: dict = None
+):
+    """
+    следующий запуск периодической задачи, вызывается из ее обработчика:
+    текущая задача освобождает dedup_key, чтобы его заняла следующая
+    :param session: объект сессии обработчика
+    :param kind: тип задачи
+    :param dedup_key: ключ периодической задачи, в очереди одна задача с ключом
+    :param delay: через сколько секунд выполнить следующий запуск
+    :param payload: параметры задачи
+    """
+
+    await session.execute(
+        update(Jobs)
+        .where(Jobs.dedup_key == dedup_key)
+        .values(dedup_key=None)
+        .execution_options(synchronize_session=False)
+    )
+    await enqueue_job(session, kind, payload or {}, dedup_key=dedup_key, delay=delay)
+
+
+async def start_periodic_job(
+    session_maker, kind: str, dedup_key: str, payload: dict = None
+):
+    """
+    постановка в очередь периодической задачи, если ее еще нет,
+    вызывается при запуске каждого воркера
+    :param session_maker: фабрика сессий
+    :param kind: тип задачи
+    :param dedup_key: ключ периодической задачи
+    :param payload: параметры задачи
+    """
+
+    try:
+        async with session_maker() as session:
+            await enqueue_job(session, kind, payload or {}, dedup_key=dedup_key)
+            await session.commit()
+    except Exception as err:
+        logger.error(f"Periodic job {kind} schedule error: {err}")
@@ -1,21 +1,24 @@
 from datetime import datetime
 from pathlib import Path
-from os import remove, environ
+from os import remove
+from shutil import copyfileobj
 from typing import Union
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, insert, update, delete
 
 from fastapi import UploadFile
-from dotenv import load_dotenv
 
+from config import get_settings
 from logger.logger import logger
 from models.models import Users, Followers, Tweets, Likes, Media
+from models.sharding import shard_session
+from .jobs import enqueue_job, job_handler
+from .sharding import copy_users
 
 
-load_dotenv()
-
-MEDIA_DIR = environ.get("MEDIA_DIR", "static/media")
+MEDIA_DIR = get_settings().MEDIA_DIR
+UPLOAD_CHUNK_SIZE = get_settings().UPLOAD_CHUNK_SIZE
 
 FILES_DIR = Path(__file__).resolve().parent.parent.joinpath(MEDIA_DIR)
 
@@ -29,11 +32,25 @@ async def temp_file_name() -> str:
     return "".join(name) + ".tmp"
 
 
-async def save_file(session: AsyncSession, file: UploadFile) -> Union[int, None]:
+class MediaLinkError(Exception):
+    """
+    медиа-файлы нельзя привязать к твиту: не существуют, уже привязаны
+    или загружены другим пользователем
+    """
+
+    def __init__(self, media_ids: list):
+        self.media_ids = media_ids
+        super().__init__(f"Media can not be attached: {media_ids}")
+
+
+async def save_file(
+    session: AsyncSession, file: UploadFile, uploader: int
+) -> Union[int, None]:
     """
     сохранение медиафайла на диск
     :param session: объект сессии
     :param file: объект - file прикрепленный к твиту
+    :param uploader: id пользователя, загрузившего файл
     :return: id загруженного файла
     """
 
@@ -41,19 +58,24 @@ async def save_file(session: AsyncSession, file: UploadFile) -> Union[int, None]
 
     try:
         with open(FILES_DIR.joinpath(filename), "wb") as f:
-            f.write(file.file.read())
+            # файл копируется блоками, без чтения в память целиком
+            copyfileobj(file.file, f, UPLOAD_CHUNK_SIZE)
     except OSError as err:
         logger.error(f"Error {err} on save file:{filename}")
         return None
 
     try:
-        result = await session.scalar(
-            insert(Media)
-            .values(
-                filepath=filename,
+        # файлы пользователя учитываются на его шарде, если шарды настроены
+        async with shard_session(session, uploader) as content:
+            await copy_users(session, content, [uploader])
+            result = await content.scalar(
+                insert(Media)
+                .values(
+                    filepath=filename,
+                    uploader=uploader,
+                )
+                .returning(Media.id)
             )
-            .returning(Media.id)
-        )
         await session.commit()
     except Exception as err:
         logger.error(err)
@@ -63,30 +85,32 @@ async def save_file(session: AsyncSession, file: UploadFile) -> Union[int, None]
 
 
 async def link_media_to_tweet(
-    session: AsyncSession, media_id_list: tuple, tweet_id: int
+    session: AsyncSession, media_id_list: tuple, tweet_id: int, user_idx: int
 ):
     """
-    привязывание загруженных медиа-файлов к твиту
+    привязывание загруженных медиа-файлов к твиту в транзакции вызывающей функции.
+    Привязываются только свободные файлы, загруженные автором твита
     :param session: объект сессии
     :param media_id_list: список id медиа-файлов
     :param tweet_id: id твита
+    :param user_idx: id автора твита
     :return:
+    :raises MediaLinkError: если какой-либо файл не может быть привязан
     """
 
-    try:
-        await session.execute(
-            update(Media)
-            .values(
-                tweet_id=tweet_id,
-            )
-            .where(Media.id.in_(media_id_list))
-        )
-
-        await session.commit()
-    except Exception as err:
-        logger.error(
-            f"Media files id:{media_id_list} are not attached to tweet number:{tweet_id}. {err}"
+    linked = await session.scalars(
+        update(Media)
+        .values(tweet_id=tweet_id)
+        .where(
+            Media.id.in_(media_id_list),
+            Media.tweet_id.is_(None),
+            Media.uploader == user_idx,
         )
+        .returning(Media.id)
+    )
+    mismatch = sorted(set(media_id_list) - set(linked.all()))
+    if mismatch:
+        raise MediaLinkError(mismatch)
 
 
 async def delete_files(files: list):
@@ -99,6 +123,9 @@ async def delete_files(files: list):
     for filename in files:
         try:
             remove(FILES_DIR.joinpath(filename))
+        except FileNotFoundError:
+            # файл удален предыдущей попыткой
+            logger.info(f"File {filename} already deleted")
         except OSError as err:
             logger.error(f"Error on deleting file:{filename}. {err} ")
             return False
@@ -107,34 +134,43 @@ async def delete_files(files: list):
     return True
 
 
-async def delete_media(session: AsyncSession, tweet_idx: int) -> bool:
+async def delete_media(session: AsyncSession, tweet_idx: int, uploader: int) -> bool:
     """
     удаление из БД медиа-файлов прикрепленных к удаляемому твиту
     :param session: объект сессии
-    :param media_id_list: список id медиа-файлов
     :param tweet_idx: id твита
+    :param uploader: id автора твита, загрузившего файлы
     :return:
     """
 
     try:
-        result = await session.scalars(
-            delete(Media).where(Media.tweet_id == tweet_idx).returning(Media.filepath)
-        )
-        await session.commit()
+        async with shard_session(session, uploader) as content:
+            result = await content.scalars(
+                delete(Media)
+                .where(Media.tweet_id == tweet_idx)
+                .returning(Media.filepath)
+            )
+            deleted_media_filepath = result.all()
 
-        deleted_media_filepath = result.all()
+        # файлы удаляются задачей после commit
+        if deleted_media_filepath:
+            await enqueue_job(
+                session, "delete_files", {"files": deleted_media_filepath}
+            )
+        await session.commit()
     except Exception as err:
         logger.error(err)
-        deleted_media_filepath = None
+        return False
 
     if not deleted_media_filepath:
         logger.info(f"media for deleted tweet id={tweet_idx} not found")
         return True
 
-    res = await delete_files(deleted_media_filepath)
-    if not res:
-        logger.error(f"Error when deleting files: {deleted_media_filepath}.")
-        return False
-
-    logger.info(f"Deleting media for tweet id={tweet_idx} completed successfully.")
+    logger.info(f"Deleting media for tweet id={tweet_idx} scheduled.")
     return True
+
+
+@job_handler("delete_files")
+async def delete_files_job(session: AsyncSession, payload: dict):
+    if not await delete_files(payload["files"]):
+        raise OSError(f"Error when deleting files: {payload['files']}.")
@@ -0,0 +1,398 @@
+import datetime
+import gzip
+import re
+import shutil
+from pathlib import Path
+from typing import Tuple, Union
+
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy import delete, select, update, text
+from sqlalchemy.sql import column, table as table_clause
+from starlette.concurrency import run_in_threadpool
+
+from config import get_settings
+from logger.logger import logger
+from models import sharding
+from models.models import Users, Tweets, Likes, Media, TweetTags, TweetMentions
+from .jobs import job_handler, enqueue_next_run, start_periodic_job
+from .media import FILES_DIR
+
+
+settings = get_settings()
+
+PARTITION_MONTHS_AHEAD = settings.PARTITION_MONTHS_AHEAD
+PARTITION_ARCHIVE_AFTER_MONTHS = settings.PARTITION_ARCHIVE_AFTER_MONTHS
+PARTITION_MAINTENANCE_INTERVAL = settings.PARTITION_MAINTENANCE_INTERVAL
+
+ARCHIVE_DIR = (
+    Path(__file__).resolve().parent.parent.joinpath(settings.PARTITION_ARCHIVE_DIR)
+)
+
+# таблицы, секционированные по месяцам created_on
+PARTITIONED_TABLES = (Tweets.__tablename__, Likes.__tablename__)
+
+# ключ задачи обслуживания секций: в очереди всегда не больше одной такой задачи
+MAINTENANCE_KEY = "partitions"
+
+# месячная секция: <таблица>_pYYYYMM
+PARTITION_NAME = re.compile(r"^(?P<table>\w+)_p(?P<year>\d{4})(?P<month>\d{2})$")
+
+PARTITIONS = text(
+    "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+    "WHERE i.inhparent = CAST(:table AS regclass) ORDER BY c.relname"
+)
+# таблицы месячных секций, отсоединенные, но еще не архивированные
+DETACHED = text(
+    "SELECT c.relname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+    "WHERE n.nspname = current_schema() AND c.relkind = 'r' AND NOT c.relispartition "
+    "AND starts_with(c.relname, :prefix) ORDER BY c.relname"
+)
+# отсоединение секции через CONCURRENTLY было прервано
+DETACH_PENDING = text(
+    "SELECT inhdetachpending FROM pg_inherits WHERE inhrelid = CAST(:name AS regclass)"
+)
+
+
+def month_start(value: Union[datetime.date, datetime.datetime]) -> datetime.date:
+    """
+    первый день месяца
+    """
+    return datetime.date(value.year, value.month, 1)
+
+
+def add_months(month: datetime.date, count: int) -> datetime.date:
+    """
+    первый день месяца через count месяцев (count < 0 - раньше)
+    """
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: datetime.date) -> str:
+    """
+    имя месячной секции таблицы
+    """
+    return f"{table}_p{month:%Y%m}"
+
+
+async def list_partitions(session: AsyncSession, table: str) -> dict:
+    """
+    месячные секции таблицы, секция по умолчанию не входит
+    :param session: объект сессии
+    :param table: имя секционированной таблицы
+    :return: dict имя секции -> первый день месяца
+    """
+
+    names = (await session.scalars(PARTITIONS, {"table": table})).all()
+    partitions = dict()
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match and match["table"] == table:
+            partitions[name] = datetime.date(int(match["year"]), int(match["month"]), 1)
+    return partitions
+
+
+async def list_detached(session: AsyncSession, table: str) -> list:
+    """
+    месячные секции таблицы, отсоединенные прерванной архивацией
+    :param session: объект сессии
+    :param table: имя секционированной таблицы
+    :return: список имен таблиц
+    """
+
+    names = await session.scalars(DETACHED, {"prefix": f"{table}_p"})
+    detached = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match and match["table"] == table:
+            detached.append(name)
+    return detached
+
+
+async def ensure_partitions(
+    session: AsyncSession,
+    months_ahead: int = PARTITION_MONTHS_AHEAD,
+    today: datetime.date = None,
+    since: Union[datetime.date, datetime.datetime] = None,
+) -> dict:
+    """
+    создание секций с текущего месяца (или с месяца since) до months_ahead
+    месяцев вперед. Секции по умолчанию нет, поэтому строки с created_on вне
+    секций не вставляются: загрузка старых данных сначала создает их секции.
+    Секция создается отдельной таблицей и присоединяется через ATTACH PARTITION:
+    CREATE TABLE ... PARTITION OF блокирует чтение таблицы
+    :param session: объект сессии
+    :param months_ahead: на сколько месяцев вперед создаются секции
+    :param today: текущая дата, по умолчанию - сегодня
+    :param since: дата, с месяца которой создаются секции, если она раньше today
+    :return: dict с результатом и списком созданных секций
+    """
+
+    current = month_start(today or datetime.date.today())
+    first = min(current, month_start(since)) if since else current
+    months = []
+    month = first
+    while month <= add_months(current, months_ahead):
+        months.append(month)
+        month = add_months(month, 1)
+
+    created = []
+    for table in PARTITIONED_TABLES:
+        existing = await list_partitions(session, table)
+        for month in months:
+            name = partition_name(table, month)
+            if name in existing:
+                continue
+
+            await session.execute(
+                text(
+                    f'CREATE TABLE "{name}" '
+                    f'(LIKE "{table}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+                )
+            )
+            await session.execute(
+                text(
+                    f'ALTER TABLE "{table}" ATTACH PARTITION "{name}" '
+                    f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')"
+                )
+            )
+            created.append(name)
+            logger.info(f"Partition {name} created")
+
+    return {"result": True, "created": created}
+
+
+async def copy_to_archive(session: AsyncSession, query: str, path: Path):
+    """
+    выгрузка результата запроса в сжатый CSV через COPY TO. Файл пишется под
+    временным именем и переименовывается после успешной выгрузки
+    :param session: объект сессии
+    :param query: запрос
+    :param path: путь файла архива
+    """
+
+    temp_path = path.with_name(path.name + ".tmp")
+    raw_connection = await (await session.connection()).get_raw_connection()
+    with gzip.open(temp_path, "wb") as archive:
+
+        async def write(data: bytes):
+            await run_in_threadpool(archive.write, data)
+
+        await raw_connection.driver_connection.copy_from_query(
+            query, output=write, format="csv", header=True
+        )
+    temp_path.replace(path)
+
+
+def move_files(files: list, target_dir: Path):
+    """
+    перенос медиа-файлов в каталог архива, отсутствующие файлы пропускаются
+    """
+
+    for filename in files:
+        target = target_dir.joinpath(filename)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            shutil.move(FILES_DIR.joinpath(filename), target)
+        except FileNotFoundError:
+            logger.info(f"File {filename} already moved")
+
+
+async def detach_partition(engine: AsyncEngine, table: str, name: str):
+    """
+    отсоединение секции без блокировки чтения и записи таблицы: DETACH PARTITION
+    CONCURRENTLY выполняется вне транзакции, на отдельном соединении.
+    Прерванное отсоединение завершается через FINALIZE
+    :param engine: движок БД
+    :param table: имя секционированной таблицы
+    :param name: имя секции
+    """
+
+    async with engine.connect() as connection:
+        connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+        pending = await connection.scalar(DETACH_PENDING, {"name": name})
+        mode = "FINALIZE" if pending else "CONCURRENTLY"
+        # отсоединение ждет завершения транзакций, начатых раньше него
+        await connection.execute(text("SET statement_timeout = 0"))
+        try:
+            await connection.execute(
+                text(f'ALTER TABLE "{table}" DETACH PARTITION "{name}" {mode}')
+            )
+        finally:
+            await connection.execute(text("RESET statement_timeout"))
+
+
+async def archive_tweets(
+    engine: AsyncEngine, name: str, archive_dir: Path
+) -> Tuple[list, list]:
+    """
+    архивация отсоединенной секции твитов вместе с зависимыми строками: твиты,
+    лайки этих твитов (из любых секций likes) и строки медиа-файлов выгружаются
+    в <секция>.csv.gz, <секция>_likes.csv.gz и <секция>_media.csv.gz, строки
+    лайков, хэштегов, упоминаний и медиа удаляются, таблица секции удаляется.
+    Файлы картинок переносятся в каталог <секция>_media архива после commit
+    :param engine: движок БД
+    :param name: имя отсоединенной секции
+    :param archive_dir: каталог архива
+    :return: (файлы архива, id авторов архивированных твитов)
+    """
+
+    tweet_ids = select(column("id")).select_from(table_clause(name))
+    queries = {
+        f"{name}.csv.gz": f'SELECT * FROM "{name}"',
+        f"{name}_likes.csv.gz": (
+            f'SELECT * FROM likes WHERE tweet_id IN (SELECT id FROM "{name}")'
+        ),
+        f"{name}_media.csv.gz": (
+            f'SELECT * FROM media WHERE tweet_id IN (SELECT id FROM "{name}")'
+        ),
+    }
+    paths = []
+
+    async with AsyncSession(engine) as session:
+        # выгрузка месяца дольше ограничения времени запроса
+        await session.execute(text("SET LOCAL statement_timeout = 0"))
+        for filename, query in queries.items():
+            path = archive_dir.joinpath(filename)
+            await copy_to_archive(session, query, path)
+            paths.append(path)
+
+        authors = (
+            await session.scalars(
+                select(column("user_id")).select_from(table_clause(name)).distinct()
+            )
+        ).all()
+        for model in (Likes, TweetTags, TweetMentions):
+            await session.execute(
+                delete(model)
+                .where(model.tweet_id.in_(tweet_ids))
+                .execution_options(synchronize_session=False)
+            )
+        files = (
+            await session.scalars(
+                delete(Media)
+                .where(Media.tweet_id.in_(tweet_ids))
+                .returning(Media.filepath)
+                .execution_options(synchronize_session=False)
+            )
+        ).all()
+        await session.execute(text(f'DROP TABLE "{name}"'))
+        await session.commit()
+
+    if files:
+        await run_in_threadpool(
+            move_files, files, archive_dir.joinpath(f"{name}_media")
+        )
+    return [str(path) for path in paths], authors
+
+
+async def archive_partitions(
+    engine: AsyncEngine,
+    after_months: int = PARTITION_ARCHIVE_AFTER_MONTHS,
+    archive_dir: Union[str, Path] = ARCHIVE_DIR,
+    today: datetime.date = None,
+) -> dict:
+    """
+    архивация месячных секций твитов старше after_months месяцев (archive_tweets).
+    Секции отсоединяются через DETACH PARTITION CONCURRENTLY, поэтому чтение и
+    запись твитов и лайков не ждут выгрузки, каждая секция архивируется в своей
+    транзакции на отдельном соединении. Лайки архивируются вместе с твитами,
+    старые секции лайков удаляются, когда в них не осталось строк.
+    Секции, отсоединенные прерванной архивацией, архивируются при следующем запуске
+    :param engine: движок БД
+    :param after_months: возраст секций в месяцах, 0 - без архивации
+    :param archive_dir: каталог архива
+    :param today: текущая дата, по умолчанию - сегодня
+    :return: dict с результатом, списком файлов архива и id авторов
+    архивированных твитов - их версии ETag увеличивает вызывающая функция
+    """
+
+    if after_months <= 0:
+        return {"result": True, "archived": [], "authors": []}
+
+    cutoff = add_months(month_start(today or datetime.date.today()), -after_months)
+    archive_dir = Path(archive_dir)
+    archive_dir.mkdir(parents=True, exist_ok=True)
+
+    async with AsyncSession(engine) as session:
+        partitions = {
+            table: await list_partitions(session, table) for table in PARTITIONED_TABLES
+        }
+        detached = await list_detached(session, Tweets.__tablename__)
+
+    archived, authors = [], set()
+    table = Tweets.__tablename__
+    for name, month in partitions[table].items():
+        if month < cutoff:
+            await detach_partition(engine, table, name)
+            detached.append(name)
+    for name in detached:
+        paths, user_ids = await archive_tweets(engine, name, archive_dir)
+        archived.extend(paths)
+        authors.update(user_ids)
+        logger.info(f"Partition {name} archived to {archive_dir}")
+
+    # в старых секциях лайков остаются только лайки неархивированных твитов
+    table = Likes.__tablename__
+    for name, month in partitions[table].items():
+        if month >= cutoff:
+            continue
+        async with AsyncSession(engine) as session:
+            rows = await session.scalar(text(f'SELECT count(*) FROM "{name}"'))
+        if rows:
+            logger.info(f"Partition {name} kept: {rows} likes of live tweets")
+            continue
+        await detach_partition(engine, table, name)
+        async with AsyncSession(engine) as session:
+            await session.execute(text(f'DROP TABLE "{name}"'))
+            await session.commit()
+        logger.info(f"Empty partition {name} dropped")
+
+    return {"result": True, "archived": archived, "authors": sorted(authors)}
+
+
+@job_handler("partitions")
+async def maintain_partitions(session: AsyncSession, payload: dict):
+    """
+    архивация старых секций на отдельных соединениях и создание будущих секций
+    в основной БД и на каждом шарде (архив шарда - в подкаталоге с его именем),
+    следующее обслуживание - через PARTITION_MAINTENANCE_INTERVAL
+    """
+
+    authors = set((await archive_partitions(session.bind))["authors"])
+    await ensure_partitions(session)
+
+    shards = sharding.shard_sessions
+    for name in shards.names if shards is not None else ():
+        result = await archive_partitions(
+            shards.engines[name], archive_dir=ARCHIVE_DIR.joinpath(name)
+        )
+        authors.update(result["authors"])
+        async with shards(name) as content:
+            await ensure_partitions(content)
+            await content.commit()
+
+    if authors:
+        # архивированные твиты пропали из лент и профилей, версии - в основной БД
+        await session.execute(
+            update(Users)
+            .where(Users.id.in_(sorted(authors)))
+            .values(content_version=Users.content_version + 1)
+            .execution_options(synchronize_session=False)
+        )
+
+    await enqueue_next_run(
+        session, "partitions", MAINTENANCE_KEY, PARTITION_MAINTENANCE_INTERVAL
+    )
+
+
+async def start_partition_maintenance(session_maker):
+    """
+    постановка в очередь обслуживания секций, если его еще нет,
+    вызывается при запуске каждого воркера
+    :param session_maker: фабрика сессий
+    """
+
+    if PARTITION_MAINTENANCE_INTERVAL <= 0:
+        return
+    await start_periodic_job(session_maker, "partitions", MAINTENANCE_KEY)
@@ -0,0 +1,311 @@
+import heapq
+import math
+import time
+from collections import OrderedDict
+from datetime import datetime
+from itertools import chain
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, func, bindparam
+
+from config import get_settings
+from models import sharding
+from models.models import Followers, Tweets, Likes
+from .follow_graph import follow_graph
+
+
+settings = get_settings()
+
+RANK_TOP_K = settings.RANK_TOP_K
+RANK_WINDOW = settings.RANK_WINDOW
+RANK_VELOCITY_HALF_LIFE = settings.RANK_VELOCITY_HALF_LIFE
+RANK_RECENCY_HALF_LIFE = settings.RANK_RECENCY_HALF_LIFE
+RANK_AFFINITY_WEIGHT = settings.RANK_AFFINITY_WEIGHT
+RANK_CACHE_TTL = settings.RANK_CACHE_TTL
+RANK_CACHE_MAX_USERS = settings.RANK_CACHE_MAX_USERS
+
+# постоянные времени экспоненциального затухания, секунды
+VELOCITY_TAU = RANK_VELOCITY_HALF_LIFE / math.log(2)
+RECENCY_TAU = RANK_RECENCY_HALF_LIFE / math.log(2)
+
+
+def decayed_velocity():
+    """
+    скорость лайков твита, затухшая к текущему моменту
+    """
+    return Tweets.like_velocity * func.exp(
+        -func.extract("epoch", func.localtimestamp() - Tweets.like_velocity_on)
+        / VELOCITY_TAU
+    )
+
+
+# счетчик лайков и скорость лайков (экспоненциально затухающая сумма)
+# обновляются в транзакции лайка, чтение ленты их не агрегирует
+UPDATE_ENGAGEMENT = (
+    update(Tweets)
+    .where(Tweets.id.in_(bindparam("tweet_ids", expanding=True)))
+    .values(
+        likes_count=Tweets.likes_count + bindparam("delta"),
+        like_velocity=func.greatest(
+            func.coalesce(decayed_velocity(), 0) + bindparam("delta"), 0
+        ),
+        like_velocity_on=func.localtimestamp(),
+    )
+    .execution_options(synchronize_session=False)
+)
+
+PRE_SCORE = (1 + func.coalesce(decayed_velocity(), 0)) * func.exp(
+    -func.extract("epoch", func.localtimestamp() - Tweets.created_on) / RECENCY_TAU
+)
+FEED_CANDIDATES = (
+    select(
+        Tweets.id,
+        Tweets.user_id,
+        Tweets.created_on,
+        Tweets.like_velocity,
+        Tweets.like_velocity_on,
+    )
+    .where(
+        Tweets.user_id.in_(
+            select(Followers.user_id).where(
+                Followers.follower_id == bindparam("user_idx")
+            )
+        ),
+        Tweets.created_on >= bindparam("since"),
+    )
+    .order_by(PRE_SCORE.desc())
+    .limit(bindparam("limit"))
+)
+# кандидаты при шардировании: авторы - из основной БД, твиты - с шардов авторов
+FEED_AUTHOR_IDS = select(Followers.user_id).where(
+    Followers.follower_id == bindparam("user_idx")
+)
+SHARD_FEED_CANDIDATES = (
+    select(
+        Tweets.id,
+        Tweets.user_id,
+        Tweets.created_on,
+        Tweets.like_velocity,
+        Tweets.like_velocity_on,
+        PRE_SCORE.label("pre_score"),
+    )
+    .where(
+        Tweets.user_id.in_(bindparam("author_ids", expanding=True)),
+        Tweets.created_on >= bindparam("since"),
+    )
+    .order_by(PRE_SCORE.desc())
+    .limit(bindparam("limit"))
+)
+AUTHOR_AFFINITY = (
+    select(Tweets.user_id, func.count(Likes.id))
+    .join(Tweets, Tweets.id == Likes.tweet_id)
+    .where(
+        Likes.user_id == bindparam("user_idx"), Likes.created_on >= bindparam("since")
+    )
+    .group_by(Tweets.user_id)
+)
+
+
+async def update_engagement(session: AsyncSession, tweet_ids: list, delta: int):
+    """
+    изменение счетчиков лайков твитов, сохраняется при commit вызывающей функции
+    :param session: объект сессии
+    :param tweet_ids: список id твитов
+    :param delta: 1 - лайк поставлен, -1 - удален
+    """
+
+    if tweet_ids:
+        await session.execute(
+            UPDATE_ENGAGEMENT, {"tweet_ids": list(tweet_ids), "delta": delta}
+        )
+
+
+class RankedFeed:
+    """
+    ранжированная лента: для пользователя кэшируются top-K кандидатов
+    (свежие твиты отслеживаемых авторов с наибольшей скоростью лайков)
+    и число его лайков каждому автору. Скорость лайков кандидатов
+    обновляется событиями like, при запросе кандидаты только пересортировываются:
+    score = (1 + скорость лайков) * затухание по возрасту * близость к автору
+    """
+
+    def __init__(
+        self,
+        top_k: int = RANK_TOP_K,
+        ttl: float = RANK_CACHE_TTL,
+        max_users: int = RANK_CACHE_MAX_USERS,
+    ):
+        self.top_k = top_k
+        self.ttl = ttl
+        self.max_users = max_users
+        # id пользователя -> (время устаревания, кандидаты, близость к авторам)
+        self.entries = OrderedDict()
+        # id твита -> [скорость лайков, время скорости, количество кэшей с твитом]
+        self.tweets = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def invalidate(self, user_id: int):
+        entry = self.entries.pop(user_id, None)
+        if entry is None:
+            return
+        for tweet_id, _, _ in entry[1]:
+            stats = self.tweets.get(tweet_id)
+            if stats is None:
+                continue
+            stats[2] -= 1
+            if stats[2] <= 0:
+                del self.tweets[tweet_id]
+
+    def apply(self, event: dict):
+        """
+        обработка события канала: like меняет скорость кэшированного твита,
+        delete убирает твит, новые твиты и изменения подписок сбрасывают
+        кэш затронутых пользователей
+        """
+
+        event_type = event.get("type")
+        if event_type == "like":
+            stats = self.tweets.get(event.get("tweet_id"))
+            if stats is not None:
+                now = time.time()
+                velocity = stats[0] * math.exp(-(now - stats[1]) / VELOCITY_TAU)
+                stats[0] = max(velocity + event.get("delta", 1), 0.0)
+                stats[1] = now
+        elif event_type == "delete":
+            self.tweets.pop(event.get("tweet_id"), None)
+        elif event_type == "tweet":
+            # читатели автора известны из индекса подписок, без него сбрасывается весь кэш
+            if not follow_graph.ready:
+                self.clear()
+                return
+            for user_id in follow_graph.follower_ids(event.get("author_id")):
+                self.invalidate(user_id)
+        elif event_type in ("follow", "unfollow"):
+            self.invalidate(event["user_id"])
+            for user_id in event["follower_ids"]:
+                self.invalidate(user_id)
+
+    def clear(self):
+        self.entries.clear()
+        self.tweets.clear()
+
+    async def _shard_rows(self, session: AsyncSession, params: dict) -> tuple:
+        """
+        кандидаты и лайки пользователя при шардировании: кандидаты запрашиваются
+        у шардов авторов, лайки пользователя хранятся на шардах твитов - у всех
+        шардов. Общие top-K кандидатов выбираются по предварительному score
+        :return: (строки кандидатов, строки (id автора, количество лайков))
+        """
+
+        shards = sharding.shard_sessions
+        authors = dict()
+        for author_id in await session.scalars(FEED_AUTHOR_IDS, params):
+            authors.setdefault(shards.shard_for(author_id), []).append(author_id)
+
+        async def shard_rows(content: AsyncSession, name: str) -> tuple:
+            candidates = []
+            if name in authors:
+                res = await content.execute(
+                    SHARD_FEED_CANDIDATES,
+                    dict(params, author_ids=authors[name], limit=self.top_k),
+                )
+                candidates = res.all()
+            likes = (await content.execute(AUTHOR_AFFINITY, params)).all()
+            return candidates, likes
+
+        parts = (await shards.scatter(shard_rows)).values()
+        candidates = heapq.nlargest(
+            self.top_k,
+            chain.from_iterable(rows for rows, _ in parts),
+            key=lambda row: row.pre_score,
+        )
+        counts = dict()
+        for author_id, count in chain.from_iterable(likes for _, likes in parts):
+            counts[author_id] = counts.get(author_id, 0) + count
+        return [row[:5] for row in candidates], counts.items()
+
+    async def _build(self, session: AsyncSession, user_idx: int, now: float):
+        since = datetime.fromtimestamp(now - RANK_WINDOW)
+        params = {"user_idx": user_idx, "since": since}
+
+        if sharding.shard_sessions is not None:
+            rows, likes = await self._shard_rows(session, params)
+        else:
+            rows = await session.execute(
+                FEED_CANDIDATES, dict(params, limit=self.top_k)
+            )
+            likes = await session.execute(AUTHOR_AFFINITY, params)
+
+        candidates = []
+        for tweet_id, author_id, created_on, velocity, velocity_on in rows:
+            candidates.append((tweet_id, author_id, created_on.timestamp()))
+            stats = self.tweets.get(tweet_id)
+            if stats is None:
+                velocity_ts = velocity_on.timestamp() if velocity_on else now
+                self.tweets[tweet_id] = [velocity or 0.0, velocity_ts, 1]
+            else:
+                stats[2] += 1
+
+        affinity = {
+            author_id: 1 + RANK_AFFINITY_WEIGHT * math.log1p(count)
+            for author_id, count in likes
+        }
+        return candidates, affinity
+
+    async def top_ids(self, session: AsyncSession, user_idx: int, limit: int) -> list:
+        """
+        id твитов ленты пользователя по убыванию score
+        :param session: объект сессии
+        :param user_idx: id пользователя
+        :param limit: количество твитов
+        :return: список id
+        """
+
+        now = time.time()
+        entry = self.entries.get(user_idx)
+        if entry is not None and entry[0] > now:
+            self.entries.move_to_end(user_idx)
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.invalidate(user_idx)
+            candidates, affinity = await self._build(session, user_idx, now)
+            entry = (now + self.ttl, candidates, affinity)
+            self.entries[user_idx] = entry
+            while len(self.entries) > self.max_users:
+                self.invalidate(next(iter(self.entries)))
+
+        _, candidates, affinity = entry
+        scored = []
+        for tweet_id, author_id, created_ts in candidates:
+            stats = self.tweets.get(tweet_id)
+            if stats is None:
+                continue
+            velocity = stats[0] * math.exp(-(now - stats[1]) / VELOCITY_TAU)
+            recency = math.exp(-max(now - created_ts, 0) / RECENCY_TAU)
+            score = (1 + velocity) * recency * affinity.get(author_id, 1)
+            scored.append((score, tweet_id))
+
+        scored.sort(reverse=True)
+        return [tweet_id for _, tweet_id in scored[:limit]]
+
+    def start(self, broker):
+        """
+        :param broker: брокер событий (utils.events.EventBroker)
+        """
+        broker.listeners.append(self.apply)
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self.entries),
+            "tweets": len(self.tweets),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+ranked_feed = RankedFeed()
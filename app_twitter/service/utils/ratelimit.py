@@ -0,0 +1,338 @@
+import asyncio
+import datetime
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Union
+
+from sqlalchemy import func, case, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from starlette import status
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from config import get_settings
+from logger.logger import logger
+from models.models import RateLimitBuckets
+from .jobs import job_handler, enqueue_next_run, start_periodic_job
+
+
+settings = get_settings()
+
+RATE_LIMIT_PER_KEY = settings.RATE_LIMIT_PER_KEY
+RATE_LIMIT_PER_KEY_BURST = settings.RATE_LIMIT_PER_KEY_BURST
+RATE_LIMIT_GLOBAL = settings.RATE_LIMIT_GLOBAL
+RATE_LIMIT_GLOBAL_BURST = settings.RATE_LIMIT_GLOBAL_BURST
+RATE_LIMIT_BACKEND = settings.RATE_LIMIT_BACKEND
+RATE_LIMIT_MAX_KEYS = settings.RATE_LIMIT_MAX_KEYS
+RATE_LIMIT_POOL_SIZE = settings.RATE_LIMIT_POOL_SIZE
+RATE_LIMIT_POOL_TIMEOUT = settings.RATE_LIMIT_POOL_TIMEOUT
+RATE_LIMIT_CLEANUP_INTERVAL = settings.RATE_LIMIT_CLEANUP_INTERVAL
+
+CLEANUP_KEY = "rate_limit_cleanup"
+
+SHED_LOOP_LAG = settings.SHED_LOOP_LAG
+SHED_POOL_WAIT = settings.SHED_POOL_WAIT
+SHED_CHECK_INTERVAL = settings.SHED_CHECK_INTERVAL
+SHED_SAMPLE_TTL = settings.SHED_SAMPLE_TTL
+
+
+class TokenBucket:
+    """
+    корзина токенов: пополняется со скоростью rate до burst,
+    каждый запрос забирает один токен
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """
+        :return: 0 - токен получен, иначе через сколько секунд появится токен
+        """
+
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class MemoryRateLimiter:
+    """
+    корзины токенов в памяти воркера, число ключей ограничено (LRU)
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+
+    async def close(self):
+        pass
+
+    async def acquire(self, key: str) -> float:
+        """
+        :param key: ключ ограничения
+        :return: 0 - запрос разрешен, иначе рекомендуемая пауза в секундах
+        """
+
+        if self.rate <= 0:
+            return 0.0
+
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst, now)
+            self.buckets[key] = bucket
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket.take(now)
+
+
+def create_limiter_engine(dsn: str) -> AsyncEngine:
+    """
+    отдельный небольшой пул ограничителя: запросы API не ждут из-за него
+    соединений основного пула, upsert выполняется без BEGIN/COMMIT (autocommit)
+    :param dsn: строка подключения postgresql://
+    :return: движок с пулом на RATE_LIMIT_POOL_SIZE соединений
+    """
+
+    return create_async_engine(
+        dsn.replace("postgresql://", "postgresql+asyncpg://", 1),
+        pool_size=RATE_LIMIT_POOL_SIZE,
+        max_overflow=0,
+        pool_timeout=RATE_LIMIT_POOL_TIMEOUT,
+        isolation_level="AUTOCOMMIT",
+    )
+
+
+def hash_key(key: str) -> str:
+    """
+    api-key хранится в БД только в виде хэша
+    """
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class PostgresRateLimiter:
+    """
+    корзины токенов в таблице rate_limit_buckets, общие для всех воркеров:
+    пополнение и списание токена выполняются одним upsert по хэшу ключа
+    """
+
+    def __init__(self, engine: AsyncEngine, rate: float, burst: float):
+        self.engine = engine
+        self.rate = rate
+        self.burst = burst
+
+    async def close(self):
+        await self.engine.dispose()
+
+    async def acquire(self, key: str) -> float:
+        if self.rate <= 0:
+            return 0.0
+
+        table = RateLimitBuckets.__table__
+        now = func.localtimestamp()
+        refilled = func.least(
+            self.burst,
+            table.c.tokens
+            + func.extract("epoch", now - table.c.updated_on) * self.rate,
+        )
+
+        query = pg_insert(table).values(
+            key=hash_key(key), tokens=self.burst - 1, allowed=True, updated_on=now
+        )
+        query = query.on_conflict_do_update(
+            index_elements=[table.c.key],
+            set_=dict(
+                tokens=case((refilled >= 1, refilled - 1), else_=refilled),
+                allowed=refilled >= 1,
+                updated_on=now,
+            ),
+        ).returning(table.c.tokens, table.c.allowed)
+
+        try:
+            async with self.engine.connect() as connection:
+                row = (await connection.execute(query)).one()
+        except Exception as err:
+            # при недоступности БД запросы не ограничиваются
+            logger.error(f"Rate limit backend error: {err}")
+            return 0.0
+
+        if row.allowed:
+            return 0.0
+        return (1 - row.tokens) / self.rate
+
+
+class LoadShedder:
+    """
+    сброс нагрузки: пока задержка цикла событий или ожидание соединения из пула
+    превышают пороги, новые запросы сразу получают 503, а не ждут в очереди
+    """
+
+    def __init__(
+        self,
+        loop_lag_limit: float = SHED_LOOP_LAG,
+        pool_wait_limit: float = SHED_POOL_WAIT,
+        interval: float = SHED_CHECK_INTERVAL,
+    ):
+        self.loop_lag_limit = loop_lag_limit
+        self.pool_wait_limit = pool_wait_limit
+        self.interval = interval
+        self.loop_lag = 0.0
+        self.pool_wait = 0.0
+        self.pool_wait_updated = 0.0
+        self.shed_count = 0
+        self._task = None
+
+    def record_pool_wait(self, seconds: float):
+        """
+        время ожидания соединения из пула, сглаженное скользящим средним
+        """
+        self.pool_wait = 0.8 * self.pool_wait + 0.2 * seconds
+        self.pool_wait_updated = time.monotonic()
+
+    def current_pool_wait(self) -> float:
+        if time.monotonic() - self.pool_wait_updated > SHED_SAMPLE_TTL:
+            return 0.0
+        return self.pool_wait
+
+    def overloaded(self) -> bool:
+        return (
+            self.loop_lag > self.loop_lag_limit
+            or self.current_pool_wait() > self.pool_wait_limit
+        )
+
+    async def _monitor(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.loop_lag = max(loop.time() - started - self.interval, 0.0)
+
+    def start(self):
+        self._task = asyncio.create_task(self._monitor())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+load_shedder = LoadShedder()
+
+
+def create_key_limiter(dsn: str = None):
+    """
+    ограничитель для api-key с хранилищем из RATE_LIMIT_BACKEND
+    :param dsn: строка подключения к БД счетчиков для postgres
+    """
+
+    if RATE_LIMIT_BACKEND == "postgres" and dsn is not None:
+        return PostgresRateLimiter(
+            create_limiter_engine(dsn), RATE_LIMIT_PER_KEY, RATE_LIMIT_PER_KEY_BURST
+        )
+    return MemoryRateLimiter(RATE_LIMIT_PER_KEY, RATE_LIMIT_PER_KEY_BURST)
+
+
+@job_handler(CLEANUP_KEY)
+async def delete_idle_buckets(session: AsyncSession, payload: dict):
+    """
+    удаление счетчиков ключей без запросов дольше burst / rate секунд: такая
+    корзина уже полна и совпадает с новой, следующее удаление - через
+    RATE_LIMIT_CLEANUP_INTERVAL
+    """
+
+    if RATE_LIMIT_PER_KEY > 0:
+        idle = datetime.timedelta(seconds=RATE_LIMIT_PER_KEY_BURST / RATE_LIMIT_PER_KEY)
+        result = await session.execute(
+            delete(RateLimitBuckets)
+            .where(RateLimitBuckets.updated_on < func.localtimestamp() - idle)
+            .execution_options(synchronize_session=False)
+        )
+        logger.info(f"Idle rate limit buckets deleted: {result.rowcount}")
+    await enqueue_next_run(
+        session, CLEANUP_KEY, CLEANUP_KEY, RATE_LIMIT_CLEANUP_INTERVAL
+    )
+
+
+async def start_rate_limit_cleanup(session_maker):
+    """
+    постановка в очередь удаления счетчиков неактивных ключей, если его еще
+    нет, вызывается при запуске каждого воркера
+    :param session_maker: фабрика сессий
+    """
+
+    if RATE_LIMIT_BACKEND != "postgres" or RATE_LIMIT_CLEANUP_INTERVAL <= 0:
+        return
+    await start_periodic_job(session_maker, CLEANUP_KEY, CLEANUP_KEY)
+
+
+class RequestLimiter:
+    """
+    проверки запроса к API перед выполнением: сброс нагрузки,
+    ограничение частоты по api-key (или адресу клиента) и общее ограничение воркера
+    """
+
+    def __init__(self, key_limiter, global_limiter=None, shedder=None):
+        self.key_limiter = key_limiter
+        self.global_limiter = global_limiter or MemoryRateLimiter(
+            RATE_LIMIT_GLOBAL, RATE_LIMIT_GLOBAL_BURST
+        )
+        self.shedder = shedder or load_shedder
+        self.limited_count = 0
+
+    async def close(self):
+        await self.key_limiter.close()
+
+    async def check(self, request: Request) -> Union[JSONResponse, None]:
+        """
+        :return: ответ с ошибкой, если запрос не выполняется, иначе None
+        """
+
+        if self.shedder.overloaded():
+            self.shedder.shed_count += 1
+            return JSONResponse(
+                content={
+                    "result": False,
+                    "error_type": "Service Unavailable.",
+                    "error_message": "Server is overloaded, retry later.",
+                },
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": "1"},
+            )
+
+        key = request.headers.get("api-key")
+        if not key:
+            key = request.client.host if request.client else "unknown"
+
+        retry_after = await self.key_limiter.acquire(key)
+        if not retry_after:
+            retry_after = await self.global_limiter.acquire("*")
+        if retry_after:
+            self.limited_count += 1
+            return JSONResponse(
+                content={
+                    "result": False,
+                    "error_type": "Too Many Requests.",
+                    "error_message": "Request rate limit exceeded.",
+                },
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={"Retry-After": str(max(int(retry_after + 0.999), 1))},
+            )
+        return None
@@ -0,0 +1,257 @@
+from typing import Union
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, insert, update, delete, func, distinct
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql import Select
+
+from config import get_settings
+from logger.logger import logger
+from models.models import Users, Followers, FollowRecommendations, Jobs
+from .jobs import enqueue_job, job_handler
+
+
+settings = get_settings()
+
+RECOMMENDATIONS_LIMIT = settings.RECOMMENDATIONS_LIMIT
+RECOMMENDATIONS_REFRESH_INTERVAL = settings.RECOMMENDATIONS_REFRESH_INTERVAL
+RECOMMENDATIONS_REFRESH_DELAY = settings.RECOMMENDATIONS_REFRESH_DELAY
+RECOMMENDATIONS_BATCH_USERS = settings.RECOMMENDATIONS_BATCH_USERS
+
+# ключ задачи полного пересчета: в очереди всегда не больше одной такой задачи
+REFRESH_ALL_KEY = "recommendations:all"
+
+
+def recommendations_query(user_ids: Union[list, Select], limit: int) -> Select:
+    """
+    рекомендации для группы пользователей одним запросом: пользователи, на которых
+    подписаны их подписки, кроме уже отслеживаемых, не больше limit на пользователя.
+    Подписка user_id на follower_id - строка followers, как в follow_to_user
+    :param user_ids: список id или запрос, возвращающий id пользователей
+    :param limit: количество рекомендаций на пользователя
+    :return: запрос строк (user_id, recommended_id, score, created_on)
+    """
+
+    mine = aliased(Followers)
+    theirs = aliased(Followers)
+    score = func.count(distinct(mine.follower_id))
+    followed = select(Followers.id).where(
+        Followers.user_id == mine.user_id,
+        Followers.follower_id == theirs.follower_id,
+    )
+
+    ranked = (
+        select(
+            mine.user_id.label("user_id"),
+            theirs.follower_id.label("recommended_id"),
+            score.label("score"),
+            func.row_number()
+            .over(
+                partition_by=mine.user_id,
+                order_by=(score.desc(), theirs.follower_id),
+            )
+            .label("rank"),
+        )
+        .join(theirs, theirs.user_id == mine.follower_id)
+        .where(
+            mine.user_id.in_(user_ids),
+            theirs.follower_id != mine.user_id,
+            ~followed.exists(),
+        )
+        .group_by(mine.user_id, theirs.follower_id)
+        .subquery()
+    )
+
+    return select(
+        ranked.c.user_id,
+        ranked.c.recommended_id,
+        ranked.c.score,
+        func.localtimestamp(),
+    ).where(ranked.c.rank <= limit)
+
+
+async def refresh_recommendations(
+    session: AsyncSession,
+    user_ids: Union[list, Select],
+    limit: int = RECOMMENDATIONS_LIMIT,
+):
+    """
+    пересчет рекомендаций группы пользователей, сохраняется при commit
+    вызывающей функции
+    :param session: объект сессии
+    :param user_ids: список id или запрос, возвращающий id пользователей
+    :param limit: количество рекомендаций на пользователя
+    """
+
+    await session.execute(
+        delete(FollowRecommendations)
+        .where(FollowRecommendations.user_id.in_(user_ids))
+        .execution_options(synchronize_session=False)
+    )
+    await session.execute(
+        insert(FollowRecommendations).from_select(
+            ["user_id", "recommended_id", "score", "created_on"],
+            recommendations_query(user_ids, limit),
+        )
+    )
+
+
+async def schedule_recommendations_refresh(session: AsyncSession, user_id: int):
+    """
+    отложенный пересчет после изменения подписок пользователя, изменения
+    за время задержки обрабатываются одной задачей
+    :param session: объект сессии
+    :param user_id: id пользователя, подписки которого изменились
+    """
+
+    await enqueue_job(
+        session,
+        "recommendations",
+        {"user_id": user_id},
+        dedup_key=f"recommendations:{user_id}",
+        delay=RECOMMENDATIONS_REFRESH_DELAY,
+    )
+
+
+@job_handler("recommendations")
+async def refresh_user_recommendations(session: AsyncSession, payload: dict):
+    """
+    пересчет для пользователя, подписки которого изменились,
+    и подписанных на него пользователей, для которых изменились
+    подписки второго уровня. Подписанные пересчитываются пачками по
+    RECOMMENDATIONS_BATCH_USERS по возрастанию id: задача обрабатывает пачку
+    и ставит в очередь следующую с after_id
+    """
+
+    user_id = payload["user_id"]
+    after_id = payload.get("after_id")
+    if after_id is None:
+        await refresh_recommendations(session, [user_id])
+        after_id = 0
+
+    user_ids = (
+        await session.scalars(
+            select(Followers.user_id)
+            .where(Followers.follower_id == user_id, Followers.user_id > after_id)
+            .order_by(Followers.user_id)
+            .limit(RECOMMENDATIONS_BATCH_USERS)
+        )
+    ).all()
+    if user_ids:
+        await refresh_recommendations(session, user_ids)
+
+    if len(user_ids) == RECOMMENDATIONS_BATCH_USERS:
+        await enqueue_job(
+            session,
+            "recommendations",
+            {"user_id": user_id, "after_id": user_ids[-1]},
+        )
+
+
+@job_handler("recommendations_all")
+async def refresh_all_recommendations(session: AsyncSession, payload: dict):
+    """
+    полный пересчет пачками по RECOMMENDATIONS_BATCH_USERS пользователей:
+    каждая задача обрабатывает пачку и ставит в очередь следующую,
+    после последней пачки - следующий пересчет через RECOMMENDATIONS_REFRESH_INTERVAL
+    """
+
+    after_id = payload.get("after_id", 0)
+    user_ids = (
+        await session.scalars(
+            select(Users.id)
+            .where(Users.id > after_id)
+            .order_by(Users.id)
+            .limit(RECOMMENDATIONS_BATCH_USERS)
+        )
+    ).all()
+    if user_ids:
+        await refresh_recommendations(session, user_ids)
+
+    # текущая задача освобождает ключ, чтобы его заняла следующая
+    await session.execute(
+        update(Jobs)
+        .where(Jobs.dedup_key == REFRESH_ALL_KEY)
+        .values(dedup_key=None)
+        .execution_options(synchronize_session=False)
+    )
+    if len(user_ids) == RECOMMENDATIONS_BATCH_USERS:
+        await enqueue_job(
+            session,
+            "recommendations_all",
+            {"after_id": user_ids[-1]},
+            dedup_key=REFRESH_ALL_KEY,
+        )
+    else:
+        logger.info("Follow recommendations refreshed")
+        await enqueue_job(
+            session,
+            "recommendations_all",
+            {"after_id": 0},
+            dedup_key=REFRESH_ALL_KEY,
+            delay=RECOMMENDATIONS_REFRESH_INTERVAL,
+        )
+
+
+async def start_recommendations_refresh(session_maker):
+    """
+    постановка в очередь полного пересчета, если его еще нет,
+    вызывается при запуске каждого воркера
+    :param session_maker: фабрика сессий
+    """
+
+    if RECOMMENDATIONS_REFRESH_INTERVAL <= 0:
+        return
+    try:
+        async with session_maker() as session:
+            await enqueue_job(
+                session,
+                "recommendations_all",
+                {"after_id": 0},
+                dedup_key=REFRESH_ALL_KEY,
+            )
+            await session.commit()
+    except Exception as err:
+        logger.error(f"Follow recommendations schedule error: {err}")
+
+
+async def get_recommendations(
+    session: AsyncSession, user_idx: int, limit: int = RECOMMENDATIONS_LIMIT
+) -> dict:
+    """
+    рекомендации пользователя из таблицы follow_recommendations,
+    пользователи, на которых он подписался после пересчета, пропускаются
+    :param session: объект сессии
+    :param user_idx: id пользователя
+    :param limit: количество рекомендаций
+    :return: dict с результатом и списком пользователей
+    """
+
+    followed = select(Followers.id).where(
+        Followers.user_id == user_idx,
+        Followers.follower_id == FollowRecommendations.recommended_id,
+    )
+
+    try:
+        res = await session.execute(
+            select(Users.id, Users.name, FollowRecommendations.score)
+            .join(Users, Users.id == FollowRecommendations.recommended_id)
+            .where(FollowRecommendations.user_id == user_idx, ~followed.exists())
+            .order_by(
+                FollowRecommendations.score.desc(),
+                FollowRecommendations.recommended_id,
+            )
+            .limit(limit)
+        )
+    except Exception as err:
+        logger.error(err)
+        return {
+            "result": False,
+            "error_type": "DB error",
+            "error_message": "Error when accessing the database.",
+        }
+
+    return {
+        "result": True,
+        "users": [{"id": row.id, "name": row.name, "score": row.score} for row in res],
+    }
@@ -0,0 +1,337 @@
+"""
+шардирование данных пользователей по id (models.sharding): подготовка шардов
+и перенос данных пользователей на шарды, выбранные кольцом согласованного
+хэширования - после добавления или удаления шарда и при переходе с одной БД.
+
+Шарды задаются SHARD_DSNS, новый шард добавляется в конец списка.
+Пример запуска из каталога app_twitter/service:
+    python -m utils.sharding init
+    python -m utils.sharding rebalance --from-primary --dry-run
+    python -m utils.sharding rebalance --from-primary
+    python -m utils.sharding rebalance --drain postgresql://tw:tw@shard2:5432/tw
+"""
+import argparse
+import asyncio
+import sys
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Union
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete, bindparam, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from logger.logger import logger
+from models import sharding
+from models.sharding import ShardSessionMaker, SHARD_ID_STRIDE
+from models.models import metadata, Users, Tweets, Likes, Media
+from models.models import TweetTags, TweetMentions
+from .tags import parse_tweet_text
+
+
+# таблицы шарда с id, уникальными на всех шардах: их строки переносятся между шардами
+SHARDED_TABLES = (Tweets, Likes, Media, TweetTags, TweetMentions)
+# строк в одном INSERT при переносе
+MOVE_CHUNK_SIZE = 1000
+
+USER_ROWS = select(Users.id, Users.name, Users.email).where(
+    Users.id.in_(bindparam("user_ids", expanding=True))
+)
+USER_IDS_BY_NAMES = select(Users.id).where(
+    Users.name.in_(bindparam("names", expanding=True))
+)
+TWEET_AUTHOR = select(Tweets.user_id).where(Tweets.id == bindparam("tweet_idx"))
+# пользователи, у которых есть твиты или медиа-файлы
+CONTENT_OWNERS = (
+    select(Tweets.user_id)
+    .union(select(Media.uploader).where(Media.uploader.is_not(None)))
+    .subquery()
+)
+
+
+async def copy_users(session: AsyncSession, content: AsyncSession, user_ids):
+    """
+    копирование строк пользователей (id, name, email) в БД шарда, на них
+    ссылаются внешние ключи твитов, лайков и упоминаний. Существующие строки
+    не меняются, изменения сохраняет commit вызывающей функции
+    :param session: сессия БД, из которой копируются строки
+    :param content: сессия шарда
+    :param user_ids: id пользователей
+    """
+
+    if content is session or not user_ids:
+        return
+    rows = await session.execute(USER_ROWS, {"user_ids": list(set(user_ids))})
+    values = [dict(row) for row in rows.mappings()]
+    if values:
+        await content.execute(pg_insert(Users).values(values).on_conflict_do_nothing())
+
+
+async def copy_tweet_users(
+    session: AsyncSession, content: AsyncSession, user_id: int, tweet_data: str
+):
+    """
+    копирование в БД шарда автора твита и упомянутых в нем пользователей
+    :param session: сессия основной БД
+    :param content: сессия шарда автора
+    :param user_id: id автора
+    :param tweet_data: текст твита
+    """
+
+    if content is session:
+        return
+    user_ids = [user_id]
+    _, mentions = parse_tweet_text(tweet_data)
+    if mentions:
+        user_ids += (
+            await session.scalars(USER_IDS_BY_NAMES, {"names": mentions})
+        ).all()
+    await copy_users(session, content, user_ids)
+
+
+async def locate_tweet(tweet_idx: int) -> Union[tuple, None]:
+    """
+    поиск твита по id на всех шардах параллельно
+    :param tweet_idx: id твита
+    :return: (имя шарда, id автора) или None, если твита нет
+    """
+
+    async def author(session: AsyncSession, name: str):
+        return await session.scalar(TWEET_AUTHOR, {"tweet_idx": tweet_idx})
+
+    found = await sharding.shard_sessions.scatter(author)
+    for name, author_id in found.items():
+        if author_id is not None:
+            return name, author_id
+    return None
+
+
+@asynccontextmanager
+async def tweet_session(session: AsyncSession, tweet_idx: int) -> AsyncIterator[tuple]:
+    """
+    сессия БД, в которой находится твит: без шардов - переданная сессия, commit
+    выполняет вызывающая функция; с шардами - сессия шарда твита, commit при
+    выходе из блока без исключения
+    :param session: сессия основной БД
+    :param tweet_idx: id твита
+    :return: (сессия, id автора - только с шардами, иначе None)
+    :raises LookupError: твит не найден ни на одном шарде
+    """
+
+    if sharding.shard_sessions is None:
+        yield session, None
+        return
+
+    found = await locate_tweet(tweet_idx)
+    if found is None:
+        raise LookupError(f"Tweet id={tweet_idx} not found on shards")
+    name, author_id = found
+    async with sharding.shard_sessions(name) as content:
+        yield content, author_id
+        await content.commit()
+
+
+def sequence_start(floor: int, residue: int, stride: int) -> int:
+    """
+    наименьшее значение больше floor с остатком residue по модулю stride
+    """
+    return floor + 1 + (residue - floor - 1) % stride
+
+
+async def init_shards(
+    shards: ShardSessionMaker, primary: Callable = None, stride: int = SHARD_ID_STRIDE
+) -> dict:
+    """
+    создание таблиц на шардах и настройка последовательностей id: на шарде
+    с номером n генерируются id с остатком n + 1 по модулю stride, поэтому id
+    твитов, лайков и медиа не повторяются на разных шардах и строки можно
+    переносить без изменения id. Последовательности начинаются после
+    наибольшего id шарда и основной БД. Повторный запуск безопасен
+    :param shards: фабрика сессий шардов
+    :param primary: фабрика сессий основной БД
+    :param stride: шаг последовательностей
+    :return: dict с результатом и первым id каждой таблицы на каждом шарде
+    """
+
+    floors = dict.fromkeys((model.__tablename__ for model in SHARDED_TABLES), 0)
+    if primary is not None:
+        async with primary() as session:
+            for table in floors:
+                floors[table] = await session.scalar(
+                    text(f"SELECT coalesce(max(id), 0) FROM {table}")
+                )
+
+    starts = dict()
+    for idx, name in enumerate(shards.names):
+        async with shards.engines[name].begin() as conn:
+            await conn.run_sync(metadata.create_all)
+            starts[name] = dict()
+            for table, floor in floors.items():
+                shard_max = await conn.scalar(
+                    text(f"SELECT coalesce(max(id), 0) FROM {table}")
+                )
+                start = sequence_start(
+                    max(floor, shard_max), (idx + 1) % stride, stride
+                )
+                await conn.execute(
+                    text(
+                        f"ALTER SEQUENCE {table}_id_seq "
+                        f"INCREMENT BY {stride} RESTART WITH {start}"
+                    )
+                )
+                starts[name][table] = start
+        logger.info(f"Shard {name} ready: {starts[name]}")
+
+    return {"result": True, "sequences": starts}
+
+
+async def insert_rows(content: AsyncSession, model, rows: list):
+    """
+    вставка перенесенных строк пачками, уже перенесенные строки пропускаются
+    """
+
+    for start in range(0, len(rows), MOVE_CHUNK_SIZE):
+        chunk = rows[start : start + MOVE_CHUNK_SIZE]
+        await content.execute(pg_insert(model).values(chunk).on_conflict_do_nothing())
+
+
+async def move_user(source: AsyncSession, target: AsyncSession, user_id: int) -> dict:
+    """
+    перенос твитов пользователя с их лайками, хэштегами и упоминаниями и его
+    медиа-файлов. Сначала сохраняются строки на целевом шарде, затем удаляются
+    на исходном: после сбоя между commit повторный перенос пропускает
+    уже перенесенные строки. Секции месяцев старых твитов и лайков создаются
+    на целевом шарде до вставки
+    :param source: сессия исходной БД
+    :param target: сессия целевого шарда
+    :param user_id: id пользователя
+    :return: dict количество перенесенных строк по таблицам
+    """
+
+    # utils.partitions импортирует utils.media, который использует этот модуль
+    from .partitions import ensure_partitions
+
+    tweet_ids = select(Tweets.id).where(Tweets.user_id == user_id)
+    queries = {
+        Tweets: select(Tweets.__table__).where(Tweets.user_id == user_id),
+        Likes: select(Likes.__table__).where(Likes.tweet_id.in_(tweet_ids)),
+        TweetTags: select(TweetTags.__table__).where(TweetTags.tweet_id.in_(tweet_ids)),
+        TweetMentions: select(TweetMentions.__table__).where(
+            TweetMentions.tweet_id.in_(tweet_ids)
+        ),
+        Media: select(Media.__table__).where(Media.uploader == user_id),
+    }
+    rows = dict()
+    for model, query in queries.items():
+        rows[model] = [dict(row) for row in (await source.execute(query)).mappings()]
+
+    user_ids = {user_id}
+    user_ids.update(row["user_id"] for row in rows[Likes])
+    user_ids.update(row["user_id"] for row in rows[TweetMentions])
+    await copy_users(source, target, user_ids)
+    times = [row["created_on"] for model in (Tweets, Likes) for row in rows[model]]
+    if times:
+        await ensure_partitions(target, since=min(times))
+    for model, values in rows.items():
+        await insert_rows(target, model, values)
+    await target.commit()
+
+    for model in (Likes, TweetTags, TweetMentions):
+        await source.execute(
+            delete(model)
+            .where(model.tweet_id.in_(tweet_ids))
+            .execution_options(synchronize_session=False)
+        )
+    await source.execute(delete(Media).where(Media.uploader == user_id))
+    await source.execute(delete(Tweets).where(Tweets.user_id == user_id))
+    await source.commit()
+
+    return {model.__tablename__: len(values) for model, values in rows.items()}
+
+
+async def rebalance(
+    shards: ShardSessionMaker, sources: dict = None, dry_run: bool = False
+) -> dict:
+    """
+    перенос данных пользователей, которые находятся не на своем шарде
+    :param shards: фабрика сессий шардов, кольцо которой задает размещение
+    :param sources: дополнительные источники {имя: фабрика сессий} - основная БД
+    при переходе на шарды или удаляемые шарды
+    :param dry_run: только подсчет пользователей для переноса
+    :return: dict с результатом и количеством пользователей по направлениям
+    """
+
+    sources = {
+        **{name: shards.session_makers[name] for name in shards.names},
+        **(sources or {}),
+    }
+    moved = dict()
+    for source_name, source_maker in sources.items():
+        async with source_maker() as source:
+            owners = (
+                await source.scalars(
+                    select(CONTENT_OWNERS.c.user_id).order_by(CONTENT_OWNERS.c.user_id)
+                )
+            ).all()
+        for user_id in owners:
+            target_name = shards.shard_for(user_id)
+            if target_name == source_name:
+                continue
+            direction = f"{source_name}->{target_name}"
+            moved[direction] = moved.get(direction, 0) + 1
+            if dry_run:
+                continue
+            async with source_maker() as source, shards(target_name) as target:
+                counts = await move_user(source, target, user_id)
+            logger.info(f"User id={user_id} moved {direction}: {counts}")
+
+    return {"result": True, "dry_run": dry_run, "users": moved}
+
+
+async def main(args: argparse.Namespace) -> int:
+    from models.database import async_session_maker, engine
+
+    shards = sharding.shard_sessions
+    if shards is None:
+        logger.error("Sharding is not configured, set SHARD_DSNS")
+        return 1
+
+    drained = ShardSessionMaker(args.drain) if args.drain else None
+    try:
+        if args.command == "init":
+            result = await init_shards(shards, async_session_maker)
+        else:
+            sources = dict()
+            if args.from_primary:
+                sources["primary"] = async_session_maker
+            if drained is not None:
+                for name in drained.names:
+                    sources[f"drain:{name}"] = drained.session_makers[name]
+            result = await rebalance(shards, sources, dry_run=args.dry_run)
+        logger.info(f"{args.command}: {result}")
+        return 0 if result["result"] else 1
+    finally:
+        await shards.dispose()
+        if drained is not None:
+            await drained.dispose()
+        await engine.dispose()
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Shards setup and rebalancing")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("init", help="create tables and id sequences on shards")
+    rebalance_parser = commands.add_parser(
+        "rebalance", help="move users' data to their shards"
+    )
+    rebalance_parser.add_argument(
+        "--from-primary", action="store_true", help="move data out of DB_* database"
+    )
+    rebalance_parser.add_argument(
+        "--drain", action="append", default=[], help="DSN of a removed shard"
+    )
+    rebalance_parser.add_argument("--dry-run", action="store_true")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,50 @@
+import json
+from typing import AsyncIterator, Iterable
+
+
+def encode_json(obj) -> bytes:
+    """
+    JSON в том же виде, что и JSONResponse.render
+    """
+
+    return json.dumps(
+        obj, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def encode_items(items: Iterable) -> bytes:
+    """
+    элементы массива JSON через запятую, без скобок
+    """
+
+    return b",".join(encode_json(item) for item in items)
+
+
+async def json_object_stream(
+    head: dict, key: str, chunks: AsyncIterator[list]
+) -> AsyncIterator[bytes]:
+    """
+    потоковое формирование JSON-объекта head с массивом key, элементы которого
+    поступают пачками: каждая пачка кодируется и отдается отдельно, поэтому
+    память ограничена размером пачки, а не размером ответа.
+    Результат совпадает с JSONResponse(content={**head, key: [...]})
+    :param head: поля объекта до массива
+    :param key: имя поля массива
+    :param chunks: асинхронный итератор списков элементов массива
+    :return: асинхронный итератор частей тела ответа
+    """
+
+    prefix = encode_json(head)[:-1]
+    if head:
+        prefix += b","
+    yield prefix + encode_json(key) + b":["
+
+    first = True
+    async for items in chunks:
+        if not items:
+            continue
+        body = encode_items(items)
+        yield body if first else b"," + body
+        first = False
+
+    yield b"]}"
@@ -0,0 +1,149 @@
+import heapq
+import re
+from itertools import islice
+from typing import Union
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, insert
+
+from logger.logger import logger
+from models import sharding
+from models.models import Users, TweetTags, TweetMentions
+
+
+TAG_MAX_LENGTH = 100
+
+TAG_PATTERN = re.compile(r"(?<![\w#])#(\w+)")
+MENTION_PATTERN = re.compile(r"(?<![\w@])@(\w+)")
+
+
+def normalize_tag(tag: str) -> str:
+    """
+    приведение хэштега к виду, в котором он хранится в индексе
+    :param tag: хэштег с символом # или без него
+    :return: хэштег в нижнем регистре
+    """
+    return tag.lstrip("#").lower()[:TAG_MAX_LENGTH]
+
+
+def parse_tweet_text(tweet_data: str) -> tuple:
+    """
+    выделение хэштегов и упоминаний из текста твита
+    :param tweet_data: текст твита
+    :return: кортеж (список хэштегов, список имен упомянутых пользователей),
+             без повторов и в порядке появления в тексте
+    """
+
+    if not tweet_data:
+        return [], []
+
+    tags = list(
+        dict.fromkeys(normalize_tag(tag) for tag in TAG_PATTERN.findall(tweet_data))
+    )
+    mentions = list(dict.fromkeys(MENTION_PATTERN.findall(tweet_data)))
+
+    return tags, mentions
+
+
+async def save_tweet_tags(session: AsyncSession, tweet_id: int, tweet_data: str):
+    """
+    запись хэштегов и упоминаний твита в индексные таблицы,
+    commit выполняет вызывающая функция
+    :param session: объект сессии
+    :param tweet_id: id твита
+    :param tweet_data: текст твита
+    :return: кортеж (список хэштегов, список id упомянутых пользователей)
+    """
+
+    tags, mentions = parse_tweet_text(tweet_data)
+
+    if tags:
+        await session.execute(
+            insert(TweetTags), [{"tag": tag, "tweet_id": tweet_id} for tag in tags]
+        )
+
+    mentioned_ids = []
+    if mentions:
+        res = await session.scalars(select(Users.id).where(Users.name.in_(mentions)))
+        mentioned_ids = res.all()
+
+    if mentioned_ids:
+        await session.execute(
+            insert(TweetMentions),
+            [{"user_id": user_id, "tweet_id": tweet_id} for user_id in mentioned_ids],
+        )
+
+    return tags, mentioned_ids
+
+
+async def page_ids(session: AsyncSession, query, limit: int) -> list:
+    """
+    страница id твитов по убыванию id. Хэштеги и упоминания хранятся на шарде
+    автора твита, поэтому при шардировании запрос выполняется на всех шардах:
+    id на шардах не пересекаются, страница - первые limit id слияния
+    :param session: объект сессии основной БД
+    :param query: запрос id с сортировкой по убыванию и limit
+    :param limit: размер страницы
+    :return: список id твитов
+    """
+
+    if sharding.shard_sessions is None:
+        return (await session.scalars(query)).all()
+
+    async def shard_ids(content: AsyncSession, name: str) -> list:
+        return (await content.scalars(query)).all()
+
+    parts = await sharding.shard_sessions.scatter(shard_ids)
+    return list(islice(heapq.merge(*parts.values(), reverse=True), limit))
+
+
+async def tag_tweet_ids(
+    session: AsyncSession, tag: str, before_id: Union[int, None], limit: int
+) -> list:
+    """
+    страница id твитов с хэштегом, по убыванию id (keyset-пагинация)
+    :param session: объект сессии
+    :param tag: хэштег
+    :param before_id: курсор - id последнего твита предыдущей страницы
+    :param limit: размер страницы
+    :return: список id твитов
+    """
+
+    query = select(TweetTags.tweet_id).where(TweetTags.tag == normalize_tag(tag))
+    if before_id:
+        query = query.where(TweetTags.tweet_id < before_id)
+
+    try:
+        return await page_ids(
+            session, query.order_by(TweetTags.tweet_id.desc()).limit(limit), limit
+        )
+    except Exception as err:
+        logger.error(err)
+
+    return []
+
+
+async def mention_tweet_ids(
+    session: AsyncSession, user_idx: int, before_id: Union[int, None], limit: int
+) -> list:
+    """
+    страница id твитов, в которых упомянут пользователь (keyset-пагинация)
+    :param session: объект сессии
+    :param user_idx: id упомянутого пользователя
+    :param before_id: курсор - id последнего твита предыдущей страницы
+    :param limit: размер страницы
+    :return: список id твитов
+    """
+
+    query = select(TweetMentions.tweet_id).where(TweetMentions.user_id == user_idx)
+    if before_id:
+        query = query.where(TweetMentions.tweet_id < before_id)
+
+    try:
+        return await page_ids(
+            session, query.order_by(TweetMentions.tweet_id.desc()).limit(limit), limit
+        )
+    except Exception as err:
+        logger.error(err)
+
+    return []
@@ -0,0 +1,220 @@
+import asyncio
+import heapq
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Iterable, Union
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, insert, delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from config import get_settings
+from logger.logger import logger
+from models.models import TrendBuckets, TrendingTags
+
+
+settings = get_settings()
+
+TRENDS_BUCKET_SECONDS = settings.TRENDS_BUCKET_SECONDS
+TRENDS_WINDOW_BUCKETS = settings.TRENDS_WINDOW_BUCKETS
+TRENDS_HALF_LIFE = settings.TRENDS_HALF_LIFE
+TRENDS_TOP_K = settings.TRENDS_TOP_K
+TRENDS_SNAPSHOT_INTERVAL = settings.TRENDS_SNAPSHOT_INTERVAL
+
+# ключ advisory-блокировки (hashtext имени): снимок пересчитывает только один воркер
+TRENDS_LOCK_NAME = "trending_tags"
+
+
+class TrendingCounter:
+    """
+    изменения счетчиков хэштегов воркера по временным интервалам (buckets),
+    накапливаются при создании и удалении твитов и записываются в общую
+    таблицу trend_buckets. Популярность считается по строкам таблицы:
+    скользящее окно интервалов, вес интервала экспоненциально затухает с возрастом
+    """
+
+    def __init__(
+        self,
+        bucket_seconds: int = TRENDS_BUCKET_SECONDS,
+        window_buckets: int = TRENDS_WINDOW_BUCKETS,
+        half_life: float = TRENDS_HALF_LIFE,
+    ):
+        self.bucket_seconds = bucket_seconds
+        self.window_buckets = window_buckets
+        self.half_life = half_life
+        # изменения, еще не записанные в общую таблицу: (тег, интервал) -> delta
+        self.pending = Counter()
+
+    def bucket_of(self, ts: float) -> int:
+        return int(ts // self.bucket_seconds) * self.bucket_seconds
+
+    def window_start(self, now: float) -> int:
+        return self.bucket_of(now) - (self.window_buckets - 1) * self.bucket_seconds
+
+    def add(self, tags: Iterable[str], ts: float = None, delta: int = 1):
+        """
+        учет хэштегов твита
+        :param tags: хэштеги твита
+        :param ts: время создания твита, по умолчанию - текущее
+        :param delta: 1 - твит создан, -1 - твит удален
+        """
+
+        now = time.time()
+        ts = now if ts is None else ts
+        bucket = self.bucket_of(ts)
+        if bucket < self.window_start(now):
+            return
+
+        for tag in tags:
+            self.pending[(tag, bucket)] += delta
+
+    def remove(self, tags: Iterable[str], ts: float):
+        self.add(tags, ts, delta=-1)
+
+    def drain(self) -> list:
+        """
+        изменения счетчиков с момента предыдущего вызова
+        :return: список (тег, интервал, delta)
+        """
+        pending = [(tag, b, delta) for (tag, b), delta in self.pending.items() if delta]
+        self.pending = Counter()
+        return pending
+
+    def top(self, rows: Iterable, k: int = TRENDS_TOP_K, now: float = None) -> list:
+        """
+        k самых популярных хэштегов с учетом затухания
+        :param rows: счетчики (тег, интервал, количество), интервалы вне окна пропускаются
+        :return: список (тег, вес) по убыванию веса
+        """
+
+        now = time.time() if now is None else now
+        start = self.window_start(now)
+
+        scores = Counter()
+        for tag, bucket, count in rows:
+            if bucket < start:
+                continue
+            age = now - (bucket + self.bucket_seconds / 2)
+            scores[tag] += count * 0.5 ** (max(age, 0) / self.half_life)
+
+        return heapq.nlargest(
+            k,
+            ((tag, score) for tag, score in scores.items() if score > 0),
+            key=lambda item: item[1],
+        )
+
+
+trending_counter = TrendingCounter()
+
+
+async def flush_trends(session: AsyncSession, counter: TrendingCounter = None):
+    """
+    запись накопленных воркером изменений счетчиков в общую таблицу
+    :param session: объект сессии
+    :param counter: счетчик воркера
+    :return: количество записанных изменений
+    """
+
+    counter = counter or trending_counter
+    pending = counter.drain()
+    if not pending:
+        return 0
+
+    query = pg_insert(TrendBuckets).values(
+        [
+            {"tag": tag, "bucket": bucket, "count": delta}
+            for tag, bucket, delta in pending
+        ]
+    )
+    try:
+        await session.execute(
+            query.on_conflict_do_update(
+                index_elements=[TrendBuckets.tag, TrendBuckets.bucket],
+                set_={"count": TrendBuckets.count + query.excluded.count},
+            )
+        )
+        await session.commit()
+    except Exception:
+        # изменения вернутся в очередь и будут записаны при следующей попытке
+        for tag, bucket, delta in pending:
+            counter.pending[(tag, bucket)] += delta
+        raise
+
+    return len(pending)
+
+
+async def snapshot_trends(session: AsyncSession, k: int = TRENDS_TOP_K) -> bool:
+    """
+    пересчет снимка популярных хэштегов по общей таблице счетчиков
+    :param session: объект сессии
+    :param k: размер списка
+    :return: True если снимок обновлен этим воркером
+    """
+
+    locked = await session.scalar(
+        select(func.pg_try_advisory_xact_lock(func.hashtext(TRENDS_LOCK_NAME)))
+    )
+    if not locked:
+        await session.rollback()
+        return False
+
+    now = time.time()
+    start = trending_counter.window_start(now)
+
+    await session.execute(delete(TrendBuckets).where(TrendBuckets.bucket < start))
+    rows = await session.execute(
+        select(TrendBuckets.tag, TrendBuckets.bucket, TrendBuckets.count)
+    )
+    top = trending_counter.top(rows, k, now)
+    updated_on = datetime.now()
+
+    await session.execute(delete(TrendingTags))
+    if top:
+        await session.execute(
+            insert(TrendingTags),
+            [
+                {"rank": rank, "tag": tag, "score": score, "updated_on": updated_on}
+                for rank, (tag, score) in enumerate(top, start=1)
+            ],
+        )
+    await session.commit()
+
+    return True
+
+
+async def get_trending_tags(session: AsyncSession, limit: int) -> list:
+    """
+    список популярных хэштегов из последнего снимка
+    :param session: объект сессии
+    :param limit: размер списка
+    :return: список хэштегов с весами
+    """
+
+    try:
+        res = await session.scalars(
+            select(TrendingTags).order_by(TrendingTags.rank).limit(limit)
+        )
+        return [obj.to_json() for obj in res]
+    except Exception as err:
+        logger.error(err)
+
+    return []
+
+
+async def trends_snapshot_loop(session_maker, interval: Union[int, float] = None):
+    """
+    фоновая задача воркера: периодическая запись счетчиков и пересчет снимка
+    :param session_maker: фабрика сессий
+    :param interval: период в секундах
+    """
+
+    interval = interval or TRENDS_SNAPSHOT_INTERVAL
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with session_maker() as session:
+                await flush_trends(session)
+                await snapshot_trends(session)
+        except Exception as err:
+            logger.error(f"Trending tags snapshot error: {err}")
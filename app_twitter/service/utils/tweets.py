@@ -1,53 +1,340 @@
 import datetime
+import heapq
 from pprint import pprint
-from typing import Any
+from typing import Any, AsyncIterator, Union
 from pathlib import Path, PurePath, PurePosixPath
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, insert, update, delete
+from sqlalchemy import select, insert, update, delete, literal, bindparam, lambda_stmt
 
 
+from config import get_settings
 from logger.logger import logger
 from models.models import Users, Followers, Tweets, Likes, Media
+from models.models import TweetTags, TweetMentions
+from models import sharding
+from models.sharding import shard_session
 from .users import update_user_last_activity, check_user_exists
-from .media import link_media_to_tweet, delete_media, MEDIA_DIR
+from .media import link_media_to_tweet, delete_media, MediaLinkError, MEDIA_DIR
+from .tags import save_tweet_tags, parse_tweet_text
+from .trends import trending_counter
+from .events import publish_event, publish_events
+from .follow_graph import follow_graph
+from .ranking import ranked_feed, update_engagement
+from .etags import bump_content_version
+from .sharding import copy_users, copy_tweet_users, locate_tweet, tweet_session
+
+
+# лента формируется одним SQL-запросом в JSON на стороне postgres (tweets_list_json)
+FEED_FAST_PATH = get_settings().FEED_FAST_PATH
+# твитов в пачке потоковой ленты (stream_tweets_list)
+FEED_STREAM_CHUNK_SIZE = get_settings().FEED_STREAM_CHUNK_SIZE
+# глубина ленты в днях, 0 - вся история
+FEED_WINDOW_DAYS = get_settings().FEED_WINDOW_DAYS
+# окно кандидатов ранжированной ленты с учетом времени жизни их кэша
+RANK_WINDOW = get_settings().RANK_WINDOW + get_settings().RANK_CACHE_TTL
+
+# выражения частых запросов создаются один раз, значения передаются при выполнении.
+# tweets и likes секционированы по created_on: условие created_on >= since
+# ограничивает запрос секциями окна ленты, лайк не старше своего твита
+FEED_TWEET_IDS = (
+    select(Tweets.id)
+    .join(Users)
+    .join(Followers)
+    .where(
+        Followers.follower_id == bindparam("user_idx"),
+        Tweets.created_on >= bindparam("since"),
+    )
+)
+FEED_TWEETS = (
+    select(Tweets.id, Tweets.tweetdata, Users.id, Users.name)
+    .join(Users)
+    .join(Followers)
+    .where(
+        Followers.follower_id == bindparam("user_idx"),
+        Tweets.created_on >= bindparam("since"),
+    )
+    .order_by(Tweets.id.desc())
+)
+TWEETS_BY_IDS = (
+    select(Tweets.id, Tweets.tweetdata, Users.id, Users.name)
+    .join(Users)
+    .where(
+        Tweets.id.in_(bindparam("tweet_ids", expanding=True)),
+        Tweets.created_on >= bindparam("since"),
+    )
+)
+
+LIKES_WITH_NAMES = (
+    select(Likes.user_id, Likes.tweet_id, Users.name).join(Users).order_by(Likes.id)
+)
+LIKES_BY_TWEET_IDS = LIKES_WITH_NAMES.where(
+    Likes.tweet_id.in_(bindparam("tweet_ids", expanding=True)),
+    Likes.created_on >= bindparam("since"),
+)
+FEED_LIKES = LIKES_WITH_NAMES.where(
+    Likes.tweet_id.in_(FEED_TWEET_IDS), Likes.created_on >= bindparam("since")
+)
+
+MEDIA_COLUMNS = select(Media.id, Media.filepath, Media.tweet_id).order_by(Media.id)
+MEDIA_BY_TWEET_IDS = MEDIA_COLUMNS.where(
+    Media.tweet_id.in_(bindparam("tweet_ids", expanding=True))
+)
+FEED_MEDIA = MEDIA_COLUMNS.where(Media.tweet_id.in_(FEED_TWEET_IDS))
+
+# твит по id ищется сначала в секциях окна ленты (tweet_lookup)
+TWEET_EXISTS = select(Tweets.id).where(
+    Tweets.id == bindparam("tweet_idx"), Tweets.created_on >= bindparam("since")
+)
+USERS_TWEET_EXISTS = select(Tweets.id).where(
+    Tweets.id == bindparam("tweet_idx"),
+    Tweets.user_id == bindparam("user_idx"),
+    Tweets.created_on >= bindparam("since"),
+)
+FOLLOWS_TWEET_EXISTS = select(Tweets.id).where(
+    Tweets.user_id.in_(
+        select(Followers.follower_id).where(Followers.user_id == bindparam("user_idx"))
+    ),
+    Tweets.id == bindparam("tweet_idx"),
+    Tweets.created_on >= bindparam("since"),
+)
+TWEET_AUTHOR = select(Tweets.user_id).where(
+    Tweets.id == bindparam("tweet_idx"), Tweets.created_on >= bindparam("since")
+)
+
+# лента при шардировании: авторы - из основной БД, твиты - с шардов авторов
+FEED_AUTHOR_IDS = select(Followers.user_id).where(
+    Followers.follower_id == bindparam("user_idx")
+)
+FOLLOWS_AUTHOR = select(Followers.id).where(
+    Followers.user_id == bindparam("user_idx"),
+    Followers.follower_id == bindparam("author_id"),
+)
+SHARD_FEED_TWEETS = (
+    select(Tweets.id, Tweets.tweetdata, Users.id, Users.name, Tweets.created_on)
+    .join(Users)
+    .where(
+        Tweets.user_id.in_(bindparam("author_ids", expanding=True)),
+        Tweets.created_on >= bindparam("since"),
+    )
+    .order_by(Tweets.created_on.desc(), Tweets.id.desc())
+)
+
+
+def feed_since(days: int = None) -> datetime.datetime:
+    """
+    начало окна ленты: твиты и лайки раньше него запросы ленты не читают.
+    Окно начинается с полуночи и сдвигается раз в сутки, начало входит в ETag ленты
+    :param days: глубина окна в днях, по умолчанию FEED_WINDOW_DAYS
+    :return: время начала окна, при глубине 0 - datetime.min
+    """
+
+    days = FEED_WINDOW_DAYS if days is None else days
+    if not days:
+        return datetime.datetime.min
+    start = datetime.date.today() - datetime.timedelta(days=days)
+    return datetime.datetime.combine(start, datetime.time())
+
+
+async def tweet_lookup(session: AsyncSession, statement, params: dict):
+    """
+    запрос твита по id: id не содержит даты, поэтому сначала читаются только
+    секции окна ленты, куда приходятся почти все обращения, и только если твит
+    не найден - все секции
+    :param session: экземпляр сессии работы с БД
+    :param statement: выражение с параметром since
+    :param params: значения остальных параметров
+    :return: первое значение первой строки результата или None
+    """
+
+    value = await session.scalar(statement, dict(params, since=feed_since()))
+    if value is None and FEED_WINDOW_DAYS:
+        value = await session.scalar(
+            statement, dict(params, since=datetime.datetime.min)
+        )
+    return value
 
 
 async def add_tweet(
     session: AsyncSession, user_idx: int, tweet_data: str, tweet_media_ids: tuple
 ):
     """
-    добавление твита
+    добавление твита, твит и привязка картинок сохраняются одним commit
     :param session:
     :param tweet_data: текст твита
     :param tweet_media_ids: список id картинок добавленных к твиту
     :param user_idx: id пользователя создавшего твит
     :return: id созданного твита
+    :raises MediaLinkError: если картинки не могут быть привязаны, твит не создается
     """
 
     try:
-        res_insert_tweet = await session.execute(
-            insert(Tweets)
-            .values(tweetdata=tweet_data, user_id=user_idx)
-            .returning(Tweets.id)
-        )
+        # твит, его хэштеги и картинки - на шарде автора, если шарды настроены
+        async with shard_session(session, user_idx) as content:
+            await copy_tweet_users(session, content, user_idx, tweet_data)
+            res_insert_tweet = await content.execute(
+                lambda_stmt(
+                    lambda: insert(Tweets)
+                    .values(tweetdata=tweet_data, user_id=user_idx)
+                    .returning(Tweets.id)
+                )
+            )
+            tweet_id = res_insert_tweet.scalars().one()
+
+            tags, _ = await save_tweet_tags(content, tweet_id, tweet_data)
+
+            # если был передан media_id то привязывем строку с мадиаданными к твиту,
+            # id 0 клиенты передают, когда картинок нет
+            media_ids = tuple(idx for idx in tweet_media_ids if idx > 0)
+            if len(media_ids) > 0:
+                await link_media_to_tweet(content, media_ids, tweet_id, user_idx)
 
+        await bump_content_version(session, user_id=user_idx)
         await update_user_last_activity(session, user_id=user_idx)
+        await publish_event(session, "tweet", tweet_id, author_id=user_idx)
         await session.commit()
 
-        tweet_id = res_insert_tweet.scalars().one()
-
-        # если был передан media_id то привязывем строку с мадиаданными к твиту
-        if len(tweet_media_ids) > 0:
-            await link_media_to_tweet(session, tweet_media_ids, tweet_id)
+        trending_counter.add(tags)
 
         return tweet_id
+    except MediaLinkError as err:
+        logger.info(f"{err}, tweet of user id={user_idx} not created")
+        await session.rollback()
+        raise
     except Exception as err:
         logger.error(err)
 
     return None
 
 
+def group_likes(rows) -> dict:
+    """
+    группировка строк лайков по id твита
+    :param rows: строки с полями user_id, tweet_id, name
+    :return: словарь {id твита: список лайков}
+    """
+
+    likes = dict()
+    for like in rows:
+        if like.tweet_id in likes:
+            likes[like.tweet_id].append({"user_id": like.user_id, "name": like.name})
+        else:
+            likes[like.tweet_id] = [
+                {"user_id": like.user_id, "name": like.name},
+            ]
+
+    return likes
+
+
+def group_media(rows) -> dict:
+    """
+    группировка путей к медиа-файлам по id твита
+    :param rows: строки с полями filepath, tweet_id
+    :return: словарь {id твита: список путей к файлам}
+    """
+
+    media_dict = dict()
+    for media in rows:
+        if media.tweet_id in media_dict.keys():
+            media_dict[media.tweet_id].append(
+                str(Path(Path(MEDIA_DIR).stem).joinpath(media.filepath))
+            )
+        else:
+            media_dict[media.tweet_id] = [
+                str(Path(Path(MEDIA_DIR).stem).joinpath(media.filepath)),
+            ]
+
+    return media_dict
+
+
+def format_tweet(tweet, media_dict: dict, likes: dict) -> dict:
+    """
+    твит в формате ленты
+    :param tweet: строка с полями id, tweetdata, id_1 (id автора), name
+    :param media_dict: результат group_media
+    :param likes: результат group_likes
+    :return: словарь твита
+    """
+
+    return {
+        "id": tweet.id,
+        "content": tweet.tweetdata,
+        "author": {"id": tweet.id_1, "name": tweet.name},
+        "attachments": media_dict.get(tweet.id),
+        "likes": likes.get(tweet.id, []),
+    }
+
+
+async def get_likes_for_tweets(
+    session: AsyncSession, tweet_ids: list, since: datetime.datetime = None
+) -> dict:
+    """
+    лайки для набора твитов, сгруппированные по id твита
+    :param session: экземпляр сессии работы с БД
+    :param tweet_ids: список id твитов
+    :param since: твиты созданы не раньше, читаются только секции лайков после него
+    :return: словарь {id твита: список лайков}
+    """
+
+    res_likes_list = await session.execute(
+        LIKES_BY_TWEET_IDS,
+        {"tweet_ids": list(tweet_ids), "since": since or datetime.datetime.min},
+    )
+    return group_likes(res_likes_list)
+
+
+async def get_media_for_tweets(session: AsyncSession, tweet_ids: list) -> dict:
+    """
+    пути к медиа-файлам для набора твитов, сгруппированные по id твита
+    :param session: экземпляр сессии работы с БД
+    :param tweet_ids: список id твитов
+    :return: словарь {id твита: список путей к файлам}
+    """
+
+    res = await session.execute(MEDIA_BY_TWEET_IDS, {"tweet_ids": list(tweet_ids)})
+    return group_media(res)
+
+
+async def tweets_by_ids(
+    session: AsyncSession, tweet_ids: list, since: datetime.datetime = None
+) -> list:
+    """
+    формирование списка твитов по их id, в формате ленты
+    :param session: экземпляр сессии работы с БД
+    :param tweet_ids: список id твитов, задает порядок твитов в результате
+    :param since: твиты созданы не раньше, читаются только секции после него
+    :return: список твитов
+    """
+
+    if not tweet_ids:
+        return []
+
+    since = since or datetime.datetime.min
+
+    async def load(content: AsyncSession, name: str = None) -> dict:
+        likes = await get_likes_for_tweets(content, tweet_ids, since)
+        media_dict = await get_media_for_tweets(content, tweet_ids)
+        res = await content.execute(
+            TWEETS_BY_IDS, {"tweet_ids": list(tweet_ids), "since": since}
+        )
+        return {tweet.id: format_tweet(tweet, media_dict, likes) for tweet in res}
+
+    try:
+        if sharding.shard_sessions is not None:
+            # твиты страницы могут быть на разных шардах, твит с лайками и
+            # картинками - на одном
+            tweets = dict()
+            for part in (await sharding.shard_sessions.scatter(load)).values():
+                tweets.update(part)
+        else:
+            tweets = await load(session)
+    except Exception as err:
+        logger.error(err)
+        return []
+
+    return [tweets[idx] for idx in tweet_ids if idx in tweets]
+
+
 async def tweets_list(session: AsyncSession, user_idx: int) -> list:
     """
     формирование ленты с твитами
@@ -56,57 +343,64 @@ async def tweets_list(session: AsyncSession, user_idx: int) -> list:
     :return: список твитов для пользователя
     """
 
+    if sharding.shard_sessions is not None:
+        return await sharded_tweets_list(session, user_idx)
+
     try:
-        # получение списка id твитов в ленте
-        query_tweets_id = (
-            select(Tweets.id)
-            .join(Users)
-            .join(Followers)
-            .where(Followers.follower_id == user_idx)
-        )
+        params = {"user_idx": user_idx, "since": feed_since()}
         # получение списка лайков для ленты твитов
-        query_likes_list = (
-            select(Likes.user_id, Likes.tweet_id, Users.name)
-            .join(Users)
-            .where(Likes.tweet_id.in_(query_tweets_id))
-        )
-
-        res_likes_list = await session.execute(query_likes_list)
-        likes = dict()
-        for like in res_likes_list:
-            if like.tweet_id in likes:
-                likes[like.tweet_id].append(
-                    {"user_id": like.user_id, "name": like.name}
-                )
-            else:
-                likes[like.tweet_id] = [
-                    {"user_id": like.user_id, "name": like.name},
-                ]
+        likes = group_likes(await session.execute(FEED_LIKES, params))
 
         # подготовка списка прикрепленных медиа
-        query_media = select(Media.id, Media.filepath, Media.tweet_id).where(
-            Media.tweet_id.in_(query_tweets_id)
-        )
-        res = await session.execute(query_media)
-        media_dict = dict()
-        for media in res:
-            if media.tweet_id in media_dict.keys():
-                media_dict[media.tweet_id].append(
-                    str(Path(Path(MEDIA_DIR).stem).joinpath(media.filepath))
-                )
-            else:
-                media_dict[media.tweet_id] = [
-                    str(Path(Path(MEDIA_DIR).stem).joinpath(media.filepath)),
-                ]
-
-        query_tweets = (
-            select(Tweets.id, Tweets.tweetdata, Users.id, Users.name)
-            .join(Users)
-            .join(Followers)
-            .where(Followers.follower_id == user_idx)
+        media_dict = group_media(await session.execute(FEED_MEDIA, params))
+
+        res = await session.execute(FEED_TWEETS, params)
+
+        await update_user_last_activity(session, user_id=user_idx)
+        await session.commit()
+
+    except Exception as err:
+        logger.error(err)
+
+        return []
+
+    return [format_tweet(tweet, media_dict, likes) for tweet in res]
+
+
+async def sharded_tweets_list(session: AsyncSession, user_idx: int) -> list:
+    """
+    лента при шардировании (scatter-gather): авторы группируются по шардам,
+    шарды с авторами опрашиваются параллельно, каждый возвращает твиты своих
+    авторов с лайками и картинками по убыванию created_on, списки шардов
+    сливаются heapq.merge. id твитов на разных шардах не упорядочены по времени,
+    поэтому лента упорядочена по (created_on, id)
+    :param session: экземпляр сессии работы с основной БД
+    :param user_idx: id пользователя
+    :return: список твитов для пользователя
+    """
+
+    shards = sharding.shard_sessions
+
+    async def shard_feed(content: AsyncSession, name: str) -> list:
+        res = await content.execute(
+            SHARD_FEED_TWEETS, {"author_ids": authors[name], "since": since}
         )
+        rows = res.all()
+        tweet_ids = [tweet.id for tweet in rows]
+        likes = await get_likes_for_tweets(content, tweet_ids, since)
+        media_dict = await get_media_for_tweets(content, tweet_ids)
+        return [
+            ((tweet.created_on, tweet.id), format_tweet(tweet, media_dict, likes))
+            for tweet in rows
+        ]
+
+    since = feed_since()
+    try:
+        authors = dict()
+        for author_id in await session.scalars(FEED_AUTHOR_IDS, {"user_idx": user_idx}):
+            authors.setdefault(shards.shard_for(author_id), []).append(author_id)
 
-        res = await session.execute(query_tweets)
+        parts = await shards.scatter(shard_feed, authors)
 
         await update_user_last_activity(session, user_id=user_idx)
         await session.commit()
@@ -116,21 +410,135 @@ async def tweets_list(session: AsyncSession, user_idx: int) -> list:
 
         return []
 
-    result_tweet_list = list()
-    for tweet in res:
-        if tweet.id not in likes:
-            likes[tweet.id] = []
-        result_tweet_list.append(
-            {
-                "id": tweet.id,
-                "content": tweet.tweetdata,
-                "author": {"id": tweet.id_1, "name": tweet.name},
-                "attachments": media_dict.get(tweet.id),
-                "likes": likes[tweet.id],
-            }
+    merged = heapq.merge(*parts.values(), key=lambda item: item[0], reverse=True)
+    return [tweet for _, tweet in merged]
+
+
+async def stream_tweets_list(
+    session: AsyncSession, user_idx: int, chunk_size: int = FEED_STREAM_CHUNK_SIZE
+) -> AsyncIterator[list]:
+    """
+    лента пачками по chunk_size твитов: твиты читаются курсором на стороне
+    сервера, лайки и медиа запрашиваются для каждой пачки, поэтому в памяти
+    находится только текущая пачка. Используется для StreamingResponse
+    :param session: экземпляр сессии работы с БД, открыт до конца чтения
+    :param user_idx: id пользователя
+    :param chunk_size: твитов в пачке
+    :return: асинхронный итератор списков твитов в формате ленты
+    """
+
+    if sharding.shard_sessions is not None:
+        # курсор открыт на одной БД, лента с шардов собирается целиком
+        yield await sharded_tweets_list(session, user_idx)
+        return
+
+    since = feed_since()
+    try:
+        result = await session.stream(
+            FEED_TWEETS,
+            {"user_idx": user_idx, "since": since},
+            execution_options={"yield_per": chunk_size},
+        )
+        async for rows in result.partitions():
+            tweet_ids = [tweet.id for tweet in rows]
+            likes = await get_likes_for_tweets(session, tweet_ids, since)
+            media_dict = await get_media_for_tweets(session, tweet_ids)
+            yield [format_tweet(tweet, media_dict, likes) for tweet in rows]
+
+        await update_user_last_activity(session, user_id=user_idx)
+        await session.commit()
+
+    except Exception as err:
+        # заголовки уже отправлены, обрыв потока - признак ошибки для клиента
+        logger.error(err)
+        await session.rollback()
+        raise
+
+
+async def ranked_tweets_list(session: AsyncSession, user_idx: int, limit: int) -> list:
+    """
+    ранжированная лента: кандидаты и их счетчики берутся из кэша ranked_feed,
+    из БД (при шардировании - с шардов) загружаются только твиты страницы
+    :param session: экземпляр сессии работы с БД
+    :param user_idx: id пользователя
+    :param limit: количество твитов
+    :return: список твитов по убыванию score
+    """
+
+    try:
+        ids = await ranked_feed.top_ids(session, user_idx, limit)
+        await update_user_last_activity(session, user_id=user_idx)
+        await session.commit()
+    except Exception as err:
+        logger.error(err)
+        return []
+
+    # кандидаты ranked_feed выбраны из окна RANK_WINDOW
+    since = datetime.datetime.now() - datetime.timedelta(seconds=RANK_WINDOW)
+    return await tweets_by_ids(session, ids, since)
+
+
+# ответ GET /api/tweets целиком, в том же формате что и tweets_list:
+# лайки и пути к картинкам собираются json_agg во вложенных подзапросах
+FEED_JSON_SQL = """
+SELECT json_build_object(
+    'result', true,
+    'tweets', coalesce(json_agg(json_build_object(
+        'id', t.id,
+        'content', t.tweetdata,
+        'author', json_build_object('id', u.id, 'name', u.name),
+        'attachments', (
+            SELECT json_agg($2::text || m.filepath ORDER BY m.id)
+            FROM media m
+            WHERE m.tweet_id = t.id
+        ),
+        'likes', coalesce((
+            SELECT json_agg(
+                json_build_object('user_id', l.user_id, 'name', lu.name)
+                ORDER BY l.id
+            )
+            FROM likes l
+            JOIN users lu ON lu.id = l.user_id
+            WHERE l.tweet_id = t.id AND l.created_on >= $3
+        ), '[]')
+    ) ORDER BY t.id DESC), '[]')
+)::text
+FROM tweets t
+JOIN users u ON u.id = t.user_id
+JOIN followers f ON f.user_id = u.id
+WHERE f.follower_id = $1 AND t.created_on >= $3
+"""
+
+MEDIA_URL_PREFIX = str(Path(Path(MEDIA_DIR).stem)) + "/"
+
+
+async def tweets_list_json(session: AsyncSession, user_idx: int) -> Union[bytes, None]:
+    """
+    формирование ответа с лентой твитов одним запросом через соединение asyncpg,
+    без разбора строк результата в python
+    :param session: экземпляр сессии работы с БД
+    :param user_idx: id пользователя
+    :return: тело ответа в JSON, None - ленту нужно сформировать tweets_list
+    """
+
+    if sharding.shard_sessions is not None:
+        return None
+
+    try:
+        connection = await session.connection()
+        raw_connection = await connection.get_raw_connection()
+        body = await raw_connection.driver_connection.fetchval(
+            FEED_JSON_SQL, user_idx, MEDIA_URL_PREFIX, feed_since()
         )
 
-    return result_tweet_list
+        await update_user_last_activity(session, user_id=user_idx)
+        await session.commit()
+
+    except Exception as err:
+        logger.error(err)
+        return None
+
+    return body.encode()
 
 
 async def check_tweet_exists(session: AsyncSession, tweet_idx: int) -> bool:
@@ -142,10 +550,10 @@ async def check_tweet_exists(session: AsyncSession, tweet_idx: int) -> bool:
     """
 
     try:
-        tweet_id = await session.execute(
-            select(Tweets.id).where(Tweets.id == tweet_idx)
-        )
-        if tweet_id.scalars().one_or_none():
+        if sharding.shard_sessions is not None:
+            return await locate_tweet(tweet_idx) is not None
+
+        if await tweet_lookup(session, TWEET_EXISTS, {"tweet_idx": tweet_idx}):
             return True
 
     except Exception as err:
@@ -166,14 +574,29 @@ async def check_follows_tweet_exists(
     """
 
     try:
-        query_followers = select(Followers.follower_id).where(
-            Followers.user_id == user_idx
-        )
+        # твит ищется на всех шардах, подписка проверяется в основной БД
+        if sharding.shard_sessions is not None:
+            found = await locate_tweet(tweet_idx)
+            if found is None:
+                return False
+            if follow_graph.ready:
+                return follow_graph.has_edge(user_idx, found[1])
+            follows = await session.scalar(
+                FOLLOWS_AUTHOR, {"user_idx": user_idx, "author_id": found[1]}
+            )
+            return follows is not None
 
-        query_tweet = await session.scalar(
-            select(Tweets.id).where(
-                Tweets.user_id.in_(query_followers), Tweets.id == tweet_idx
+        # подписка проверяется по индексу в памяти, пока он не загружен - в БД
+        if follow_graph.ready:
+            author_id = await tweet_lookup(
+                session, TWEET_AUTHOR, {"tweet_idx": tweet_idx}
             )
+            return author_id is not None and follow_graph.has_edge(user_idx, author_id)
+
+        query_tweet = await tweet_lookup(
+            session,
+            FOLLOWS_TWEET_EXISTS,
+            {"user_idx": user_idx, "tweet_idx": tweet_idx},
         )
         if query_tweet:
             return True
@@ -195,11 +618,14 @@ async def check_users_tweet_exists(
     """
 
     try:
-        tweet_id = await session.execute(
-            select(Tweets.id).where(Tweets.id == tweet_idx, Tweets.user_id == user_idx)
-        )
+        async with shard_session(session, user_idx) as content:
+            tweet_id = await tweet_lookup(
+                content,
+                USERS_TWEET_EXISTS,
+                {"user_idx": user_idx, "tweet_idx": tweet_idx},
+            )
 
-        if tweet_id.scalars().one_or_none():
+        if tweet_id:
             return True
 
     except Exception as err:
@@ -220,11 +646,21 @@ async def add_like_to_tweet(
     """
 
     try:
-        await session.execute(
-            insert(Likes).values(user_id=user_idx, tweet_id=tweet_idx)
-        )
+        # лайк хранится вместе с твитом, на шарде автора
+        async with tweet_session(session, tweet_idx) as (content, author_id):
+            await copy_users(session, content, [user_idx])
+            await content.execute(
+                lambda_stmt(
+                    lambda: insert(Likes).values(user_id=user_idx, tweet_id=tweet_idx)
+                )
+            )
+            await update_engagement(content, [tweet_idx], 1)
 
+        await bump_content_version(
+            session, user_id=author_id, tweet_ids=None if author_id else [tweet_idx]
+        )
         await update_user_last_activity(session, user_id=user_idx)
+        await publish_event(session, "like", tweet_idx, author_id=author_id, delta=1)
         await session.commit()
 
     except Exception as err:
@@ -246,13 +682,25 @@ async def delete_like_to_tweet(
     """
 
     try:
-        result = await session.scalar(
-            delete(Likes)
-            .where(Likes.user_id == user_idx, Likes.tweet_id == tweet_idx)
-            .returning(Likes.id)
-        )
+        async with tweet_session(session, tweet_idx) as (content, author_id):
+            result = await content.scalar(
+                lambda_stmt(
+                    lambda: delete(Likes)
+                    .where(Likes.user_id == user_idx, Likes.tweet_id == tweet_idx)
+                    .returning(Likes.id)
+                )
+            )
+            if result:
+                await update_engagement(content, [tweet_idx], -1)
 
         await update_user_last_activity(session, user_id=user_idx)
+        if result:
+            await bump_content_version(
+                session, user_id=author_id, tweet_ids=None if author_id else [tweet_idx]
+            )
+            await publish_event(
+                session, "like", tweet_idx, author_id=author_id, delta=-1
+            )
         await session.commit()
 
         if result:
@@ -264,6 +712,98 @@ async def delete_like_to_tweet(
     return {"result": False}
 
 
+async def batch_like_tweets(
+    session: AsyncSession, user_idx: int, tweet_ids: list, like: bool = True
+) -> dict:
+    """
+    поставить или убрать лайки для списка твитов в одной транзакции,
+    доступность твитов проверяется так же как в check_follows_tweet_exists
+    :param session:
+    :param user_idx: id пользователя
+    :param tweet_ids: список id твитов
+    :param like: True - поставить лайки, False - убрать
+    :return: dict результат операции для каждого твита
+    """
+
+    if sharding.shard_sessions is not None:
+        # твиты пачки могут быть на разных шардах, транзакция на несколько БД
+        # не поддерживается
+        logger.error("Batch likes are not supported with sharding")
+        return {"result": False}
+
+    tweet_ids = list(dict.fromkeys(tweet_ids))
+    query_followers = select(Followers.follower_id).where(Followers.user_id == user_idx)
+    query_visible = select(Tweets.id).where(
+        Tweets.id.in_(tweet_ids), Tweets.user_id.in_(query_followers)
+    )
+    query_liked = select(Likes.tweet_id).where(
+        Likes.user_id == user_idx, Likes.tweet_id.in_(tweet_ids)
+    )
+
+    try:
+        if follow_graph.ready:
+            authors = await session.execute(
+                select(Tweets.id, Tweets.user_id).where(Tweets.id.in_(tweet_ids))
+            )
+            visible = {
+                idx
+                for idx, author_id in authors
+                if follow_graph.has_edge(user_idx, author_id)
+            }
+        else:
+            visible = set((await session.scalars(query_visible)).all())
+
+        if like:
+            res = await session.scalars(
+                insert(Likes)
+                .from_select(
+                    ["user_id", "tweet_id"],
+                    select(literal(user_idx), Tweets.id).where(
+                        Tweets.id.in_(visible), Tweets.id.not_in(query_liked)
+                    ),
+                )
+                .returning(Likes.tweet_id)
+            )
+        else:
+            res = await session.scalars(
+                delete(Likes)
+                .where(Likes.user_id == user_idx, Likes.tweet_id.in_(visible))
+                .returning(Likes.tweet_id)
+            )
+        changed = set(res.all())
+
+        await update_engagement(session, changed, 1 if like else -1)
+        await bump_content_version(session, tweet_ids=changed)
+        await publish_events(session, "like", list(changed), delta=1 if like else -1)
+        await update_user_last_activity(session, user_id=user_idx)
+        await session.commit()
+
+    except Exception as err:
+        logger.error(err)
+        await session.rollback()
+        return {"result": False}
+
+    if like:
+        statuses = ("liked", "already_liked")
+    else:
+        statuses = ("unliked", "not_liked")
+
+    items = list()
+    for tweet_idx in tweet_ids:
+        if tweet_idx not in visible:
+            items.append(
+                {"tweet_id": tweet_idx, "result": False, "status": "not_found"}
+            )
+        elif tweet_idx in changed:
+            items.append({"tweet_id": tweet_idx, "result": True, "status": statuses[0]})
+        else:
+            items.append(
+                {"tweet_id": tweet_idx, "result": False, "status": statuses[1]}
+            )
+
+    return {"result": True, "items": items}
+
+
 async def delete_tweet(session: AsyncSession, user_idx: int, tweet_idx: int) -> dict:
     """
     удалить tweet
@@ -285,18 +825,28 @@ async def delete_tweet(session: AsyncSession, user_idx: int, tweet_idx: int) ->
         logger.error(err)
         return {"result": False, "error": err}
 
-    result = await session.execute(
-        delete(Tweets)
-        .where(Tweets.user_id == user_idx, Tweets.id == tweet_idx)
-        .returning(Tweets.id)
-    )
+    async with shard_session(session, user_idx) as content:
+        result = await content.execute(
+            delete(Tweets)
+            .where(Tweets.user_id == user_idx, Tweets.id == tweet_idx)
+            .returning(Tweets.id, Tweets.tweetdata, Tweets.created_on)
+        )
 
-    deleted_tweet_id = result.scalar()
+        deleted_tweet = result.one()
+        # у секционированных tweets нет внешних ключей, зависимые строки удаляются явно
+        for model in (Likes, TweetTags, TweetMentions):
+            await content.execute(delete(model).where(model.tweet_id == tweet_idx))
 
+    await bump_content_version(session, user_id=user_idx)
     await update_user_last_activity(session, user_id=user_idx)
+    await publish_event(session, "delete", deleted_tweet.id, author_id=user_idx)
     await session.commit()
 
-    res_delete_media = await delete_media(session, tweet_idx)
+    tags, _ = parse_tweet_text(deleted_tweet.tweetdata)
+    if tags and deleted_tweet.created_on:
+        trending_counter.remove(tags, deleted_tweet.created_on.timestamp())
+
+    res_delete_media = await delete_media(session, tweet_idx, user_idx)
 
     if not res_delete_media:
         err = f"Deleted tweet id={tweet_idx} from user id={user_idx}, but error an deleting media files."
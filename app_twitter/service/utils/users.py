@@ -2,10 +2,106 @@ import datetime
 from typing import Union
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, insert, update, delete
+from sqlalchemy import (
+    select,
+    insert,
+    update,
+    delete,
+    func,
+    literal,
+    bindparam,
+    lambda_stmt,
+)
+from sqlalchemy.orm import aliased, noload
 
 from logger.logger import logger
 from models.models import Users, Followers
+from .jobs import enqueue_job, job_handler
+from .events import publish_follow_event
+from .follow_graph import follow_graph
+from .recommendations import schedule_recommendations_refresh
+
+
+# выражения частых запросов создаются один раз, значения передаются при выполнении,
+# поэтому при каждом запросе не строится и не компилируется новое выражение
+USER_BY_ID = select(Users).where(Users.id == bindparam("user_id"))
+USER_BY_APIKEY = select(Users).where(Users.apikey == bindparam("apikey"))
+UPDATE_LAST_ACTIVITY = (
+    update(Users)
+    .where(Users.id == bindparam("user_id"))
+    .values(last_activity=func.greatest(Users.last_activity, bindparam("now")))
+    .returning(Users.id)
+    .execution_options(synchronize_session=False)
+)
+FOLLOWERS_BY_USER_ID = select(Followers).where(
+    Followers.user_id == bindparam("user_id")
+)
+FOLLOWING_BY_USER_ID = select(Followers).where(
+    Followers.follower_id == bindparam("user_id")
+)
+USER_NAME_BY_ID = select(Users.name).where(Users.id == bindparam("user_id"))
+FOLLOW_PAIR = select(Followers).where(
+    Followers.user_id == bindparam("user_id"),
+    Followers.follower_id == bindparam("follower_id"),
+)
+# профиль без загрузки связанных твитов, лайков и подписок
+USER_PROFILE_BY_ID = USER_BY_ID.options(noload("*"))
+USER_PROFILE_BY_APIKEY = USER_BY_APIKEY.options(noload("*"))
+USER_PROFILES_BY_IDS = (
+    select(Users)
+    .where(Users.id.in_(bindparam("user_ids", expanding=True)))
+    .options(noload("*"))
+)
+# поля профиля, которые не отдаются в пакетном ответе о других пользователях
+PRIVATE_FIELDS = ("apikey", "email")
+UPDATE_FOLLOWERS_COUNT = (
+    update(Users)
+    .where(Users.id == bindparam("user_id"))
+    .values(
+        followers_count=Users.followers_count + bindparam("delta"),
+        profile_version=Users.profile_version + 1,
+    )
+    .execution_options(synchronize_session=False)
+)
+UPDATE_FOLLOWING_COUNT = (
+    update(Users)
+    .where(Users.id.in_(bindparam("user_ids", expanding=True)))
+    .values(
+        following_count=Users.following_count + bindparam("delta"),
+        profile_version=Users.profile_version + 1,
+    )
+    .execution_options(synchronize_session=False)
+)
+# поля, от которых зависит ответ профиля, для ETag (utils.etags)
+PROFILE_VERSION = select(
+    Users.id, Users.profile_version, Users.content_version, Users.last_activity
+)
+PROFILE_VERSION_BY_ID = PROFILE_VERSION.where(Users.id == bindparam("user_id"))
+PROFILE_VERSION_BY_APIKEY = PROFILE_VERSION.where(Users.apikey == bindparam("apikey"))
+FOLLOW_COUNTS = select(Users.followers_count, Users.following_count).where(
+    Users.id == bindparam("user_id")
+)
+# страницы списков подписчиков и подписок, курсор - id пользователя в списке
+FOLLOWERS_PAGE = (
+    select(Followers.id, Followers.follower_id.label("user_id"), Users.name)
+    .join(Users, Users.id == Followers.follower_id)
+    .where(
+        Followers.user_id == bindparam("user_id"),
+        Followers.follower_id > bindparam("after_id"),
+    )
+    .order_by(Followers.follower_id)
+    .limit(bindparam("limit"))
+)
+FOLLOWING_PAGE = (
+    select(Followers.id, Followers.user_id, Users.name)
+    .join(Users, Users.id == Followers.user_id)
+    .where(
+        Followers.follower_id == bindparam("user_id"),
+        Followers.user_id > bindparam("after_id"),
+    )
+    .order_by(Followers.user_id)
+    .limit(bindparam("limit"))
+)
 
 
 async def check_user_exists(
@@ -21,12 +117,12 @@ async def check_user_exists(
 
     try:
         if user_id:
-            result = await session.execute(select(Users).filter(Users.id == user_id))
+            result = await session.execute(USER_PROFILE_BY_ID, {"user_id": user_id})
             user_obj = result.scalars().one_or_none()
             if user_obj:
                 return user_obj.to_json()
         elif apikey:
-            result = await session.execute(select(Users).filter(Users.apikey == apikey))
+            result = await session.execute(USER_PROFILE_BY_APIKEY, {"apikey": apikey})
             user_obj = result.scalars().one_or_none()
             if user_obj:
                 return user_obj.to_json()
@@ -38,41 +134,60 @@ async def check_user_exists(
 
 async def update_user_last_activity(session: AsyncSession, user_id: int) -> bool:
     """
-    обновление времени последней активности пользователя
+    обновление времени последней активности пользователя выполняется задачей
+    last_activity, задача создается в транзакции вызывающей функции.
+    Пока задача пользователя в очереди, новые не создаются, в ожидающей
+    задаче время заменяется последним
     :param session:
     :param user_id: id пользователя
     :return: результат операции
     """
 
     try:
-        result = await session.scalar(
-            update(Users)
-            .where(Users.id == user_id)
-            .values(last_activity=datetime.datetime.now())
-            .returning(Users.id)
+        await enqueue_job(
+            session,
+            "last_activity",
+            {"user_id": user_id, "time": datetime.datetime.now().isoformat()},
+            dedup_key=f"last_activity:{user_id}",
+            replace_payload=True,
         )
-        await session.commit()
-        if result:
-            return True
+        return True
     except Exception as err:
         logger.error(err)
-    logger.error("User not found for updating last activity time.")
     return False
 
 
-async def get_user_by_apikey(session: AsyncSession, apikey: str) -> Users:
+@job_handler("last_activity")
+async def last_activity_job(session: AsyncSession, payload: dict):
+    result = await session.scalar(
+        UPDATE_LAST_ACTIVITY,
+        {
+            "user_id": payload["user_id"],
+            "now": datetime.datetime.fromisoformat(payload["time"]),
+        },
+    )
+    if not result:
+        logger.error("User not found for updating last activity time.")
+
+
+async def get_user_by_apikey(
+    session: AsyncSession, apikey: str, fields: str = "full"
+) -> Users:
     """
     возвращет профиль пользователя по api-key
     :param session: AsyncSession
     :param apikey: str
+    :param fields: full - со списками подписчиков и подписок, counts - только количество
     :return: User
     """
 
     try:
-        user_obj = await session.scalar(select(Users).filter(Users.apikey == apikey))
+        user_obj = await session.scalar(USER_PROFILE_BY_APIKEY, {"apikey": apikey})
 
         if user_obj:
             result = {"result": True, "user": user_obj.to_json()}
+            if fields == "counts":
+                return result
 
             followers = await get_followers_by_user_id(
                 session, int(result["user"]["id"])
@@ -102,19 +217,24 @@ async def get_user_by_apikey(session: AsyncSession, apikey: str) -> Users:
         }
 
 
-async def get_user_by_id(session: AsyncSession, idx: str) -> Users:
+async def get_user_by_id(
+    session: AsyncSession, idx: str, fields: str = "full"
+) -> Users:
     """
     возвращет профиль пользователя по user_id
     :param session: AsyncSession
     :param idx: str
+    :param fields: full - со списками подписчиков и подписок, counts - только количество
     :return: User
     """
 
     try:
-        user_obj = await session.scalar(select(Users).filter(Users.id == int(idx)))
+        user_obj = await session.scalar(USER_PROFILE_BY_ID, {"user_id": int(idx)})
 
         if user_obj:
             result = {"result": True, "user": user_obj.to_json()}
+            if fields == "counts":
+                return result
 
             followers = await get_followers_by_user_id(
                 session, int(result["user"]["id"])
@@ -152,13 +272,11 @@ async def get_followers_by_user_id(session: AsyncSession, user_idx: int) -> list
     """
 
     try:
-        followers = await session.scalars(
-            select(Followers).filter(Followers.user_id == user_idx)
-        )
+        followers = await session.scalars(FOLLOWERS_BY_USER_ID, {"user_id": user_idx})
         result = list()
         for obj in followers:
             user_name = await session.scalar(
-                select(Users.name).filter(Users.id == obj.follower_id)
+                USER_NAME_BY_ID, {"user_id": obj.follower_id}
             )
 
             result.append({"id": obj.id, "name": user_name})
@@ -178,15 +296,107 @@ async def get_following_by_user_id(session: AsyncSession, user_id: int) -> list:
     """
 
     try:
-        following = await session.execute(
-            select(Followers).filter(Followers.follower_id == user_id)
-        )
+        following = await session.execute(FOLLOWING_BY_USER_ID, {"user_id": user_id})
         return [{"id": obj.id, "name": obj.user.name} for obj in following.scalars()]
     except Exception as err:
         logger.error(err)
         return []
 
 
+async def get_follow_page(
+    session: AsyncSession,
+    user_idx: int,
+    followers: bool = True,
+    after_id: int = 0,
+    limit: int = 20,
+) -> dict:
+    """
+    страница списка подписчиков или подписок пользователя по возрастанию id,
+    количество берется из счетчика в профиле
+    :param session: AsyncSession
+    :param user_idx: id пользователя
+    :param followers: True - подписчики (followers), False - подписки (following)
+    :param after_id: курсор - id последнего пользователя предыдущей страницы
+    :param limit: размер страницы
+    :return: dict со списком, количеством и курсором следующей страницы
+    """
+
+    try:
+        counts = (await session.execute(FOLLOW_COUNTS, {"user_id": user_idx})).first()
+        if counts is None:
+            return {
+                "result": False,
+                "error_type": "User not found",
+                "error_message": f"User with ID={user_idx} was not found",
+            }
+
+        rows = await session.execute(
+            FOLLOWERS_PAGE if followers else FOLLOWING_PAGE,
+            {"user_id": user_idx, "after_id": after_id, "limit": limit},
+        )
+        users = [
+            {"id": row.id, "user_id": row.user_id, "name": row.name} for row in rows
+        ]
+    except Exception as err:
+        logger.error(err)
+        return {
+            "result": False,
+            "error_type": "DB error",
+            "error_message": "Error when accessing the database.",
+        }
+
+    return {
+        "result": True,
+        "users": users,
+        "count": counts.followers_count if followers else counts.following_count,
+        "next_cursor": users[-1]["user_id"] if len(users) == limit else None,
+    }
+
+
+async def update_follow_counters(
+    session: AsyncSession, user_id: int, follower_ids: list, delta: int
+):
+    """
+    изменение счетчиков после добавления или удаления строк followers
+    (user_id, follower_id), сохраняется при commit вызывающей функции
+    :param session: AsyncSession
+    :param user_id: значение user_id строк
+    :param follower_ids: значения follower_id строк
+    :param delta: 1 - строки добавлены, -1 - удалены
+    """
+
+    if not follower_ids:
+        return
+
+    await session.execute(
+        UPDATE_FOLLOWERS_COUNT, {"user_id": user_id, "delta": delta * len(follower_ids)}
+    )
+    await session.execute(
+        UPDATE_FOLLOWING_COUNT, {"user_ids": list(follower_ids), "delta": delta}
+    )
+
+
+async def recount_follow_counters(session: AsyncSession):
+    """
+    пересчет счетчиков всех пользователей по таблице followers,
+    после загрузки подписок в обход follow_to_user
+    :param session: AsyncSession
+    """
+
+    await session.execute(
+        update(Users)
+        .values(
+            followers_count=select(func.count(Followers.id))
+            .where(Followers.user_id == Users.id)
+            .scalar_subquery(),
+            following_count=select(func.count(Followers.id))
+            .where(Followers.follower_id == Users.id)
+            .scalar_subquery(),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
 async def follow_to_user(session: AsyncSession, apikey: str, user_idx: int) -> dict:
     """
     выполняет добавление фолловера пользователю
@@ -207,10 +417,8 @@ async def follow_to_user(session: AsyncSession, apikey: str, user_idx: int) -> d
     ):
         try:
             check_followers = await session.execute(
-                select(Followers).filter(
-                    Followers.user_id == check_user_apikey["id"],
-                    Followers.follower_id == user_idx,
-                )
+                FOLLOW_PAIR,
+                {"user_id": check_user_apikey["id"], "follower_id": user_idx},
             )
         except Exception as err:
             logger.error(err)
@@ -219,20 +427,29 @@ async def follow_to_user(session: AsyncSession, apikey: str, user_idx: int) -> d
         # если такой пары фалловер-юзер не существует, то добавляем фалловера
         if not check_followers.scalars().one_or_none():
             try:
+                follower_id = check_user_apikey["id"]
                 await session.execute(
-                    insert(Followers).values(
-                        follower_id=user_idx, user_id=check_user_apikey["id"]
+                    lambda_stmt(
+                        lambda: insert(Followers).values(
+                            follower_id=user_idx, user_id=follower_id
+                        )
                     )
                 )
-                await session.commit()
-
                 await update_user_last_activity(
                     session, user_id=check_user_apikey["id"]
                 )
+                await update_follow_counters(session, follower_id, [user_idx], 1)
+                await publish_follow_event(session, "follow", follower_id, [user_idx])
+                await schedule_recommendations_refresh(session, follower_id)
+                await session.commit()
 
             except Exception as err:
                 logger.error(err)
                 return {"result": False}
+            # индекс воркера обновляется сразу, остальные воркеры - по событию
+            follow_graph.apply(
+                {"type": "follow", "user_id": follower_id, "follower_ids": [user_idx]}
+            )
             return {"result": True}
         logger.info(
             f"Add follower error. Follower:{check_user_apikey['name']} to user:{check_user_id['name']} "
@@ -260,26 +477,31 @@ async def delete_follower_to_user(
 
     try:
         # проверка на существование такого фалловера
+        follower_id = check_user_apikey["id"]
         check_followers = await session.execute(
-            select(Followers).filter(
-                Followers.user_id == check_user_apikey["id"],
-                Followers.follower_id == user_idx,
-            )
+            FOLLOW_PAIR, {"user_id": follower_id, "follower_id": user_idx}
         )
 
         if check_followers.scalars().one_or_none():
             # фалловер существует - удаляем его
 
             await session.execute(
-                delete(Followers).where(
-                    Followers.user_id == check_user_apikey["id"],
-                    Followers.follower_id == user_idx,
+                lambda_stmt(
+                    lambda: delete(Followers).where(
+                        Followers.user_id == follower_id,
+                        Followers.follower_id == user_idx,
+                    )
                 )
             )
 
-            await session.commit()
-
             await update_user_last_activity(session, user_id=check_user_apikey["id"])
+            await update_follow_counters(session, follower_id, [user_idx], -1)
+            await publish_follow_event(session, "unfollow", follower_id, [user_idx])
+            await schedule_recommendations_refresh(session, follower_id)
+            await session.commit()
+            follow_graph.apply(
+                {"type": "unfollow", "user_id": follower_id, "follower_ids": [user_idx]}
+            )
             return {"result": True}
 
     except Exception as err:
@@ -291,3 +513,157 @@ async def delete_follower_to_user(
     )
 
     return {"result": False}
+
+
+async def get_users_by_ids(session: AsyncSession, user_ids: list) -> dict:
+    """
+    возвращает профили списка пользователей без PRIVATE_FIELDS, подписчики
+    и подписки всех пользователей загружаются двумя запросами
+    :param session: AsyncSession
+    :param user_ids: список id пользователей
+    :return: dict с результатом для каждого id
+    """
+
+    user_ids = list(dict.fromkeys(user_ids))
+    FollowerUser = aliased(Users)
+
+    try:
+        res = await session.scalars(USER_PROFILES_BY_IDS, {"user_ids": user_ids})
+        users = {obj.id: obj.to_json() for obj in res}
+
+        for user in users.values():
+            for field in PRIVATE_FIELDS:
+                del user[field]
+            user["followers"] = []
+            user["following"] = []
+
+        followers = await session.execute(
+            select(Followers.id, Followers.user_id, FollowerUser.name)
+            .join(FollowerUser, FollowerUser.id == Followers.follower_id)
+            .where(Followers.user_id.in_(users.keys()))
+            .order_by(Followers.id)
+        )
+        for row in followers:
+            users[row.user_id]["followers"].append({"id": row.id, "name": row.name})
+
+        following = await session.execute(
+            select(Followers.id, Followers.follower_id, Users.name)
+            .join(Users, Users.id == Followers.user_id)
+            .where(Followers.follower_id.in_(users.keys()))
+            .order_by(Followers.id)
+        )
+        for row in following:
+            users[row.follower_id]["following"].append({"id": row.id, "name": row.name})
+
+    except Exception as err:
+        logger.error(err)
+        return {
+            "result": False,
+            "error_type": "DB error",
+            "error_message": "Error when accessing the database.",
+        }
+
+    items = list()
+    for idx in user_ids:
+        if idx in users:
+            items.append({"id": idx, "result": True, "user": users[idx]})
+        else:
+            items.append(
+                {
+                    "id": idx,
+                    "result": False,
+                    "error_type": "User not found",
+                    "error_message": f"User with ID={idx} was not found",
+                }
+            )
+
+    return {"result": True, "items": items}
+
+
+async def batch_follow_users(
+    session: AsyncSession, user_idx: int, user_ids: list, follow: bool = True
+) -> dict:
+    """
+    подписка или отписка от списка пользователей в одной транзакции,
+    с теми же проверками что и follow_to_user / delete_follower_to_user
+    :param session:
+    :param user_idx: id пользователя от имени которого выполняется операция
+    :param user_ids: список id пользователей
+    :param follow: True - подписаться, False - отписаться
+    :return: возвращает результат операции для каждого пользователя
+    """
+
+    user_ids = list(dict.fromkeys(user_ids))
+    query_following = select(Followers.follower_id).where(Followers.user_id == user_idx)
+
+    try:
+        existing = set(
+            (
+                await session.scalars(select(Users.id).where(Users.id.in_(user_ids)))
+            ).all()
+        )
+
+        if follow:
+            res = await session.scalars(
+                insert(Followers)
+                .from_select(
+                    ["user_id", "follower_id"],
+                    select(literal(user_idx), Users.id).where(
+                        Users.id.in_(existing),
+                        Users.id != user_idx,
+                        Users.id.not_in(query_following),
+                    ),
+                )
+                .returning(Followers.follower_id)
+            )
+        else:
+            res = await session.scalars(
+                delete(Followers)
+                .where(
+                    Followers.user_id == user_idx,
+                    Followers.follower_id.in_(user_ids),
+                )
+                .returning(Followers.follower_id)
+            )
+        changed = set(res.all())
+        event = {
+            "type": "follow" if follow else "unfollow",
+            "user_id": user_idx,
+            "follower_ids": sorted(changed),
+        }
+
+        await update_follow_counters(
+            session, user_idx, event["follower_ids"], 1 if follow else -1
+        )
+        await update_user_last_activity(session, user_id=user_idx)
+        await publish_follow_event(
+            session, event["type"], user_idx, event["follower_ids"]
+        )
+        if changed:
+            await schedule_recommendations_refresh(session, user_idx)
+        await session.commit()
+
+    except Exception as err:
+        logger.error(err)
+        await session.rollback()
+        return {"result": False}
+
+    follow_graph.apply(event)
+
+    if follow:
+        statuses = ("followed", "already_following")
+    else:
+        statuses = ("unfollowed", "not_following")
+
+    items = list()
+    for idx in user_ids:
+        if idx not in existing:
+            items.append({"user_id": idx, "result": False, "status": "not_found"})
+        elif idx == user_idx:
+            items.append({"user_id": idx, "result": False, "status": "self"})
+        elif idx in changed:
+            items.append({"user_id": idx, "result": True, "status": statuses[0]})
+        else:
+            items.append({"user_id": idx, "result": False, "status": statuses[1]})
+
+    return {"result": True, "items": items}